@@ -0,0 +1,257 @@
+#
+#   This file is part of m.css.
+#
+#   Copyright © 2017, 2018, 2019, 2020, 2021, 2022, 2023
+#             Vladimír Vondruš <mosra@centrum.cz>
+#
+#   Permission is hereby granted, free of charge, to any person obtaining a
+#   copy of this software and associated documentation files (the "Software"),
+#   to deal in the Software without restriction, including without limitation
+#   the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#   and/or sell copies of the Software, and to permit persons to whom the
+#   Software is furnished to do so, subject to the following conditions:
+#
+#   The above copyright notice and this permission notice shall be included
+#   in all copies or substantial portions of the Software.
+#
+#   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#   IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#   FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#   THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#   LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#   DEALINGS IN THE SOFTWARE.
+#
+
+# Common code for incremental builds in doxygen.py and python.py. A build
+# manifest remembers a fingerprint of everything that affects all output
+# (config, templates, the scripts themselves) plus, for every generated page,
+# fingerprints of its own inputs and of the shared state it looked at while
+# being generated. Pages for which none of these changed are not generated
+# again.
+
+import hashlib
+import logging
+import os
+import pickle
+import sys
+import types
+from types import SimpleNamespace as Empty
+from typing import Any, Dict, List, Set
+
+# Bump when the manifest layout changes, older manifests get ignored
+manifest_version = 4
+
+def _fingerprint_into(hash, value, seen):
+    # Type name first so e.g. 1 and '1' or [] and () don't hash the same
+    hash.update(type(value).__qualname__.encode('utf-8'))
+
+    if value is None or isinstance(value, (bool, int, float, complex)):
+        hash.update(repr(value).encode('utf-8'))
+    elif isinstance(value, str):
+        hash.update(value.encode('utf-8'))
+    elif isinstance(value, (bytes, bytearray)):
+        hash.update(value)
+    elif isinstance(value, (list, tuple)):
+        hash.update(str(len(value)).encode('utf-8'))
+        for i in value: _fingerprint_into(hash, i, seen)
+    elif isinstance(value, (set, frozenset)):
+        hash.update(b''.join(sorted(fingerprint(i) for i in value)))
+    elif isinstance(value, dict):
+        hash.update(str(len(value)).encode('utf-8'))
+        for k, v in value.items():
+            _fingerprint_into(hash, k, seen)
+            _fingerprint_into(hash, v, seen)
+    elif isinstance(value, types.CodeType):
+        hash.update(value.co_code)
+        hash.update(repr(value.co_names).encode('utf-8'))
+        _fingerprint_into(hash, value.co_consts, seen)
+    # Functions and lambdas in the config (such as code filters or URL
+    # formatters) are fingerprinted by their code and captured values, so
+    # editing them in the conf file invalidates the output as well. The seen
+    # set guards against cycles, such as recursive closures.
+    elif isinstance(value, types.FunctionType):
+        hash.update('{}.{}'.format(value.__module__, value.__qualname__).encode('utf-8'))
+        if id(value) in seen: return
+        seen.add(id(value))
+        _fingerprint_into(hash, value.__code__, seen)
+        _fingerprint_into(hash, value.__defaults__, seen)
+        for cell in value.__closure__ or ():
+            try:
+                _fingerprint_into(hash, cell.cell_contents, seen)
+            except ValueError: # empty cell
+                pass
+        seen.remove(id(value))
+    # Classes, builtins, modules, ... are fingerprinted by their name
+    elif isinstance(value, (type, types.BuiltinFunctionType, types.ModuleType)):
+        hash.update(getattr(value, '__module__', '').encode('utf-8'))
+        hash.update(getattr(value, '__qualname__', value.__name__).encode('utf-8'))
+    # Enums have a usable repr, plain objects (such as the Empty namespaces or
+    # instances of user-defined classes) are fingerprinted by their contents
+    elif hasattr(value, '__dict__') and not hasattr(value, '_value_'):
+        if id(value) in seen: return
+        seen.add(id(value))
+        _fingerprint_into(hash, vars(value), seen)
+        seen.remove(id(value))
+    # Same for slotted classes, slots that are not set are skipped
+    elif hasattr(type(value), '__slots__') and not hasattr(value, '_value_'):
+        if id(value) in seen: return
+        seen.add(id(value))
+        _fingerprint_into(hash, {name: getattr(value, name) for name in _slots(type(value)) if hasattr(value, name)}, seen)
+        seen.remove(id(value))
+    else:
+        hash.update(repr(value).encode('utf-8'))
+
+# All slots of given class, including those of its base classes
+def _slots(class_) -> List[str]:
+    out = []
+    for base in reversed(class_.__mro__):
+        slots = getattr(base, '__slots__', [])
+        out += [slots] if isinstance(slots, str) else slots
+    return out
+
+def fingerprint(value) -> bytes:
+    hash = hashlib.sha1()
+    _fingerprint_into(hash, value, set())
+    return hash.digest()
+
+# Fingerprint of given files and directories, recursively
+def fingerprint_files(paths) -> bytes:
+    hash = hashlib.sha1()
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    hash.update(os.path.relpath(os.path.join(dirpath, filename), path).encode('utf-8'))
+                    hash.update(fingerprint_file(os.path.join(dirpath, filename)))
+        else:
+            hash.update(fingerprint_file(path))
+    return hash.digest()
+
+def fingerprint_file(path) -> bytes:
+    if not os.path.exists(path): return b''
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).digest()
+
+# Fingerprint of source files of given modules. Used to invalidate the whole
+# output when m.css itself gets updated.
+def fingerprint_modules(names) -> bytes:
+    return fingerprint_files([sys.modules[name].__file__ for name in names if getattr(sys.modules.get(name), '__file__', None)])
+
+def load_manifest(file, fingerprint: bytes):
+    manifest = None
+    if os.path.exists(file):
+        try:
+            with open(file, 'rb') as f:
+                manifest = pickle.load(f)
+        except Exception as e:
+            logging.warning("can't load build manifest {}, doing a full rebuild: {}".format(file, e))
+
+    if not manifest or getattr(manifest, 'version', None) != manifest_version:
+        manifest = Empty()
+        manifest.version = manifest_version
+        manifest.fingerprint = None
+        manifest.pages = {}
+        manifest.search = None
+        # Shard files of the search data, if it's sharded, so they can be kept
+        # when the search data don't need to be built again
+        manifest.search_shards = []
+        # See _output.OutputWriter
+        manifest.outputs = {}
+
+    # If anything that affects all output changed, everything has to be
+    # generated again. Remember the pages and outputs though, as they need to
+    # be cleaned up if they're not generated anymore.
+    manifest.outdated = manifest.fingerprint != fingerprint
+    manifest.fingerprint = fingerprint
+    if manifest.outdated: manifest.search = None
+    return manifest
+
+def save_manifest(file, manifest):
+    del manifest.outdated
+    with open(file, 'wb') as f:
+        pickle.dump(manifest, f)
+
+# A dict that remembers which keys were looked up. Used for tracking which
+# parts of the global state a page depends on, plain iteration is not tracked.
+# If the values need special treatment (for example because they reference
+# live Python objects), a custom fingerprint function can be passed.
+class RecordingDict(dict):
+    def __init__(self, *args, fingerprint=fingerprint, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.accessed: Set[Any] = set()
+        self.fingerprint = fingerprint
+        # Fingerprints are memoized as the state doesn't change during
+        # rendering
+        self.fingerprints: Dict[Any, bytes] = {}
+        self.frozen = False
+
+    def __getitem__(self, key):
+        self.accessed.add(key)
+        return dict.__getitem__(self, key)
+
+    def __contains__(self, key):
+        self.accessed.add(key)
+        return dict.__contains__(self, key)
+
+    def get(self, key, default=None):
+        self.accessed.add(key)
+        return dict.get(self, key, default)
+
+    def reset(self):
+        self.accessed = set()
+
+    def _fingerprint(self, key) -> bytes:
+        if key not in self.fingerprints:
+            # Keys added after freeze() are treated as if they didn't exist
+            self.fingerprints[key] = self.fingerprint(None if self.frozen else dict.get(self, key))
+        return self.fingerprints[key]
+
+    # Fingerprint all values right away. Used when the values get modified
+    # during rendering, such as the doc contents in python.py that are filled
+    # lazily when first needed, so each page sees the same initial state
+    # independently of what was rendered before it.
+    def freeze(self):
+        for key in dict.keys(self): self._fingerprint(key)
+        self.frozen = True
+
+    # Fingerprints of all keys accessed since the last call. A missing key is
+    # recorded as well so it's detected when the key gets added later.
+    def dependencies(self) -> Dict[Any, bytes]:
+        out = {key: self._fingerprint(key) for key in self.accessed}
+        self.accessed = set()
+        return out
+
+    # Whether any of previously recorded dependencies changed
+    def changed(self, dependencies: Dict[Any, bytes]) -> bool:
+        for key, value in dependencies.items():
+            if self._fingerprint(key) != value: return True
+        return False
+
+# Like RecordingDict, but for a list that's only ever iterated as a whole
+class RecordingList(list):
+    def __init__(self, *args, **kwargs):
+        list.__init__(self, *args, **kwargs)
+        self.accessed = False
+        self.memoized_fingerprint = None
+
+    def __iter__(self):
+        self.accessed = True
+        return list.__iter__(self)
+
+    def reset(self):
+        self.accessed = False
+
+    def _fingerprint(self) -> bytes:
+        if self.memoized_fingerprint is None:
+            self.memoized_fingerprint = fingerprint(list(list.__iter__(self)))
+        return self.memoized_fingerprint
+
+    def dependencies(self) -> Dict[Any, bytes]:
+        out = {None: self._fingerprint()} if self.accessed else {}
+        self.accessed = False
+        return out
+
+    def changed(self, dependencies: Dict[Any, bytes]) -> bool:
+        return bool(dependencies) and self._fingerprint() != dependencies[None]
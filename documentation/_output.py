@@ -0,0 +1,504 @@
+#
+#   This file is part of m.css.
+#
+#   Copyright © 2017, 2018, 2019, 2020, 2021, 2022, 2023
+#             Vladimír Vondruš <mosra@centrum.cz>
+#
+#   Permission is hereby granted, free of charge, to any person obtaining a
+#   copy of this software and associated documentation files (the "Software"),
+#   to deal in the Software without restriction, including without limitation
+#   the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#   and/or sell copies of the Software, and to permit persons to whom the
+#   Software is furnished to do so, subject to the following conditions:
+#
+#   The above copyright notice and this permission notice shall be included
+#   in all copies or substantial portions of the Software.
+#
+#   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#   IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#   FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#   THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#   LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#   DEALINGS IN THE SOFTWARE.
+#
+
+
+# Common output writing for doxygen.py and python.py. Files get written only if
+# their contents differ from what's already in the output directory, so
+# unchanged pages keep their timestamps and tools syncing or serving the
+# output don't need to process them again. The contents are compared by a
+# SHA-1 hash. If hashes from the previous run are available (which is the case
+# for incremental builds, where they're saved in the build manifest), the old
+# files don't need to be read at all unless their size or modification time
+# changed. Knowing what was written the previous time also allows removing
+# outputs that are not generated anymore.
+#
+# Rendered templates are streamed to a temporary file chunk by chunk, hashing
+# the data on the way, and the temporary file then either replaces the
+# original or gets deleted if the contents are the same. That way neither the
+# whole rendered string nor its encoded copy is ever in memory, which matters
+# for huge pages with thousands of members.
+#
+# With background writing enabled, all file operations are done by a writer
+# thread, fed through a bounded queue by the thread doing the rendering. That
+# way parsing and rendering of the next page overlaps with writing the
+# previous one, which helps especially on network filesystems where writes
+# are slow. The queue size limits how much rendered data can wait for being
+# written. Errors from the writer thread are raised on the next call or from
+# finish().
+#
+# Optionally, compressed copies of the text outputs are written next to them
+# at the end, for static hosts that serve pre-compressed files if they exist.
+# These go through the same write-if-changed logic and are tracked as regular
+# outputs, so incremental builds remove them together with the file they
+# were made from.
+
+import asyncio
+import gzip
+import io
+import logging
+import os
+import queue
+import tempfile
+import threading
+from hashlib import sha1
+from multiprocessing.pool import ThreadPool
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    # Only gzip is available then
+    brotli = None
+
+# Rendered template pieces are collected until they're at least this long,
+# then encoded and written together. Jinja yields a lot of tiny strings,
+# encoding and hashing each separately would be slow.
+_chunk_size = 64*1024
+
+# Used when hashing existing files
+_read_size = 1024*1024
+
+# Max count of operations waiting for the writer thread. With the chunks being
+# 64 kB, this is a few MB of rendered data at most.
+_queue_size = 64
+
+# Extensions of files that get compressed by OutputWriter.compress(). That's
+# the pages, CSS, JavaScript and the search data, either Base85-encoded in a
+# *.js file or binary.
+compressed_extensions = ['.html', '.css', '.js', '.bin']
+
+# Gzip without the current time in the header, so the same input always
+# results in the same output and unchanged files are not written again.
+# gzip.compress() accepts the mtime only since Python 3.8.
+def _gzip(data: bytes) -> bytes:
+    out = io.BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=9, mtime=0) as f:
+        f.write(data)
+    return out.getvalue()
+
+# Compression formats supported by OutputWriter.compress(), the key is the
+# extension appended to the compressed file
+_compressors = {
+    'gz': _gzip,
+    'br': lambda data: brotli.compress(data)
+}
+
+# Reads a file and compresses it with all given formats. Used by
+# OutputWriter.compress() from worker threads.
+def _compress_file(path_formats) -> List[bytes]:
+    path, formats = path_formats
+    with open(path, 'rb') as f:
+        data = f.read()
+    return [_compressors[format](data) for format in formats]
+
+def _hash_file(path) -> bytes:
+    hash = sha1()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(_read_size)
+            if not data: break
+            hash.update(data)
+    return hash.digest()
+
+# A temporary file next to the output, written in chunks and hashed on the
+# way. The pieces are collected and encoded by the rendering thread, file
+# operations go through OutputWriter._run().
+class _StreamedFile:
+    def __init__(self, output, filename):
+        self.output = output
+        self.filename = filename
+        self.path = os.path.join(output.directory, filename)
+        self.temp = None
+        self.file = None
+        self.hash = sha1()
+        self.size = 0
+        self.failed = False
+        self.pieces = []
+        self.pieces_size = 0
+        output._run(self._open, file=self)
+
+    def _open(self):
+        output_dir = os.path.dirname(self.path)
+        if not os.path.exists(output_dir): os.makedirs(output_dir)
+        fd, self.temp = tempfile.mkstemp(dir=output_dir, prefix='.' + os.path.basename(self.path) + '.')
+        self.file = os.fdopen(fd, 'wb')
+
+    def _write(self, data: bytes):
+        self.hash.update(data)
+        self.size += len(data)
+        self.file.write(data)
+
+    def _discard(self):
+        if self.file: self.file.close()
+        if self.temp and os.path.exists(self.temp): os.remove(self.temp)
+
+    def add(self, piece: str):
+        self.pieces += [piece]
+        self.pieces_size += len(piece)
+        if self.pieces_size >= _chunk_size: self.flush()
+
+    def flush(self):
+        if not self.pieces: return
+        data = ''.join(self.pieces).encode('utf-8')
+        self.pieces = []
+        self.pieces_size = 0
+        self.output._run(self._write, data, file=self)
+
+class OutputWriter:
+    # If previous is None, there's no knowledge about the previous run and
+    # nothing gets removed by remove_orphans(). If background is True, files
+    # are written by a writer thread.
+    def __init__(self, directory, previous: Optional[Dict[str, Tuple[int, int, bytes]]] = None, *, background=False):
+        self.directory = directory
+        self.previous = previous
+        # Filename -> (size, mtime in ns, hash) of all files written, found
+        # unchanged or explicitly kept in this run. While writing in the
+        # background, it's complete only after finish().
+        self.files: Dict[str, Tuple[int, int, bytes]] = {}
+        self.written = 0
+        self.unchanged = 0
+        self.removed = 0
+        self.recording = None
+
+        self.background = background
+        self.queue = None
+        self.thread = None
+        self.error = None
+
+        # Temporary files are created with 0600 permissions, they get changed
+        # to what a plain open() would create. Querying the umask means
+        # changing it, so do that just once, here.
+        umask = os.umask(0)
+        os.umask(umask)
+        self.mode = 0o666 & ~umask
+
+    # Calls the function right away or queues it for the writer thread. If it
+    # fails and file is specified, its temporary file is removed. Returns what
+    # the function returned, or None if writing in the background.
+    def _run(self, function, *args, file: Optional[_StreamedFile] = None):
+        if not self.background:
+            try:
+                return function(*args)
+            except:
+                if file: file._discard()
+                raise
+
+        self._raise_error()
+        if self.thread is None:
+            self.queue = queue.Queue(_queue_size)
+            self.thread = threading.Thread(target=self._process, daemon=True)
+            self.thread.start()
+        self.queue.put((function, args, file))
+
+    def _process(self):
+        while True:
+            function, args, file = self.queue.get()
+            if function is None: return
+
+            # Operations on a file that failed before are skipped, the error
+            # is remembered only for the first failure
+            if file and file.failed: continue
+            try:
+                function(*args)
+            except BaseException as e:
+                if self.error is None: self.error = e
+                if file:
+                    file.failed = True
+                    file._discard()
+
+    def _raise_error(self):
+        if self.error is None: return
+        error = self.error
+        self.error = None
+        raise error
+
+    # Waits until everything queued for the writer thread is written and
+    # stops the thread. Raises the first error that happened in it. Has to be
+    # called before forking, a new thread is started once something gets
+    # written again.
+    def finish(self):
+        if self.thread is not None:
+            self.queue.put((None, (), None))
+            self.thread.join()
+            self.queue = None
+            self.thread = None
+        self._raise_error()
+
+    def _is_unchanged(self, path, filename, size, hash) -> bool:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return False
+        if stat.st_size != size: return False
+
+        # If the file wasn't touched since it was written the last time, the
+        # recorded hash can be trusted
+        if self.previous is not None:
+            previous = self.previous.get(filename)
+            if previous and previous[:2] == (stat.st_size, stat.st_mtime_ns):
+                return previous[2] == hash
+
+        return _hash_file(path) == hash
+
+    def _add(self, filename, path, hash, written):
+        stat = os.stat(path)
+        self.files[filename] = (stat.st_size, stat.st_mtime_ns, hash)
+        if written: self.written += 1
+        else: self.unchanged += 1
+        if self.recording is not None:
+            self.recording[filename] = (self.files[filename], written)
+
+    def _write(self, filename, data: bytes) -> bool:
+        path = os.path.join(self.directory, filename)
+        hash = sha1(data).digest()
+        if self._is_unchanged(path, filename, len(data), hash):
+            self._add(filename, path, hash, False)
+            return False
+
+        output_dir = os.path.dirname(path)
+        if not os.path.exists(output_dir): os.makedirs(output_dir)
+        with open(path, 'wb') as f:
+            f.write(data)
+        self._add(filename, path, hash, True)
+        return True
+
+    # Writes data to given file relative to the output directory, unless it
+    # already has the same contents. Returns whether the file was written, or
+    # None if writing in the background.
+    def write(self, filename, data: bytes) -> Optional[bool]:
+        return self._run(self._write, filename, data)
+
+    # Writes a rendered template. Adds back a trailing newline so we don't need
+    # to bother with patching test files to include a trailing newline to make
+    # Git happy. Can't use keep_trailing_newline because that'd add it also for
+    # nested templates :(
+    def write_rendered(self, filename, rendered: str) -> Optional[bool]:
+        return self.write(filename, rendered.encode('utf-8') + b'\n')
+
+    # Moves a fully written _StreamedFile to its destination, unless the
+    # destination already has the same contents
+    def _finish_streamed(self, file: _StreamedFile) -> bool:
+        file.file.close()
+        hash = file.hash.digest()
+        if self._is_unchanged(file.path, file.filename, file.size, hash):
+            os.remove(file.temp)
+            self._add(file.filename, file.path, hash, False)
+            return False
+
+        os.chmod(file.temp, self.mode)
+        os.replace(file.temp, file.path)
+        self._add(file.filename, file.path, hash, True)
+        return True
+
+    # Calls fill() with a _StreamedFile to put the contents into, and then
+    # moves it to given file relative to the output directory, unless the file
+    # already has the same contents. Returns whether the file was written, or
+    # None if writing in the background.
+    def _write_streamed(self, filename, fill) -> Optional[bool]:
+        file = _StreamedFile(self, filename)
+        try:
+            fill(file)
+            file.flush()
+        except:
+            self._run(file._discard)
+            raise
+        return self._run(self._finish_streamed, file, file=file)
+
+    # Writes the string chunks to given file relative to the output directory,
+    # unless it already has the same contents. Returns whether the file was
+    # written, or None if writing in the background.
+    def write_chunks(self, filename, chunks: Iterable[str]) -> Optional[bool]:
+        def fill(file):
+            for chunk in chunks: file.add(chunk)
+        return self._write_streamed(filename, fill)
+
+    # Renders a template with given variables directly into given file
+    # relative to the output directory, unless it already has the same
+    # contents. Adds a trailing newline the same way as write_rendered(), the
+    # output is byte-for-byte the same. The variables are passed as a dict and
+    # not as keyword arguments so they can't collide with the other
+    # parameters. If context is not None, it's a dict created by
+    # _templates.shared_context() with values common for all pages and the
+    # variables are layered on top of it. Returns whether the file was
+    # written, or None if writing in the background.
+    def write_template(self, filename, template, vars: Dict[str, Any], context: Optional[Dict[str, Any]] = None) -> Optional[bool]:
+        # Equivalent to what Template.generate() does, except that the shared
+        # context is used as-is instead of being merged with globals again.
+        # It's the parent of the page context, with the page variables being
+        # put only into the page context itself, so the shared dict with all
+        # its values isn't copied for every page.
+        if context is None:
+            ctx = template.new_context(vars)
+        else:
+            ctx = template.new_context(context, shared=True)
+            ctx.vars.update(vars)
+
+        # Jinja's generate() for an async environment collects everything
+        # into a list first, so iterate the async generator directly instead
+        if template.environment.is_async:
+            async def fill_async(file):
+                generator = template.root_render_func(ctx)
+                try:
+                    async for chunk in generator: file.add(chunk)
+                finally:
+                    await generator.aclose()
+            def fill(file):
+                # Not asyncio.run(), which is only since Python 3.7. Not
+                # asyncio.get_event_loop() either, as there's no current loop
+                # anymore once asyncio.run() was called by anything else, for
+                # example by Jinja's own render().
+                loop = asyncio.new_event_loop()
+                try:
+                    loop.run_until_complete(fill_async(file))
+                except Exception:
+                    # Rewrites the traceback to point to the template source
+                    template.environment.handle_exception()
+                finally:
+                    loop.close()
+                file.add('\n')
+        else:
+            def fill(file):
+                try:
+                    for chunk in template.root_render_func(ctx): file.add(chunk)
+                except Exception:
+                    template.environment.handle_exception()
+                file.add('\n')
+        return self._write_streamed(filename, fill)
+
+    def _copy(self, source, filename) -> bool:
+        with open(source, 'rb') as f:
+            return self._write(filename, f.read())
+
+    # Copies a file to given file relative to the output directory, unless it
+    # already has the same contents. Returns whether the file was written, or
+    # None if writing in the background.
+    def copy(self, source, filename) -> Optional[bool]:
+        return self._run(self._copy, source, filename)
+
+    def _keep(self, filename):
+        if self.previous is None or filename not in self.previous or filename in self.files: return
+        self.files[filename] = self.previous[filename]
+
+    # Marks a file from the previous run as still being a part of the output,
+    # without writing it again. Used for pages that incremental builds skip.
+    def keep(self, filename):
+        self._run(self._keep, filename)
+
+    # Used by doxygen.py for collecting what a worker process wrote, so it can
+    # be merged back in the main process
+    def start_recording(self):
+        self.finish()
+        self.recording = {}
+
+    def stop_recording(self) -> Dict[str, Tuple[Tuple[int, int, bytes], bool]]:
+        self.finish()
+        out = self.recording
+        self.recording = None
+        return out
+
+    def _merge(self, files):
+        for filename, (entry, written) in files.items():
+            self.files[filename] = entry
+            if written: self.written += 1
+            else: self.unchanged += 1
+
+    def merge(self, files):
+        self._run(self._merge, files)
+
+    # Removes files written in the previous run that were neither written nor
+    # kept in this one
+    def remove_orphans(self):
+        self.finish()
+        if self.previous is None: return
+        for filename in self.previous.keys() - self.files.keys():
+            path = os.path.join(self.directory, filename)
+            if not os.path.exists(path): continue
+            logging.debug("removing stale {}".format(filename))
+            os.remove(path)
+            self.removed += 1
+
+    # Whether the compressed file was made from the same contents as the
+    # current file in the previous run and wasn't touched since. Without the
+    # previous state it's unknown, so everything gets compressed again, but
+    # unchanged compressed files still aren't written.
+    def _is_compressed(self, filename, compressed) -> bool:
+        if self.previous is None: return False
+        previous = self.previous.get(filename)
+        previous_compressed = self.previous.get(compressed)
+        if not previous or not previous_compressed or previous[2] != self.files[filename][2]:
+            return False
+        try:
+            stat = os.stat(os.path.join(self.directory, compressed))
+        except FileNotFoundError:
+            return False
+        return previous_compressed[:2] == (stat.st_size, stat.st_mtime_ns)
+
+    # Writes compressed copies of all HTML, CSS, JavaScript and search data
+    # files written, found unchanged or kept in this run, with the format
+    # extension appended, such as index.html.gz. Supported formats are 'gz'
+    # and 'br', the latter only if the brotli module is available. Files
+    # whose compressed copy is up-to-date are skipped, see _is_compressed().
+    # With more than one job, files get compressed in parallel. Threads are
+    # enough, as zlib and brotli don't hold the GIL while compressing, the
+    # writing is done in the calling thread.
+    def compress(self, formats: List[str], jobs=1):
+        self.finish()
+
+        supported = []
+        for format in formats:
+            if format not in _compressors:
+                logging.warning("unknown output compression format {}, ignoring".format(format))
+            elif format == 'br' and brotli is None:
+                logging.warning("brotli module not found, not writing .br files")
+            else:
+                supported += [format]
+
+        to_compress = []
+        for filename in list(self.files.keys()):
+            if os.path.splitext(filename)[1] not in compressed_extensions: continue
+            formats = []
+            for format in supported:
+                compressed = filename + '.' + format
+                if self._is_compressed(filename, compressed):
+                    self._keep(compressed)
+                else:
+                    formats += [format]
+            if formats: to_compress += [(filename, formats)]
+
+        logging.debug("compressing {} files".format(len(to_compress)))
+        def write(compressed_files):
+            for (filename, formats), compressed in zip(to_compress, compressed_files):
+                for format, data in zip(formats, compressed):
+                    self._write(filename + '.' + format, data)
+        paths_formats = [(os.path.join(self.directory, filename), formats) for filename, formats in to_compress]
+        if jobs > 1 and len(to_compress) > 1:
+            with ThreadPool(min(jobs, len(to_compress))) as pool:
+                write(pool.imap(_compress_file, paths_formats))
+        else:
+            write(map(_compress_file, paths_formats))
+
+    def report(self):
+        self.finish()
+        logging.debug("{} files written, {} unchanged, {} removed".format(self.written, self.unchanged, self.removed))
@@ -0,0 +1,148 @@
+#
+#   This file is part of m.css.
+#
+#   Copyright © 2017, 2018, 2019, 2020, 2021, 2022, 2023
+#             Vladimír Vondruš <mosra@centrum.cz>
+#
+#   Permission is hereby granted, free of charge, to any person obtaining a
+#   copy of this software and associated documentation files (the "Software"),
+#   to deal in the Software without restriction, including without limitation
+#   the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#   and/or sell copies of the Software, and to permit persons to whom the
+#   Software is furnished to do so, subject to the following conditions:
+#
+#   The above copyright notice and this permission notice shall be included
+#   in all copies or substantial portions of the Software.
+#
+#   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#   IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#   FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#   THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#   LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#   DEALINGS IN THE SOFTWARE.
+#
+
+
+# Build profiling for doxygen.py and python.py. Collects time spent in
+# particular phases of the build, time spent on each generated page, cache hit
+# rates and peak memory use, and saves all that as JSON so it can be compared
+# across builds, for example to catch performance regressions on a CI.
+
+import json
+import logging
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+try:
+    import resource
+except ImportError: # pragma: no cover
+    # Not available on Windows, peak memory use isn't reported there
+    resource = None
+
+def peak_rss() -> Dict[str, int]:
+    if not resource: return {} # pragma: no cover
+
+    # The ru_maxrss is in bytes on macOS but in kilobytes elsewhere. Worker
+    # processes and everything spawned (such as Doxygen, LaTeX or dot) is
+    # reported as children, only the largest of them is remembered.
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return {
+        'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*scale,
+        'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss*scale
+    }
+
+class Profile:
+    def __init__(self):
+        self.begin = time.perf_counter()
+        self.total = None
+        # Name -> [total seconds, count]. Phases can nest, their times then
+        # overlap.
+        self.phases: Dict[str, List] = {}
+        # Page output filename -> seconds spent generating it
+        self.pages: Dict[str, float] = {}
+        # Cache name -> [hits, misses]
+        self.caches: Dict[str, List[int]] = {}
+        self.peak_rss: Dict[str, int] = {}
+
+    def add_phase(self, name, seconds, count=1):
+        phase = self.phases.setdefault(name, [0.0, 0])
+        phase[0] += seconds
+        phase[1] += count
+
+    @contextmanager
+    def phase(self, name):
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - begin)
+
+    def add_page(self, name, seconds):
+        self.pages[name] = self.pages.get(name, 0.0) + seconds
+
+    def add_cache(self, name, hits, misses):
+        cache = self.caches.setdefault(name, [0, 0])
+        cache[0] += hits
+        cache[1] += misses
+
+    # Used by doxygen.py for collecting what happened in a worker process,
+    # which gets merged back to the main process profile. The worker has a
+    # forked copy of the profile so it's enough to just start from scratch.
+    def start_recording(self):
+        self.phases = {}
+        self.pages = {}
+        self.caches = {}
+
+    def stop_recording(self) -> Tuple[Dict[str, List], Dict[str, float], Dict[str, List[int]]]:
+        return self.phases, self.pages, self.caches
+
+    def merge(self, recorded):
+        phases, pages, caches = recorded
+        for name, (seconds, count) in phases.items():
+            self.add_phase(name, seconds, count)
+        for name, seconds in pages.items():
+            self.add_page(name, seconds)
+        for name, (hits, misses) in caches.items():
+            self.add_cache(name, hits, misses)
+
+    def finish(self):
+        self.total = time.perf_counter() - self.begin
+        self.peak_rss = peak_rss()
+
+    def slowest_pages(self, count) -> List[Tuple[str, float]]:
+        return sorted(self.pages.items(), key=lambda page: (-page[1], page[0]))[:count]
+
+    def to_json(self, top=10):
+        return {
+            'total': self.total,
+            'phases': {name: {'time': seconds, 'count': count} for name, (seconds, count) in self.phases.items()},
+            'caches': {name: {'hits': hits, 'misses': misses, 'hit_rate': hits/(hits + misses) if hits + misses else None} for name, (hits, misses) in self.caches.items()},
+            'peak_rss': self.peak_rss,
+            'pages': self.pages,
+            'slowest_pages': [{'name': name, 'time': seconds} for name, seconds in self.slowest_pages(top)]
+        }
+
+    # Saves the profile as JSON into given file and prints a summary with
+    # top slowest pages
+    def save(self, file, top=10):
+        with open(file, 'w') as f:
+            json.dump(self.to_json(top), f, indent=2)
+            f.write('\n')
+
+        out = ["build took {:.3f} s".format(self.total)]
+        for name, (seconds, count) in sorted(self.phases.items(), key=lambda phase: -phase[1][0]):
+            out += ["  {:>9.3f} s  {:>6}x  {}".format(seconds, count, name)]
+        for name, (hits, misses) in self.caches.items():
+            if hits + misses:
+                out += ["{} cache: {} hits, {} misses, {:.1f}% hit rate".format(name, hits, misses, 100.0*hits/(hits + misses))]
+        if self.peak_rss:
+            out += ["peak RSS: {:.1f} MB, children {:.1f} MB".format(self.peak_rss['self']/1024/1024, self.peak_rss['children']/1024/1024)]
+        if self.pages:
+            out += ["{} slowest out of {} pages:".format(min(top, len(self.pages)), len(self.pages))]
+            for name, seconds in self.slowest_pages(top):
+                out += ["  {:>9.3f} s  {}".format(seconds, name)]
+        logging.info('\n'.join(out))
+        logging.info("profile saved to {}".format(file))
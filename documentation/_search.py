@@ -26,83 +26,106 @@
 # Can't be in __init__.py because I can't say `from . import Trie` in
 # doxygen.py. But `from _search import bla` works. Ugh.
 
+import array
 import base64
+import bisect
+import collections
 import enum
+import multiprocessing
+import os
 import struct
 from types import SimpleNamespace as Empty
-from typing import List, Tuple, Union
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
 
-# Version 0 was without the type map
-searchdata_format_version = 2
+# Version 0 was without the type map, version 2 had fixed-size fields with
+# the sizes configurable for each file
+searchdata_format_version = 3
 search_filename = f'search-v{searchdata_format_version}.js'
 searchdata_filename = f'{{search_filename_prefix}}-v{searchdata_format_version}.bin'
 searchdata_filename_b85 = f'{{search_filename_prefix}}-v{searchdata_format_version}.js'
 
 # In order to be both space-efficient and flexible enough to accommodate for
-# larger projects, the bit counts for particular data types can vary in each
-# file. There's the following categories:
-#
-# - NAME_SIZE_BITS, how many bits is needed to store name lengths (such as
-#   prefix length). Can be either 8 or 16.
-# - RESULT_ID_BITS, how many bits is needed for IDs pointing into the result
-#   map. Can be either 16, 24 or 32.
-# - FILE_OFFSET_BITS, how many bits is needed to store general offsets into
-#   the file. Can be either 24 or 32.
+# larger projects without any configuration, counts, result IDs, name lengths
+# and trie child offsets are stored as VARINTs. That's the LEB128 encoding,
+# with the lowest 7 bits of the value in the first byte, next 7 bits in the
+# second byte etc., and the highest bit of each byte telling whether another
+# byte follows. Values below 128 thus take a single byte, below 16384 two
+# bytes and so on. The only fixed-size values besides the header are offsets
+# into the result map, as these need to be randomly accessed. Their size is
+# picked for each file to be the smallest that fits, with FILE_OFFSET_BITS
+# being either 16, 24 or 32.
 #
 # Whole file encoding
 # ===================
 #
-# magic | version | type | not  | symbol | result | type   | trie | result | type
-# 'MCS' | (0x02)  | data | used | count  |  map   |  map   | data |  map   | map
-#       |         |      |      |        | offset | offset |      |  data  | data
-#  24b  |   8b    |  8b  | 24b  |  32b   |  32b   |  32b   |  …   |   …    |  …
+# magic | version | type | shard  | not  | symbol | result | type   | trie | result | type
+# 'MCS' | (0x03)  | data |  key   | used | count  |  map   |  map   | data |  map   | map
+#       |         |      | length |      |        | offset | offset |      |  data  | data
+#  24b  |   8b    |  8b  |   8b   | 16b  |  32b   |  32b   |  32b   |  …   |   …    |  …
+#
+# The type data encode whether the file is a shard of sharded search data, see
+# below:
+#
+# not  | sharded
+# used |
+#  7b  |   1b
 #
-# The type data encode the NAME_SIZE_BITS, RESULT_ID_BITS and
-# FILE_OFFSET_BITS:
+# Sharded search data
+# ===================
+#
+# For large projects the search data can be split into shards, so only the
+# parts needed for what's being typed get downloaded. Each shard is a whole
+# file as described here, with the sharded bit set. A shard is identified by a
+# key, which is the byte sequence that has to be typed for the shard to be
+# needed, and the key length is stored in the header. The trie contains the
+# key as a chain of nodes leading from the root, followed by the subtree
+# below it except for children that are in other shards. Those have the child
+# offset difference set to 0, which can't happen for a child that's in the
+# same file. The result and type map contain only what the trie references.
 #
-# not  | NAME_SIZE_BITS | RESULT_ID_BITS | FILE_OFFSET_BITS
-# used | 0b0 = 8b       | 0b00 = 16b     | 0b0 = 24b
-#      | 0b1 = 16b      | 0b01 = 24b     | 0b1 = 32b
-#      |                | 0b10 = 32b     |
-#  4b  |     1b         |       2b       |       1b
+# The shard with an empty key is the index, which is loaded first. All
+# children of its root are in other shards, one for each first byte. Besides
+# those, large subtrees behind lookahead barriers are put into separate shards
+# as well, as they're only needed once the barrier is typed and not when
+# gathering results from a node above. Shard file names are derived from the
+# index file name by appending the key as hexadecimal digits, so for example
+# `searchdata-v3.bin` has shards named `searchdata-v3-6d.bin`,
+# `searchdata-v3-6d6174683a.bin` etc.
 #
 # Trie encoding
 # =============
 #
 # Because child tries are serialized first, the trie containing the initial
-# characters is never the first, and instead the root offset points to it. If
-# result count < 128:
-#
-#  root  |   |         header       |      results     | children
-# offset | … | | result # | child # |         …        |  data
-#  32b   |   |0|    7b    |   8b    | n*RESULT_ID_BITS |    …
+# characters is never the first, and instead the root offset points to it.
+# Result IDs come last so they don't need to be skipped when just looking for
+# a child:
 #
-# If result count > 127, it's instead this -- since entries with very large
-# number of results (such as python __init__()) are rather rare, it doesn't
-# make sense to have it globally configurable and then waste 8 bits in the
-# majority of cases. Note that the 15-bit value is stored as Big-Endian,
-# otherwise the leftmost bit couldn't be used to denote the size.
+#  root  |   |         header        |   children   |  results
+# offset | … | result # | child #    |     data     |
+#  32b   |   |  VARINT  |  VARINT    |      …       | n*VARINT
 #
-#  root  |   |         header       |      results     | children
-# offset | … | | result # | child # |         …        |  data
-#  32b   |   |1| 15b (BE) |   8b    | n*RESULT_ID_BITS |    …
+# Trie children data encoding. Children are always serialized before their
+# parent, so instead of the child offset it's the difference between offset
+# of the parent and the child that's stored, which is usually a small value.
+# The lowest bit of it is the lookahead barrier:
 #
-# Trie children data encoding, the barrier is stored in the topmost offset bit:
-#
-# child 1 | child 2 |   |     child 1      |      child 2     |
-#  char   |  char   | … | barrier + offset | barrier + offset | …
-#   8b    |   8b    |   | FILE_OFFSET_BITS | FILE_OFFSET_BITS |
+# child 1 | child 2 |   |          child 1         |          child 2         |
+#  char   |  char   | … | offset difference << 1 | | offset difference << 1 | | …
+#         |         |   |          barrier         |          barrier         |
+#   8b    |   8b    |   |          VARINT          |          VARINT          |
 #
 # Result map encoding
 # ===================
 #
-# First all flags, then all offsets, so we don't need to have weird paddings or
-# alignments. The "file size" is there so size of item N can be always
-# retrieved as `offsets[N + 1] - offsets[N]`
+# First the size of offsets, then all offsets and then all flags, so we don't
+# need to have weird paddings or alignments. The offsets are relative to the
+# beginning of the result map including the size byte, and the "file size" is
+# there so size of item N can be always retrieved as
+# `offsets[N + 1] - offsets[N]`.
 #
-#       item         |       file       | item  | item 1 | item 2 |
-#      offsets       |       size       | flags |  data  |  data  | …
-# n*FILE_OFFSET_BITS | FILE_OFFSET_BITS | n*8b  |        |        |
+# offset |       item         |       file       | item  | item 1 | item 2 |
+#  size  |      offsets       |       size       | flags |  data  |  data  | …
+#   8b   | n*FILE_OFFSET_BITS | FILE_OFFSET_BITS | n*8b  |        |        |
 #
 # Basic item data (flags & 0b11 == 0b00):
 #
@@ -112,35 +135,35 @@ searchdata_filename_b85 = f'{{search_filename_prefix}}-v{searchdata_format_versi
 #
 # Suffixed item data (flags & 0b11 == 0b01):
 #
-#     suffix     | name | \0 | URL
-#     length     |      |    |
-# NAME_SIZE_BITS |      | 8b |
+# suffix | name | \0 | URL
+# length |      |    |
+# VARINT |      | 8b |
 #
 # Prefixed item data (flags & 0xb11 == 0b10):
 #
-#     prefix     |     prefix     |  name  | \0 |  URL
-#       id       |     length     | suffix |    | suffix
-# RESULT_ID_BITS | NAME_SIZE_BITS |        | 8b |
+# prefix | prefix |  name  | \0 |  URL
+#   id   | length | suffix |    | suffix
+# VARINT | VARINT |        | 8b |
 #
 # Prefixed & suffixed item (flags & 0xb11 == 0b11):
 #
-#     prefix     |     prefix     |     suffix     |  name  | \0 | URL
-#       id       |     length     |     length     | suffix |    |
-# RESULT_ID_BITS | NAME_SIZE_BITS | NAME_SIZE_BITS |        | 8b |
+# prefix | prefix | suffix |  name  | \0 | URL
+#   id   | length | length | suffix |    |
+# VARINT | VARINT | VARINT |        | 8b |
 #
 # Alias item (flags & 0xf0 == 0x00), flags & 0xb11 then denote what's in the
 # `…` portion, alias have no URL so the alias name is in place of it:
 #
-#     alias      |   | alias
-#       id       | … | name
-# RESULT_ID_BITS |   |
+# alias  |   | alias
+#   id   | … | name
+# VARINT |   |
 #
 # Type map encoding
 # =================
 #
 # Again the "end offset" is here so size of type N can be always retrieved as
 # `offsets[N + 1] - offsets[N]`. Type names are not expected to have more than
-# 255 chars, so NAME_SIZE_BITS is not used here.
+# 255 chars, so the offsets are just 8-bit.
 #
 #     type 1     |     type 2     |   |         |        | type 1 |
 # class |  name  | class |  name  | … | padding |  end   |  name  | …
@@ -151,137 +174,122 @@ class Serializer:
     # This is currently hardcoded
     result_map_flag_bytes = 1
 
-    header_struct = struct.Struct('<3sBBxxxIII')
+    header_struct = struct.Struct('<3sBBBxxIII')
     result_map_flags_struct = struct.Struct('<B')
     trie_root_offset_struct = struct.Struct('<I')
     type_map_entry_struct = struct.Struct('<BB')
 
-    def __init__(self, *, file_offset_bytes, result_id_bytes, name_size_bytes):
-        assert file_offset_bytes in [3, 4]
+    # If file_offset_bytes is None, the smallest size that fits is picked for
+    # each result map. Setting it is useful only for testing.
+    def __init__(self, *, file_offset_bytes: Optional[int] = None):
+        assert file_offset_bytes in [None, 2, 3, 4]
         self.file_offset_bytes = file_offset_bytes
 
-        assert result_id_bytes in [2, 3, 4]
-        self.result_id_bytes = result_id_bytes
-
-        assert name_size_bytes in [1, 2]
-        self.name_size_bytes = name_size_bytes
-
-    def pack_header(self, symbol_count, trie_size, result_map_size):
+    def pack_header(self, symbol_count, trie_size, result_map_size, shard_key_length: Optional[int] = None):
         return self.header_struct.pack(b'MCS', searchdata_format_version,
-            (self.file_offset_bytes - 3) << 0 |
-            (self.result_id_bytes - 2) << 1 |
-            (self.name_size_bytes - 1) << 3,
+            (shard_key_length is not None) << 0,
+            shard_key_length or 0,
             symbol_count,
             self.header_struct.size + trie_size,
             self.header_struct.size + trie_size + result_map_size)
 
+    def pack_varint(self, value: int) -> bytearray:
+        assert value >= 0
+        out = bytearray()
+        while value >= 0x80:
+            out.append(value & 0x7f | 0x80)
+            value >>= 7
+        out.append(value)
+        return out
+
     def pack_result_map_flags(self, flags: int):
         return self.result_map_flags_struct.pack(flags)
-    def pack_result_map_offset(self, offset: int):
-        if offset >= 256**self.file_offset_bytes:
-            raise OverflowError("Result map offset too large to store in {} bits, set SEARCH_FILE_OFFSET_BYTES = {} in your conf.py.".format(self.file_offset_bytes*8, self.file_offset_bytes + 1))
-        return offset.to_bytes(self.file_offset_bytes, byteorder='little')
+    def pack_result_map_offset(self, offset: int, file_offset_bytes: int):
+        if offset >= 256**file_offset_bytes:
+            raise OverflowError("Result map offset too large to store in {} bits".format(file_offset_bytes*8))
+        return offset.to_bytes(file_offset_bytes, byteorder='little')
     def pack_result_map_prefix(self, id: int, length: int):
-        if id >= 256**self.result_id_bytes:
-            raise OverflowError("Result map prefix ID too large to store in {} bits, set SEARCH_RESULT_ID_BYTES = {} in your conf.py.".format(self.result_id_bytes*8, self.result_id_bytes + 1))
-        if length >= 256**self.name_size_bytes:
-            raise OverflowError("Result map prefix length too large to store in {} bits, set SEARCH_NAME_SIZE_BYTES = {} in your conf.py.".format(self.name_size_bytes*8, self.name_size_bytes + 1))
-        return id.to_bytes(self.result_id_bytes, byteorder='little') + \
-           length.to_bytes(self.name_size_bytes, byteorder='little')
+        return self.pack_varint(id) + self.pack_varint(length)
     def pack_result_map_suffix_length(self, length: int):
-        if length >= 256**self.name_size_bytes:
-            raise OverflowError("Result map suffix length too large to store in {} bits, set SEARCH_NAME_SIZE_BYTES = {} in your conf.py.".format(self.name_size_bytes*8, self.name_size_bytes + 1))
-        return length.to_bytes(self.name_size_bytes, byteorder='little')
+        return self.pack_varint(length)
     def pack_result_map_alias(self, id: int):
-        if id >= 256**self.result_id_bytes:
-            raise OverflowError("Result map alias ID too large to store in {} bits, set SEARCH_RESULT_ID_BYTES = {} in your conf.py.".format(self.result_id_bytes*8, self.result_id_bytes + 1))
-        return id.to_bytes(self.result_id_bytes, byteorder='little')
+        return self.pack_varint(id)
 
     def pack_trie_root_offset(self, offset: int):
         return self.trie_root_offset_struct.pack(offset)
-    def pack_trie_node(self, result_ids: List[int], child_chars_offsets_barriers: List[Tuple[int, int, bool]]):
-        out = bytearray()
-        # If the result count fits into 7 bits, pack it into a single byte
-        if len(result_ids) < 128:
-            out += len(result_ids).to_bytes(1, byteorder='little')
-        # Otherwise use the leftmost bit to denote it's two-byte, and store the
-        # higher 8 bits in a second byte. Which is the same as storing the
-        # value as Big-Endian.
-        else:
-            assert len(result_ids) < 32768
-            out += (len(result_ids) | 0x8000).to_bytes(2, byteorder='big')
-        out += len(child_chars_offsets_barriers).to_bytes(1, byteorder='little')
+    # The offset is where the node itself is going to be, needed to calculate
+    # differences to the child offsets. Child offset of 0 means the child is
+    # in another shard.
+    def pack_trie_node(self, offset: int, result_ids: List[int], child_chars_offsets_barriers: List[Tuple[int, int, bool]]):
+        out = self.pack_varint(len(result_ids))
+        out += self.pack_varint(len(child_chars_offsets_barriers))
+        out += bytes([char for char, child_offset, barrier in child_chars_offsets_barriers])
+        for char, child_offset, barrier in child_chars_offsets_barriers:
+            assert child_offset < offset
+            out += self.pack_varint((offset - child_offset if child_offset else 0) << 1 | barrier)
         for id in result_ids:
-            if id >= 256**self.result_id_bytes:
-                raise OverflowError("Trie result ID too large to store in {} bits, set SEARCH_RESULT_ID_BYTES = {} in your conf.py.".format(self.result_id_bytes*8, self.result_id_bytes + 1))
-            out += id.to_bytes(self.result_id_bytes, byteorder='little')
-        out += bytes([char for char, offset, barrier in child_chars_offsets_barriers])
-        child_barrier_mask = 1 << (self.file_offset_bytes*8 - 1)
-        for char, offset, barrier in child_chars_offsets_barriers:
-            if offset >= child_barrier_mask:
-                raise OverflowError("Trie child offset too large to store in {} bits, set SEARCH_FILE_OFFSET_BYTES = {} in your conf.py.".format(self.file_offset_bytes*8 - 1, self.file_offset_bytes + 1))
-            out += (offset | (barrier*child_barrier_mask)).to_bytes(self.file_offset_bytes, byteorder='little')
+            out += self.pack_varint(id)
         return out
 
     def pack_type_map_entry(self, class_: int, offset: int):
         return self.type_map_entry_struct.pack(class_, offset)
 
+# All unpack_*() functions work on anything supporting the buffer protocol.
+# Passing a memoryview, for example of a mmap'd file, avoids copying the data
+# when taking the trie or the result map out of a whole file.
 class Deserializer:
-    def __init__(self, *, file_offset_bytes, result_id_bytes, name_size_bytes):
-        assert file_offset_bytes in [3, 4]
-        self.file_offset_bytes = file_offset_bytes
-
-        assert result_id_bytes in [2, 3, 4]
-        self.result_id_bytes = result_id_bytes
-
-        assert name_size_bytes in [1, 2]
-        self.name_size_bytes = name_size_bytes
-
     @classmethod
     def from_serialized(self, serialized: bytes):
-        magic, version, type_data, symbol_count, map_offset, type_map_offset = Serializer.header_struct.unpack_from(serialized)
+        magic, version, type_data, shard_key_length, symbol_count, map_offset, type_map_offset = Serializer.header_struct.unpack_from(serialized)
         assert magic == b'MCS'
         assert version == searchdata_format_version
-        out = Deserializer(
-            file_offset_bytes=[3, 4][(type_data & 0b0001) >> 0],
-            result_id_bytes=[2, 3, 4][(type_data & 0b0110) >> 1],
-            name_size_bytes=[1, 2][(type_data & 0b1000) >> 3])
+        out = Deserializer()
         out.symbol_count = symbol_count
+        out.shard_key_length = shard_key_length if type_data & 0b1 else None
         out.map_offset = map_offset
         out.type_map_offset = type_map_offset
         return out
 
     # The last tuple item is number of bytes extracted
+    def unpack_varint(self, serialized: bytes, offset: int) -> Tuple[int, int]:
+        # Most values fit into a single byte
+        byte = serialized[offset]
+        if not byte & 0x80: return byte, 1
+
+        value = 0
+        shift = 0
+        size = 0
+        while True:
+            byte = serialized[offset + size]
+            value |= (byte & 0x7f) << shift
+            shift += 7
+            size += 1
+            if not byte & 0x80: return value, size
+
     def unpack_result_map_flags(self, serialized: bytes, offset: int) -> Tuple[int, int]:
         return Serializer.result_map_flags_struct.unpack_from(serialized, offset) + (Serializer.result_map_flags_struct.size, )
-    def unpack_result_map_offset(self, serialized: bytes, offset: int) -> Tuple[int, int]:
-        return int.from_bytes(serialized[offset:offset + self.file_offset_bytes], byteorder='little'), self.file_offset_bytes
+    def unpack_result_map_offset_size(self, serialized: bytes) -> Tuple[int, int]:
+        return serialized[0], 1
+    def unpack_result_map_offset(self, serialized: bytes, offset: int, file_offset_bytes: int) -> Tuple[int, int]:
+        return int.from_bytes(serialized[offset:offset + file_offset_bytes], byteorder='little'), file_offset_bytes
     def unpack_result_map_prefix(self, serialized: bytes, offset: int) -> Tuple[int, int, int]:
-        return int.from_bytes(serialized[offset:offset + self.result_id_bytes], byteorder='little'), int.from_bytes(serialized[offset + self.result_id_bytes:offset + self.result_id_bytes + self.name_size_bytes], byteorder='little'), self.result_id_bytes + self.name_size_bytes
+        id, id_size = self.unpack_varint(serialized, offset)
+        length, length_size = self.unpack_varint(serialized, offset + id_size)
+        return id, length, id_size + length_size
     def unpack_result_map_suffix_length(self, serialized: bytes, offset: int) -> Tuple[int, int]:
-        return int.from_bytes(serialized[offset:offset + self.name_size_bytes], byteorder='little'), self.name_size_bytes
+        return self.unpack_varint(serialized, offset)
     def unpack_result_map_alias(self, serialized: bytes, offset: int) -> Tuple[int, int]:
-        return int.from_bytes(serialized[offset:offset + self.result_id_bytes], byteorder='little'), self.result_id_bytes
+        return self.unpack_varint(serialized, offset)
 
     def unpack_trie_root_offset(self, serialized: bytes, offset: int) -> Tuple[int, int]:
         return Serializer.trie_root_offset_struct.unpack_from(serialized, offset) + (Serializer.trie_root_offset_struct.size, )
-    def unpack_trie_node(self, serialized: bytes, offset: int) -> Tuple[List[int], List[int], List[Tuple[int, int, bool]], int]:
+    # Child offsets are returned absolute, 0 if the child is in another shard
+    def unpack_trie_node(self, serialized: bytes, offset: int) -> Tuple[List[int], List[Tuple[int, int, bool]], int]:
         prev_offset = offset
-        # Result count, first try 8-bit, if it has the highest bit set, extract
-        # two bytes (as a BE) and then remove the highest bit
-        result_count = int.from_bytes(serialized[offset:offset + 1], byteorder='little')
-        if result_count & 0x80:
-            result_count = int.from_bytes(serialized[offset:offset + 2], byteorder='big') & ~0x8000
-            offset += 1
-        offset += 1
-        child_count = int.from_bytes(serialized[offset:offset + 1], byteorder='little')
-        offset += 1
-
-        # Unpack all result IDs
-        result_ids = []
-        for i in range(result_count):
-            result_ids += [int.from_bytes(serialized[offset:offset + self.result_id_bytes], byteorder='little')]
-            offset += self.result_id_bytes
+        result_count, size = self.unpack_varint(serialized, offset)
+        offset += size
+        child_count, size = self.unpack_varint(serialized, offset)
+        offset += size
 
         # Unpack all child chars
         child_chars = list(serialized[offset:offset + child_count])
@@ -289,11 +297,17 @@ class Deserializer:
 
         # Unpack all children offsets and lookahead barriers
         child_chars_offsets_barriers = []
-        child_barrier_mask = 1 << (self.file_offset_bytes*8 - 1)
         for i in range(child_count):
-            child_offset_barrier = int.from_bytes(serialized[offset:offset + self.file_offset_bytes], byteorder='little')
-            child_chars_offsets_barriers += [(child_chars[i], child_offset_barrier & ~child_barrier_mask, bool(child_offset_barrier & child_barrier_mask))]
-            offset += self.file_offset_bytes
+            child_offset_barrier, size = self.unpack_varint(serialized, offset)
+            child_chars_offsets_barriers += [(child_chars[i], prev_offset - (child_offset_barrier >> 1) if child_offset_barrier >> 1 else 0, bool(child_offset_barrier & 1))]
+            offset += size
+
+        # Unpack all result IDs
+        result_ids = []
+        for i in range(result_count):
+            id, size = self.unpack_varint(serialized, offset)
+            result_ids += [id]
+            offset += size
 
         return result_ids, child_chars_offsets_barriers, offset - prev_offset
 
@@ -350,92 +364,183 @@ class ResultFlag(enum.Flag):
     _TYPE14 = 14 << 4
     _TYPE15 = 15 << 4
 
+def _common_prefix_length(a: str, b: str) -> int:
+    length = 0
+    for i, j in zip(a, b):
+        if i != j: break
+        length += 1
+    return length
+
+# Used by ResultMap.serialize() to find, among entries of the same name, the
+# one sharing the longest URL prefix with another entry, picking the one with
+# the smallest index if there's more than one. The entries are sorted by URL,
+# which means the longest shared prefix is always with one of the neighbors of
+# the searched URL and all entries sharing it are next to each other. A sparse
+# table of minimal indices then gives the smallest index in such a range in
+# constant time, so the search is logarithmic in the entry count instead of
+# linear.
+class _UrlPrefixes:
+    def __init__(self, entries, indices: List[int]):
+        self._sorted = sorted((entries[index].url, index) for index in indices)
+        self._urls = [url for url, index in self._sorted]
+
+        # _minima[k][i] is the smallest index out of the 2^k entries starting
+        # at i
+        minima = [index for url, index in self._sorted]
+        self._minima = [minima]
+        width = 1
+        while 2*width <= len(self._sorted):
+            minima = [min(minima[i], minima[i + width]) for i in range(len(minima) - width)]
+            self._minima += [minima]
+            width *= 2
+
+    # Smallest index in given range, or None if it's empty
+    def _min(self, begin: int, end: int):
+        if begin >= end: return None
+        level = (end - begin).bit_length() - 1
+        minima = self._minima[level]
+        return min(minima[begin], minima[end - (1 << level)])
+
+    # Returns the entry sharing the longest prefix with given URL and the
+    # prefix length. The entry given by `exclude` is ignored, there has to be
+    # at least one other.
+    def find(self, url: str, exclude: int) -> Tuple[int, int]:
+        urls = self._urls
+
+        # Position where the URL would be inserted, which is either the
+        # excluded entry itself or the following one
+        position = bisect.bisect_left(self._sorted, (url, exclude))
+        after = position
+        if after < len(urls) and self._sorted[after][1] == exclude: after += 1
+
+        length = -1
+        if position: length = _common_prefix_length(url, urls[position - 1])
+        if after < len(urls): length = max(length, _common_prefix_length(url, urls[after]))
+        assert length != -1
+
+        # All entries sharing the prefix are around the neighbors, find the
+        # end of the range with a binary search
+        prefix = url[:length]
+        begin = bisect.bisect_left(urls, prefix)
+        end = len(urls)
+        i = after
+        while i < end:
+            middle = (i + end)//2
+            if urls[middle].startswith(prefix): i = middle + 1
+            else: end = middle
+
+        found = [index for index in (self._min(begin, position), self._min(after, end)) if index is not None]
+        return min(found), length
+
+# Search result collected by doxygen.py and python.py. There's one for every
+# symbol, so it's slotted to not need a per-instance dict.
+class SearchResult:
+    __slots__ = ['flags', 'url', 'prefix', 'name', 'keywords', 'params', 'suffix']
+
+    def __init__(self):
+        self.flags: ResultFlag
+        self.url: str
+        self.prefix: List[str]
+        self.name: str
+        # Additional (search, title, suffix length) tuples, used by doxygen.py
+        self.keywords: List[Tuple[str, str, int]] = []
+        self.params: Optional[List[str]] = None
+        self.suffix: Optional[str] = None
+
+class ResultMapEntry:
+    __slots__ = ['name', 'url', 'flags', 'alias', 'prefix', 'prefix_length', 'suffix_length']
+
+    def __init__(self, name, url, flags, alias, prefix, prefix_length, suffix_length):
+        self.name: str = name
+        self.url: str = url
+        self.flags: ResultFlag = flags
+        self.alias: Optional[int] = alias
+        self.prefix: int = prefix
+        self.prefix_length: int = prefix_length
+        self.suffix_length: int = suffix_length
+
 class ResultMap:
     def __init__(self):
-        self.entries = []
+        self.entries: List[ResultMapEntry] = []
 
     def add(self, name, url, alias=None, suffix_length=0, flags=ResultFlag(0)) -> int:
         if suffix_length: flags |= ResultFlag.HAS_SUFFIX
         if alias is not None:
             assert flags & ResultFlag._TYPE == ResultFlag.ALIAS
 
-        entry = Empty()
-        entry.name = name
-        entry.url = url
-        entry.flags = flags
-        entry.alias = alias
-        entry.prefix = 0
-        entry.prefix_length = 0
-        entry.suffix_length = suffix_length
-
-        self.entries += [entry]
+        self.entries += [ResultMapEntry(name, url, flags, alias, 0, 0, suffix_length)]
         return len(self.entries) - 1
 
+    # Creates a map with just the entries of given IDs and the entries they
+    # alias, in the original order. Returns the new map together with a
+    # mapping from the original IDs to the new ones. Used for sharded search
+    # data, has to be called before serialize(), which merges the prefixes in
+    # place.
+    def slice(self, ids) -> Tuple['ResultMap', Dict[int, int]]:
+        ids = set(ids)
+        ids |= {self.entries[id].alias for id in ids if self.entries[id].alias is not None}
+
+        mapping: Dict[int, int] = {id: i for i, id in enumerate(sorted(ids))}
+        out = ResultMap()
+        for id in sorted(ids):
+            e = self.entries[id]
+            out.entries += [e if e.alias is None else ResultMapEntry(e.name, e.url, e.flags, mapping[e.alias], e.prefix, e.prefix_length, e.suffix_length)]
+        return out, mapping
+
     def serialize(self, serializer: Serializer, merge_prefixes=True) -> bytearray:
         if merge_prefixes:
-            # Put all entry names into a trie to discover common prefixes
-            trie = Trie()
+            # Group entries with the same name together. Multiple entries have
+            # the same name for example in case of function overloads.
+            names: Dict[str, List[int]] = {}
             for index, e in enumerate(self.entries):
-                trie.insert(e.name, index)
+                names.setdefault(e.name, []).append(index)
+
+            # For each name find the longest other name that's a prefix of it.
+            # In a sorted list, prefixes of a name are always before it and
+            # names that aren't prefixes of it end the run of names that are,
+            # so it's enough to maintain a stack of names that are prefixes of
+            # each other. An empty name is never used as a prefix.
+            name_prefixes: Dict[str, str] = {}
+            stack: List[str] = []
+            for name in sorted(names):
+                if not name: continue
+                while stack and not name.startswith(stack[-1]):
+                    stack.pop()
+                if stack: name_prefixes[name] = stack[-1]
+                stack += [name]
 
             # Create a new list with merged prefixes
+            url_prefixes: Dict[str, _UrlPrefixes] = {}
             merged = []
             for index, e in enumerate(self.entries):
-                # Search in the trie and get the longest shared name prefix
-                # that is already fully contained in some other entry
-                current = trie
+                # Get the longest shared name prefix that's fully contained in
+                # some other entry. Allow self-reference only when some of the
+                # entries with the same name have a longer suffix (otherwise
+                # cycles happen). This is for functions that should appear
+                # when searching for foo (so they get ordered properly based
+                # on the name length) and also when searching for foo() (so
+                # everything that's not a function gets filtered out). Such
+                # entries are completely the same except for a different
+                # suffix length.
                 longest_prefix = None
-                for c in e.name.encode('utf-8'):
-                    for candidate, child in current.children.items():
-                        if c == candidate:
-                            current = child[1]
+                if e.name:
+                    for i in names[e.name]:
+                        if self.entries[i].suffix_length > e.suffix_length:
+                            longest_prefix = e.name
                             break
-                    else: assert False # pragma: no cover
-
-                    # Allow self-reference only when referenced result suffix
-                    # is longer (otherwise cycles happen). This is for
-                    # functions that should appear when searching for foo (so
-                    # they get ordered properly based on the name length) and
-                    # also when searching for foo() (so everything that's not
-                    # a function gets filtered out). Such entries are
-                    # completely the same except for a different suffix length.
-                    if index in current.results:
-                        for i in current.results:
-                            if self.entries[i].suffix_length > self.entries[index].suffix_length:
-                                longest_prefix = current
-                                break
-                    elif current.results:
-                        longest_prefix = current
+                    else:
+                        longest_prefix = name_prefixes.get(e.name)
 
                 # Name prefix found, for all possible URLs find the one that
                 # shares the longest prefix
-                if longest_prefix:
-                    max_prefix = (0, -1)
-                    for longest_index in longest_prefix.results:
-                        # Ignore self (function self-reference, see above)
-                        if longest_index == index: continue
-
-                        prefix_length = 0
-                        for i in range(min(len(e.url), len(self.entries[longest_index].url))):
-                            if e.url[i] != self.entries[longest_index].url[i]: break
-                            prefix_length += 1
-                        if max_prefix[1] < prefix_length:
-                            max_prefix = (longest_index, prefix_length)
-
-                    # Expect we found something
-                    assert max_prefix[1] != -1
+                if longest_prefix is not None:
+                    if longest_prefix not in url_prefixes:
+                        url_prefixes[longest_prefix] = _UrlPrefixes(self.entries, names[longest_prefix])
+                    prefix, prefix_length = url_prefixes[longest_prefix].find(e.url, index)
 
                     # Save the entry with reference to the prefix
-                    entry = Empty()
-                    assert e.name.startswith(self.entries[longest_prefix.results[0]].name)
-                    entry.name = e.name[len(self.entries[longest_prefix.results[0]].name):]
-                    entry.url = e.url[max_prefix[1]:]
-                    entry.flags = e.flags|ResultFlag.HAS_PREFIX
-                    entry.alias = e.alias
-                    entry.prefix = max_prefix[0]
-                    entry.prefix_length = max_prefix[1]
-                    entry.suffix_length = e.suffix_length
-                    merged += [entry]
+                    assert e.name.startswith(longest_prefix)
+                    merged += [ResultMapEntry(e.name[len(longest_prefix):], e.url[prefix_length:], e.flags|ResultFlag.HAS_PREFIX, e.alias, prefix, prefix_length, e.suffix_length)]
 
                 # No prefix found, copy the entry verbatim
                 else: merged += [e]
@@ -443,97 +548,130 @@ class ResultMap:
             # Everything merged, replace the original list
             self.entries = merged
 
-        # Write the offset array. Starting offset for items is after the
-        # (aligned) flag array and (aligned) offset + file size array.
-        output = bytearray()
-        offset = len(self.entries)*serializer.result_map_flag_bytes + (len(self.entries) + 1)*serializer.file_offset_bytes
+        # Serialize the entries first, as their total size decides how large
+        # the offsets need to be
+        entries = []
         for e in self.entries:
-            output += serializer.pack_result_map_offset(offset)
-
-            # The entry is an alias, extra field for alias index
+            entry = bytearray()
             if e.flags & ResultFlag._TYPE == ResultFlag.ALIAS:
-                offset += serializer.result_id_bytes
-
-            # Extra field for prefix index and length
+                assert not e.alias is None
+                assert not e.url
+                entry += serializer.pack_result_map_alias(e.alias)
             if e.flags & ResultFlag.HAS_PREFIX:
-                offset += serializer.result_id_bytes + serializer.name_size_bytes
-
-            # Extra field for suffix length
+                entry += serializer.pack_result_map_prefix(e.prefix, e.prefix_length)
             if e.flags & ResultFlag.HAS_SUFFIX:
-                offset += serializer.name_size_bytes
-
-            # Length of the name
-            offset += len(e.name.encode('utf-8'))
-
-            # Length of the URL and 0-delimiter. If URL is empty, it's not
-            # added at all, then the 0-delimiter is also not needed.
-            if e.name and e.url:
-                 offset += len(e.url.encode('utf-8')) + 1
+                entry += serializer.pack_result_map_suffix_length(e.suffix_length)
+            entry += e.name.encode('utf-8')
+            # If URL is empty, it's not added at all, then the 0-delimiter is
+            # also not needed
+            if e.url:
+                entry += b'\0'
+                entry += e.url.encode('utf-8')
+            entries += [entry]
+
+        # Pick the smallest offset size where the file size fits, unless it's
+        # set explicitly. Starting offset for items is after the offset size,
+        # the offset + file size array and the flag array.
+        size = sum(len(entry) for entry in entries)
+        for file_offset_bytes in [serializer.file_offset_bytes] if serializer.file_offset_bytes else [2, 3, 4]:
+            offset = 1 + (len(self.entries) + 1)*file_offset_bytes + len(self.entries)*serializer.result_map_flag_bytes
+            if offset + size < 256**file_offset_bytes: break
+
+        # Write the offset size and the offset array
+        output = bytearray([file_offset_bytes])
+        for entry in entries:
+            output += serializer.pack_result_map_offset(offset, file_offset_bytes)
+            offset += len(entry)
 
         # Write file size
-        output += serializer.pack_result_map_offset(offset)
+        output += serializer.pack_result_map_offset(offset, file_offset_bytes)
 
         # Write the flag array
         for e in self.entries:
             output += serializer.pack_result_map_flags(e.flags.value)
 
         # Write the entries themselves
-        for e in self.entries:
-            if e.flags & ResultFlag._TYPE == ResultFlag.ALIAS:
-                assert not e.alias is None
-                assert not e.url
-                output += serializer.pack_result_map_alias(e.alias)
-            if e.flags & ResultFlag.HAS_PREFIX:
-                output += serializer.pack_result_map_prefix(e.prefix, e.prefix_length)
-            if e.flags & ResultFlag.HAS_SUFFIX:
-                output += serializer.pack_result_map_suffix_length(e.suffix_length)
-            output += e.name.encode('utf-8')
-            if e.url:
-                output += b'\0'
-                output += e.url.encode('utf-8')
+        for entry in entries:
+            output += entry
 
         assert len(output) == offset
         return output
 
+# The trie is stored in flat arrays indexed by node ID instead of as a tree of
+# Python objects, which takes several times less memory for large projects and
+# makes it possible to do everything without recursion. The root is node 0.
+# Children of each node are kept as a singly-linked list in the order they
+# were added, which is also the order in which they get serialized, and
+# looked up through a single dict indexed with (parent ID << 8) | byte.
 class Trie:
     def __init__(self):
-        self.results = []
-        self.children = {}
-
-    def _insert(self, path: bytes, result: Union[int, List[int]], lookahead_barriers):
-        if not path:
-            # Inserting a list is mainly used by the
-            # TrieSerialization.test_23bit_file_offset_too_small() test, as
-            # otherwise it'd be WAY too slow.
-            # TODO this whole thing needs optimizing with less recursion
-            if type(result) is list:
-                self.results += result
+        self._edges: Dict[int, int] = {}
+        # Byte leading to given node and whether there's a lookahead barrier
+        # on it
+        self._chars = bytearray(1)
+        self._barriers = bytearray(1)
+        self._first_child = array.array('i', [-1])
+        self._last_child = array.array('i', [-1])
+        self._next_sibling = array.array('i', [-1])
+        # Only a small fraction of nodes have results, so it's a dict
+        self._results: Dict[int, List[int]] = {}
+        # Nodes with subtrees in other shards, see split()
+        self._external: Set[int] = set()
+
+    def _child(self, node: int, char: int) -> int:
+        key = node << 8 | char
+        child = self._edges.get(key)
+        if child is None:
+            child = len(self._chars)
+            self._edges[key] = child
+            self._chars.append(char)
+            self._barriers.append(0)
+            self._first_child.append(-1)
+            self._last_child.append(-1)
+            self._next_sibling.append(-1)
+            if self._last_child[node] == -1:
+                self._first_child[node] = child
             else:
-                self.results += [result]
-            return
-
-        char = path[0]
-        if not char in self.children:
-            self.children[char] = (False, Trie())
-        if lookahead_barriers and lookahead_barriers[0] == 0:
-            lookahead_barriers = lookahead_barriers[1:]
-            self.children[char] = (True, self.children[char][1])
-        self.children[char][1]._insert(path[1:], result, [b - 1 for b in lookahead_barriers])
+                self._next_sibling[self._last_child[node]] = child
+            self._last_child[node] = child
+        return child
+
+    def _children(self, node: int) -> List[int]:
+        out = []
+        child = self._first_child[node]
+        while child != -1:
+            out += [child]
+            child = self._next_sibling[child]
+        return out
 
     def insert(self, path: str, result: Union[int, List[int]], lookahead_barriers=[]):
-        self._insert(path.encode('utf-8'), result, lookahead_barriers)
-
-    def _sort(self, key):
-        self.results.sort(key=key)
-        for _, child in self.children.items():
-            child[1]._sort(key)
+        node = 0
+        barrier = 0
+        for depth, char in enumerate(path.encode('utf-8')):
+            node = self._child(node, char)
+            if barrier < len(lookahead_barriers) and lookahead_barriers[barrier] == depth:
+                self._barriers[node] = 1
+                barrier += 1
+
+        # Inserting a list is mainly used by the
+        # TrieSerialization.test_23bit_file_offset_too_small() test, as
+        # otherwise it'd be WAY too slow.
+        results = self._results.setdefault(node, [])
+        if type(result) is list:
+            results += result
+        else:
+            results += [result]
 
     def sort(self, result_map: ResultMap):
         # What the shit, why can't I just take two elements and say which one
-        # is in front of which, this is awful
+        # is in front of which, this is awful. The same result is in many
+        # nodes, so the keys are calculated just once for each.
+        keys = {}
         def key(item: int):
+            if item in keys: return keys[item]
+
             entry = result_map.entries[item]
-            return [
+            keys[item] = [
                 # First order based on deprecation/deletion status, deprecated
                 # always last, deleted in front of them, usable stuff on top
                 2 if entry.flags & ResultFlag.DEPRECATED else 1 if entry.flags & ResultFlag.DELETED else 0,
@@ -549,36 +687,153 @@ class Trie:
                 # first)
                 len(entry.name)
             ]
+            return keys[item]
+
+        for results in self._results.values():
+            results.sort(key=key)
+
+    # Splits the trie into shards for sharded search data, see the format
+    # description at the top for details. Each child of the root starts a
+    # shard, and so does each node behind a lookahead barrier that has at
+    # least min_shard_weight nodes and results in its subtree, not counting
+    # what's in other shards already. Returns a list of shard keys and tries,
+    # the first being the index with an empty key. Each trie contains the key
+    # as a chain from the root, so it can be searched the same way as the
+    # whole trie.
+    def split(self, min_shard_weight) -> List[Tuple[bytes, 'Trie']]:
+        count = len(self._chars)
+        parent = array.array('i', [-1])*count
+        depth = array.array('i', [0])*count
+        for node in range(count):
+            for child in self._children(node):
+                parent[child] = node
+                depth[child] = depth[node] + 1
+
+        # Children always have a larger ID than their parent, so going
+        # backwards accumulates the subtree weights bottom up. The key length
+        # is stored in a byte, so deeper nodes can't start a shard.
+        weight = array.array('q', [0])*count
+        cut = bytearray(count)
+        for node in reversed(range(1, count)):
+            weight[node] += 1 + len(self._results.get(node, []))
+            if depth[node] == 1 or (self._barriers[node] and weight[node] >= min_shard_weight and depth[node] <= 255):
+                cut[node] = 1
+            else:
+                weight[parent[node]] += weight[node]
 
-        self._sort(key)
+        out = []
+        for root in [0] + [node for node in range(1, count) if cut[node]]:
+            chain = []
+            node = root
+            while node:
+                chain += [node]
+                node = parent[node]
 
-    # Returns offset of the serialized thing in `output`
-    def _serialize(self, serializer: Serializer, hashtable, output: bytearray, merge_subtrees) -> int:
-        # Serialize all children first
-        child_chars_offsets_barriers = []
-        for char, child in self.children.items():
-            offset = child[1]._serialize(serializer, hashtable, output, merge_subtrees=merge_subtrees)
-            child_chars_offsets_barriers += [(char, offset, child[0])]
-
-        # Serialize this node
-        serialized = serializer.pack_trie_node(self.results, child_chars_offsets_barriers)
-
-        # Subtree merging: if this exact tree is already in the table, return
-        # its offset. Otherwise add it and return the new offset.
-        # TODO: why hashable = bytes(output[base_offset:] + serialized) didn't work?
-        hashable = bytes(serialized)
-        if merge_subtrees and hashable in hashtable:
-            return hashtable[hashable]
-        else:
-            offset = len(output)
-            output += serialized
-            if merge_subtrees: hashtable[hashable] = offset
-            return offset
+            trie = Trie()
+            copy = 0
+            for node in reversed(chain):
+                copy = trie._child(copy, self._chars[node])
+                trie._barriers[copy] = self._barriers[node]
+            if root in self._results:
+                trie._results[copy] = list(self._results[root])
+
+            # Pairs of a node in this trie and a parent node in the new one
+            stack = [(child, copy) for child in reversed(self._children(root))]
+            while stack:
+                node, parent_copy = stack.pop()
+                copy = trie._child(parent_copy, self._chars[node])
+                trie._barriers[copy] = self._barriers[node]
+                if cut[node]:
+                    trie._external.add(copy)
+                    continue
+                if node in self._results:
+                    trie._results[copy] = list(self._results[node])
+                stack += [(child, copy) for child in reversed(self._children(node))]
+
+            out += [(bytes(self._chars[node] for node in reversed(chain)), trie)]
+        return out
+
+    # IDs of all results referenced by the trie
+    def result_ids(self) -> Set[int]:
+        return {id for results in self._results.values() for id in results}
 
-    def serialize(self, serializer: Serializer, merge_subtrees=True) -> bytearray:
+    # Replaces all result IDs according to given mapping, used together with
+    # ResultMap.slice(). Order of the results in each node is kept.
+    def remap_results(self, mapping: Dict[int, int]):
+        for results in self._results.values():
+            results[:] = [mapping[id] for id in results]
+
+    # If stats is passed, it gets filled with count of all nodes in the trie
+    # and count of nodes that were actually serialized after merging.
+    def serialize(self, serializer: Serializer, merge_subtrees=True, stats: Optional[Empty] = None) -> bytearray:
         output = bytearray(b'\x00\x00\x00\x00')
-        hashtable = {}
-        output[0:4] = serializer.pack_trie_root_offset(self._serialize(serializer, hashtable, output, merge_subtrees=merge_subtrees))
+        hashtable: Dict[bytes, int] = {}
+        # Offset of each serialized node in `output`
+        offsets = array.array('q', bytes(8*len(self._chars)))
+        chars = self._chars
+        barriers = self._barriers
+        results = self._results
+        first_child = self._first_child
+        next_sibling = self._next_sibling
+        external = self._external
+        node_count = 0
+
+        # Children are serialized before their parent. Each node is visited
+        # twice, first to put its children on the stack and then, marked with
+        # a bit complement, to serialize it once all the children are done.
+        # Nodes with subtrees in other shards are not serialized at all and
+        # keep the offset at 0.
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            if node in external:
+                continue
+            if node >= 0:
+                stack += [~node]
+                stack += reversed(self._children(node))
+                continue
+
+            node = ~node
+            node_count += 1
+            child_chars_offsets_barriers = []
+            child = first_child[node]
+            while child != -1:
+                # Subtrees in other shards are marked with a lookahead barrier
+                # as well so they're skipped when gathering results
+                child_chars_offsets_barriers += [(chars[child], offsets[child], barriers[child] or child in external)]
+                child = next_sibling[child]
+            node_results = results.get(node, [])
+
+            # Subtree merging: if an equivalent node is already serialized,
+            # use its offset. Otherwise add it and remember the new offset.
+            # Because children are serialized first and already replaced with
+            # the offsets of their merged equivalents, comparing just the
+            # results and the child offsets of a node is enough to find out
+            # whether whole subtrees are equivalent, and the result is a
+            # minimal acyclic automaton without having to compare any
+            # subtrees. The serialized node depends on its own offset, so the
+            # table can't be indexed by the output bytes. It's indexed by the
+            # result IDs and the absolute child offsets packed together with
+            # the chars and barriers instead, which takes several times less
+            # memory than tuples would for the millions of nodes of a large
+            # project.
+            if merge_subtrees:
+                hashable = array.array('q', [len(node_results)] + node_results + [char << 40 | child_offset << 1 | barrier for char, child_offset, barrier in child_chars_offsets_barriers]).tobytes()
+                offset = hashtable.get(hashable)
+                if offset is None:
+                    offset = len(output)
+                    output += serializer.pack_trie_node(offset, node_results, child_chars_offsets_barriers)
+                    hashtable[hashable] = offset
+            else:
+                offset = len(output)
+                output += serializer.pack_trie_node(offset, node_results, child_chars_offsets_barriers)
+            offsets[node] = offset
+
+        output[0:4] = serializer.pack_trie_root_offset(offsets[0])
+
+        if stats is not None:
+            stats.node_count = node_count
+            stats.serialized_node_count = len(hashtable) if merge_subtrees else node_count
         return output
 
 def serialize_type_map(serializer: Serializer, map: List[Tuple[CssClass, str]]) -> bytearray:
@@ -602,58 +857,336 @@ def serialize_type_map(serializer: Serializer, map: List[Tuple[CssClass, str]])
 
     return serialized + names
 
-def serialize_search_data(serializer: Serializer, trie: Trie, map: ResultMap, type_map: List[Tuple[CssClass, str]], symbol_count, *, merge_subtrees=True, merge_prefixes=True) -> bytearray:
+def serialize_search_data(serializer: Serializer, trie: Trie, map: ResultMap, type_map: List[Tuple[CssClass, str]], symbol_count, *, merge_subtrees=True, merge_prefixes=True, shard_key: Optional[bytes] = None) -> bytearray:
     serialized_trie = trie.serialize(serializer, merge_subtrees=merge_subtrees)
     serialized_map = map.serialize(serializer, merge_prefixes=merge_prefixes)
     serialized_type_map = serialize_type_map(serializer, type_map)
 
-    preamble = serializer.pack_header(symbol_count, len(serialized_trie), len(serialized_map))
+    preamble = serializer.pack_header(symbol_count, len(serialized_trie), len(serialized_map), shard_key_length=None if shard_key is None else len(shard_key))
     return preamble + serialized_trie + serialized_map + serialized_type_map
 
+# Arguments for _serialize_search_data_shard(), set only for the duration of
+# serialize_search_data_sharded() so they get inherited by the forked workers
+# instead of being pickled
+_shard_args = None
+
+def _serialize_search_data_shard(i):
+    serializer, shards, type_map, symbol_count, merge_subtrees, merge_prefixes = _shard_args
+    key, trie, map = shards[i]
+    # The index reports the total symbol count, the other shards just what
+    # they contain
+    return serialize_search_data(serializer, trie, map, type_map, len(map.entries) if key else symbol_count, merge_subtrees=merge_subtrees, merge_prefixes=merge_prefixes, shard_key=key)
+
+# Splits the search data into shards, see the format description at the top
+# and Trie.split() for details. Returns a list of shard keys and serialized
+# shards, the first being the index. The shards are independent of each
+# other, so with more than one job they're serialized in parallel.
+def serialize_search_data_sharded(serializer: Serializer, trie: Trie, map: ResultMap, type_map: List[Tuple[CssClass, str]], symbol_count, *, merge_subtrees=True, merge_prefixes=True, min_shard_weight=4096, jobs=1) -> List[Tuple[bytes, bytearray]]:
+    global _shard_args
+
+    shards = []
+    for key, shard_trie in trie.split(min_shard_weight):
+        shard_map, mapping = map.slice(shard_trie.result_ids())
+        shard_trie.remap_results(mapping)
+        shards += [(key, shard_trie, shard_map)]
+
+    _shard_args = (serializer, shards, type_map, symbol_count, merge_subtrees, merge_prefixes)
+    try:
+        if jobs > 1 and len(shards) > 2 and 'fork' in multiprocessing.get_all_start_methods():
+            with multiprocessing.get_context('fork').Pool(min(jobs, len(shards))) as pool:
+                serialized_shards = pool.map(_serialize_search_data_shard, range(len(shards)))
+        else:
+            serialized_shards = [_serialize_search_data_shard(i) for i in range(len(shards))]
+    finally:
+        _shard_args = None
+
+    return [(key, serialized) for (key, shard_trie, shard_map), serialized in zip(shards, serialized_shards)]
+
+# Name of a shard file corresponding to given index file name
+def search_shard_filename(filename: str, key: bytes) -> str:
+    if not key: return filename
+    base, extension = os.path.splitext(filename)
+    return '{}-{}{}'.format(base, key.hex(), extension)
+
 def base85encode_search_data(data: bytearray) -> bytearray:
     return (b"/* Generated by https://mcss.mosra.cz/documentation/doxygen/. Do not edit. */\n" +
             b"Search.load('" + base64.b85encode(data, True) + b"');\n")
 
-def _pretty_print_trie(deserializer: Deserializer, serialized: bytearray, hashtable, stats, base_offset, indent, *, show_merged, show_lookahead_barriers, color_map) -> str:
-    # Visualize where the trees were merged
-    if show_merged and base_offset in hashtable:
-        return color_map['red'] + '#' + color_map['reset']
+# Inverse of base85encode_search_data(). The Base85 data are padded to a
+# multiple of four bytes, same as when decoded by search.js.
+def base85decode_search_data(data: bytes) -> bytes:
+    begin = data.index(b"Search.load('") + len(b"Search.load('")
+    return base64.b85decode(data[begin:data.index(b"')", begin)])
+
+# Key of a shard of sharded search data, which is stored as a chain of nodes
+# from the root of its trie
+def shard_key(deserializer: Deserializer, serialized: bytes) -> bytes:
+    out = bytearray()
+    offset = deserializer.unpack_trie_root_offset(serialized, 0)[0]
+    for i in range(deserializer.shard_key_length):
+        result_ids, child_chars_offsets_barriers, next_offset = deserializer.unpack_trie_node(serialized, offset)
+        char, offset, barrier = child_chars_offsets_barriers[0]
+        out.append(char)
+    return bytes(out)
+
+# Python equivalent of the lookup done by search.js, for benchmarking and
+# debugging search data without a browser. The data can be anything
+# supporting the buffer protocol, such as a mmap'd file, it's only accessed
+# through a memoryview and never copied. For sharded data, load_shard gets
+# called with a shard key the first time the shard is needed and is expected
+# to return its data or None if it's not available, in which case the search
+# returns nothing, same as search.js does while the shard is downloading.
+#
+# Unlike search.js, each search starts from the root instead of continuing
+# from what was found for the previous string, the results are the same.
+class SearchData:
+    def __init__(self, serialized, *, load_shard: Optional[Callable[[bytes], Any]] = None, max_results=100):
+        self.load_shard = load_shard
+        self.max_results = max_results
+
+        self.index = self._open(serialized)
+        if self.index.deserializer.shard_key_length is None:
+            self.shards = None
+        else:
+            assert not self.index.deserializer.shard_key_length, "expected the index of sharded search data"
+            self.shards = {b'': self.index}
+
+    @staticmethod
+    def _open(serialized) -> Empty:
+        view = memoryview(serialized)
+        out = Empty()
+        out.deserializer = Deserializer.from_serialized(view)
+        out.trie = view[Serializer.header_struct.size:out.deserializer.map_offset]
+        out.map = view[out.deserializer.map_offset:out.deserializer.type_map_offset]
+        out.type_map = view[out.deserializer.type_map_offset:]
+
+        # Same as in pretty_print_map(), the offset of the first value gives
+        # out the total value count and thus where the flags start
+        out.file_offset_bytes, out.offsets_offset = out.deserializer.unpack_result_map_offset_size(out.map)
+        offset = out.deserializer.unpack_result_map_offset(out.map, out.offsets_offset, out.file_offset_bytes)[0]
+        size = (offset - out.offsets_offset - out.file_offset_bytes)//(out.file_offset_bytes + Serializer.result_map_flag_bytes)
+        out.flags_offset = out.offsets_offset + (size + 1)*out.file_offset_bytes
+        return out
 
-    stats.node_count += 1
+    # Returns None if the shard isn't available
+    def _shard(self, key: bytes) -> Optional[Empty]:
+        if key not in self.shards:
+            data = self.load_shard(key) if self.load_shard else None
+            shard = None
+            if data is not None:
+                shard = self._open(data)
+                assert shard_key(shard.deserializer, shard.trie) == key, "shard key doesn't match"
+            self.shards[key] = shard
+        return self.shards[key]
+
+    def _result(self, data: Empty, index: int, suffix_length: int, max_url_prefix: int) -> Empty:
+        deserializer = data.deserializer
+        flags = data.map[data.flags_offset + index]
+        offset = deserializer.unpack_result_map_offset(data.map, data.offsets_offset + index*data.file_offset_bytes, data.file_offset_bytes)[0]
+
+        # The result is an alias, parse the aliased prefix
+        aliased_index = None
+        if not flags & ResultFlag._TYPE.value:
+            aliased_index, size = deserializer.unpack_result_map_alias(data.map, offset)
+            offset += size
+
+        # The result has a prefix, parse that first, recursively
+        name = b''
+        url = b''
+        if flags & ResultFlag.HAS_PREFIX.value:
+            prefix_index, prefix_url_prefix_length, size = deserializer.unpack_result_map_prefix(data.map, offset)
+            offset += size
+            prefix = self._result(data, prefix_index, 0, min(prefix_url_prefix_length, max_url_prefix))
+            name = prefix.name
+            url = prefix.url
+
+        # The result has a suffix, extract its length
+        result_suffix_length = 0
+        if flags & ResultFlag.HAS_SUFFIX.value:
+            result_suffix_length, size = deserializer.unpack_result_map_suffix_length(data.map, offset)
+            offset += size
+
+        next_offset = deserializer.unpack_result_map_offset(data.map, data.offsets_offset + (index + 1)*data.file_offset_bytes, data.file_offset_bytes)[0]
+        entry_name, _, entry_url = bytes(data.map[offset:next_offset]).partition(b'\0')
+
+        out = Empty()
+        out.name = name + entry_name
+        out.alias = None
+        out.suffix_length = suffix_length + result_suffix_length
+
+        # The result is an alias and we're not resolving a prefix, extract the
+        # aliased name and URL
+        if aliased_index is not None and max_url_prefix == 0xffffff:
+            alias = self._result(data, aliased_index, 0, 0xffffff)
+            out.alias = alias.name
+            out.url = alias.url
+            out.flags = alias.flags
+            out.css_class = alias.css_class
+            out.type_name = alias.type_name
+            return out
+
+        # Otherwise extract URL from here. Aliases don't have a type, it's
+        # retrieved from the final target.
+        out.url = url + entry_url[:max(max_url_prefix - len(url), 0)]
+        out.flags = ResultFlag(flags & 0x0f)
+        out.css_class = None
+        out.type_name = None
+        if flags >> 4:
+            type_map_index = (flags >> 4) - 1
+            class_id, name_offset, size = deserializer.unpack_type_map_entry(data.type_map, type_map_index*Serializer.type_map_entry_struct.size)
+            next_name_offset = deserializer.unpack_type_map_entry(data.type_map, (type_map_index + 1)*Serializer.type_map_entry_struct.size)[1]
+            out.css_class = CssClass(class_id)
+            out.type_name = str(data.type_map[name_offset:next_name_offset], 'utf-8')
+        return out
 
-    out = ''
-    result_ids, child_chars_offsets_barriers, offset = deserializer.unpack_trie_node(serialized, base_offset)
-
-    stats.max_node_results = max(len(result_ids), stats.max_node_results)
-    stats.max_node_children = max(len(child_chars_offsets_barriers), stats.max_node_children)
-
-    # print results, if any
-    if result_ids:
-        out += color_map['blue'] + ' ['
-        for i, result in enumerate(result_ids):
-            if i: out += color_map['blue']+', '
-            stats.max_node_result_index = max(result, stats.max_node_result_index)
-            out += color_map['cyan'] + str(result)
-        out += color_map['blue'] + ']'
-
-    # print children, if any
-    for i, (char, offset, barrier) in enumerate(child_chars_offsets_barriers):
-        if len(result_ids) or i:
-            out += color_map['reset'] + '\n'
-            out += color_map['blue'] + indent + color_map['white']
-        if char <= 127:
-            out += chr(char)
-        else:
-            out += color_map['reset'] + hex(char)
-        if (show_lookahead_barriers and barrier):
-            out += color_map['green'] + '$'
-        if char > 127 or (show_lookahead_barriers and barrier):
-            out += color_map['reset'] + '\n' + color_map['blue'] + indent + ' ' + color_map['white']
-        stats.max_node_child_offset = max(offset, stats.max_node_child_offset)
-        out += _pretty_print_trie(deserializer, serialized, hashtable, stats, offset, indent + ('|' if len(child_chars_offsets_barriers) > 1 else ' '), show_merged=show_merged, show_lookahead_barriers=show_lookahead_barriers, color_map=color_map)
-
-    hashtable[base_offset] = True
-    return out
+    # Returns a list of results and a string to suggest for Tab
+    # autocompletion. Names and URLs of the results are UTF-8 bytes, same as
+    # search.js keeps them, and the suffix lengths are in bytes as well. If
+    # stats is passed, it gets filled with offsets, result counts and child
+    # counts of all nodes on the path to the searched string and count of
+    # nodes the results were gathered from.
+    def search(self, string: str, stats: Optional[Empty] = None) -> Tuple[List[Empty], str]:
+        # Normalize the search string first, convert to UTF-8 and trim spaces
+        # from the left. From the right they're trimmed only if nothing is
+        # found.
+        string = string.lstrip().lower().encode('utf-8')
+
+        data = self.index
+        deserializer = data.deserializer
+        offset = deserializer.unpack_trie_root_offset(data.trie, 0)[0]
+        path = []
+        found = 0
+        while True:
+            result_ids, child_chars_offsets_barriers, size = deserializer.unpack_trie_node(data.trie, offset)
+            path += [(offset, len(result_ids), len(child_chars_offsets_barriers))]
+            if found == len(string): break
+
+            for char, child_offset, barrier in child_chars_offsets_barriers:
+                if char == string[found]: break
+            else:
+                # If everything except spaces at the end was found, pretend
+                # the spaces aren't there
+                if not string[found:].strip(): string = string[:found]
+                break
+
+            found += 1
+
+            # The rest is in another shard, switch to it and go through its
+            # key to get to the same place
+            if not child_offset:
+                data = self._shard(string[:found])
+                if data is None: return [], ''
+                deserializer = data.deserializer
+                child_offset = deserializer.unpack_trie_root_offset(data.trie, 0)[0]
+                for i in range(found):
+                    child_offset = deserializer.unpack_trie_node(data.trie, child_offset)[1][0][1]
+
+            offset = child_offset
+
+        if stats is not None:
+            stats.path = path
+            stats.node_count = 0
+
+        # If the whole thing was not found, return an empty result
+        if found != len(string): return [], ''
+
+        # Otherwise gather the results, breadth-first
+        autocompletion = bytearray()
+        results = []
+        leaves = collections.deque([(offset, 0)])
+        while leaves:
+            offset, suffix_length = leaves.popleft()
+            result_ids, child_chars_offsets_barriers, size = deserializer.unpack_trie_node(data.trie, offset)
+            if stats is not None: stats.node_count += 1
+
+            for index in result_ids:
+                results += [self._result(data, index, suffix_length, 0xffffff)]
+                if len(results) >= self.max_results:
+                    return results, _autocompleted_chars_to_utf8(autocompletion)
+
+            for char, child_offset, barrier in child_chars_offsets_barriers:
+                # Lookahead barrier, don't dig deeper. Subtrees in other shards
+                # have it set as well.
+                if barrier: continue
+                leaves.append((child_offset, suffix_length + 1))
+
+                # Nothing found yet and this is the only path forward, add the
+                # char to suggested Tab autocompletion
+                if not results and len(leaves) == 1 and len(child_chars_offsets_barriers) == 1:
+                    autocompletion.append(char)
+
+        return results, _autocompleted_chars_to_utf8(autocompletion)
+
+# Drops an incomplete UTF-8 sequence from the end of the autocompleted chars
+def _autocompleted_chars_to_utf8(chars: bytearray) -> str:
+    return chars.decode('utf-8', errors='ignore')
+
+# Done with an explicit stack instead of recursion, which would hit the limit
+# for deep tries. The stack contains either offsets of nodes to print,
+# together with their indentation, or strings to output. Since the trie is
+# acyclic, a node can't be encountered again while printing its own subtree,
+# so it can be marked as printed already when it's visited.
+def _pretty_print_trie(deserializer: Deserializer, serialized: bytearray, stats, *, show_merged, show_lookahead_barriers, color_map) -> str:
+    printed = set()
+    out = []
+    stack = [(deserializer.unpack_trie_root_offset(serialized, 0)[0], '')]
+    while stack:
+        item = stack.pop()
+        if type(item) is str:
+            out += [item]
+            continue
+
+        # Visualize where the trees were merged
+        base_offset, indent = item
+        if show_merged and base_offset in printed:
+            out += [color_map['red'] + '#' + color_map['reset']]
+            continue
+        printed.add(base_offset)
+
+        stats.node_count += 1
+
+        result_ids, child_chars_offsets_barriers, offset = deserializer.unpack_trie_node(serialized, base_offset)
+
+        stats.max_node_results = max(len(result_ids), stats.max_node_results)
+        stats.max_node_children = max(len(child_chars_offsets_barriers), stats.max_node_children)
+
+        # print results, if any
+        if result_ids:
+            piece = color_map['blue'] + ' ['
+            for i, result in enumerate(result_ids):
+                if i: piece += color_map['blue']+', '
+                stats.max_node_result_index = max(result, stats.max_node_result_index)
+                piece += color_map['cyan'] + str(result)
+            piece += color_map['blue'] + ']'
+            out += [piece]
+
+        # print children, if any
+        children = []
+        for i, (char, offset, barrier) in enumerate(child_chars_offsets_barriers):
+            piece = ''
+            if len(result_ids) or i:
+                piece += color_map['reset'] + '\n'
+                piece += color_map['blue'] + indent + color_map['white']
+            if char <= 127:
+                piece += chr(char)
+            else:
+                piece += color_map['reset'] + hex(char)
+            # Subtrees in other shards have the barrier set implicitly, don't
+            # show it
+            barrier = show_lookahead_barriers and barrier and offset
+            if barrier:
+                piece += color_map['green'] + '$'
+            if char > 127 or barrier:
+                piece += color_map['reset'] + '\n' + color_map['blue'] + indent + ' ' + color_map['white']
+            stats.max_node_child_offset = max(offset, stats.max_node_child_offset)
+            # Subtree in another shard
+            if not offset:
+                children += [piece + color_map['yellow'] + '@' + color_map['reset']]
+                continue
+            children += [piece, (offset, indent + ('|' if len(child_chars_offsets_barriers) > 1 else ' '))]
+        stack += reversed(children)
+
+    return ''.join(out)
 
 color_map_colors = {'blue': '\033[0;34m',
                     'white': '\033[1;39m',
@@ -674,8 +1207,6 @@ color_map_dummy = {'blue': '',
 def pretty_print_trie(deserializer: Deserializer, serialized: bytes, *, show_merged=False, show_lookahead_barriers=True, colors=False):
     color_map = color_map_colors if colors else color_map_dummy
 
-    hashtable = {}
-
     stats = Empty()
     stats.node_count = 0
     stats.max_node_results = 0
@@ -683,7 +1214,7 @@ def pretty_print_trie(deserializer: Deserializer, serialized: bytes, *, show_mer
     stats.max_node_result_index = 0
     stats.max_node_child_offset = 0
 
-    out = _pretty_print_trie(deserializer, serialized, hashtable, stats, deserializer.unpack_trie_root_offset(serialized, 0)[0], '', show_merged=show_merged, show_lookahead_barriers=show_lookahead_barriers, color_map=color_map)
+    out = _pretty_print_trie(deserializer, serialized, stats, show_merged=show_merged, show_lookahead_barriers=show_lookahead_barriers, color_map=color_map)
     if out: out = color_map['white'] + out
     stats = """
 node count:             {}
@@ -696,11 +1227,12 @@ max node child offset:  {}""".lstrip().format(stats.node_count, stats.max_node_r
 def pretty_print_map(deserializer: Deserializer, serialized: bytes, *, entryTypeClass, colors=False):
     color_map = color_map_colors if colors else color_map_dummy
 
-    # The first item gives out offset of first value, which can be used to
-    # calculate total value count
-    offset, offset_size = deserializer.unpack_result_map_offset(serialized, 0)
-    size = int((offset - offset_size)/(offset_size + Serializer.result_map_flag_bytes))
-    flags_offset = (size + 1)*offset_size
+    # The first item after the offset size gives out offset of first value,
+    # which can be used to calculate total value count
+    file_offset_bytes, offsets_offset = deserializer.unpack_result_map_offset_size(serialized)
+    offset, offset_size = deserializer.unpack_result_map_offset(serialized, offsets_offset, file_offset_bytes)
+    size = int((offset - offsets_offset - offset_size)/(offset_size + Serializer.result_map_flag_bytes))
+    flags_offset = offsets_offset + (size + 1)*offset_size
 
     out = ''
     for i in range(size):
@@ -725,8 +1257,8 @@ def pretty_print_map(deserializer: Deserializer, serialized: bytes, *, entryType
             extra += ['deleted']
         if flags & ResultFlag._TYPE:
             extra += ['type={}'.format(entryTypeClass(flags.type).name)]
-        next_offset = deserializer.unpack_result_map_offset(serialized, (i + 1)*offset_size)[0]
-        name, _, url = serialized[offset:next_offset].partition(b'\0')
+        next_offset = deserializer.unpack_result_map_offset(serialized, offsets_offset + (i + 1)*offset_size, file_offset_bytes)[0]
+        name, _, url = bytes(serialized[offset:next_offset]).partition(b'\0')
         out += color_map['cyan'] + str(i) + color_map['blue'] + ': ' + color_map['white'] + name.decode('utf-8') + color_map['blue'] + ' [' + color_map['yellow'] + (color_map['blue'] + ', ' + color_map['yellow']).join(extra) + color_map['blue'] + '] ->' + (' ' + color_map['reset'] + url.decode('utf-8') if url else '')
         offset = next_offset
     return out
@@ -739,15 +1271,28 @@ def pretty_print_type_map(deserializer: Deserializer, serialized: bytes, *, entr
     while name_offset < len(serialized):
         if i: out += ',\n'
         next_class_id, next_name_offset = deserializer.unpack_type_map_entry(serialized, (i + 1)*type_map_bytes)[:2]
-        out += "({}, {}, '{}')".format(entryTypeClass(i + 1), CssClass(class_id), serialized[name_offset:next_name_offset].decode('utf-8'))
+        out += "({}, {}, '{}')".format(entryTypeClass(i + 1), CssClass(class_id), str(serialized[name_offset:next_name_offset], 'utf-8'))
         i += 1
         class_id, name_offset = next_class_id, next_name_offset
     return out
 
+# Key of a shard of sharded search data, formatted the same way as in the trie
+def _pretty_print_shard_key(deserializer: Deserializer, serialized: bytes) -> str:
+    return ''.join(chr(char) if char <= 127 else hex(char) for char in shard_key(deserializer, serialized))
+
+# The serialized data can be anything supporting the buffer protocol, the
+# sections are taken out of it through a memoryview without copying
 def pretty_print(serialized: bytes, *, entryTypeClass, show_merged=False, show_lookahead_barriers=True, colors=False):
     deserializer = Deserializer.from_serialized(serialized)
-
-    pretty_trie, stats = pretty_print_trie(deserializer, serialized[Serializer.header_struct.size:deserializer.map_offset], show_merged=show_merged, show_lookahead_barriers=show_lookahead_barriers, colors=colors)
-    pretty_map = pretty_print_map(deserializer, serialized[deserializer.map_offset:deserializer.type_map_offset], entryTypeClass=entryTypeClass, colors=colors)
-    pretty_type_map = pretty_print_type_map(deserializer, serialized[deserializer.type_map_offset:], entryTypeClass=entryTypeClass)
-    return '{} symbols\n'.format(deserializer.symbol_count) + pretty_trie + '\n' + pretty_map + '\n' + pretty_type_map, stats
+    view = memoryview(serialized)
+
+    pretty_trie, stats = pretty_print_trie(deserializer, view[Serializer.header_struct.size:deserializer.map_offset], show_merged=show_merged, show_lookahead_barriers=show_lookahead_barriers, colors=colors)
+    pretty_map = pretty_print_map(deserializer, view[deserializer.map_offset:deserializer.type_map_offset], entryTypeClass=entryTypeClass, colors=colors)
+    pretty_type_map = pretty_print_type_map(deserializer, view[deserializer.type_map_offset:], entryTypeClass=entryTypeClass)
+    if deserializer.shard_key_length is None:
+        header = '{} symbols\n'.format(deserializer.symbol_count)
+    elif not deserializer.shard_key_length:
+        header = '{} symbols, sharded\n'.format(deserializer.symbol_count)
+    else:
+        header = '{} symbols in shard {}\n'.format(deserializer.symbol_count, _pretty_print_shard_key(deserializer, view[Serializer.header_struct.size:deserializer.map_offset]))
+    return header + pretty_trie + '\n' + pretty_map + '\n' + pretty_type_map, stats
@@ -0,0 +1,72 @@
+#
+#   This file is part of m.css.
+#
+#   Copyright © 2017, 2018, 2019, 2020, 2021, 2022, 2023
+#             Vladimír Vondruš <mosra@centrum.cz>
+#
+#   Permission is hereby granted, free of charge, to any person obtaining a
+#   copy of this software and associated documentation files (the "Software"),
+#   to deal in the Software without restriction, including without limitation
+#   the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#   and/or sell copies of the Software, and to permit persons to whom the
+#   Software is furnished to do so, subject to the following conditions:
+#
+#   The above copyright notice and this permission notice shall be included
+#   in all copies or substantial portions of the Software.
+#
+#   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#   IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#   FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#   THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#   LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#   DEALINGS IN THE SOFTWARE.
+#
+
+
+# Common Jinja setup for doxygen.py and python.py
+
+import glob
+import inspect
+import os
+from typing import Any, Dict
+
+import jinja2
+
+# Persistent cache of compiled templates in given directory, so the templates
+# don't need to be compiled again on every run. Jinja checks the template
+# source checksum on load, so edited templates get compiled again. Code
+# compiled for sync and async rendering and by different Jinja versions
+# differs, so those go to different files.
+#
+# Jinja however also evaluates filters with constant arguments already when
+# compiling, such as {{ 'search.js'|format_url }}, so the compiled code
+# depends on the filter implementation and the config it uses as well. The key
+# should be a fingerprint of those. Files compiled with a different key are
+# removed, as they'd otherwise just pile up.
+def bytecode_cache(directory, is_async: bool, key: bytes) -> jinja2.BytecodeCache:
+    if not os.path.exists(directory): os.makedirs(directory)
+    key = key.hex()[:16]
+    for file in glob.glob(os.path.join(glob.escape(directory), 'jinja-*.cache')):
+        if '-{}-'.format(key) not in os.path.basename(file): os.remove(file)
+    return jinja2.FileSystemBytecodeCache(directory, 'jinja-{}-{}-{}-%s.cache'.format(jinja2.__version__, 'async' if is_async else 'sync', key))
+
+# Whether any filter, test or global registered in the environment is a
+# coroutine function and thus the templates need to be rendered in async mode,
+# which is otherwise just an overhead
+def needs_async(env: jinja2.Environment) -> bool:
+    for values in [env.filters, env.tests, env.globals]:
+        for value in values.values():
+            if inspect.iscoroutinefunction(value): return True
+    return False
+
+# Flattens environment globals and given dicts into a single dict that's
+# passed to _output.OutputWriter.write_template() for every page, so the
+# hundreds of config values don't need to be merged anew for each of them.
+# The values aren't copied, so this has to be called only once the config is
+# final.
+def shared_context(env: jinja2.Environment, *dicts, **kwargs) -> Dict[str, Any]:
+    context = dict(env.globals)
+    for values in dicts: context.update(values)
+    context.update(kwargs)
+    return context
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+#
+#   This file is part of m.css.
+#
+#   Copyright © 2017, 2018, 2019, 2020, 2021, 2022, 2023
+#             Vladimír Vondruš <mosra@centrum.cz>
+#
+#   Permission is hereby granted, free of charge, to any person obtaining a
+#   copy of this software and associated documentation files (the "Software"),
+#   to deal in the Software without restriction, including without limitation
+#   the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#   and/or sell copies of the Software, and to permit persons to whom the
+#   Software is furnished to do so, subject to the following conditions:
+#
+#   The above copyright notice and this permission notice shall be included
+#   in all copies or substantial portions of the Software.
+#
+#   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#   IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#   FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#   THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#   LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#   DEALINGS IN THE SOFTWARE.
+#
+
+# Benchmark of doxygen.py and python.py on synthetic projects generated by
+# synthetic.py. For each generator and scale, the project is generated into a
+# temporary directory and a full build is done in a fresh process, measuring
+# the wall time of run(), build_search_data(), Trie.serialize() and
+# ResultMap.serialize(), peak memory use and size of the search data. Results
+# can be saved as JSON with --output and compared to a previous run with
+# --compare, printing relative changes. Run with --help for options.
+
+import argparse
+import concurrent.futures
+import copy
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from synthetic import generate_doxygen, generate_python
+
+# Bump when the results format changes
+results_version = 1
+
+# Measured values, in the order they're printed. Everything except the sizes
+# and counts is a time in seconds.
+_timings = ['run()', 'build_search_data()', 'Trie.serialize()', 'ResultMap.serialize()']
+
+def peak_memory():
+    try:
+        import resource
+    except ImportError: # pragma: no cover
+        return None
+    # Kilobytes on Linux, bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*(1 if sys.platform == 'darwin' else 1024)
+
+# Wraps a function so it adds its execution time to given dict
+def _timed(times, name, function):
+    def wrapper(*args, **kwargs):
+        begin = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            times[name] = times.get(name, 0.0) + time.perf_counter() - begin
+    return wrapper
+
+def _instrument(module, times):
+    import _search
+
+    _search.Trie.serialize = _timed(times, 'Trie.serialize()', _search.Trie.serialize)
+    _search.ResultMap.serialize = _timed(times, 'ResultMap.serialize()', _search.ResultMap.serialize)
+    # run() looks the function up in the module globals
+    module.build_search_data = _timed(times, 'build_search_data()', module.build_search_data)
+
+_search_config = {
+    'SEARCH_DOWNLOAD_BINARY': True
+}
+
+def _output_size(path):
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            size += os.path.getsize(os.path.join(dirpath, filename))
+    return size
+
+# Executed in a fresh process so the peak memory is not affected by anything
+# done before
+def _build_doxygen(path, jobs):
+    import doxygen
+
+    times = {}
+    _instrument(doxygen, times)
+    state = doxygen.State(copy.deepcopy(doxygen.default_config))
+    state.config.update(_search_config)
+    doxygen.parse_doxyfile(state, os.path.join(path, 'Doxyfile'))
+
+    begin = time.perf_counter()
+    doxygen.run(state, jobs=jobs)
+    times['run()'] = time.perf_counter() - begin
+
+    output = os.path.join(path, 'html')
+    return times, peak_memory(), os.path.getsize(os.path.join(output, doxygen.searchdata_filename.format(search_filename_prefix='searchdata'))), _output_size(output), len(os.listdir(output))
+
+def _build_python(path, name, plugins):
+    sys.path.append(path)
+    import python
+
+    times = {}
+    _instrument(python, times)
+    config = copy.deepcopy(python.default_config)
+    config.update(_search_config)
+    config.update({
+        'INPUT_MODULES': [name],
+        'OUTPUT': os.path.join(path, 'output'),
+        'PLUGINS': plugins,
+        'M_SPHINX_PARSE_DOCSTRINGS': True
+    })
+
+    begin = time.perf_counter()
+    python.run(path, config)
+    times['run()'] = time.perf_counter() - begin
+
+    output = config['OUTPUT']
+    return times, peak_memory(), os.path.getsize(os.path.join(output, python.searchdata_filename.format(search_filename_prefix='searchdata'))), _output_size(output), len(os.listdir(output))
+
+def _in_fresh_process(function, *args):
+    with concurrent.futures.ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(function, *args).result()
+
+def run(generators, scales, *, repeat=1, jobs=1, formulas=False, plugins=[]):
+    results = []
+    for generator in generators:
+        for scale in scales:
+            path = tempfile.mkdtemp(prefix='m.css-benchmark-')
+            try:
+                if generator == 'doxygen':
+                    compounds, members = generate_doxygen(path, scale, formulas=formulas)
+                    build = lambda: _in_fresh_process(_build_doxygen, path, jobs)
+                else:
+                    compounds, members = generate_python(path, 'mcss_synthetic', scale)
+                    build = lambda: _in_fresh_process(_build_python, path, 'mcss_synthetic', plugins)
+
+                # Take the best time of all repeats. The memory use and sizes
+                # are the same every time.
+                result = {'generator': generator, 'scale': scale, 'compounds': compounds, 'members': members}
+                for i in range(repeat):
+                    times, memory, search_data_size, output_size, output_files = build()
+                    for name in _timings:
+                        result[name] = min(result.get(name, times.get(name)), times.get(name))
+                result['peak memory'] = memory
+                result['search data size'] = search_data_size
+                result['output size'] = output_size
+                result['output files'] = output_files
+                results += [result]
+                print_result(result)
+            finally:
+                shutil.rmtree(path)
+
+    return results
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.realpath(__file__)), capture_output=True, check=True).stdout.decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def save(file, results):
+    with open(file, 'w') as f:
+        json.dump({
+            'version': results_version,
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'results': results
+        }, f, indent=2)
+        f.write('\n')
+
+def _format(name, value):
+    if value is None: return '-'
+    if name in _timings: return '{:.3f} s'.format(value)
+    if name == 'output files': return str(value)
+    return '{:.1f} MB'.format(value/1024/1024) if value >= 1024*1024 else '{:.1f} kB'.format(value/1024)
+
+_values = _timings + ['peak memory', 'search data size', 'output size', 'output files']
+
+def print_result(result, baseline=None):
+    print("{} at scale {}: {} compounds, {} members".format(result['generator'], result['scale'], result['compounds'], result['members']))
+    for name in _values:
+        line = "  {:24} {:>12}".format(name, _format(name, result.get(name)))
+        if baseline and baseline.get(name) and result.get(name) is not None:
+            line += "  {:>12}  {:+7.1f}%".format(_format(name, baseline[name]), 100.0*(result[name]/baseline[name] - 1.0))
+        print(line)
+
+# Prints results of a previous run side by side with given results, for
+# generators and scales present in both
+def compare(file, results):
+    with open(file) as f:
+        baseline = json.load(f)
+    if baseline.get('version') != results_version:
+        print("{} has an incompatible results version {}, can't compare".format(file, baseline.get('version')))
+        return
+
+    print("\ncompared to {}, revision {}:".format(file, baseline['revision']))
+    baseline_results = {(result['generator'], result['scale']): result for result in baseline['results']}
+    for result in results:
+        if (result['generator'], result['scale']) in baseline_results:
+            print_result(result, baseline_results[(result['generator'], result['scale'])])
+
+if __name__ == '__main__': # pragma: no cover
+    parser = argparse.ArgumentParser(description="doxygen.py and python.py benchmark")
+    parser.add_argument('--generators', nargs='+', help="what to benchmark", choices=['doxygen', 'python'], default=['doxygen', 'python'])
+    parser.add_argument('--scales', nargs='+', help="count of namespaces or modules, each with 10 classes with 10 members", type=int, default=[1, 10])
+    parser.add_argument('--repeat', help="take the best time out of given count of runs", type=int, default=1)
+    parser.add_argument('--jobs', help="number of parallel jobs for doxygen.py", type=int, default=1)
+    parser.add_argument('--formulas', help="put formulas into the Doxygen XML, LaTeX is needed to render them", action='store_true')
+    parser.add_argument('--plugins', nargs='+', help="plugins to use for python.py, such as m.sphinx to parse docstrings", default=[])
+    parser.add_argument('--output', help="save results as JSON into given file")
+    parser.add_argument('--compare', help="compare to results saved in given file")
+    args = parser.parse_args()
+
+    results = run(args.generators, args.scales, repeat=args.repeat, jobs=args.jobs, formulas=args.formulas, plugins=args.plugins)
+    if args.output: save(args.output, results)
+    if args.compare: compare(args.compare, results)
@@ -0,0 +1,122 @@
+#
+#   This file is part of m.css.
+#
+#   Copyright © 2017, 2018, 2019, 2020, 2021, 2022, 2023
+#             Vladimír Vondruš <mosra@centrum.cz>
+#
+#   Permission is hereby granted, free of charge, to any person obtaining a
+#   copy of this software and associated documentation files (the "Software"),
+#   to deal in the Software without restriction, including without limitation
+#   the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#   and/or sell copies of the Software, and to permit persons to whom the
+#   Software is furnished to do so, subject to the following conditions:
+#
+#   The above copyright notice and this permission notice shall be included
+#   in all copies or substantial portions of the Software.
+#
+#   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#   IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#   FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#   THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#   LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#   DEALINGS IN THE SOFTWARE.
+#
+
+# Inspection of generated search data. Loads a search-v*.bin or
+# searchdata-v*.js file, runs given queries through _search.SearchData, which
+# does the same lookup as search.js, and prints the results together with how
+# long the lookup took and what trie nodes it went through. Shards of sharded
+# search data are loaded from next to the file when first needed. With
+# --stats, prints statistics about all trie nodes as well. Run with --help for
+# options.
+
+import argparse
+import collections
+import mmap
+import os
+import statistics
+import sys
+import time
+from types import SimpleNamespace as Empty
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from _search import Deserializer, SearchData, base85decode_search_data, search_shard_filename
+
+# Binary files are mapped into memory as-is, Base85-encoded files have to be
+# decoded first
+def load(filename):
+    if not os.path.exists(filename): return None
+    with open(filename, 'rb') as f:
+        if filename.endswith('.js'):
+            return base85decode_search_data(f.read())
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+# Offsets and sizes of all trie nodes reachable from the root of given data
+def nodes(data: Empty):
+    deserializer = data.deserializer
+    out = {}
+    stack = [deserializer.unpack_trie_root_offset(data.trie, 0)[0]]
+    while stack:
+        offset = stack.pop()
+        if offset in out: continue
+        result_ids, child_chars_offsets_barriers, size = deserializer.unpack_trie_node(data.trie, offset)
+        out[offset] = (len(result_ids), len(child_chars_offsets_barriers), size)
+        stack += [child_offset for char, child_offset, barrier in child_chars_offsets_barriers if child_offset]
+    return out
+
+# Prints how many nodes have given count of something, the least common high
+# counts are summarized by just the maximum
+def print_distribution(name, counts):
+    print("  {:24} {}, max {}".format(name, ', '.join('{}: {}'.format(count, frequency) for count, frequency in sorted(collections.Counter(counts).items())[:8]), max(counts)))
+
+def print_stats(name, data: Empty):
+    all = nodes(data)
+    sizes = [size for result_count, child_count, size in all.values()]
+    print("{}: {} symbols, trie {} B, map {} B, type map {} B".format(name, data.deserializer.symbol_count, len(data.trie), len(data.map), len(data.type_map)))
+    print("  {:24} {}".format('trie nodes', len(all)))
+    print("  {:24} {:.2f} B, max {} B".format('node size', statistics.mean(sizes), max(sizes)))
+    print_distribution('results per node', [result_count for result_count, child_count, size in all.values()])
+    print_distribution('children per node', [child_count for result_count, child_count, size in all.values()])
+
+def run(search: SearchData, queries, repeat, show):
+    for query in queries:
+        times = []
+        for i in range(repeat):
+            begin = time.perf_counter()
+            results, autocompletion = search.search(query)
+            times += [time.perf_counter() - begin]
+
+        stats = Empty()
+        search.search(query, stats)
+        print("{!r}: {} results, autocompletion {!r}, {:.1f} µs min, {:.1f} µs median".format(query, len(results), autocompletion, min(times)*1e6, statistics.median(times)*1e6))
+        print("  path: {}".format(' '.join('{}[{}r {}c]'.format(offset, result_count, child_count) for offset, result_count, child_count in stats.path)))
+        print("  results gathered from {} nodes".format(stats.node_count))
+        for result in results[:show]:
+            print("  {}{} [{}] -> {}".format(result.name.decode('utf-8'), ' (' + result.alias.decode('utf-8') + ')' if result.alias else '', result.type_name, result.url.decode('utf-8')))
+        if len(results) > show:
+            print("  ... and {} more".format(len(results) - show))
+
+if __name__ == '__main__': # pragma: no cover
+    parser = argparse.ArgumentParser(description="Search data inspection")
+    parser.add_argument('file', help="search data file, either *.bin or *.js")
+    parser.add_argument('query', help="strings to search for", nargs='*')
+    parser.add_argument('--repeat', help="how many times to repeat each query for timing", type=int, default=100)
+    parser.add_argument('--max-results', help="maximum result count, same as in search.js", type=int, default=100)
+    parser.add_argument('--show', help="how many results to show for each query", type=int, default=10)
+    parser.add_argument('--stats', help="print statistics of all trie nodes", action='store_true')
+    args = parser.parse_args()
+
+    begin = time.perf_counter()
+    data = load(args.file)
+    if data is None: sys.exit("can't open {}".format(args.file))
+    search = SearchData(data, load_shard=lambda key: load(search_shard_filename(args.file, key)), max_results=args.max_results)
+    print("loaded {} in {:.1f} ms".format(args.file, (time.perf_counter() - begin)*1e3))
+
+    run(search, args.query, args.repeat, args.show)
+
+    if args.stats:
+        print_stats(args.file, search.index)
+        for key, shard in sorted(search.shards.items() if search.shards else []):
+            if key and shard: print_stats(search_shard_filename(args.file, key), shard)
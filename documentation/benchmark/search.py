@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+#
+#   This file is part of m.css.
+#
+#   Copyright © 2017, 2018, 2019, 2020, 2021, 2022, 2023
+#             Vladimír Vondruš <mosra@centrum.cz>
+#
+#   Permission is hereby granted, free of charge, to any person obtaining a
+#   copy of this software and associated documentation files (the "Software"),
+#   to deal in the Software without restriction, including without limitation
+#   the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#   and/or sell copies of the Software, and to permit persons to whom the
+#   Software is furnished to do so, subject to the following conditions:
+#
+#   The above copyright notice and this permission notice shall be included
+#   in all copies or substantial portions of the Software.
+#
+#   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#   IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#   FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#   THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#   LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#   DEALINGS IN THE SOFTWARE.
+#
+
+# Benchmark of the search data building. Fills a Trie and a ResultMap with a
+# synthetic C++-like project the same way doxygen.py build_search_data() does
+# -- each symbol inserted with all possible prefixes and lookahead barriers,
+# functions twice -- and measures how long it takes and how much memory it
+# needs, together with how long it takes to decode everything again. With
+# --map-entries, only the ResultMap serialization, including the prefix
+# merging, is benchmarked on given count of entries. Run with --help for
+# options. See build.py for a benchmark of the whole doxygen.py and python.py
+# build, including the search data.
+
+import argparse
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace as Empty
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from _search import Deserializer, ResultFlag, ResultMap, Serializer, Trie
+
+_words = ['vector', 'matrix', 'frame', 'buffer', 'texture', 'mesh', 'shader', 'image', 'scene', 'object', 'range', 'array', 'view', 'string', 'color', 'angle', 'deg', 'rad']
+_suffixes = ['', 'Into', 'From', 'Size', 'Count']
+
+# Synthetic symbols in the form of (prefix list, name, has params, url),
+# deterministic for given count. Namespaces contain classes which contain
+# functions, many of them overloaded.
+def symbols(count):
+    random.seed(0)
+    out = []
+    namespace = 0
+    while len(out) < count:
+        prefix = ['ns{}'.format(namespace % 50), random.choice(_words) + str(namespace)]
+        namespace += 1
+        out += [(prefix[:-1], prefix[-1], False, '/'.join(prefix) + '.html')]
+        for i in range(5):
+            class_ = random.choice(_words).capitalize() + str(i)
+            url = '/'.join(prefix + [class_]) + '.html'
+            out += [(prefix, class_, False, url)]
+            for j in range(20):
+                out += [(prefix + [class_], random.choice(_words) + random.choice(_suffixes), True, url + '#a{}'.format(j))]
+    return out[:count]
+
+def fill_map(symbols, map: ResultMap):
+    indices = []
+    for prefix, name, has_params, url in symbols:
+        full_name = '::'.join(prefix + [name])
+        if has_params:
+            indices += [(map.add(full_name + '()', url, suffix_length=2, flags=ResultFlag(6 << 4)),
+                         map.add(full_name + '()', url, flags=ResultFlag(6 << 4)))]
+        else:
+            indices += [(map.add(full_name, url, flags=ResultFlag(2 << 4)), None)]
+    return indices
+
+def fill(symbols, trie: Trie, map: ResultMap):
+    for (prefix, name, has_params, url), (index, index_args) in zip(symbols, fill_map(symbols, map)):
+
+        prefixed_name = prefix + [name]
+        for i in range(len(prefixed_name)):
+            lookahead_barriers = []
+            name = ''
+            for j in prefixed_name[i:]:
+                if name:
+                    lookahead_barriers += [len(name)]
+                    name += '::'
+                name += j
+            trie.insert(name.lower(), index, lookahead_barriers=lookahead_barriers)
+            if has_params:
+                trie.insert(name.lower() + '()', index_args, lookahead_barriers=lookahead_barriers + [len(name)])
+
+# Unpacks all trie nodes reachable from the root and all result map entries,
+# returns the count of both
+def decode(serialized_trie, serialized_map):
+    deserializer = Deserializer()
+
+    nodes = 0
+    visited = set()
+    stack = [deserializer.unpack_trie_root_offset(serialized_trie, 0)[0]]
+    while stack:
+        offset = stack.pop()
+        if offset in visited: continue
+        visited.add(offset)
+        nodes += 1
+        stack += [child_offset for char, child_offset, barrier in deserializer.unpack_trie_node(serialized_trie, offset)[1] if child_offset]
+
+    file_offset_bytes, offsets_offset = deserializer.unpack_result_map_offset_size(serialized_map)
+    offset = deserializer.unpack_result_map_offset(serialized_map, offsets_offset, file_offset_bytes)[0]
+    entries = (offset - offsets_offset - file_offset_bytes)//(file_offset_bytes + Serializer.result_map_flag_bytes)
+    flags_offset = offsets_offset + (entries + 1)*file_offset_bytes
+    for i in range(entries):
+        offset = deserializer.unpack_result_map_offset(serialized_map, offsets_offset + i*file_offset_bytes, file_offset_bytes)[0]
+        flags = ResultFlag(deserializer.unpack_result_map_flags(serialized_map, flags_offset + i)[0])
+        if flags & ResultFlag._TYPE == ResultFlag.ALIAS:
+            offset += deserializer.unpack_result_map_alias(serialized_map, offset)[1]
+        if flags & ResultFlag.HAS_PREFIX:
+            offset += deserializer.unpack_result_map_prefix(serialized_map, offset)[2]
+        if flags & ResultFlag.HAS_SUFFIX:
+            offset += deserializer.unpack_result_map_suffix_length(serialized_map, offset)[1]
+
+    return nodes, entries
+
+def peak_memory():
+    try:
+        import resource
+    except ImportError: # pragma: no cover
+        return None
+    # Kilobytes on Linux, bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*(1 if sys.platform == 'darwin' else 1024)
+
+def print_times(times):
+    for name, value in times.items():
+        print("  {:24} {:8.3f} s".format(name, value))
+    memory = peak_memory()
+    if memory is not None:
+        print("  {:24} {:8} MB".format('peak memory', memory//(1024*1024)))
+
+def run(count, merge_subtrees=True):
+    serializer = Serializer()
+    data = symbols(count)
+
+    times = {}
+    begin = time.perf_counter()
+    trie = Trie()
+    map = ResultMap()
+    fill(data, trie, map)
+    times['insert'] = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    trie.sort(map)
+    times['Trie.sort()'] = time.perf_counter() - begin
+
+    stats = Empty()
+    begin = time.perf_counter()
+    serialized_trie = trie.serialize(serializer, merge_subtrees=merge_subtrees, stats=stats)
+    times['Trie.serialize()'] = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    serialized_map = map.serialize(serializer)
+    times['ResultMap.serialize()'] = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    decode(serialized_trie, serialized_map)
+    times['decode'] = time.perf_counter() - begin
+
+    print("{} symbols, trie {} kB, map {} kB".format(count, len(serialized_trie)//1024, len(serialized_map)//1024))
+    print("{} trie nodes, {} after subtree merging".format(stats.node_count, stats.serialized_node_count))
+    print_times(times)
+
+def run_map(count):
+    serializer = Serializer()
+    map = ResultMap()
+    # Functions are added twice, so there's slightly less symbols needed
+    fill_map(symbols(count), map)
+    del map.entries[count:]
+
+    times = {}
+    begin = time.perf_counter()
+    serialized_map = map.serialize(serializer)
+    times['ResultMap.serialize()'] = time.perf_counter() - begin
+
+    print("{} map entries, map {} kB".format(len(map.entries), len(serialized_map)//1024))
+    print_times(times)
+
+if __name__ == '__main__': # pragma: no cover
+    parser = argparse.ArgumentParser(description="Search data building benchmark")
+    parser.add_argument('--symbols', help="symbol count", type=int, default=20000)
+    parser.add_argument('--map-entries', help="benchmark just the result map with given entry count", type=int)
+    parser.add_argument('--no-subtree-merging', help="don't merge equivalent trie subtrees", action='store_true')
+    args = parser.parse_args()
+
+    if args.map_entries: run_map(args.map_entries)
+    else: run(args.symbols, merge_subtrees=not args.no_subtree_merging)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+#
+#   This file is part of m.css.
+#
+#   Copyright © 2017, 2018, 2019, 2020, 2021, 2022, 2023
+#             Vladimír Vondruš <mosra@centrum.cz>
+#
+#   Permission is hereby granted, free of charge, to any person obtaining a
+#   copy of this software and associated documentation files (the "Software"),
+#   to deal in the Software without restriction, including without limitation
+#   the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#   and/or sell copies of the Software, and to permit persons to whom the
+#   Software is furnished to do so, subject to the following conditions:
+#
+#   The above copyright notice and this permission notice shall be included
+#   in all copies or substantial portions of the Software.
+#
+#   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#   IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#   FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#   THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#   LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#   DEALINGS IN THE SOFTWARE.
+#
+
+# Generators of synthetic projects for benchmarking doxygen.py and python.py.
+# The Doxygen generator writes XML as if Doxygen was run on a C++ project, so
+# no Doxygen is needed, the Python generator writes a package with modules,
+# classes, functions, enums and data. Both produce deterministic output for
+# given size, with descriptions that link to other symbols and contain code
+# and, optionally, formulas. Run with --help for options, see build.py for
+# the actual benchmark.
+
+import argparse
+import html
+import os
+import random
+
+_words = ['vector', 'matrix', 'frame', 'buffer', 'texture', 'mesh', 'shader', 'image', 'scene', 'object', 'range', 'array', 'view', 'string', 'color', 'angle']
+_sentences = [
+    "Returns the {} with all components normalized.",
+    "Convenience overload for the {}, see the other overload for details.",
+    "Expects that the {} is not empty, otherwise the behavior is undefined.",
+    "The {} is shared with the caller, which has to ensure it outlives this instance.",
+    "Unlike the default constructor, this doesn't initialize the {}."
+]
+
+def _description(random, count):
+    return ' '.join(random.choice(_sentences).format(random.choice(_words)) for i in range(count))
+
+def _doxygen_para(random, ref, formula_id=None):
+    out = '<para>{} See <ref refid="{}" kindref="compound">{}</ref> for more information. {}'.format(html.escape(_description(random, 2)), ref[0], ref[1], html.escape(_description(random, 1)))
+    if formula_id is not None:
+        out += ' The length is <formula id="{}">$\\sqrt{{x^2 + y^2}}$</formula>.'.format(formula_id)
+    return out + '</para>'
+
+def _doxygen_code(random):
+    word = random.choice(_words)
+    lines = ['{}<sp/>a<sp/>=<sp/>{}::create();'.format(word.capitalize(), word), 'a.normalize();', 'std::printf(&quot;%f\\n&quot;,<sp/>a.length());']
+    return '<para><programlisting filename=".cpp">{}</programlisting></para>'.format(''.join('<codeline><highlight class="normal">{}</highlight></codeline>'.format(line) for line in lines))
+
+# Writes a Doxyfile and XML files of a project with given count of
+# namespaces, each with given count of classes, each with given count of
+# member functions, plus a file for each class and a main page. If formulas is
+# set, every other function description contains a formula, which needs LaTeX
+# to be rendered. Returns count of compounds and members.
+def generate_doxygen(path, namespaces, classes=10, members=10, formulas=False):
+    rng = random.Random(0)
+    xml = os.path.join(path, 'xml')
+    os.makedirs(xml, exist_ok=True)
+    with open(os.path.join(path, 'Doxyfile'), 'w') as f:
+        f.write("""PROJECT_NAME = Synthetic
+OUTPUT_DIRECTORY =
+XML_OUTPUT = xml
+HTML_OUTPUT = html
+GENERATE_HTML = NO
+GENERATE_LATEX = NO
+GENERATE_XML = YES
+""")
+
+    index = []
+    formula_id = 0
+    member_count = 0
+    def write(id, body):
+        with open(os.path.join(xml, id + '.xml'), 'w') as f:
+            f.write('<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n<doxygen version="1.9.8">\n{}\n</doxygen>\n'.format(body))
+
+    for n in range(namespaces):
+        namespace_id = 'namespacens{}'.format(n)
+        namespace_name = 'ns{}'.format(n)
+        inner = []
+        for c in range(classes):
+            class_id = 'classns{}_1_1{}{}'.format(n, rng.choice(_words).capitalize(), c)
+            class_name = '{}::{}'.format(namespace_name, class_id.rpartition('_1_1')[2])
+            file_id = '{}_8h'.format(class_id[5:])
+            file_name = '{}.h'.format(class_id[5:])
+            inner += [(class_id, class_name)]
+
+            functions = []
+            for m in range(members):
+                name = rng.choice(_words) + rng.choice(['', 'Into', 'From', 'Size', 'Count'])
+                detailed = _doxygen_para(rng, (namespace_id, namespace_name), formula_id if formulas and m % 2 else None)
+                if formulas and m % 2: formula_id += 1
+                if m % 3 == 0: detailed += _doxygen_code(rng)
+                functions += ['''<memberdef kind="function" id="{id}_1a{m:032x}" prot="public" static="no" const="{const}" explicit="no" inline="no" virt="non-virtual">
+<type>float</type><definition>float {class_name}::{name}</definition><argsstring>(std::size_t index, float scale) const</argsstring><name>{name}</name>
+<param><type>std::size_t</type><declname>index</declname></param><param><type>float</type><declname>scale</declname><defval>1.0f</defval></param>
+<briefdescription><para>{brief}</para></briefdescription>
+<detaileddescription>{detailed}<para><parameterlist kind="param"><parameteritem><parameternamelist><parametername>index</parametername></parameternamelist><parameterdescription><para>Element index</para></parameterdescription></parameteritem><parameteritem><parameternamelist><parametername>scale</parametername></parameternamelist><parameterdescription><para>Scale factor</para></parameterdescription></parameteritem></parameterlist><simplesect kind="return"><para>The scaled value</para></simplesect></para></detaileddescription>
+<inbodydescription></inbodydescription><location file="{file_name}" line="{line}" column="5"/></memberdef>'''.format(id=class_id, m=m, const='yes' if m % 2 else 'no', class_name=class_name, name=name, brief=html.escape(_description(rng, 1)), detailed=detailed, file_name=file_name, line=20 + m)]
+            member_count += members + 1
+
+            write(class_id, '''<compounddef id="{id}" kind="class" language="C++" prot="public">
+<compoundname>{name}</compoundname><includes refid="{file_id}" local="no">{file_name}</includes>
+<sectiondef kind="public-func">{functions}</sectiondef>
+<sectiondef kind="public-attrib"><memberdef kind="variable" id="{id}_1avalue" prot="public" static="no" mutable="no">
+<type>float</type><definition>float {name}::value</definition><argsstring></argsstring><name>value</name>
+<briefdescription><para>The value</para></briefdescription><detaileddescription></detaileddescription><inbodydescription></inbodydescription>
+<location file="{file_name}" line="10" column="5"/></memberdef></sectiondef>
+<briefdescription><para>{brief}</para></briefdescription>
+<detaileddescription>{detailed}{code}</detaileddescription>
+<location file="{file_name}" line="5" column="1" bodyfile="{file_name}" bodystart="5" bodyend="100"/>
+<listofallmembers></listofallmembers></compounddef>'''.format(id=class_id, name=class_name, file_id=file_id, file_name=file_name, functions='\n'.join(functions), brief=html.escape(_description(rng, 1)), detailed=_doxygen_para(rng, (namespace_id, namespace_name)), code=_doxygen_code(rng)))
+            write(file_id, '''<compounddef id="{id}" kind="file" language="C++">
+<compoundname>{name}</compoundname><innerclass refid="{class_id}" prot="public">{class_name}</innerclass><innernamespace refid="{namespace_id}">{namespace_name}</innernamespace>
+<briefdescription><para>Class <ref refid="{class_id}" kindref="compound">{class_name}</ref>.</para></briefdescription><detaileddescription></detaileddescription>
+<location file="{name}"/></compounddef>'''.format(id=file_id, name=file_name, class_id=class_id, class_name=class_name, namespace_id=namespace_id, namespace_name=namespace_name))
+            index += [(class_id, 'class', class_name), (file_id, 'file', file_name)]
+
+        functions = []
+        for m in range(members):
+            functions += ['''<memberdef kind="function" id="{id}_1a{m:032x}" prot="public" static="no" const="no" explicit="no" inline="no" virt="non-virtual">
+<type>void</type><definition>void {name}::free{m}</definition><argsstring>()</argsstring><name>free{m}</name>
+<briefdescription><para>{brief}</para></briefdescription><detaileddescription></detaileddescription><inbodydescription></inbodydescription>
+<location file="{file_name}" line="{line}" column="1"/></memberdef>'''.format(id=namespace_id, name=namespace_name, m=m, brief=html.escape(_description(rng, 1)), file_name=inner[0][0][5:] + '.h', line=200 + m)]
+        member_count += members
+        write(namespace_id, '''<compounddef id="{id}" kind="namespace" language="C++">
+<compoundname>{name}</compoundname>{inner}
+<sectiondef kind="func">{functions}</sectiondef>
+<briefdescription><para>{brief}</para></briefdescription><detaileddescription>{detailed}</detaileddescription>
+<location file="{file_name}" line="1" column="1"/></compounddef>'''.format(id=namespace_id, name=namespace_name, inner=''.join('<innerclass refid="{}" prot="public">{}</innerclass>'.format(*i) for i in inner), functions='\n'.join(functions), brief=html.escape(_description(rng, 1)), detailed=_doxygen_para(rng, inner[0]), file_name=inner[0][0][5:] + '.h'))
+        index += [(namespace_id, 'namespace', namespace_name)]
+
+    write('indexpage', '''<compounddef id="indexpage" kind="page"><compoundname>index</compoundname><title>Synthetic</title>
+<briefdescription></briefdescription><detaileddescription>{}</detaileddescription></compounddef>'''.format(_doxygen_para(rng, index[0]) + _doxygen_code(rng)))
+    index += [('indexpage', 'page', 'index')]
+
+    with open(os.path.join(xml, 'index.xml'), 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n<doxygenindex version="1.9.8">\n')
+        for id, kind, name in index:
+            f.write('<compound refid="{}" kind="{}"><name>{}</name></compound>\n'.format(id, kind, name))
+        f.write('</doxygenindex>\n')
+
+    return len(index), member_count
+
+def _python_docstring(random, indent, ref):
+    return '"""{}\n\n{}{} See :ref:`{}` for more information.\n\n{}.. code:: py\n\n{}    a = {}()\n{}    a.normalize()\n{}"""'.format(_description(random, 1), indent, _description(random, 2), ref, indent, indent, ref.rpartition('.')[2], indent, indent)
+
+# Writes a Python package named name into given directory with given count of
+# modules, each with given count of classes, each with given count of
+# methods, properties and data. Returns count of modules and classes and count
+# of their members.
+def generate_python(path, name, modules, classes=10, members=10):
+    rng = random.Random(0)
+    package = os.path.join(path, name)
+    os.makedirs(package, exist_ok=True)
+    with open(os.path.join(package, '__init__.py'), 'w') as f:
+        f.write('"""Synthetic package"""\n\n')
+        f.write(''.join('from . import module{}\n'.format(n) for n in range(modules)))
+
+    member_count = 0
+    for n in range(modules):
+        out = ['"""{}"""\n\nimport enum\nfrom typing import List, Optional\n'.format(_description(rng, 1))]
+        class_names = ['{}{}'.format(rng.choice(_words).capitalize(), c) for c in range(classes)]
+        for c, class_name in enumerate(class_names):
+            ref = '{}.module{}.{}'.format(name, n, class_names[(c + 1) % classes])
+            out += ['\nclass {}:\n    {}\n'.format(class_name, _python_docstring(rng, '    ', ref))]
+            out += ['\n    #: {}\n    DEFAULT_SIZE: int = {}\n'.format(_description(rng, 1), c)]
+            for m in range(members):
+                out += ['''
+    def {name}{m}(self, index: int, scale: float = 1.0) -> Optional[List[float]]:
+        {docstring}
+
+    @property
+    def {name}{m}_count(self) -> int:
+        """{brief}"""
+'''.format(name=rng.choice(_words), m=m, docstring=_python_docstring(rng, '        ', ref), brief=_description(rng, 1))]
+            member_count += 2*members + 1
+
+        out += ['\nclass Flags(enum.IntFlag):\n    """{}"""\n\n'.format(_description(rng, 1))]
+        out += ['    {} = {}\n'.format(word.upper(), 1 << i) for i, word in enumerate(_words[:8])]
+        for m in range(members):
+            out += ['\ndef {}{}(a: {}, b: str = \'\') -> bool:\n    {}\n'.format(rng.choice(_words), m, class_names[m % classes], _python_docstring(rng, '    ', '{}.module{}.{}'.format(name, n, class_names[m % classes])))]
+        member_count += members + 8
+
+        with open(os.path.join(package, 'module{}.py'.format(n)), 'w') as f:
+            f.write(''.join(out))
+
+    return modules*(classes + 2), member_count
+
+if __name__ == '__main__': # pragma: no cover
+    parser = argparse.ArgumentParser(description="Synthetic project generator")
+    parser.add_argument('kind', help="project kind", choices=['doxygen', 'python'])
+    parser.add_argument('output', help="output directory")
+    parser.add_argument('--scale', help="count of namespaces or modules", type=int, default=10)
+    parser.add_argument('--classes', help="count of classes in each namespace or module", type=int, default=10)
+    parser.add_argument('--members', help="count of members in each class", type=int, default=10)
+    parser.add_argument('--formulas', help="put formulas into the Doxygen XML, LaTeX is needed to render them", action='store_true')
+    args = parser.parse_args()
+
+    if args.kind == 'doxygen':
+        compounds, members = generate_doxygen(args.output, args.scale, args.classes, args.members, args.formulas)
+    else:
+        compounds, members = generate_python(args.output, 'mcss_synthetic', args.scale, args.classes, args.members)
+    print("{} compounds, {} members".format(compounds, members))
@@ -37,26 +37,31 @@ import inspect
 import os
 import glob
 import mimetypes
-import shutil
+import multiprocessing
 import subprocess
+import time
 import urllib.parse
 import logging
 from types import SimpleNamespace as Empty
-from typing import Tuple, Dict, Any, List
+from typing import Tuple, Dict, Any, List, Optional, Set, Union
 
 from importlib.machinery import SourceFileLoader
 from jinja2 import Environment, FileSystemLoader
-from pygments import highlight
-from pygments.formatters import HtmlFormatter
-from pygments.lexers import TextLexer, BashSessionLexer, get_lexer_by_name, find_lexer_class_for_filename
+import pygments
+from pygments.lexers import TextLexer, BashSessionLexer
 
-from _search import CssClass, ResultFlag, ResultMap, Trie, Serializer, serialize_search_data, base85encode_search_data, search_filename, searchdata_filename, searchdata_filename_b85, searchdata_format_version
+from _output import OutputWriter
+from _profile import Profile
+from _templates import bytecode_cache, shared_context
+from _incremental import RecordingDict, RecordingList, fingerprint, fingerprint_file, fingerprint_files, fingerprint_modules, load_manifest, save_manifest
+from _search import CssClass, ResultFlag, ResultMap, SearchResult, Trie, Serializer, serialize_search_data, serialize_search_data_sharded, search_shard_filename, base85encode_search_data, search_filename, searchdata_filename, searchdata_filename_b85, searchdata_format_version
 
 sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../plugins'))
 import dot2svg
 import latex2svg
 import latex2svgextra
 import ansilexer
+import pygmentsextra
 
 class EntryType(enum.Enum):
     # Order must match the search_type_map below; first value is reserved for
@@ -94,6 +99,9 @@ search_type_map = [
     (CssClass.DEFAULT, "var")
 ]
 
+# Options of the fixed-width search data format, removed in version 3 of it
+deprecated_search_options = ['SEARCH_RESULT_ID_BYTES', 'SEARCH_FILE_OFFSET_BYTES', 'SEARCH_NAME_SIZE_BYTES']
+
 default_config = {
     'DOXYFILE': 'Doxyfile',
 
@@ -121,15 +129,18 @@ default_config = {
     'CLASS_INDEX_EXPAND_INNER': False,
 
     'M_MATH_CACHE_FILE': 'm.math.cache',
+    'M_MATH_CACHE_SIZE': 64*1024*1024,
+    'M_DOT_CACHE_FILE': None,
+    'M_DOT_CACHE_SIZE': 64*1024*1024,
+    'M_CODE_CACHE_FILE': None,
+    'M_CODE_CACHE_SIZE': 64*1024*1024,
     'M_CODE_FILTERS_PRE': {},
     'M_CODE_FILTERS_POST': {},
 
     'SEARCH_DISABLED': False,
     'SEARCH_DOWNLOAD_BINARY': False,
     'SEARCH_FILENAME_PREFIX': 'searchdata',
-    'SEARCH_RESULT_ID_BYTES': 2,
-    'SEARCH_FILE_OFFSET_BYTES': 3,
-    'SEARCH_NAME_SIZE_BYTES': 1,
+    'SEARCH_SHARDED': False,
     'SEARCH_HELP':
 """<p class="m-noindent">Search for symbols, directories, files, pages or
 modules. You can omit any prefix from the symbol or file path; adding a
@@ -147,14 +158,22 @@ copy a link to the result using <span class="m-label m-dim">⌘</span>
     'SEARCH_EXTERNAL_URL': None,
 
     'SHOW_UNDOCUMENTED': False,
-    'VERSION_LABELS': False
+    'VERSION_LABELS': False,
+
+    'XML_CACHE_SIZE': 64*1024*1024,
+    'TEMPLATE_CACHE_DIR': None,
+    'COMPRESS_OUTPUT': []
 }
 
 xref_id_rx = re.compile(r"""(.*)_1(_[a-z-0-9]+|@)$""")
 slugify_nonalnum_rx = re.compile(r"""[^\w\s-]""")
 slugify_hyphens_rx = re.compile(r"""[-\s]+""")
 
+# There's one for every compound and they're kept for the whole run, so it's
+# slotted to not need a per-instance dict
 class StateCompound:
+    __slots__ = ['id', 'kind', 'name', 'url', 'brief', 'has_details', 'deprecated', 'since', 'is_inline', 'is_final', 'templates', 'children', 'parent', 'leaf_name']
+
     def __init__(self):
         self.id: str
         self.kind: str
@@ -163,9 +182,13 @@ class StateCompound:
         self.brief: str
         self.has_details: bool
         self.deprecated: str
+        self.since: str
+        self.is_inline: bool
         self.is_final: bool = None
+        self.templates: List
         self.children: List[str]
         self.parent: str = None
+        self.leaf_name: str
 
 class State:
     def __init__(self, config):
@@ -177,6 +200,22 @@ class State:
         self.doxyfile: Dict[str, Any] = {}
         self.config: Dict[str, Any] = config
         self.images: List[str] = []
+        self.output: OutputWriter = None
+        self.profile = Profile()
+        # Values common for all rendered pages, see
+        # _templates.shared_context()
+        self.template_context: Dict[str, Any] = {}
+        # XML trees parsed in extract_metadata() and kept for parse_xml() and
+        # parse_index_xml() so they don't need to be parsed again. Only files
+        # listed in xml_cache_files are kept, and only until their total size
+        # exceeds the XML_CACHE_SIZE budget.
+        self.xml_cache: Dict[str, ET.ElementTree] = {}
+        self.xml_cache_files: Set[str] = set()
+        self.xml_cache_budget = 0
+        # Formulas found in each XML file in extract_metadata(), rendered all
+        # at once before parse_xml() is called for the files
+        self.formulas: Dict[str, List[str]] = {}
+        self.graphs: Dict[str, List[str]] = {}
         self.current = '' # current file being processed (for logging)
         # Current kind of compound being processed. Affects current_include
         # below (i.e., per-entry includes are parsed only for namespaces or
@@ -347,6 +386,31 @@ def parse_type(state: State, type: ET.Element) -> str:
     # Remove spacing inside <> and before & and *
     return fix_type_spacing(out)
 
+# Source of a <dot> or <dotfile> element. Why the heck can't it just read the
+# file and paste it into the XML?! Returns None if the file doesn't exist.
+def dot_source(state: State, element: ET.Element) -> Optional[str]:
+    if element.tag == 'dot': return element.text
+
+    # Since 1.8.16 the whole <dotfile> tag is dropped if the file doesn't
+    # exist. Such a great solution that it's unfathomable. FFS.
+    if 'name' not in element.attrib: return None
+
+    # Since 1.9.3, the file is copied to the XML output directory and name
+    # contains its relative path. Before that, the name was absolute,
+    # os.path.join() should do the right thing in both cases.
+    path = os.path.join(state.basedir, state.doxyfile['OUTPUT_DIRECTORY'], state.doxyfile['XML_OUTPUT'], element.attrib['name'])
+    with open(path, 'r') as f:
+        return f.read()
+
+# Sources of all graphs in a compound, used for pre-rendering them
+def dot_sources(state: State, compounddef: ET.Element) -> List[str]:
+    out = []
+    for i in compounddef.iter():
+        if i.tag not in ['dot', 'dotfile']: continue
+        source = dot_source(state, i)
+        if source: out += [source]
+    return out
+
 def parse_desc_internal(state: State, element: ET.Element, immediate_parent: ET.Element = None, trim = True, add_css_class = None):
     out = Empty()
     out.section = None
@@ -1087,28 +1151,14 @@ def parse_desc_internal(state: State, element: ET.Element, immediate_parent: ET.
             assert element.tag in ['para', '{http://mcss.mosra.cz/doxygen/}div']
             has_block_elements = True
 
-            # Why the heck can't it just read the file and paste it into the
-            # XML?!
             caption = None
+            source = dot_source(state, i)
             if i.tag == 'dotfile':
-                if 'name' in i.attrib:
-                    # Since 1.9.3, the file is copied to the XML output
-                    # directory and name contains its relative path. Before
-                    # that, the name was absolute, os.path.join() should do the
-                    # right thing in both cases.
-                    path = os.path.join(state.basedir, state.doxyfile['OUTPUT_DIRECTORY'], state.doxyfile['XML_OUTPUT'], i.attrib['name'])
-                    with open(path, 'r') as f:
-                        source = f.read()
-                # Since 1.8.16 the whole <dotfile> tag is dropped if the file
-                # doesn't exist. Such a great solution that it's unfathomable.
-                # FFS.
-                else:
+                if source is None:
                     logging.warning("{}: file passed to @dotfile was not found, rendering an empty graph".format(state.current))
                     source = 'digraph "" {}'
                 caption = i.text
-            else:
-                source = i.text
-                if 'caption' in i.attrib: caption = i.attrib['caption']
+            elif 'caption' in i.attrib: caption = i.attrib['caption']
 
             size = None
             if 'width' in i.attrib:
@@ -1276,7 +1326,7 @@ def parse_desc_internal(state: State, element: ET.Element, immediate_parent: ET.
                 if not filename.endswith(key): continue
 
                 if isinstance(v, str):
-                    lexer = get_lexer_by_name(v)
+                    lexer = pygmentsextra.lexer_by_name(v)
                 else:
                     lexer = v()
                 break
@@ -1285,11 +1335,10 @@ def parse_desc_internal(state: State, element: ET.Element, immediate_parent: ET.
             else:
                 # Put some bogus prefix to the filename in case it is just
                 # `.ext`
-                lexer = find_lexer_class_for_filename("code" + filename)
+                lexer = pygmentsextra.lexer_for_filename("code" + filename)
                 if not lexer:
                     logging.warning("{}: unrecognized language of {} in <programlisting>, highlighting disabled".format(state.current, filename))
                     lexer = TextLexer()
-                else: lexer = lexer()
 
             # Style console sessions differently
             if (isinstance(lexer, BashSessionLexer) or
@@ -1298,16 +1347,11 @@ def parse_desc_internal(state: State, element: ET.Element, immediate_parent: ET.
             else:
                 class_ = 'm-code'
 
-            if isinstance(lexer, ansilexer.AnsiLexer):
-                formatter = ansilexer.HtmlAnsiFormatter()
-            else:
-                formatter = HtmlFormatter(nowrap=True)
-
             # Apply a global pre filter, if any
             filter = state.config['M_CODE_FILTERS_PRE'].get(lexer.name)
             if filter: code = filter(code)
 
-            highlighted = highlight(code, lexer, formatter).rstrip()
+            highlighted = pygmentsextra.highlight(code, lexer).rstrip()
             # Strip whitespace around if inline code, strip only trailing
             # whitespace if a block
             if not code_block: highlighted = highlighted.lstrip()
@@ -1879,7 +1923,7 @@ def parse_enum(state: State, element: ET.Element):
         value.description, value_search_keywords, value.deprecated, value.since = parse_enum_value_desc(state, enumvalue)
         if value.brief or value.description:
             if enum.base_url == state.current_compound_url and not state.config['SEARCH_DISABLED']:
-                result = Empty()
+                result = SearchResult()
                 result.flags = ResultFlag.from_type(ResultFlag.DEPRECATED if value.deprecated else ResultFlag(0), EntryType.ENUM_VALUE)
                 result.url = enum.base_url + '#' + value.id
                 result.prefix = state.current_prefix + [enum.name]
@@ -1903,7 +1947,7 @@ def parse_enum(state: State, element: ET.Element):
         enum.has_details = True # has_details might already be True from above
     if enum.brief or enum.has_details or enum.has_value_details:
         if enum.base_url == state.current_compound_url and not state.config['SEARCH_DISABLED']:
-            result = Empty()
+            result = SearchResult()
             result.flags = ResultFlag.from_type(ResultFlag.DEPRECATED if enum.deprecated else ResultFlag(0), EntryType.ENUM)
             result.url = enum.base_url + '#' + enum.id
             result.prefix = state.current_prefix
@@ -1979,7 +2023,7 @@ def parse_typedef(state: State, element: ET.Element):
     if typedef.brief or typedef.has_details:
         # Avoid duplicates in search
         if typedef.base_url == state.current_compound_url and not state.config['SEARCH_DISABLED']:
-            result = Empty()
+            result = SearchResult()
             result.flags = ResultFlag.from_type(ResultFlag.DEPRECATED if typedef.deprecated else ResultFlag(0), EntryType.TYPEDEF)
             result.url = typedef.base_url + '#' + typedef.id
             result.prefix = state.current_prefix
@@ -2179,7 +2223,7 @@ def parse_func(state: State, element: ET.Element):
         # search. Again, the compound URL check means the search entry is not
         # duplicated for functions referenced from file docs.
         if (func.brief or func.has_details) and not state.config['SEARCH_DISABLED']:
-            result = Empty()
+            result = SearchResult()
             result.flags = ResultFlag.from_type((ResultFlag.DEPRECATED if func.deprecated else ResultFlag(0))|(ResultFlag.DELETED if func.is_deleted else ResultFlag(0)), EntryType.FUNC)
             result.url = func.base_url + '#' + func.id
             result.prefix = state.current_prefix
@@ -2218,7 +2262,7 @@ def parse_var(state: State, element: ET.Element):
     if var.brief or var.has_details:
         # Avoid duplicates in search
         if var.base_url == state.current_compound_url and not state.config['SEARCH_DISABLED']:
-            result = Empty()
+            result = SearchResult()
             result.flags = ResultFlag.from_type(ResultFlag.DEPRECATED if var.deprecated else ResultFlag(0), EntryType.VAR)
             result.url = var.base_url + '#' + var.id
             result.prefix = state.current_prefix
@@ -2258,7 +2302,7 @@ def parse_define(state: State, element: ET.Element):
     if define.brief or define.has_details:
         # Avoid duplicates in search
         if define.base_url == state.current_compound_url and not state.config['SEARCH_DISABLED']:
-            result = Empty()
+            result = SearchResult()
             result.flags = ResultFlag.from_type(ResultFlag.DEPRECATED if define.deprecated else ResultFlag(0), EntryType.DEFINE)
             result.url = define.base_url + '#' + define.id
             result.prefix = []
@@ -2313,6 +2357,17 @@ def extract_metadata(state: State, xml):
         logging.error("{}: XML parse error, skipping whole file: {}".format(state.current, e))
         return
 
+    # Keep the tree for the second pass if there's still space for it. Files
+    # are parsed again in the same order as here and evicted from the cache
+    # as that happens, so simply keeping the first N files that fit is the
+    # best we can do -- anything LRU-like would just keep the trees that are
+    # needed last.
+    if xml in state.xml_cache_files:
+        size = os.path.getsize(xml)
+        if size <= state.xml_cache_budget:
+            state.xml_cache[xml] = tree
+            state.xml_cache_budget -= size
+
     root = tree.getroot()
 
     # From index.xml we need just list of all example files in correct order,
@@ -2346,6 +2401,12 @@ def extract_metadata(state: State, xml):
     if state.config['SHOW_UNDOCUMENTED']:
         _document_all_stuff(compounddef)
 
+    # Remember formulas and graphs for the pre-render pass in run()
+    formulas = ['{}'.format(i.text) for i in compounddef.iter('formula')]
+    if formulas: state.formulas[xml] = formulas
+    graphs = dot_sources(state, compounddef)
+    if graphs: state.graphs[xml] = graphs
+
     compound = StateCompound()
     compound.id  = compounddef.attrib['id']
     compound.kind = compounddef.attrib['kind']
@@ -2361,7 +2422,7 @@ def extract_metadata(state: State, xml):
     # Groups are explicitly created so they *have details*, other
     # things need to have at least some documentation. Pages are treated as
     # having something unless they're stupid. See the function for details.
-    compound.has_details = compound.kind == 'group' or compound.brief or compounddef.find('detaileddescription') or (compound.kind == 'page' and not is_a_stupid_empty_markdown_page(compounddef))
+    compound.has_details = bool(compound.kind == 'group' or compound.brief or compounddef.find('detaileddescription') or (compound.kind == 'page' and not is_a_stupid_empty_markdown_page(compounddef)))
     compound.children = []
 
     # Version badges, deprecation status. If @since is followed by
@@ -2493,7 +2554,7 @@ def postprocess_state(state: State):
             links += [(html, title, url, id, sublinks)]
         state.config[var] = links
 
-def build_search_data(state: State, merge_subtrees=True, add_lookahead_barriers=True, merge_prefixes=True) -> bytearray:
+def build_search_data(state: State, merge_subtrees=True, add_lookahead_barriers=True, merge_prefixes=True, sharded=False, jobs=1) -> Union[bytearray, List[Tuple[bytes, bytearray]]]:
     trie = Trie()
     map = ResultMap()
 
@@ -2519,7 +2580,7 @@ def build_search_data(state: State, merge_subtrees=True, add_lookahead_barriers=
         name_with_args = result.name
         name = result.name
         suffix_length = 0
-        if hasattr(result, 'params') and result.params is not None:
+        if result.params is not None:
             # Some very heavily templated function parameters might cause the
             # suffix_length to exceed 256, which won't fit into the serialized
             # search data. However that *also* won't fit in the search result
@@ -2535,7 +2596,7 @@ def build_search_data(state: State, merge_subtrees=True, add_lookahead_barriers=
                 params = params[:48] + '…'
             name_with_args += '(' + html.escape(params) + ')'
             suffix_length += len(params.encode('utf-8')) + 2
-        if hasattr(result, 'suffix') and result.suffix:
+        if result.suffix:
             name_with_args += result.suffix
             # TODO: escape elsewhere so i don't have to unescape here
             suffix_length += len(html.unescape(result.suffix))
@@ -2546,7 +2607,7 @@ def build_search_data(state: State, merge_subtrees=True, add_lookahead_barriers=
         # Add functions and function macros the second time with () appended,
         # everything is the same except for suffix length which is 2 chars
         # shorter
-        if hasattr(result, 'params') and result.params is not None:
+        if result.params is not None:
             index_args = map.add(html.unescape(joiner.join(result.prefix + [name_with_args])), result.url,
                 suffix_length=suffix_length - 2, flags=result.flags)
 
@@ -2566,7 +2627,7 @@ def build_search_data(state: State, merge_subtrees=True, add_lookahead_barriers=
             # appended, referencing the other result that expects () appended.
             # The lookahead barrier is at the ( character to avoid the result
             # being shown twice.
-            if hasattr(result, 'params') and result.params is not None:
+            if result.params is not None:
                 trie.insert(name.lower() + '()', index_args, lookahead_barriers=lookahead_barriers + [len(name)] if add_lookahead_barriers else [])
 
         # Add keyword aliases for this symbol
@@ -2582,7 +2643,10 @@ def build_search_data(state: State, merge_subtrees=True, add_lookahead_barriers=
     # order by default
     trie.sort(map)
 
-    return serialize_search_data(Serializer(file_offset_bytes=state.config['SEARCH_FILE_OFFSET_BYTES'], result_id_bytes=state.config['SEARCH_RESULT_ID_BYTES'], name_size_bytes=state.config['SEARCH_NAME_SIZE_BYTES']), trie, map, search_type_map, symbol_count, merge_subtrees=merge_subtrees, merge_prefixes=merge_prefixes)
+    serializer = Serializer()
+    if sharded:
+        return serialize_search_data_sharded(serializer, trie, map, search_type_map, symbol_count, merge_subtrees=merge_subtrees, merge_prefixes=merge_prefixes, jobs=jobs)
+    return serialize_search_data(serializer, trie, map, search_type_map, symbol_count, merge_subtrees=merge_subtrees, merge_prefixes=merge_prefixes)
 
 def parse_xml(state: State, xml: str):
     # Reset counter for unique math formulas
@@ -2597,10 +2661,12 @@ def parse_xml(state: State, xml: str):
 
     logging.debug("Parsing {}".format(state.current))
 
-    try:
-        tree = ET.parse(xml)
-    except ET.ParseError as e:
-        return
+    tree = state.xml_cache.pop(xml, None)
+    if not tree:
+        try:
+            tree = ET.parse(xml)
+        except ET.ParseError as e:
+            return
     root = tree.getroot()
     if root.tag != 'doxygen':
         return
@@ -2628,6 +2694,12 @@ def parse_xml(state: State, xml: str):
         logging.debug("{}: neither brief nor detailed description present, skipping".format(state.current))
         return None
 
+    # Render all formulas on the page that aren't cached yet at once, it's
+    # much faster than spawning LaTeX for each separately. Usually done for
+    # all pages together in run() already, in which case this does nothing.
+    latex2svgextra.prerender(['{}'.format(i.text) for i in compounddef.iter('formula')])
+    dot2svg.prerender(dot_sources(state, compounddef))
+
     compound = Empty()
     compound.kind = compounddef.attrib['kind']
     compound.id = compounddef.attrib['id']
@@ -3372,7 +3444,7 @@ def parse_xml(state: State, xml: str):
             kind = EntryType.GROUP
         else: assert False # pragma: no cover
 
-        result = Empty()
+        result = SearchResult()
         result.flags = ResultFlag.from_type(ResultFlag.DEPRECATED if compound.deprecated else ResultFlag(0), kind)
         result.url = compound.url
         result.prefix = state.current_prefix[:-1]
@@ -3388,7 +3460,8 @@ def parse_xml(state: State, xml: str):
 def parse_index_xml(state: State, xml):
     logging.debug("Parsing {}".format(os.path.basename(xml)))
 
-    tree = ET.parse(xml)
+    tree = state.xml_cache.pop(xml, None)
+    if not tree: tree = ET.parse(xml)
     root = tree.getroot()
     assert root.tag == 'doxygenindex'
 
@@ -3659,9 +3732,7 @@ def parse_doxyfile(state: State, doxyfile, values = None):
         ('M_SEARCH_DISABLED', 'SEARCH_DISABLED', bool),
         ('M_SEARCH_DOWNLOAD_BINARY', 'SEARCH_DOWNLOAD_BINARY', bool),
         ('M_SEARCH_FILENAME_PREFIX', 'SEARCH_FILENAME_PREFIX', str),
-        ('M_SEARCH_RESULT_ID_BYTES', 'SEARCH_RESULT_ID_BYTES', int),
-        ('M_SEARCH_FILE_OFFSET_BYTES', 'SEARCH_FILE_OFFSET_BYTES', int),
-        ('M_SEARCH_NAME_SIZE_BYTES', 'SEARCH_NAME_SIZE_BYTES', int),
+        ('M_SEARCH_SHARDED', 'SEARCH_SHARDED', bool),
         ('M_SEARCH_HELP', 'SEARCH_HELP', str),
         ('M_SEARCH_BASE_URL', 'SEARCH_BASE_URL', str),
         ('M_SEARCH_EXTERNAL_URL', 'SEARCH_EXTERNAL_URL', str),
@@ -3670,6 +3741,13 @@ def parse_doxyfile(state: State, doxyfile, values = None):
         ('M_VERSION_LABELS', 'VERSION_LABELS', bool),
 
         ('M_MATH_CACHE_FILE', 'M_MATH_CACHE_FILE', str),
+        ('M_MATH_CACHE_SIZE', 'M_MATH_CACHE_SIZE', int),
+        ('M_DOT_CACHE_FILE', 'M_DOT_CACHE_FILE', str),
+        ('M_DOT_CACHE_SIZE', 'M_DOT_CACHE_SIZE', int),
+        ('M_CODE_CACHE_FILE', 'M_CODE_CACHE_FILE', str),
+        ('M_CODE_CACHE_SIZE', 'M_CODE_CACHE_SIZE', int),
+        ('M_TEMPLATE_CACHE_DIR', 'TEMPLATE_CACHE_DIR', str),
+        ('M_COMPRESS_OUTPUT', 'COMPRESS_OUTPUT', list),
     ]:
         if key not in values: continue
 
@@ -3782,32 +3860,184 @@ def parse_doxyfile(state: State, doxyfile, values = None):
     if 'FAVICON' in state.config and state.config['FAVICON']:
         state.config['FAVICON'] = (state.config['FAVICON'], mimetypes.guess_type(state.config['FAVICON'])[0])
 
+    # Field sizes of the search data are picked automatically since search
+    # data format version 3, these options don't have any effect anymore
+    for key in deprecated_search_options:
+        if 'M_' + key in values:
+            logging.warning("{}: M_{} is deprecated and ignored, the search data field sizes are picked automatically".format(doxyfile, key))
+
     # Fail if this option is set
     if state.doxyfile.get('CREATE_SUBDIRS', False):
         logging.fatal("{}: CREATE_SUBDIRS is not supported, sorry. Disable it and try again.".format(doxyfile))
         raise NotImplementedError
 
+def render_compound(state: State, env: Environment, xml) -> str:
+    begin = time.perf_counter()
+    with state.profile.phase('parse_xml'):
+        parsed = parse_xml(state, xml)
+    if not parsed: return None
+
+    # The page is streamed to the file as it's rendered, so this includes
+    # writing as well
+    with state.profile.phase('render'):
+        template = env.get_template('{}.html'.format(parsed.compound.kind))
+        state.output.write_template(parsed.compound.url, template, {
+            'compound': parsed.compound,
+            'DOXYGEN_VERSION': parsed.version,
+            'FILENAME': parsed.compound.url}, state.template_context)
+
+    state.profile.add_page(parsed.compound.url, time.perf_counter() - begin)
+    return parsed.compound.url
+
+# Renders a compound like render_compound(), but collects everything it added
+# to the state and, for incremental builds, which parts of the state it looked
+# at. Used when the compounds are rendered in worker processes or some of them
+# are not rendered at all, the state is then put back together from these.
+# Returns the collected info, math, graph and code cache entries rendered or
+# used by the compound and the output files it wrote.
+def render_compound_collect(state: State, env: Environment, xml):
+    # Everything parse_xml() reads from the state was finalized in
+    # postprocess_state() already, the only things it adds to are search data
+    # and referenced images
+    state.search = []
+    state.images = []
+    recording = isinstance(state.compounds, RecordingDict)
+    if recording:
+        state.compounds.reset()
+        state.includes.reset()
+        state.examples.reset()
+    latex2svgextra.start_cache_recording()
+    dot2svg.start_cache_recording()
+    pygmentsextra.start_cache_recording()
+    state.output.start_recording()
+
+    compound = Empty()
+    compound.xml = None # filled by the caller, if needed
+    compound.output = render_compound(state, env, xml)
+    compound.search = state.search
+    compound.search_fingerprint = fingerprint(state.search) if recording else None
+    compound.images = state.images
+    compound.dependencies = (state.compounds.dependencies(), state.includes.dependencies(), state.examples.dependencies()) if recording else None
+    math = latex2svgextra.stop_cache_recording()
+    graphs = dot2svg.stop_cache_recording()
+    code = pygmentsextra.stop_cache_recording()
+    compound.math = list(math.keys())
+    compound.graphs = list(graphs.keys())
+    compound.code = list(code.keys())
+    return compound, math, graphs, code, state.output.stop_recording()
+
+# Whether a compound rendered in a previous incremental build doesn't need to
+# be rendered again
+def is_compound_up_to_date(state: State, html_output, previous, xml_fingerprint) -> bool:
+    return (previous and previous.xml == xml_fingerprint and
+        (not previous.output or os.path.exists(os.path.join(html_output, previous.output))) and
+        not state.compounds.changed(previous.dependencies[0]) and
+        not state.includes.changed(previous.dependencies[1]) and
+        not state.examples.changed(previous.dependencies[2]))
+
+# Arguments for _render_compound_worker(). Set right before the worker pool is
+# created so the forked processes inherit them as-is -- the state is huge and
+# the config can contain arbitrary lambdas, neither of which is something we'd
+# want to (or could) pickle for every task.
+_worker_args = None
+
+def _render_compound_worker(xml):
+    state, env = _worker_args
+
+    # The profile gets merged back in the parent process together with the
+    # cache hits and misses that happened here
+    caches = cache_stats()
+    state.profile.start_recording()
+    collected = render_compound_collect(state, env, xml)
+    for name, (hits, misses) in cache_stats().items():
+        state.profile.add_cache(name, hits - caches[name][0], misses - caches[name][1])
+    return collected + (state.profile.stop_recording(), )
+
+def render_compounds_parallel(state: State, env: Environment, xml_files, jobs):
+    global _worker_args
+
+    logging.debug("rendering {} files using {} jobs".format(len(xml_files), jobs))
+
+    # Threads don't survive a fork, so make sure nothing is waiting for the
+    # output writer thread
+    state.output.finish()
+
+    _worker_args = (state, env)
+    try:
+        with multiprocessing.get_context('fork').Pool(jobs) as pool:
+            # Results are yielded in the original file order so the search
+            # data and the list of copied images are the same as in a serial
+            # run
+            for compound, math, graphs, code, outputs, profile in pool.imap(_render_compound_worker, xml_files):
+                latex2svgextra.merge_cache(math)
+                dot2svg.merge_cache(graphs)
+                pygmentsextra.merge_cache(code)
+                state.output.merge(outputs)
+                state.profile.merge(profile)
+                yield compound
+    finally:
+        _worker_args = None
+
+    # The cached XML trees were consumed by the workers, drop them here as well
+    state.xml_cache = {}
+
+# Hits and misses of all caches, for profiling
+def cache_stats():
+    return {
+        'math': latex2svgextra.cache_stats(),
+        'graphs': dot2svg.cache_stats(),
+        'code': pygmentsextra.cache_stats()
+    }
+
+# Renders all formulas from given files that aren't cached yet in parallel, so
+# the rendering itself only fetches them from the cache
+def prerender_math(state: State, xml_files, jobs):
+    formulas = [formula for file in xml_files for formula in state.formulas.get(file, [])]
+    if formulas:
+        logging.debug("pre-rendering {} formulas using {} jobs".format(len(formulas), jobs))
+        with state.profile.phase('prerender_math'):
+            latex2svgextra.prerender(formulas, jobs=jobs)
+
+# Same as prerender_math(), but for graphs
+def prerender_graphs(state: State, xml_files, jobs):
+    graphs = [graph for file in xml_files for graph in state.graphs.get(file, [])]
+    if graphs:
+        logging.debug("pre-rendering {} graphs using {} jobs".format(len(graphs), jobs))
+        with state.profile.phase('prerender_graphs'):
+            dot2svg.prerender(graphs, jobs=jobs)
+
 default_index_pages = ['pages', 'files', 'namespaces', 'modules', 'annotated']
 default_wildcard = '*.xml'
 default_templates = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'templates/doxygen/')
+# Put next to the math cache file in OUTPUT_DIRECTORY
+manifest_filename = 'm.doxygen.manifest'
 
-def run(state: State, *, templates=default_templates, wildcard=default_wildcard, index_pages=default_index_pages, search_add_lookahead_barriers=True, search_merge_subtrees=True, search_merge_prefixes=True, sort_globbed_files=False):
+def run(state: State, *, templates=default_templates, wildcard=default_wildcard, index_pages=default_index_pages, search_add_lookahead_barriers=True, search_merge_subtrees=True, search_merge_prefixes=True, sort_globbed_files=False, jobs=1, incremental=False, profile=None, profile_top=10):
     xml_input = os.path.join(state.basedir, state.doxyfile['OUTPUT_DIRECTORY'], state.doxyfile['XML_OUTPUT'])
     xml_files_metadata = [os.path.join(xml_input, f) for f in glob.glob(os.path.join(xml_input, "*.xml"))]
     xml_files = [os.path.join(xml_input, f) for f in glob.glob(os.path.join(xml_input, wildcard))]
     html_output = os.path.join(state.basedir, state.doxyfile['OUTPUT_DIRECTORY'], state.doxyfile['HTML_OUTPUT'])
 
-    # If math rendering cache is not disabled, load the previous version. If
-    # there is no cache, reset the cache to an empty state to avoid
-    # order-dependent issues when testing
-    math_cache_file = os.path.join(state.basedir, state.doxyfile['OUTPUT_DIRECTORY'], state.config['M_MATH_CACHE_FILE'])
-    if state.config['M_MATH_CACHE_FILE'] and os.path.exists(math_cache_file):
-        latex2svgextra.unpickle_cache(math_cache_file)
+    # If math rendering cache is not disabled, use the cache file, otherwise
+    # keep the cache just in memory. The cache is reset in both cases to avoid
+    # order-dependent issues when testing.
+    if state.config['M_MATH_CACHE_FILE']:
+        latex2svgextra.open_cache(os.path.join(state.basedir, state.doxyfile['OUTPUT_DIRECTORY'], state.config['M_MATH_CACHE_FILE']), state.config['M_MATH_CACHE_SIZE'])
     else:
-        latex2svgextra.unpickle_cache(None)
+        latex2svgextra.open_cache(None)
 
-    # Configure graphviz/dot
+    # Configure graphviz/dot and its cache the same way as for math
     dot2svg.configure(state.doxyfile['DOT_FONTNAME'], state.doxyfile['DOT_FONTSIZE'])
+    if state.config['M_DOT_CACHE_FILE']:
+        dot2svg.open_cache(os.path.join(state.basedir, state.doxyfile['OUTPUT_DIRECTORY'], state.config['M_DOT_CACHE_FILE']), state.config['M_DOT_CACHE_SIZE'])
+    else:
+        dot2svg.open_cache(None)
+
+    # And the same for highlighted code
+    if state.config['M_CODE_CACHE_FILE']:
+        pygmentsextra.open_cache(os.path.join(state.basedir, state.doxyfile['OUTPUT_DIRECTORY'], state.config['M_CODE_CACHE_FILE']), state.config['M_CODE_CACHE_SIZE'])
+    else:
+        pygmentsextra.open_cache(None)
 
     if sort_globbed_files:
         xml_files_metadata.sort()
@@ -3821,7 +4051,7 @@ def run(state: State, *, templates=default_templates, wildcard=default_wildcard,
     template_paths = [templates]
     if templates != default_templates: template_paths += [default_templates]
     env = Environment(loader=FileSystemLoader(template_paths),
-                      trim_blocks=True, lstrip_blocks=True, enable_async=True)
+                      trim_blocks=True, lstrip_blocks=True)
 
     # Filter to return file basename or the full URL, if absolute
     def basename_or_url(path):
@@ -3832,6 +4062,18 @@ def run(state: State, *, templates=default_templates, wildcard=default_wildcard,
     env.filters['basename_or_url'] = basename_or_url
     env.filters['urljoin'] = urllib.parse.urljoin
 
+    # Keyed the same way as in python.py. The filters here don't use the
+    # config right now, but a compiled template could still bake in config
+    # values if that changes.
+    if state.config['TEMPLATE_CACHE_DIR']:
+        env.bytecode_cache = bytecode_cache(os.path.join(state.basedir, state.doxyfile['OUTPUT_DIRECTORY'], state.config['TEMPLATE_CACHE_DIR']), env.is_async, fingerprint((
+            fingerprint_modules([__name__, '_templates']),
+            state.config)))
+
+    # TODO: whitelist only what matters from doxyfile
+    state.template_context = shared_context(env, state.doxyfile, state.config,
+        SEARCHDATA_FORMAT_VERSION=searchdata_format_version)
+
     # Do a pre-pass and gather:
     # - brief descriptions of all classes, namespaces, dirs and files because
     #   the brief desc is not part of the <inner*> tag
@@ -3839,55 +4081,115 @@ def run(state: State, *, templates=default_templates, wildcard=default_wildcard,
     #   linking pages
     # - get URLs of namespace, class, file docs and pages so we can link to
     #   them from breadcrumb navigation
+    # - keep parsed trees of files that are processed again below, as long as
+    #   they fit into the budget
+    state.xml_cache_files = set(xml_files)
+    state.xml_cache_budget = state.config['XML_CACHE_SIZE']
     file: str
-    for file in xml_files_metadata:
-        extract_metadata(state, file)
-
-    postprocess_state(state)
-
+    with state.profile.phase('extract_metadata'):
+        for file in xml_files_metadata:
+            extract_metadata(state, file)
+
+    with state.profile.phase('postprocess_state'):
+        postprocess_state(state)
+
+    # For incremental builds, load the manifest from the previous run. All
+    # compounds get rendered again if anything that affects all of them
+    # changed, otherwise only those for which the XML or any parts of the
+    # state they looked at changed. To know what a compound looks at, record
+    # accesses to the state.
+    if incremental:
+        manifest_file = os.path.join(state.basedir, state.doxyfile['OUTPUT_DIRECTORY'], manifest_filename)
+        manifest = load_manifest(manifest_file, fingerprint((
+            fingerprint_files(template_paths),
+            fingerprint_modules([__name__, '_incremental', '_output', '_search', '_templates', 'ansilexer', 'dot2svg', 'latex2svg', 'latex2svgextra', 'pygmentsextra', 'svgcache']),
+            pygments.__version__,
+            state.doxyfile, state.config)))
+        state.compounds = RecordingDict(state.compounds)
+        state.includes = RecordingDict(state.includes)
+        state.examples = RecordingList(state.examples)
+
+    # Write only files that changed. In incremental builds the hashes of
+    # files written previously are known, so the old files don't need to be
+    # read and files that are not generated anymore can be removed.
+    state.output = OutputWriter(html_output, manifest.outputs if incremental else None, background=True)
+
+    # Index pages need just the metadata gathered above and are rendered
+    # right away, the rest is parsed and rendered either here or in parallel
+    # worker processes
+    compound_files = []
     for file in xml_files:
         if os.path.basename(file) == 'index.xml':
-            parsed = parse_index_xml(state, file)
+            with state.profile.phase('parse_index_xml'):
+                parsed = parse_index_xml(state, file)
 
             for i in index_pages:
                 file = '{}.html'.format(i)
 
-                template = env.get_template(file)
-                rendered = template.render(index=parsed.index,
-                    DOXYGEN_VERSION=parsed.version,
-                    FILENAME=file,
-                    SEARCHDATA_FORMAT_VERSION=searchdata_format_version,
-                    # TODO: whitelist only what matters from doxyfile
-                    **state.doxyfile, **state.config)
-
-                output = os.path.join(html_output, file)
-                with open(output, 'wb') as f:
-                    f.write(rendered.encode('utf-8'))
-                    # Add back a trailing newline so we don't need to bother
-                    # with patching test files to include a trailing newline to
-                    # make Git happy. Can't use keep_trailing_newline because
-                    # that'd add it also for nested templates :(
-                    f.write(b'\n')
+                begin = time.perf_counter()
+                with state.profile.phase('render_index_pages'):
+                    template = env.get_template(file)
+                    state.output.write_template(file, template, {
+                        'index': parsed.index,
+                        'DOXYGEN_VERSION': parsed.version,
+                        'FILENAME': file}, state.template_context)
+                state.profile.add_page(file, time.perf_counter() - begin)
+        else:
+            compound_files += [file]
+
+    if jobs > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+        logging.warning("parallel rendering needs the fork start method, which is not available on this platform, using a single job")
+        jobs = 1
+
+    # The simplest case, just render everything in order
+    if jobs == 1 and not incremental:
+        prerender_math(state, compound_files, jobs)
+        prerender_graphs(state, compound_files, jobs)
+        for file in compound_files:
+            render_compound(state, env, file)
+
+    # Otherwise pick compounds that need to be rendered, render them and then
+    # put the state together in the original order
+    else:
+        compounds = {}
+        xml_fingerprints = {}
+        compound_files_to_render = []
+        for file in compound_files:
+            if incremental:
+                xml_fingerprints[file] = fingerprint_file(file)
+                previous = manifest.pages.get(os.path.basename(file))
+                if not manifest.outdated and is_compound_up_to_date(state, html_output, previous, xml_fingerprints[file]):
+                    logging.debug("{}: up-to-date, skipping".format(os.path.basename(file)))
+                    latex2svgextra.touch_cache(previous.math)
+                    dot2svg.touch_cache(previous.graphs)
+                    pygmentsextra.touch_cache(previous.code)
+                    if previous.output: state.output.keep(previous.output)
+                    state.xml_cache.pop(file, None)
+                    compounds[file] = previous
+                    continue
+
+            compound_files_to_render += [file]
+
+        prerender_math(state, compound_files_to_render, jobs)
+        prerender_graphs(state, compound_files_to_render, jobs)
+
+        search = state.search
+        images = state.images
+        if jobs > 1:
+            rendered = render_compounds_parallel(state, env, compound_files_to_render, jobs)
         else:
-            parsed = parse_xml(state, file)
-            if not parsed: continue
-
-            template = env.get_template('{}.html'.format(parsed.compound.kind))
-            rendered = template.render(compound=parsed.compound,
-                DOXYGEN_VERSION=parsed.version,
-                FILENAME=parsed.compound.url,
-                SEARCHDATA_FORMAT_VERSION=searchdata_format_version,
-                # TODO: whitelist only what matters from doxyfile
-                **state.doxyfile, **state.config)
-
-            output = os.path.join(html_output, parsed.compound.url)
-            with open(output, 'wb') as f:
-                f.write(rendered.encode('utf-8'))
-                # Add back a trailing newline so we don't need to bother with
-                # patching test files to include a trailing newline to make Git
-                # happy. Can't use keep_trailing_newline because that'd add it
-                # also for nested templates :(
-                f.write(b'\n')
+            rendered = (render_compound_collect(state, env, file)[0] for file in compound_files_to_render)
+        for file, compound in zip(compound_files_to_render, rendered):
+            compound.xml = xml_fingerprints.get(file)
+            compounds[file] = compound
+
+        state.search = search
+        state.images = images
+        for file in compound_files:
+            state.search += compounds[file].search
+            state.images += compounds[file].images
+
+        logging.debug("rendered {} out of {} files".format(len(compound_files_to_render), len(compound_files)))
 
     # Empty index page in case no mainpage documentation was provided so
     # there's at least some entrypoint. Doxygen version is not set in this
@@ -3901,48 +4203,58 @@ def run(state: State, *, templates=default_templates, wildcard=default_wildcard,
         compound.description = ''
         compound.breadcrumb = [(state.doxyfile['PROJECT_NAME'], 'index.html')]
         template = env.get_template('page.html')
-        rendered = template.render(compound=compound,
-            DOXYGEN_VERSION=None,
-            FILENAME='index.html',
-            SEARCHDATA_FORMAT_VERSION=searchdata_format_version,
-            # TODO: whitelist only what matters from doxyfile
-            **state.doxyfile, **state.config)
-        output = os.path.join(html_output, 'index.html')
-        with open(output, 'wb') as f:
-            f.write(rendered.encode('utf-8'))
-            # Add back a trailing newline so we don't need to bother with
-            # patching test files to include a trailing newline to make Git
-            # happy. Can't use keep_trailing_newline because that'd add it
-            # also for nested templates :(
-            f.write(b'\n')
+        state.output.write_template('index.html', template, {
+            'compound': compound,
+            'DOXYGEN_VERSION': None,
+            'FILENAME': 'index.html'}, state.template_context)
 
     if not state.config['SEARCH_DISABLED']:
-        logging.debug("building search data for {} symbols".format(len(state.search)))
-
-        data = build_search_data(state, add_lookahead_barriers=search_add_lookahead_barriers, merge_subtrees=search_merge_subtrees, merge_prefixes=search_merge_prefixes)
-
         if state.config['SEARCH_DOWNLOAD_BINARY']:
-            with open(os.path.join(html_output, searchdata_filename.format(search_filename_prefix=state.config['SEARCH_FILENAME_PREFIX'])), 'wb') as f:
-                f.write(data)
+            search_output = searchdata_filename.format(search_filename_prefix=state.config['SEARCH_FILENAME_PREFIX'])
+        else:
+            search_output = searchdata_filename_b85.format(search_filename_prefix=state.config['SEARCH_FILENAME_PREFIX'])
+
+        # In an incremental build, the search data need to be built again
+        # only if any symbols changed
+        if incremental:
+            search_fingerprint = fingerprint(([compounds[file].search_fingerprint for file in compound_files], search_add_lookahead_barriers, search_merge_subtrees, search_merge_prefixes))
+        if incremental and manifest.search == search_fingerprint and os.path.exists(os.path.join(html_output, search_output)):
+            logging.debug("search data up-to-date, skipping")
+            state.output.keep(search_output)
+            for shard in manifest.search_shards:
+                state.output.keep(shard)
         else:
-            with open(os.path.join(html_output, searchdata_filename_b85.format(search_filename_prefix=state.config['SEARCH_FILENAME_PREFIX'])), 'wb') as f:
-                f.write(base85encode_search_data(data))
+            logging.debug("building search data for {} symbols".format(len(state.search)))
+
+            # Threads don't survive a fork, so make sure nothing is waiting
+            # for the output writer thread if the shards get serialized in
+            # parallel
+            if state.config['SEARCH_SHARDED'] and jobs > 1:
+                state.output.finish()
+
+            with state.profile.phase('search'):
+                data = build_search_data(state, add_lookahead_barriers=search_add_lookahead_barriers, merge_subtrees=search_merge_subtrees, merge_prefixes=search_merge_prefixes, sharded=state.config['SEARCH_SHARDED'], jobs=jobs)
+
+            encode = (lambda data: data) if state.config['SEARCH_DOWNLOAD_BINARY'] else base85encode_search_data
+
+            # With sharded search data, the index is written under the usual
+            # name and the shards next to it
+            shards = data if state.config['SEARCH_SHARDED'] else [(b'', data)]
+            if state.config['SEARCH_SHARDED']:
+                logging.debug("writing {} search data shards".format(len(shards)))
+            for key, shard in shards:
+                state.output.write(search_shard_filename(search_output, key), encode(shard))
+
+            if incremental:
+                manifest.search = search_fingerprint
+                manifest.search_shards = [search_shard_filename(search_output, key) for key, shard in shards if key]
 
         # OpenSearch metadata, in case we have the base URL
         if state.config['SEARCH_BASE_URL']:
             logging.debug("writing OpenSearch metadata file")
 
             template = env.get_template('opensearch.xml')
-            # TODO: whitelist only what matters from doxyfile
-            rendered = template.render(**state.doxyfile, **state.config)
-            output = os.path.join(html_output, 'opensearch.xml')
-            with open(output, 'wb') as f:
-                f.write(rendered.encode('utf-8'))
-                # Add back a trailing newline so we don't need to bother with
-                # patching test files to include a trailing newline to make Git
-                # happy. Can't use keep_trailing_newline because that'd add it
-                # also for nested templates :(
-                f.write(b'\n')
+            state.output.write_template('opensearch.xml', template, {}, state.template_context)
 
     # Copy all referenced files
     for i in state.images + state.config['STYLESHEETS'] + state.config['EXTRA_FILES'] + ([state.doxyfile['PROJECT_LOGO']] if state.doxyfile['PROJECT_LOGO'] else []) + ([state.config['FAVICON'][0]] if state.config['FAVICON'] else []) + ([] if state.config['SEARCH_DISABLED'] else ['search.js']):
@@ -3962,11 +4274,58 @@ def run(state: State, *, templates=default_templates, wildcard=default_wildcard,
             i = os.path.join(os.path.dirname(os.path.realpath(__file__)), i)
 
         logging.debug("copying {} to output".format(i))
-        shutil.copy(i, os.path.join(html_output, os.path.basename(file_out)))
-
-    # Save updated math cache file
-    if state.config['M_MATH_CACHE_FILE']:
-        latex2svgextra.pickle_cache(math_cache_file)
+        with state.profile.phase('copy'):
+            state.output.copy(i, os.path.basename(file_out))
+
+    # Wait until the output writer thread writes everything that's left
+    with state.profile.phase('write'):
+        state.output.finish()
+
+    # Save newly rendered formulas, graphs and highlighted code to the cache
+    # files
+    for name, (hits, misses) in cache_stats().items():
+        state.profile.add_cache(name, hits, misses)
+    with state.profile.phase('save_caches'):
+        latex2svgextra.close_cache()
+        dot2svg.close_cache()
+        pygmentsextra.close_cache()
+
+    # Compounds that were not processed this time because of a wildcard are
+    # kept, unless their XML file is gone, and so are the index pages
+    if incremental:
+        pages = {os.path.basename(file): compounds[file] for file in compound_files}
+        for name, previous in manifest.pages.items():
+            if name not in pages and os.path.exists(os.path.join(xml_input, name)):
+                pages[name] = previous
+                if previous.output: state.output.keep(previous.output)
+        for file in ['{}.html'.format(i) for i in index_pages] + ['index.html']:
+            state.output.keep(file)
+
+    # Compress everything that's in the output now, including the kept pages
+    if state.config['COMPRESS_OUTPUT']:
+        with state.profile.phase('compress'):
+            state.output.compress(state.config['COMPRESS_OUTPUT'], jobs=jobs)
+
+    # Remove outputs that are no longer there and save the updated manifest
+    if incremental:
+        state.output.remove_orphans()
+
+        manifest.pages = pages
+        manifest.outputs = state.output.files
+        save_manifest(manifest_file, manifest)
+
+    state.output.report()
+
+    if profile:
+        state.profile.finish()
+        state.profile.save(profile, profile_top)
+
+# Argument type for --jobs, zero is a valid value meaning all CPUs
+def non_negative_int(value) -> int:
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError("expected a non-negative number, got {}".format(value))
+    return number
 
 if __name__ == '__main__': # pragma: no cover
     parser = argparse.ArgumentParser()
@@ -3979,6 +4338,10 @@ if __name__ == '__main__': # pragma: no cover
     parser.add_argument('--search-no-lookahead-barriers', help="don't insert search lookahead barriers", action='store_true')
     parser.add_argument('--search-no-prefix-merging', help="don't merge search result prefixes", action='store_true')
     parser.add_argument('--sort-globbed-files', help="sort globbed files for better reproducibility", action='store_true')
+    parser.add_argument('--jobs', help="number of parallel jobs for rendering compound pages, 0 to use all CPUs", type=non_negative_int, default=1)
+    parser.add_argument('--incremental', help="render only compounds that changed since the previous run", action='store_true')
+    parser.add_argument('--profile', help="save build profile as JSON into given file")
+    parser.add_argument('--profile-top', help="number of slowest pages to list in the build profile", type=int, default=10)
     parser.add_argument('--debug', help="verbose debug output", action='store_true')
     args = parser.parse_args()
 
@@ -4010,6 +4373,7 @@ if __name__ == '__main__': # pragma: no cover
 
     if not args.no_doxygen:
         logging.debug("running Doxygen on {}".format(doxyfile))
-        subprocess.run(["doxygen", doxyfile], cwd=os.path.dirname(doxyfile), check=True)
+        with state.profile.phase('doxygen'):
+            subprocess.run(["doxygen", doxyfile], cwd=os.path.dirname(doxyfile), check=True)
 
-    run(state, templates=os.path.abspath(args.templates), wildcard=args.wildcard, index_pages=args.index_pages, search_merge_subtrees=not args.search_no_subtree_merging, search_add_lookahead_barriers=not args.search_no_lookahead_barriers, search_merge_prefixes=not args.search_no_prefix_merging)
+    run(state, templates=os.path.abspath(args.templates), wildcard=args.wildcard, index_pages=args.index_pages, search_merge_subtrees=not args.search_no_subtree_merging, search_add_lookahead_barriers=not args.search_no_lookahead_barriers, search_merge_prefixes=not args.search_no_prefix_merging, jobs=args.jobs or os.cpu_count(), incremental=args.incremental, profile=args.profile, profile_top=args.profile_top)
@@ -42,22 +42,29 @@ import mimetypes
 import os
 import re
 import sys
-import shutil
+import time
 import typing
 
 from enum import Enum
 from types import SimpleNamespace as Empty
 from importlib.machinery import SourceFileLoader
-from typing import Tuple, Dict, Set, Any, List, Callable, Optional
+from typing import Tuple, Dict, Set, Any, List, Callable, Optional, Union
 from urllib.parse import urljoin
 from docutils.transforms import Transform
 
 import jinja2
 
-from _search import CssClass, ResultFlag, ResultMap, Trie, Serializer, serialize_search_data, base85encode_search_data, searchdata_format_version, search_filename, searchdata_filename, searchdata_filename_b85
+from _output import OutputWriter
+from _profile import Profile
+from _templates import bytecode_cache, needs_async, shared_context
+from _incremental import RecordingDict, fingerprint, fingerprint_file, fingerprint_files, fingerprint_modules, load_manifest, save_manifest
+from _search import CssClass, ResultFlag, ResultMap, SearchResult, Trie, Serializer, serialize_search_data, serialize_search_data_sharded, search_shard_filename, base85encode_search_data, searchdata_format_version, search_filename, searchdata_filename, searchdata_filename_b85
 
 sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../plugins'))
 import m.htmlsanity
+import dot2svg
+import latex2svgextra
+import pygmentsextra
 
 default_templates = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'templates/python/')
 
@@ -130,6 +137,9 @@ def default_id_formatter(type: EntryType, path: List[str]) -> str:
     assert len(path) == 1
     return path[0]
 
+# Options of the fixed-width search data format, removed in version 3 of it
+deprecated_search_options = ['SEARCH_RESULT_ID_BYTES', 'SEARCH_FILE_OFFSET_BYTES', 'SEARCH_NAME_SIZE_BYTES']
+
 default_config = {
     'PROJECT_TITLE': 'My Python Project',
     'PROJECT_SUBTITLE': None,
@@ -172,9 +182,7 @@ default_config = {
     'SEARCH_DISABLED': False,
     'SEARCH_DOWNLOAD_BINARY': False,
     'SEARCH_FILENAME_PREFIX': 'searchdata',
-    'SEARCH_RESULT_ID_BYTES': 2,
-    'SEARCH_FILE_OFFSET_BYTES': 3,
-    'SEARCH_NAME_SIZE_BYTES': 1,
+    'SEARCH_SHARDED': False,
     'SEARCH_HELP': """.. raw:: html
 
     <p class="m-noindent">Search for modules, classes, functions and other
@@ -192,9 +200,32 @@ default_config = {
     'SEARCH_EXTERNAL_URL': None,
 
     'URL_FORMATTER': default_url_formatter,
-    'ID_FORMATTER': default_id_formatter
+    'ID_FORMATTER': default_id_formatter,
+
+    'TEMPLATE_CACHE_DIR': None,
+    'COMPRESS_OUTPUT': []
 }
 
+# Entry in State.name_map. There's one for every crawled module, class,
+# function, value etc., so it's slotted to avoid a __dict__ for each. Only the
+# attributes that make sense for given entry type are set, the rest stays
+# absent. Plugins may add entries of their own, such as m.sphinx adding
+# SimpleNamespace instances for Intersphinx inventories.
+class NameMapEntry:
+    __slots__ = ['type', 'object', 'path', 'url', 'css_classes', 'members', 'values', 'filename', 'summary', 'name']
+
+    def __init__(self):
+        self.type: EntryType
+        self.object: Any
+        self.path: List[str]
+        self.url: str
+        self.css_classes: List[str]
+        self.members: List[str]
+        self.values: List
+        self.filename: str
+        self.summary: str
+        self.name: str
+
 class State:
     def __init__(self, config):
         self.config = config
@@ -215,8 +246,13 @@ class State:
         self.hooks_pre_page: List = []
         self.hooks_post_run: List = []
 
-        self.name_map: Dict[str, Empty] = {}
+        self.name_map: Dict[str, NameMapEntry] = {}
         self.search: List[Any] = []
+        self.output: OutputWriter = None
+        self.profile = Profile()
+        # Values common for all rendered pages, see
+        # _templates.shared_context()
+        self.template_context: Dict[str, Any] = {}
 
         self.crawled: Set[object] = set()
 
@@ -367,7 +403,7 @@ _filtered_attrs_functions = set([
 ])
 
 def crawl_enum(state: State, path: List[str], enum_, parent_url):
-    enum_entry = Empty()
+    enum_entry = NameMapEntry()
     enum_entry.type = EntryType.ENUM
     enum_entry.object = enum_
     enum_entry.path = path
@@ -378,7 +414,7 @@ def crawl_enum(state: State, path: List[str], enum_, parent_url):
     if issubclass(enum_, enum.Enum):
         for i in enum_:
             subpath = path + [i.name]
-            entry = Empty()
+            entry = NameMapEntry()
             entry.type = EntryType.ENUM_VALUE
             entry.path = subpath
             entry.url = '{}#{}'.format(parent_url, state.config['ID_FORMATTER'](EntryType.ENUM_VALUE, subpath[-2:]))
@@ -390,7 +426,7 @@ def crawl_enum(state: State, path: List[str], enum_, parent_url):
 
         for name in enum_.__members__:
             subpath = path + [name]
-            entry = Empty()
+            entry = NameMapEntry()
             entry.type = EntryType.ENUM_VALUE
             entry.path = subpath
             entry.url = '{}#{}'.format(parent_url, state.config['ID_FORMATTER'](EntryType.ENUM_VALUE, subpath[-2:]))
@@ -420,7 +456,7 @@ def crawl_class(state: State, path: List[str], class_):
 
     state.crawled.add(id(class_))
 
-    class_entry = Empty()
+    class_entry = NameMapEntry()
     class_entry.type = EntryType.CLASS
     class_entry.object = class_
     class_entry.path = path
@@ -502,7 +538,7 @@ def crawl_class(state: State, path: List[str], class_):
             else: # pragma: no cover
                 assert type_ is None; continue # ignore unknown object types
 
-            entry = Empty()
+            entry = NameMapEntry()
             entry.type = type_
             entry.object = object
             entry.path = subpath
@@ -528,7 +564,7 @@ def crawl_class(state: State, path: List[str], class_):
             # have at least an object to point to (and a value)
             if name in class_entry.members: continue
 
-            entry = Empty()
+            entry = NameMapEntry()
             entry.type = EntryType.DATA
             entry.object = None # TODO will this break things?
             entry.path = subpath
@@ -553,7 +589,7 @@ def crawl_class(state: State, path: List[str], class_):
             if attrib.name not in class_entry.members:
                 class_entry.members += [attrib.name]
 
-            entry = Empty()
+            entry = NameMapEntry()
             entry.type = EntryType.PROPERTY # TODO: or data?
             entry.object = attrib
             entry.path = subpath
@@ -576,7 +612,7 @@ def crawl_module(state: State, path: List[str], module) -> List[Tuple[List[str],
     # parent's members (if there's a parent)
     if len(path) > 1: state.name_map['.'.join(path[:-1])].members += [path[-1]]
 
-    module_entry = Empty()
+    module_entry = NameMapEntry()
     module_entry.type = EntryType.MODULE
     module_entry.object = module
     module_entry.path = path
@@ -649,7 +685,7 @@ def crawl_module(state: State, path: List[str], module) -> List[Tuple[List[str],
                 crawl_enum(state, subpath, object, module_entry.url)
             else:
                 assert type_ in [EntryType.FUNCTION, EntryType.OVERLOADED_FUNCTION, EntryType.DATA]
-                entry = Empty()
+                entry = NameMapEntry()
                 entry.type = type_
                 entry.object = object
                 entry.path = subpath
@@ -727,7 +763,7 @@ def crawl_module(state: State, path: List[str], module) -> List[Tuple[List[str],
                 crawl_enum(state, subpath, object, module_entry.url)
             else:
                 assert type_ in [EntryType.FUNCTION, EntryType.OVERLOADED_FUNCTION, EntryType.DATA]
-                entry = Empty()
+                entry = NameMapEntry()
                 entry.type = type_
                 entry.object = object
                 entry.path = subpath
@@ -1308,7 +1344,7 @@ def extract_annotation(state: State, referrer_path: List[str], annotation) -> Tu
     name = extract_type(annotation)
     return name, make_name_link(state, referrer_path, map_name_prefix(state, name))
 
-def extract_module_doc(state: State, entry: Empty):
+def extract_module_doc(state: State, entry: NameMapEntry):
     assert inspect.ismodule(entry.object)
 
     # Call all scope enter hooks first
@@ -1326,7 +1362,7 @@ def extract_module_doc(state: State, entry: Empty):
 
     return out
 
-def extract_class_doc(state: State, entry: Empty):
+def extract_class_doc(state: State, entry: NameMapEntry):
     assert inspect.isclass(entry.object)
 
     # Call all scope enter hooks first
@@ -1344,7 +1380,7 @@ def extract_class_doc(state: State, entry: Empty):
 
     return out
 
-def extract_enum_doc(state: State, entry: Empty):
+def extract_enum_doc(state: State, entry: NameMapEntry):
     out = Empty()
     out.name = entry.path[-1]
     out.id = state.config['ID_FORMATTER'](EntryType.ENUM, entry.path[-1:])
@@ -1426,7 +1462,7 @@ def extract_enum_doc(state: State, entry: Empty):
     if not state.config['SEARCH_DISABLED']:
         page_url = state.name_map['.'.join(entry.path[:-1])].url
 
-        result = Empty()
+        result = SearchResult()
         result.flags = ResultFlag.from_type(ResultFlag.NONE, EntryType.ENUM)
         result.url = '{}#{}'.format(page_url, out.id)
         result.prefix = entry.path[:-1]
@@ -1434,7 +1470,7 @@ def extract_enum_doc(state: State, entry: Empty):
         state.search += [result]
 
         for value in out.values:
-            result = Empty()
+            result = SearchResult()
             result.flags = ResultFlag.from_type(ResultFlag.NONE, EntryType.ENUM_VALUE)
             result.url = '{}#{}'.format(page_url, value.id)
             result.prefix = entry.path
@@ -1443,7 +1479,7 @@ def extract_enum_doc(state: State, entry: Empty):
 
     return out
 
-def extract_function_doc(state: State, parent, entry: Empty) -> List[Any]:
+def extract_function_doc(state: State, parent, entry: NameMapEntry) -> List[Any]:
     assert inspect.isfunction(entry.object) or inspect.ismethod(entry.object) or inspect.isroutine(entry.object)
 
     # Enclosing page URL for search
@@ -1745,7 +1781,7 @@ def extract_function_doc(state: State, parent, entry: Empty) -> List[Any]:
             hook(type=entry.type, path=entry.path, param_names=param_names)
 
         if not state.config['SEARCH_DISABLED']:
-            result = Empty()
+            result = SearchResult()
             result.flags = ResultFlag.from_type(ResultFlag.NONE, EntryType.FUNCTION)
             result.url = '{}#{}'.format(page_url, out.id)
             result.prefix = entry.path[:-1]
@@ -1761,7 +1797,7 @@ def extract_function_doc(state: State, parent, entry: Empty) -> List[Any]:
 
     return overloads
 
-def extract_property_doc(state: State, parent, entry: Empty):
+def extract_property_doc(state: State, parent, entry: NameMapEntry):
     out = Empty()
     out.name = entry.path[-1]
     out.id = state.config['ID_FORMATTER'](EntryType.PROPERTY, entry.path[-1:])
@@ -1916,7 +1952,7 @@ def extract_property_doc(state: State, parent, entry: Empty):
         out.has_details = True
 
     if not state.config['SEARCH_DISABLED']:
-        result = Empty()
+        result = SearchResult()
         result.flags = ResultFlag.from_type(ResultFlag.NONE, EntryType.PROPERTY)
         result.url = '{}#{}'.format(state.name_map['.'.join(entry.path[:-1])].url, out.id)
         result.prefix = entry.path[:-1]
@@ -1925,7 +1961,7 @@ def extract_property_doc(state: State, parent, entry: Empty):
 
     return out
 
-def extract_data_doc(state: State, parent, entry: Empty):
+def extract_data_doc(state: State, parent, entry: NameMapEntry):
     assert not inspect.ismodule(entry.object) and not inspect.isclass(entry.object) and not inspect.isroutine(entry.object) and not inspect.isframe(entry.object) and not inspect.istraceback(entry.object) and not inspect.iscode(entry.object)
 
     # Call all scope enter hooks before rendering the docs
@@ -1958,7 +1994,7 @@ def extract_data_doc(state: State, parent, entry: Empty):
     out.value = format_value(state, entry.path, entry.object)
 
     if not state.config['SEARCH_DISABLED']:
-        result = Empty()
+        result = SearchResult()
         result.flags = ResultFlag.from_type(ResultFlag.NONE, EntryType.DATA)
         result.url = '{}#{}'.format(state.name_map['.'.join(entry.path[:-1])].url, out.id)
         result.prefix = entry.path[:-1]
@@ -1967,21 +2003,9 @@ def extract_data_doc(state: State, parent, entry: Empty):
 
     return out
 
-def render(*, config, template: str, url: str, filename: str, env: jinja2.Environment, **kwargs):
+def render(*, context, output: OutputWriter, template: str, url: str, filename: str, env: jinja2.Environment, **kwargs):
     template = env.get_template(template)
-    rendered = template.render(URL=url,
-        SEARCHDATA_FORMAT_VERSION=searchdata_format_version,
-        **config, **kwargs)
-    output = os.path.join(config['OUTPUT'], filename)
-    output_dir = os.path.dirname(output)
-    if not os.path.exists(output_dir): os.makedirs(output_dir)
-    with open(output, 'wb') as f:
-        f.write(rendered.encode('utf-8'))
-        # Add back a trailing newline so we don't need to bother with
-        # patching test files to include a trailing newline to make Git
-        # happy. Can't use keep_trailing_newline because that'd add it
-        # also for nested templates :(
-        f.write(b'\n')
+    output.write_template(filename, template, dict(URL=url, **kwargs), context)
 
 def render_module(state: State, path, module, env):
     # Call all scope enter hooks first
@@ -2051,14 +2075,15 @@ def render_module(state: State, path, module, env):
             assert False
 
     if not state.config['SEARCH_DISABLED']:
-        result = Empty()
+        result = SearchResult()
         result.flags = ResultFlag.from_type(ResultFlag.NONE, EntryType.MODULE)
         result.url = page.url
         result.prefix = path[:-1]
         result.name = path[-1]
         state.search += [result]
 
-    render(config=state.config,
+    render(context=state.template_context,
+        output=state.output,
         template='module.html',
         filename=page.filename,
         url=page.url,
@@ -2152,14 +2177,15 @@ def render_class(state: State, path, class_, env):
             assert False
 
     if not state.config['SEARCH_DISABLED']:
-        result = Empty()
+        result = SearchResult()
         result.flags = ResultFlag.from_type(ResultFlag.NONE, EntryType.CLASS)
         result.url = page.url
         result.prefix = path[:-1]
         result.name = path[-1]
         state.search += [result]
 
-    render(config=state.config,
+    render(context=state.template_context,
+        output=state.output,
         template='class.html',
         filename=page.filename,
         url=page.url,
@@ -2354,7 +2380,8 @@ def render_page(state: State, path, input_filename, env):
             entry = state.name_map['.'.join(path)]
             entry.summary = page.summary
             entry.name = page.breadcrumb[-1][0]
-            render(config=state.config,
+            render(context=state.template_context,
+                output=state.output,
                 template='page.html',
                 filename=page.filename,
                 url=page.url,
@@ -2403,14 +2430,15 @@ def render_page(state: State, path, input_filename, env):
     entry.name = page.breadcrumb[-1][0]
 
     if not state.config['SEARCH_DISABLED']:
-        result = Empty()
+        result = SearchResult()
         result.flags = ResultFlag.from_type(ResultFlag.NONE, EntryType.PAGE)
         result.url = page.url
         result.prefix = path[:-1]
         result.name = path[-1]
         state.search += [result]
 
-    render(config=state.config,
+    render(context=state.template_context,
+        output=state.output,
         template='page.html',
         filename=page.filename,
         url=page.url,
@@ -2420,7 +2448,7 @@ def render_page(state: State, path, input_filename, env):
 def is_html_safe(string):
     return '<' not in string and '>' not in string and '&' not in string and '"' not in string and '\'' not in string
 
-def build_search_data(state: State, merge_subtrees=True, add_lookahead_barriers=True, merge_prefixes=True) -> bytearray:
+def build_search_data(state: State, merge_subtrees=True, add_lookahead_barriers=True, merge_prefixes=True, sharded=False, jobs=1) -> Union[bytearray, List[Tuple[bytes, bytearray]]]:
     trie = Trie()
     map = ResultMap()
 
@@ -2438,7 +2466,7 @@ def build_search_data(state: State, merge_subtrees=True, add_lookahead_barriers=
         name_with_args = result.name
         name = result.name
         suffix_length = 0
-        if hasattr(result, 'params') and result.params is not None:
+        if result.params is not None:
             # Some very heavily annotated function parameters might cause the
             # suffix_length to exceed 256, which won't fit into the serialized
             # search data. However that *also* won't fit in the search result
@@ -2461,7 +2489,7 @@ def build_search_data(state: State, merge_subtrees=True, add_lookahead_barriers=
 
         # Add functions the second time with () appended, everything is the
         # same except for suffix length which is 2 chars shorter
-        if hasattr(result, 'params') and result.params is not None:
+        if result.params is not None:
             index_args = map.add(complete_name, result.url,
                 suffix_length=suffix_length - 2, flags=result.flags)
 
@@ -2481,7 +2509,7 @@ def build_search_data(state: State, merge_subtrees=True, add_lookahead_barriers=
             # the other result that expects () appended. The lookahead
             # barrier is at the ( character to avoid the result being shown
             # twice.
-            if hasattr(result, 'params') and result.params is not None:
+            if result.params is not None:
                 trie.insert(name.lower() + '()', index_args, lookahead_barriers=lookahead_barriers + [len(name)] if add_lookahead_barriers else [])
 
         # Add this symbol to total symbol count
@@ -2491,9 +2519,149 @@ def build_search_data(state: State, merge_subtrees=True, add_lookahead_barriers=
     # order by default
     trie.sort(map)
 
-    return serialize_search_data(Serializer(file_offset_bytes=state.config['SEARCH_FILE_OFFSET_BYTES'], result_id_bytes=state.config['SEARCH_RESULT_ID_BYTES'], name_size_bytes=state.config['SEARCH_NAME_SIZE_BYTES']), trie, map, search_type_map, symbol_count, merge_subtrees=merge_subtrees, merge_prefixes=merge_prefixes)
+    serializer = Serializer()
+    if sharded:
+        return serialize_search_data_sharded(serializer, trie, map, search_type_map, symbol_count, merge_subtrees=merge_subtrees, merge_prefixes=merge_prefixes, jobs=jobs)
+    return serialize_search_data(serializer, trie, map, search_type_map, symbol_count, merge_subtrees=merge_subtrees, merge_prefixes=merge_prefixes)
+
+# Renders a module, class or page. A side effect of the render is
+# entry.summary (and entry.name for pages) being filled.
+def render_entry(state: State, entry: NameMapEntry, env):
+    begin = time.perf_counter()
+    if entry.type == EntryType.MODULE:
+        render_module(state, entry.path, entry.object, env)
+    elif entry.type == EntryType.CLASS:
+        render_class(state, entry.path, entry.object, env)
+    elif entry.type == EntryType.PAGE:
+        render_page(state, entry.path, entry.filename, env)
+    state.profile.add_page(state.config['URL_FORMATTER'](entry.type, entry.path)[0], time.perf_counter() - begin)
+
+# Hits and misses of all caches, for profiling
+def cache_stats():
+    return {
+        'math': latex2svgextra.cache_stats(),
+        'graphs': dot2svg.cache_stats(),
+        'code': pygmentsextra.cache_stats()
+    }
+
+_doc_dicts = ['module_docs', 'class_docs', 'enum_docs', 'enum_value_docs', 'function_docs', 'property_docs', 'data_docs']
+
+# Memory addresses in reprs of functions, default argument values and such are
+# different on every run, strip them away
+_address_src = re.compile(r' at 0x[0-9a-fA-F]+')
+
+# Fingerprint of an object referenced from a name map entry, made only of the
+# things the rendered output is generated from
+def _fingerprint_object(object) -> str:
+    out = [type(object).__module__, type(object).__qualname__, getattr(object, '__doc__', None)]
+    if inspect.ismodule(object) or inspect.isclass(object):
+        # Annotations of module and class-level data are taken from here
+        out += [repr(object.__dict__.get('__annotations__'))]
+        if inspect.isclass(object):
+            out += [extract_type(base) for base in object.__bases__]
+            if issubclass(object, enum.Enum):
+                out += [(value.name, repr(value.value), value.__doc__) for value in object]
+            elif hasattr(object, '__members__'):
+                out += [(name, repr(value)) for name, value in object.__members__.items()]
+    elif isinstance(object, property):
+        out += [_fingerprint_object(i) for i in [object.fget, object.fset, object.fdel]]
+    elif callable(object):
+        try:
+            out += [str(inspect.signature(object))]
+        except (ValueError, TypeError):
+            pass
+        out += [repr(getattr(object, '__annotations__', None))]
+    else:
+        try:
+            out += [repr(object)]
+        except Exception: # pragma: no cover
+            pass
+    return _address_src.sub('', repr(out))
+
+# Fingerprint of a name map entry for incremental builds. The summary and name
+# get filled during rendering so they're excluded, contents of pages are
+# included instead.
+def _fingerprint_entry(entry) -> bytes:
+    if entry is None: return fingerprint(None)
+
+    values = {key: getattr(entry, key) for key in (NameMapEntry.__slots__ if isinstance(entry, NameMapEntry) else vars(entry)) if hasattr(entry, key) and key not in ['object', 'summary', 'name']}
+    if hasattr(entry, 'object'):
+        values['object'] = _fingerprint_object(entry.object)
+    if entry.type == EntryType.PAGE:
+        values['contents'] = fingerprint_file(entry.filename)
+    return fingerprint(values)
+
+# Renders an entry like render_entry(), but collects everything it added to the
+# state and which parts of the state it looked at. Used by incremental builds,
+# where entries that didn't change are not rendered at all and the state is
+# put back together from what was collected in the previous run.
+def render_entry_collect(state: State, name, entry: NameMapEntry, env):
+    search = state.search
+    external_data = state.external_data
+    state.search = []
+    state.name_map.reset()
+    for docs in _doc_dicts: getattr(state, docs).reset()
+    latex2svgextra.start_cache_recording()
+    dot2svg.start_cache_recording()
+    pygmentsextra.start_cache_recording()
+
+    render_entry(state, entry, env)
+
+    # The entry itself is always a dependency, even if the render didn't look
+    # at it in the end
+    state.name_map.accessed.add(name)
+
+    page = Empty()
+    page.output = state.config['URL_FORMATTER'](entry.type, entry.path)[0]
+    page.summary = entry.summary
+    page.name = getattr(entry, 'name', None)
+    page.search = state.search
+    page.external_data = state.external_data - external_data
+    page.dependencies = {'name_map': state.name_map.dependencies()}
+    # Doc contents used by this page, so they can be marked as used again
+    # when the page is not rendered next time
+    page.used_docs = {}
+    for docs in _doc_dicts:
+        page.dependencies[docs] = getattr(state, docs).dependencies()
+        page.used_docs[docs] = [key for key in page.dependencies[docs] if 'used' in dict.get(getattr(state, docs), key, {})]
+    page.math = list(latex2svgextra.stop_cache_recording().keys())
+    page.graphs = list(dot2svg.stop_cache_recording().keys())
+    page.code = list(pygmentsextra.stop_cache_recording().keys())
+
+    state.search = search + page.search
+    return page
+
+# Whether an entry rendered in a previous incremental build doesn't need to be
+# rendered again
+def is_entry_up_to_date(state: State, previous) -> bool:
+    return (previous and
+        os.path.exists(os.path.join(state.config['OUTPUT'], previous.output)) and
+        not state.name_map.changed(previous.dependencies['name_map']) and
+        not any(getattr(state, docs).changed(previous.dependencies[docs]) for docs in _doc_dicts))
+
+# Puts an entry rendered in a previous incremental build back into the state
+def restore_entry(state: State, entry: NameMapEntry, previous):
+    entry.summary = previous.summary
+    if previous.name is not None: entry.name = previous.name
+    state.search += previous.search
+    state.external_data = state.external_data.union(previous.external_data)
+    for docs in _doc_dicts:
+        for key in previous.used_docs[docs]:
+            getattr(state, docs).setdefault(key, {})['used'] = True
+    latex2svgextra.touch_cache(previous.math)
+    dot2svg.touch_cache(previous.graphs)
+    pygmentsextra.touch_cache(previous.code)
+
+# Put into the output directory, next to the search data
+manifest_filename = 'm.python.manifest'
+
+def run(basedir, config, *, templates=default_templates, search_add_lookahead_barriers=True, search_merge_subtrees=True, search_merge_prefixes=True, incremental=False, profile=None, profile_top=10):
+    # Field sizes of the search data are picked automatically since search
+    # data format version 3, these options don't have any effect anymore
+    for key in deprecated_search_options:
+        if key in config:
+            logging.warning("{} is deprecated and ignored, the search data field sizes are picked automatically".format(key))
 
-def run(basedir, config, *, templates=default_templates, search_add_lookahead_barriers=True, search_merge_subtrees=True, search_merge_prefixes=True):
     # Populate the INPUT, if not specified, make it absolute
     if config['INPUT'] is None: config['INPUT'] = basedir
     else: config['INPUT'] = os.path.join(basedir, config['INPUT'])
@@ -2508,10 +2676,17 @@ def run(basedir, config, *, templates=default_templates, search_add_lookahead_ba
 
     state = State(config)
 
+    # For incremental builds, record which names and doc contents each page
+    # looks at. This has to be done before plugins get references to the doc
+    # content dicts.
+    if incremental:
+        for docs in _doc_dicts: setattr(state, docs, RecordingDict())
+        state.name_map = RecordingDict(fingerprint=_fingerprint_entry)
+
     # Prepare Jinja environment
     env = jinja2.Environment(
         loader=jinja2.FileSystemLoader(templates), trim_blocks=True,
-        lstrip_blocks=True, enable_async=True)
+        lstrip_blocks=True)
     # Filter to return formatted URL or the full URL, if already absolute
     def format_url(path):
         if urllib.parse.urlparse(path).netloc: return path
@@ -2545,24 +2720,34 @@ def run(basedir, config, *, templates=default_templates, search_add_lookahead_ba
         if path not in sys.path: sys.path.append(os.path.join(config['INPUT'], path))
 
     # Import plugins
-    for plugin in ['m.htmlsanity'] + config['PLUGINS']:
-        module = importlib.import_module(plugin)
-        module.register_mcss(
-            mcss_settings=config,
-            jinja_environment=env,
-            module_doc_contents=state.module_docs,
-            class_doc_contents=state.class_docs,
-            enum_doc_contents=state.enum_docs,
-            enum_value_doc_contents=state.enum_value_docs,
-            function_doc_contents=state.function_docs,
-            property_doc_contents=state.property_docs,
-            data_doc_contents=state.data_docs,
-            hooks_post_crawl=state.hooks_post_crawl,
-            hooks_pre_scope=state.hooks_pre_scope,
-            hooks_post_scope=state.hooks_post_scope,
-            hooks_docstring=state.hooks_docstring,
-            hooks_pre_page=state.hooks_pre_page,
-            hooks_post_run=state.hooks_post_run)
+    with state.profile.phase('plugins'):
+        for plugin in ['m.htmlsanity'] + config['PLUGINS']:
+            module = importlib.import_module(plugin)
+            module.register_mcss(
+                mcss_settings=config,
+                jinja_environment=env,
+                module_doc_contents=state.module_docs,
+                class_doc_contents=state.class_docs,
+                enum_doc_contents=state.enum_docs,
+                enum_value_doc_contents=state.enum_value_docs,
+                function_doc_contents=state.function_docs,
+                property_doc_contents=state.property_docs,
+                data_doc_contents=state.data_docs,
+                hooks_post_crawl=state.hooks_post_crawl,
+                hooks_pre_scope=state.hooks_pre_scope,
+                hooks_post_scope=state.hooks_post_scope,
+                hooks_docstring=state.hooks_docstring,
+                hooks_pre_page=state.hooks_pre_page,
+                hooks_post_run=state.hooks_post_run)
+
+    # Templates are rendered in async mode only if a plugin registered an
+    # async filter, test or global, as it's otherwise just an overhead. Has to
+    # be decided before any template is compiled.
+    env.is_async = needs_async(env)
+    if config['TEMPLATE_CACHE_DIR']:
+        env.bytecode_cache = bytecode_cache(os.path.join(config['INPUT'], config['TEMPLATE_CACHE_DIR']), env.is_async, fingerprint((
+            fingerprint_modules([__name__, '_templates'] + config['PLUGINS']),
+            config)))
 
     # First process the doc input files so we have all data for rendering
     # module/class pages. This needs to be done first so the crawl after can
@@ -2570,8 +2755,9 @@ def run(basedir, config, *, templates=default_templates, search_add_lookahead_ba
     # members as well. On the other hand, this means nothing in render_doc()
     # has access to the module hierarchy -- all actual content rendering has to
     # happen later.
-    for file in config['INPUT_DOCS']:
-        render_doc(state, os.path.join(basedir, file))
+    with state.profile.phase('render_docs'):
+        for file in config['INPUT_DOCS']:
+            render_doc(state, os.path.join(basedir, file))
 
     # Crawl all input modules to gather the name tree, put their names into a
     # list for the index. The crawl is done breadth-first, so the function
@@ -2586,15 +2772,16 @@ def run(basedir, config, *, templates=default_templates, search_add_lookahead_ba
             module_name = module.__name__
         modules_to_crawl += [([module_name], module)]
         class_index += [module_name]
-    while modules_to_crawl:
-        path, object = modules_to_crawl.pop(0)
-        if id(object) in state.crawled: continue
-        modules_to_crawl += crawl_module(state, path, object)
+    with state.profile.phase('crawl'):
+        while modules_to_crawl:
+            path, object = modules_to_crawl.pop(0)
+            if id(object) in state.crawled: continue
+            modules_to_crawl += crawl_module(state, path, object)
 
     # Add special pages to the name map. The pages are done after so they can
     # override these.
     for page in special_pages:
-        entry = Empty()
+        entry = NameMapEntry()
         entry.type = EntryType.SPECIAL
         entry.path = [page]
         entry.url = config['URL_FORMATTER'](EntryType.SPECIAL, entry.path)[1]
@@ -2606,7 +2793,7 @@ def run(basedir, config, *, templates=default_templates, search_add_lookahead_ba
     for page in config['INPUT_PAGES']:
         page_name = os.path.splitext(os.path.basename(page))[0]
 
-        entry = Empty()
+        entry = NameMapEntry()
         entry.type = EntryType.PAGE
         entry.path = [page_name]
         entry.url = config['URL_FORMATTER'](EntryType.PAGE, entry.path)[1]
@@ -2617,25 +2804,65 @@ def run(basedir, config, *, templates=default_templates, search_add_lookahead_ba
         if page_name != 'index': page_index += [page_name]
 
     # Call all registered post-crawl hooks
-    for hook in state.hooks_post_crawl:
-        hook(name_map=state.name_map)
+    with state.profile.phase('hooks_post_crawl'):
+        for hook in state.hooks_post_crawl:
+            hook(name_map=state.name_map)
+
+    # Config doesn't change from now on, so it can be put into the context
+    # shared by all pages
+    state.template_context = shared_context(env, config,
+        SEARCHDATA_FORMAT_VERSION=searchdata_format_version)
+
+    # For incremental builds, load the manifest from the previous run. All
+    # pages get rendered again if anything that affects all of them changed,
+    # otherwise only those for which any names or doc contents they looked at
+    # changed. The doc contents get filled as the pages are rendered, so
+    # fingerprint everything now, before any rendering happens.
+    if incremental:
+        manifest_file = os.path.join(config['OUTPUT'], manifest_filename)
+        manifest = load_manifest(manifest_file, fingerprint((
+            fingerprint_files([templates]),
+            fingerprint_modules([__name__, '_incremental', '_output', '_search', '_templates', 'dot2svg', 'latex2svgextra', 'pygmentsextra', 'svgcache', 'm.htmlsanity'] + config['PLUGINS']),
+            docutils.__version__,
+            config)))
+        for docs in _doc_dicts: getattr(state, docs).freeze()
+        state.name_map.freeze()
+        pages = {}
+
+    # Write only files that changed. In incremental builds the hashes of
+    # files written previously are known, so the old files don't need to be
+    # read and files that are not generated anymore can be removed.
+    state.output = OutputWriter(config['OUTPUT'], manifest.outputs if incremental else None, background=True)
 
     # Go through all crawled names and render modules, classes and pages. A
     # side effect of the render is entry.summary (and entry.name for pages)
     # being filled.
     # TODO: page name need to be added earlier for intersphinx!
-    for entry in state.name_map.values():
+    begin = time.perf_counter()
+    for name, entry in state.name_map.items():
         # If there is no object, the entry is an external reference. Skip
         # those. Can't do `not entry.object` because that gives ValueError
         # for numpy ("use a.any() or a.all()")
         if hasattr(entry, 'object') and entry.object is None: continue
 
-        if entry.type == EntryType.MODULE:
-            render_module(state, entry.path, entry.object, env)
-        elif entry.type == EntryType.CLASS:
-            render_class(state, entry.path, entry.object, env)
-        elif entry.type == EntryType.PAGE:
-            render_page(state, entry.path, entry.filename, env)
+        if entry.type not in [EntryType.MODULE, EntryType.CLASS, EntryType.PAGE]: continue
+
+        if not incremental:
+            render_entry(state, entry, env)
+            continue
+
+        previous = manifest.pages.get(name)
+        if not manifest.outdated and is_entry_up_to_date(state, previous):
+            logging.debug("%s: up-to-date, skipping", name)
+            restore_entry(state, entry, previous)
+            state.output.keep(previous.output)
+            pages[name] = previous
+        else:
+            pages[name] = render_entry_collect(state, name, entry, env)
+    state.profile.add_phase('render_pages', time.perf_counter() - begin)
+
+    if incremental:
+        logging.debug("rendered %s out of %s pages", len([name for name, page in pages.items() if page is not manifest.pages.get(name)]), len(pages))
 
     # Warn if there are any unused contents left after processing everything
     for docs in ['module', 'class', 'enum', 'function', 'property', 'data']:
@@ -2690,14 +2917,16 @@ def run(basedir, config, *, templates=default_templates, search_add_lookahead_ba
     index = Empty()
     index.classes = class_index
     index.pages = page_index
-    for file in special_pages[1:]: # exclude index
-        filename, url = config['URL_FORMATTER'](EntryType.SPECIAL, [file])
-        render(config=config,
-            template=file + '.html',
-            filename=filename,
-            url=url,
-            env=env,
-            index=index)
+    with state.profile.phase('render_index_pages'):
+        for file in special_pages[1:]: # exclude index
+            filename, url = config['URL_FORMATTER'](EntryType.SPECIAL, [file])
+            render(context=state.template_context,
+                output=state.output,
+                template=file + '.html',
+                filename=filename,
+                url=url,
+                env=env,
+                index=index)
 
     # Create index.html if it was not provided by the user
     if 'index.rst' not in [os.path.basename(i) for i in config['INPUT_PAGES']]:
@@ -2709,7 +2938,8 @@ def run(basedir, config, *, templates=default_templates, search_add_lookahead_ba
         page.filename = filename
         page.url = url
         page.breadcrumb = [(config['PROJECT_TITLE'], url)]
-        render(config=config,
+        render(context=state.template_context,
+            output=state.output,
             template='page.html',
             filename=page.filename,
             url=page.url,
@@ -2717,36 +2947,51 @@ def run(basedir, config, *, templates=default_templates, search_add_lookahead_ba
             page=page)
 
     if not state.config['SEARCH_DISABLED']:
-        logging.debug("building search data for {} symbols".format(len(state.search)))
-
-        data = build_search_data(state, add_lookahead_barriers=search_add_lookahead_barriers, merge_subtrees=search_merge_subtrees, merge_prefixes=search_merge_prefixes)
-
         # Joining twice, first before passing those to the URL formatter and
         # second after. If SEARCH_DOWNLOAD_BINARY is a string, use that as a
         # filename.
         # TODO: any chance we could write the file *before* it gets ever passed
         # to URL formatters so we can add cache buster hashes to its URL?
         if state.config['SEARCH_DOWNLOAD_BINARY']:
-            with open(os.path.join(config['OUTPUT'], config['URL_FORMATTER'](EntryType.STATIC, [os.path.join(config['OUTPUT'], state.config['SEARCH_DOWNLOAD_BINARY'] if isinstance(state.config['SEARCH_DOWNLOAD_BINARY'], str) else searchdata_filename.format(search_filename_prefix=state.config['SEARCH_FILENAME_PREFIX']))])[0]), 'wb') as f:
-                f.write(data)
+            search_output = config['URL_FORMATTER'](EntryType.STATIC, [os.path.join(config['OUTPUT'], state.config['SEARCH_DOWNLOAD_BINARY'] if isinstance(state.config['SEARCH_DOWNLOAD_BINARY'], str) else searchdata_filename.format(search_filename_prefix=state.config['SEARCH_FILENAME_PREFIX']))])[0]
+        else:
+            search_output = config['URL_FORMATTER'](EntryType.STATIC, [os.path.join(config['OUTPUT'], searchdata_filename_b85.format(search_filename_prefix=state.config['SEARCH_FILENAME_PREFIX']))])[0]
+
+        # In an incremental build, the search data need to be built again
+        # only if any symbols changed
+        if incremental:
+            search_fingerprint = fingerprint((state.search, search_add_lookahead_barriers, search_merge_subtrees, search_merge_prefixes))
+        if incremental and manifest.search == search_fingerprint and os.path.exists(os.path.join(config['OUTPUT'], search_output)):
+            logging.debug("search data up-to-date, skipping")
+            state.output.keep(search_output)
+            for shard in manifest.search_shards:
+                state.output.keep(shard)
         else:
-            with open(os.path.join(config['OUTPUT'], config['URL_FORMATTER'](EntryType.STATIC, [os.path.join(config['OUTPUT'], searchdata_filename_b85.format(search_filename_prefix=state.config['SEARCH_FILENAME_PREFIX']))])[0]), 'wb') as f:
-                f.write(base85encode_search_data(data))
+            logging.debug("building search data for {} symbols".format(len(state.search)))
+
+            with state.profile.phase('search'):
+                data = build_search_data(state, add_lookahead_barriers=search_add_lookahead_barriers, merge_subtrees=search_merge_subtrees, merge_prefixes=search_merge_prefixes, sharded=state.config['SEARCH_SHARDED'])
+
+            encode = (lambda data: data) if state.config['SEARCH_DOWNLOAD_BINARY'] else base85encode_search_data
+
+            # With sharded search data, the index is written under the usual
+            # name and the shards next to it
+            shards = data if state.config['SEARCH_SHARDED'] else [(b'', data)]
+            if state.config['SEARCH_SHARDED']:
+                logging.debug("writing {} search data shards".format(len(shards)))
+            for key, shard in shards:
+                state.output.write(search_shard_filename(search_output, key), encode(shard))
+
+            if incremental:
+                manifest.search = search_fingerprint
+                manifest.search_shards = [search_shard_filename(search_output, key) for key, shard in shards if key]
 
         # OpenSearch metadata, in case we have the base URL
         if state.config['SEARCH_BASE_URL']:
             logging.debug("writing OpenSearch metadata file")
 
             template = env.get_template('opensearch.xml')
-            rendered = template.render(**state.config)
-            output = os.path.join(config['OUTPUT'], 'opensearch.xml')
-            with open(output, 'wb') as f:
-                f.write(rendered.encode('utf-8'))
-                # Add back a trailing newline so we don't need to bother with
-                # patching test files to include a trailing newline to make Git
-                # happy. Can't use keep_trailing_newline because that'd add it
-                # also for nested templates :(
-                f.write(b'\n')
+            state.output.write_template('opensearch.xml', template, {}, state.template_context)
 
     # Copy referenced files
     for i in config['STYLESHEETS'] + config['EXTRA_FILES'] + ([config['PROJECT_LOGO']] if config['PROJECT_LOGO'] else []) + ([config['FAVICON'][0]] if config['FAVICON'] else []) + list(state.external_data) + ([] if config['SEARCH_DISABLED'] else ['search.js']):
@@ -2761,20 +3006,47 @@ def run(basedir, config, *, templates=default_templates, search_add_lookahead_ba
         else:
             i = os.path.join(os.path.dirname(os.path.realpath(__file__)), i)
 
-        output = os.path.join(config['OUTPUT'], config['URL_FORMATTER'](EntryType.STATIC, [i])[0])
-        output_dir = os.path.dirname(output)
-        if not os.path.exists(output_dir): os.makedirs(output_dir)
         logging.debug("copying %s to output", i)
-        shutil.copy(i, output)
+        with state.profile.phase('copy'):
+            state.output.copy(i, config['URL_FORMATTER'](EntryType.STATIC, [i])[0])
+
+    # Wait until the output writer thread writes everything that's left
+    with state.profile.phase('write'):
+        state.output.finish()
+
+    # Call all registered finalization hooks. Plugins save their caches there,
+    # so remember the cache stats before.
+    for name, (hits, misses) in cache_stats().items():
+        state.profile.add_cache(name, hits, misses)
+    with state.profile.phase('hooks_post_run'):
+        for hook in state.hooks_post_run: hook()
+
+    if config['COMPRESS_OUTPUT']:
+        with state.profile.phase('compress'):
+            state.output.compress(config['COMPRESS_OUTPUT'], jobs=os.cpu_count() or 1)
+
+    # Remove outputs that are no longer there and save the updated manifest
+    if incremental:
+        state.output.remove_orphans()
+
+        manifest.pages = pages
+        manifest.outputs = state.output.files
+        save_manifest(manifest_file, manifest)
+
+    state.output.report()
 
-    # Call all registered finalization hooks
-    for hook in state.hooks_post_run: hook()
+    if profile:
+        state.profile.finish()
+        state.profile.save(profile, profile_top)
 
 if __name__ == '__main__': # pragma: no cover
     parser = argparse.ArgumentParser()
     parser.add_argument('conf', help="configuration file")
     parser.add_argument('--templates', help="template directory", default=default_templates)
     parser.add_argument('--debug', help="verbose debug output", action='store_true')
+    parser.add_argument('--incremental', help="render only pages that changed since the previous run", action='store_true')
+    parser.add_argument('--profile', help="save build profile as JSON into given file")
+    parser.add_argument('--profile-top', help="number of slowest pages to list in the build profile", type=int, default=10)
     args = parser.parse_args()
 
     # Set an environment variable indicating m.css is being run. This can be
@@ -2797,4 +3069,4 @@ if __name__ == '__main__': # pragma: no cover
     else:
         logging.basicConfig(level=logging.INFO)
 
-    run(os.path.dirname(os.path.abspath(args.conf)), config, templates=os.path.abspath(args.templates))
+    run(os.path.dirname(os.path.abspath(args.conf)), config, templates=os.path.abspath(args.templates), incremental=args.incremental, profile=args.profile, profile_top=args.profile_top)
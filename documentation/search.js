@@ -26,7 +26,7 @@
 "use strict"; /* it summons the Cthulhu in a proper way, they say */
 
 var Search = {
-    formatVersion: 2, /* the data filename contains this number too */
+    formatVersion: 3, /* the data filename contains this number too */
 
     dataSize: 0, /* used mainly by tests, not here */
     symbolCount: '&hellip;',
@@ -36,16 +36,27 @@ var Search = {
     typeMap: null,
     maxResults: 0,
 
-    /* Type sizes and masks. The data is always fetched as 16/32bit number and
-       then masked to 1, 2, 3 or 4 bytes. Fortunately on LE a mask is enough,
-       on BE we'd have to read N bytes before and then mask. */
-    nameSizeBytes: null,
-    nameSizeMask: null,
-    resultIdBytes: null,
-    resultIdMask: null,
+    /* For sharded search data, maps shard keys to the trie, map, typeMap and
+       mapFlagsOffset of each shard, null if it's being downloaded. The index
+       has an empty key. The shardKey is the key of the shard that trie, map
+       etc. are currently set to. */
+    shards: null,
+    shardKey: '',
+
+    /* URL the last data was loaded from and whether it's binary, used to
+       derive shard URLs from the index URL */
+    source: null,
+    indexSource: null,
+
+    /* Result map offset size and mask, stored in each result map. The data
+       is always fetched as a 32bit number and then masked to 2, 3 or 4 bytes.
+       Fortunately on LE a mask is enough, on BE we'd have to read N bytes
+       before and then mask. */
     fileOffsetBytes: null,
     fileOffsetMask: null,
-    lookaheadBarrierMask: null,
+
+    /* Size of the VARINT read by the last varint() call */
+    varintSize: 0,
 
     /* Always contains at least the root node offset and then one node offset
        per entered character */
@@ -87,57 +98,71 @@ var Search = {
             return false;
         }
 
-        /* Fetch type sizes. The only value that can fail is result ID byte
-           count, where value of 3 has no assigned meaning. */
-        let typeSizes = view.getUint8(4, true);
-        if((typeSizes & 0x01) >> 0 == 0) {
-            this.fileOffsetBytes = 3;
-            this.fileOffsetMask = 0x00ffffff;
-            this.lookaheadBarrierMask = 0x00800000;
-        } else /* (typeSizes & 0x01) >> 0 == 1 */ {
-            this.fileOffsetBytes = 4;
-            this.fileOffsetMask = 0xffffffff;
-            this.lookaheadBarrierMask = 0x80000000;
-        }
-        if((typeSizes & 0x06) >> 1 == 0) {
-            this.resultIdBytes = 2;
-            this.resultIdMask = 0x0000ffff;
-        } else if((typeSizes & 0x06) >> 1 == 1) {
-            this.resultIdBytes = 3;
-            this.resultIdMask = 0x00ffffff;
-        } else if((typeSizes & 0x06) >> 1 == 2) {
-            this.resultIdBytes = 4;
-            this.resultIdMask = 0xffffffff;
-        } else /* (typeSizes & 0x06) >> 1 == 3 */ {
-            console.error("Invalid search data result ID byte value");
+        /* Separate the data into the trie and the result / type map. The
+           result map offsets are read as 32-bit and then masked out, so keep
+           extra 1/2 byte padding at the end to avoid OOB errors. The type map
+           is always at least two bytes, so there's enough space for that. */
+        let typeData = view.getUint8(4);
+        let mapOffset = view.getUint32(12, true);
+        let typeMapOffset = view.getUint32(16, true);
+        let fileOffsetBytes = view.getUint8(mapOffset);
+        if(fileOffsetBytes < 2 || fileOffsetBytes > 4) {
+            console.error("Invalid search data result map offset size");
             return false;
         }
-        if((typeSizes & 0x08) >> 3 == 0) {
-            this.nameSizeBytes = 1;
-            this.nameSizeMask = 0x00ff;
-        } else /* (typeSizes & 0x08) >> 3 == 1 */ {
-            this.nameSizeBytes = 2;
-            this.nameSizeMask = 0xffff;
-        }
+        let data = {
+            trie: new DataView(buffer, 20, mapOffset - 20),
+            map: new DataView(buffer, mapOffset, typeMapOffset - mapOffset + (4 - fileOffsetBytes)),
+            /* No variable-size types in the type map at the moment */
+            typeMap: new DataView(buffer, typeMapOffset),
+            fileOffsetBytes: fileOffsetBytes,
+            fileOffsetMask: fileOffsetBytes == 4 ? 0xffffffff : (1 << fileOffsetBytes*8) - 1
+        };
+
+        /* Offset of the first result map item is after the offset size, N + 1
+           offsets and N flags, calculate flag offset from that */
+        data.mapFlagsOffset = 1 + fileOffsetBytes*(((data.map.getUint32(1, true) & data.fileOffsetMask) - 1 - fileOffsetBytes)/(fileOffsetBytes + 1) + 1);
+
+        /* A shard of sharded search data. The key is stored as a chain of
+           nodes from the root, each having no results and just one child, so
+           the single-byte counts are followed by the child character and its
+           offset difference. */
+        if(typeData & 0x01) {
+            let key = '';
+            let offset = data.trie.getUint32(0, true);
+            for(let i = 0, keyLength = view.getUint8(5); i != keyLength; ++i) {
+                key += String.fromCharCode(data.trie.getUint8(offset + 2));
+                offset -= Math.floor(this.varint(data.trie, offset + 3)/2);
+            }
 
-        /* Separate the data into the trie and the result / type map. Because
-           we're reading larger values than there might be and then masking out
-           the high bytes, keep extra 1/2 byte padding at the end to avoid
-           OOB errors. */
-        let mapOffset = view.getUint32(12, true);
-        let typeMapOffset = view.getUint32(16, true);
-        /* There may be a 3-byte file offset at the end of the trie which we'll
-           read as 32-bit, add one safety byte in that case */
-        this.trie = new DataView(buffer, 20, mapOffset - 20 + (4 - this.fileOffsetBytes));
-        /* There may be a 3-byte file size (for zero results) which we'll read
-           as 32-bit, add one safety byte in that case */
-        this.map = new DataView(buffer, mapOffset, typeMapOffset - mapOffset + (4 - this.fileOffsetBytes));
-        /* No variable-size types in the type map at the moment */
-        this.typeMap = new DataView(buffer, typeMapOffset);
-
-        /* Offset of the first result map item is after N + 1 offsets and N
-           flags, calculate flag offset from that */
-        this.mapFlagsOffset = this.fileOffsetBytes*(((this.map.getUint32(0, true) & this.fileOffsetMask) - this.fileOffsetBytes)/(this.fileOffsetBytes + 1) + 1);
+            /* Not the index, save it and search again for whatever was
+               waiting for it to arrive */
+            if(key.length) {
+                if(!this.shards) {
+                    console.error("Search data shard loaded without an index");
+                    return false;
+                }
+
+                this.shards[key] = data;
+
+                /* istanbul ignore if */
+                if(typeof document !== 'undefined')
+                    Search.searchAndRender(document.getElementById('search-input').value);
+
+                return true;
+            }
+
+            this.shards = {'': data};
+            this.indexSource = this.source;
+        } else this.shards = null;
+
+        this.trie = data.trie;
+        this.map = data.map;
+        this.typeMap = data.typeMap;
+        this.mapFlagsOffset = data.mapFlagsOffset;
+        this.fileOffsetBytes = data.fileOffsetBytes;
+        this.fileOffsetMask = data.fileOffsetMask;
+        this.shardKey = '';
 
         /* Set initial properties */
         this.dataSize = buffer.byteLength;
@@ -184,11 +209,70 @@ var Search = {
         req.onreadystatechange = function() {
             if(req.readyState != 4) return;
 
+            Search.source = [url, true];
             Search.init(req.response);
         }
         req.send();
     },
 
+    /* Fetches a shard of sharded search data, either as a binary or as a
+       script calling load(), depending on how the index was fetched. The
+       file name has the key appended in hexadecimal. */
+    downloadShard: /* istanbul ignore next */ function(key) {
+        this.shards[key] = null;
+
+        let url = this.indexSource[0];
+        let extension = url.lastIndexOf('.');
+        let hex = '';
+        for(let i = 0; i != key.length; ++i)
+            hex += (key.charCodeAt(i) < 16 ? '0' : '') + key.charCodeAt(i).toString(16);
+        url = url.substr(0, extension) + '-' + hex + url.substr(extension);
+        if(this.indexSource[1]) {
+            this.download(url);
+        } else {
+            let script = document.createElement('script');
+            script.src = url;
+            script.async = true;
+            document.body.appendChild(script);
+        }
+    },
+
+    /* Switches to a downloaded shard of sharded search data and puts its key
+       into the search stack, as if it was just searched for */
+    useShard: function(key) {
+        let shard = this.shards[key];
+        this.trie = shard.trie;
+        this.map = shard.map;
+        this.typeMap = shard.typeMap;
+        this.mapFlagsOffset = shard.mapFlagsOffset;
+        this.fileOffsetBytes = shard.fileOffsetBytes;
+        this.fileOffsetMask = shard.fileOffsetMask;
+        this.shardKey = key;
+        this.searchString = key;
+        this.searchStack = [this.trie.getUint32(0, true)];
+        for(let i = 0; i != key.length; ++i)
+            this.searchStack.push(this.searchStack[i] - Math.floor(this.varint(this.trie, this.searchStack[i] + 3)/2));
+    },
+
+    /* Reads a LEB128 VARINT, saving its size into varintSize. Not using
+       bitwise operations for the value as those work only with signed 32-bit
+       numbers. */
+    varint: function(view, offset) {
+        let value = 0;
+        let multiplier = 1;
+        let size = 0;
+        let byte;
+        do {
+            byte = view.getUint8(offset + size);
+            value += (byte & 0x7f)*multiplier;
+            multiplier *= 128;
+            ++size;
+        } while(byte & 0x80);
+
+        this.varintSize = size;
+        return value;
+    },
+
     base85decode: function(base85string) {
         function charValue(char) {
             if(char >=  48 && char <  58) /* 0-9 -> 0-9 */
@@ -245,6 +329,9 @@ var Search = {
     },
 
     load: function(base85string) {
+        /* istanbul ignore if */
+        if(typeof document !== 'undefined' && document.currentScript)
+            this.source = [document.currentScript.src, false];
         return this.init(this.base85decode(base85string));
     },
 
@@ -297,6 +384,12 @@ var Search = {
 
         /* TODO: maybe i could make use of InputEvent.data and others here */
 
+        /* With sharded search data, the current shard contains only strings
+           starting with its key. If the new string doesn't, go back to the
+           index. */
+        if(this.shards && searchString.substr(0, this.shardKey.length) != this.shardKey)
+            this.useShard('');
+
         /* Find longest common prefix of previous and current value so we don't
            need to needlessly search again */
         let max = Math.min(searchString.length, this.searchString.length);
@@ -315,26 +408,48 @@ var Search = {
             /* Calculate offset and count of children */
             let offset = this.searchStack[this.searchStack.length - 1];
 
-            /* If there's a lot of results, the result count is a 16bit BE value
-               instead */
-            let resultCount = this.trie.getUint8(offset);
-            let resultCountSize = 1;
-            if(resultCount & 0x80) {
-                resultCount = this.trie.getUint16(offset, false) & ~0x8000;
-                ++resultCountSize;
-            }
-
-            let childCount = this.trie.getUint8(offset + resultCountSize);
-
-            /* Go through all children and find the next offset */
-            let childOffset = offset + resultCountSize + 1 + resultCount*this.resultIdBytes;
+            /* Results are after the children, so we don't need to care
+               about them here, just skip the count */
+            this.varint(this.trie, offset);
+            let childOffset = offset + this.varintSize;
+            let childCount = this.varint(this.trie, childOffset);
+            childOffset += this.varintSize;
+
+            /* Go through all children and find the next offset. The offset
+               differences are variable-length, so all preceding ones have to
+               be read as well. */
+            let childDataOffset = childOffset + childCount;
             let found = false;
             for(let j = 0; j != childCount; ++j) {
+                let differenceBarrier = this.varint(this.trie, childDataOffset);
+                childDataOffset += this.varintSize;
                 if(String.fromCharCode(this.trie.getUint8(childOffset + j)) != searchString[foundPrefix])
                     continue;
 
-                this.searchStack.push(this.trie.getUint32(childOffset + childCount + j*this.fileOffsetBytes, true) & this.fileOffsetMask & ~this.lookaheadBarrierMask);
+                /* A zero difference means the child is in another shard */
+                let difference = Math.floor(differenceBarrier/2);
+                let next = difference ? offset - difference : 0;
                 found = true;
+
+                /* The rest is in another shard. Switch to it if it's
+                   downloaded already, otherwise fetch it and return nothing
+                   until it arrives, init() then searches again. */
+                if(!next) {
+                    let key = searchString.substr(0, foundPrefix + 1);
+                    if(!this.shards[key]) {
+                        /* istanbul ignore if */
+                        if(this.shards[key] === undefined && typeof document !== 'undefined')
+                            this.downloadShard(key);
+
+                        this.searchString = searchString.substr(0, foundPrefix);
+                        return [[], ''];
+                    }
+
+                    this.useShard(key);
+                    break;
+                }
+
+                this.searchStack.push(next);
                 break;
             }
 
@@ -377,21 +492,26 @@ var Search = {
             let offset = current[0];
             let suffixLength = current[1];
 
-            /* Calculate child count. If there's a lot of results, the count
-               "leaks over" to the child count storage. */
+            /* Calculate result and child count */
             /* TODO: hmmm. this is helluvalot duplicated code. hmm. */
-            let resultCount = this.trie.getUint8(offset);
-            let resultCountSize = 1;
-            if(resultCount & 0x80) {
-                resultCount = this.trie.getUint16(offset, false) & ~0x8000;
-                ++resultCountSize;
+            let resultCount = this.varint(this.trie, offset);
+            let childOffset = offset + this.varintSize;
+            let childCount = this.varint(this.trie, childOffset);
+            childOffset += this.varintSize;
+
+            /* Results are after the variable-length child offset differences,
+               go through those first to get to them */
+            let childDataOffset = childOffset + childCount;
+            let resultOffset = childDataOffset;
+            for(let j = 0; j != childCount; ++j) {
+                this.varint(this.trie, resultOffset);
+                resultOffset += this.varintSize;
             }
 
-            let childCount = this.trie.getUint8(offset + resultCountSize);
-
             /* Populate the results with all values associated with this node */
             for(let i = 0; i != resultCount; ++i) {
-                let index = this.trie.getUint32(offset + resultCountSize + 1 + i*this.resultIdBytes, true) & this.resultIdMask;
+                let index = this.varint(this.trie, resultOffset);
+                resultOffset += this.varintSize;
                 results.push(this.gatherResult(index, suffixLength, 0xffffff)); /* should be enough haha */
 
                 /* 'nuff said. */
@@ -400,21 +520,19 @@ var Search = {
             }
 
             /* Dig deeper */
-            let childOffset = offset + resultCountSize + 1 + resultCount*this.resultIdBytes;
             for(let j = 0; j != childCount; ++j) {
-                let offsetBarrier = this.trie.getUint32(childOffset + childCount + j*this.fileOffsetBytes, true) & this.fileOffsetMask;
+                let differenceBarrier = this.varint(this.trie, childDataOffset);
+                childDataOffset += this.varintSize;
 
                 /* Lookahead barrier, don't dig deeper */
-                if(offsetBarrier & this.lookaheadBarrierMask) continue;
+                if(differenceBarrier & 1) continue;
 
                 /* Append to the queue */
-                leaves.push([offsetBarrier & ~this.lookaheadBarrierMask, suffixLength + 1]);
+                leaves.push([offset - Math.floor(differenceBarrier/2), suffixLength + 1]);
 
                 /* We don't have anything yet and this is the only path
                    forward, add the char to suggested Tab autocompletion. Can't
-                   extract it from the leftmost 8 bits of offsetBarrier because
-                   that would make it negative, have to load as Uint8 instead.
-                   Also can't use String.fromCharCode(), because later doing
+                   use String.fromCharCode(), because later doing
                    str.charCodeAt() would give me back UTF-16 values, which is
                    absolutely unwanted when all I want is check for truncated
                    UTF-8. */
@@ -428,37 +546,37 @@ var Search = {
 
     gatherResult: function(index, suffixLength, maxUrlPrefix) {
         let flags = this.map.getUint8(this.mapFlagsOffset + index);
-        let resultOffset = this.map.getUint32(index*this.fileOffsetBytes, true) & this.fileOffsetMask;
+        let resultOffset = this.map.getUint32(1 + index*this.fileOffsetBytes, true) & this.fileOffsetMask;
 
         /* The result is an alias, parse the aliased prefix */
         let aliasedIndex = null;
         if((flags & 0xf0) == 0x00) {
-            aliasedIndex = this.map.getUint32(resultOffset, true) & this.resultIdMask;
-            resultOffset += this.resultIdBytes;
+            aliasedIndex = this.varint(this.map, resultOffset);
+            resultOffset += this.varintSize;
         }
 
         /* The result has a prefix, parse that first, recursively */
         let name = '';
         let url = '';
         if(flags & (1 << 3)) {
-            let prefixIndex = this.map.getUint32(resultOffset, true) & this.resultIdMask;
-            let prefixUrlPrefixLength = Math.min(this.map.getUint16(resultOffset + this.resultIdBytes, true) & this.nameSizeMask, maxUrlPrefix);
+            let prefixIndex = this.varint(this.map, resultOffset);
+            resultOffset += this.varintSize;
+            let prefixUrlPrefixLength = Math.min(this.varint(this.map, resultOffset), maxUrlPrefix);
+            resultOffset += this.varintSize;
 
             let prefix = this.gatherResult(prefixIndex, 0 /*ignored*/, prefixUrlPrefixLength);
             name = prefix.name;
             url = prefix.url;
-
-            resultOffset += this.resultIdBytes + this.nameSizeBytes;
         }
 
         /* The result has a suffix, extract its length */
         let resultSuffixLength = 0;
         if(flags & (1 << 0)) {
-            resultSuffixLength = this.map.getUint16(resultOffset, true) & this.nameSizeMask;
-            resultOffset += this.nameSizeBytes;
+            resultSuffixLength = this.varint(this.map, resultOffset);
+            resultOffset += this.varintSize;
         }
 
-        let nextResultOffset = this.map.getUint32((index + 1)*this.fileOffsetBytes, true) & this.fileOffsetMask;
+        let nextResultOffset = this.map.getUint32(1 + (index + 1)*this.fileOffsetBytes, true) & this.fileOffsetMask;
 
         /* Extract name */
         let j = resultOffset;
@@ -33,28 +33,29 @@ sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__))))
 sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
 
 from _search_test_metadata import EntryType, search_type_map, type_sizes
-from _search import Trie, ResultMap, ResultFlag, serialize_search_data, Serializer
+from _search import Trie, ResultMap, ResultFlag, serialize_search_data, serialize_search_data_sharded, search_shard_filename, Serializer
 
 basedir = pathlib.Path(os.path.dirname(os.path.realpath(__file__)))/'js-test-data'
 
-def type_size_suffix(*, name_size_bytes, result_id_bytes, file_offset_bytes):
-    return f'ns{name_size_bytes}-ri{result_id_bytes}-fo{file_offset_bytes}'
+def type_size_suffix(*, file_offset_bytes):
+    return f'fo{file_offset_bytes}'
 
 # Basic error handling
 
-min_size = len(serialize_search_data(Serializer(name_size_bytes=1, result_id_bytes=2, file_offset_bytes=3), Trie(), ResultMap(), [], 0))
+min_size = len(serialize_search_data(Serializer(), Trie(), ResultMap(), [], 0))
 
 with open(basedir/'short.bin', 'wb') as f:
     f.write(b'#'*(min_size - 1))
 with open(basedir/'wrong-magic.bin', 'wb') as f:
-    f.write(b'MOS\2')
+    f.write(b'MOS\3')
     f.write(b'\0'*(min_size - 4))
 with open(basedir/'wrong-version.bin', 'wb') as f:
-    f.write(b'MCS\1')
+    f.write(b'MCS\2')
     f.write(b'\0'*(min_size - 4))
-with open(basedir/'wrong-result-id-bytes.bin', 'wb') as f:
-    f.write(Serializer.header_struct.pack(b'MCS', 2, 3 << 1, 0, 0, 0))
-    f.write(b'\0'*(min_size - Serializer.header_struct.size))
+with open(basedir/'wrong-file-offset-bytes.bin', 'wb') as f:
+    empty = bytearray(serialize_search_data(Serializer(), Trie(), ResultMap(), [], 0))
+    empty[Serializer.header_struct.unpack_from(empty)[5]] = 5
+    f.write(empty)
 
 # Empty file, in all possible type size combinations
 
@@ -93,6 +94,13 @@ trie.insert("subpage", index)
 trie.insert("rectangle", map.add("Rectangle", "", alias=range_index))
 trie.insert("rect", map.add("Rectangle::Rect()", "", suffix_length=2, alias=range_index))
 
+# Sharded variant, again doesn't need all type size variants. Has to be done
+# before the map gets serialized, as that merges the prefixes in place. The
+# threshold is small enough to put the math:: subtree into a separate shard.
+for key, shard in serialize_search_data_sharded(Serializer(), trie, map, search_type_map, 7, min_shard_weight=32):
+    with open(basedir/search_shard_filename('sharded.bin', key), 'wb') as f:
+        f.write(shard)
+
 for i in type_sizes:
     with open(basedir/'searchdata-{}.bin'.format(type_size_suffix(**i)), 'wb') as f:
         f.write(serialize_search_data(Serializer(**i), trie, map, search_type_map, 7))
@@ -111,7 +119,7 @@ trie.insert("hýždě", map.add("Hýždě", "#a", flags=ResultFlag.from_type(Res
 trie.insert("hárá", map.add("Hárá", "#b", flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.PAGE)))
 
 with open(basedir/'unicode.bin', 'wb') as f:
-    f.write(serialize_search_data(Serializer(**type_sizes[0]), trie, map, search_type_map, 2))
+    f.write(serialize_search_data(Serializer(), trie, map, search_type_map, 2))
 
 # Heavy prefix nesting, nothing size-dependent here so just one variant
 
@@ -124,7 +132,7 @@ trie.insert("geometry", map.add("Magnum::Math::Geometry", "namespaceMagnum_1_1Ma
 trie.insert("range", map.add("Magnum::Math::Range", "classMagnum_1_1Math_1_1Range.html", flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.CLASS)))
 
 with open(basedir/'nested.bin', 'wb') as f:
-    f.write(serialize_search_data(Serializer(**type_sizes[0]), trie, map, search_type_map, 4))
+    f.write(serialize_search_data(Serializer(), trie, map, search_type_map, 4))
 
 # Extreme amount of search results (Python's __init__, usually), in all
 # possible type size combinations
@@ -78,26 +78,16 @@ const { StringDecoder } = require('string_decoder');
 }
 
 let type_size_suffixes = [
-    'ns1-ri2-fo3',
-    'ns1-ri2-fo4',
-    'ns1-ri3-fo3',
-    'ns1-ri3-fo4',
-    'ns1-ri4-fo3',
-    'ns1-ri4-fo4',
-
-    'ns2-ri2-fo3',
-    'ns2-ri2-fo4',
-    'ns2-ri3-fo3',
-    'ns2-ri3-fo4',
-    'ns2-ri4-fo3',
-    'ns2-ri4-fo4',
+    'fo2',
+    'fo3',
+    'fo4',
 ]
 
 /* Verify that base85-decoded file is equivalent to the binary. Nothing
    type-size-dependent in the decoder, so test just on the first variant. */
 {
     let binary = fs.readFileSync(path.join(__dirname, "js-test-data/searchdata-" + type_size_suffixes[0] + ".bin"));
-    assert.equal(binary.byteLength, 750);
+    assert.equal(binary.byteLength, 589);
     let b85 = fs.readFileSync(path.join(__dirname, "js-test-data/searchdata-" + type_size_suffixes[0] + ".b85"), {encoding: 'utf-8'});
     assert.deepEqual(new DataView(binary.buffer.slice(binary.byteOffset, binary.byteOffset + binary.byteLength)), new DataView(Search.base85decode(b85), 0, binary.byteLength));
 }
@@ -120,9 +110,9 @@ let type_size_suffixes = [
     assert.ok(!Search.init(buffer.buffer.slice(buffer.byteOffset, buffer.byteOffset + buffer.byteLength)));
 }
 
-/* Opening file with wrong result id byte count */
+/* Opening file with wrong result map offset byte count */
 {
-    let buffer = fs.readFileSync(path.join(__dirname, "js-test-data/wrong-result-id-bytes.bin"));
+    let buffer = fs.readFileSync(path.join(__dirname, "js-test-data/wrong-file-offset-bytes.bin"));
     assert.ok(!Search.init(buffer.buffer.slice(buffer.byteOffset, buffer.byteOffset + buffer.byteLength)));
 }
 
@@ -136,9 +126,9 @@ for(let i = 0; i != type_size_suffixes.length; ++i) {
     if(i == 0)
         assert.equal(Search.dataSize, 31);
     else if(i == type_size_suffixes.length - 1)
-        assert.equal(Search.dataSize, 32);
+        assert.equal(Search.dataSize, 33);
     else {
-        assert.ok(Search.dataSize >= 31 && Search.dataSize <= 32);
+        assert.ok(Search.dataSize >= 31 && Search.dataSize <= 33);
     }
 
     assert.equal(Search.symbolCount, "0 symbols (0 kB)");
@@ -153,13 +143,13 @@ for(let i = 0; i != type_size_suffixes.length; ++i) {
     /* Test just the smallest and largest size, everything else should be in
        between */
     if(i == 0) {
-        assert.equal(Search.dataSize, 750);
-        assert.equal(Search.symbolCount, "7 symbols (0.7 kB)");
+        assert.equal(Search.dataSize, 589);
+        assert.equal(Search.symbolCount, "7 symbols (0.6 kB)");
     } else if(i == type_size_suffixes.length - 1) {
-        assert.equal(Search.dataSize, 883);
-        assert.equal(Search.symbolCount, "7 symbols (0.9 kB)");
+        assert.equal(Search.dataSize, 611);
+        assert.equal(Search.symbolCount, "7 symbols (0.6 kB)");
     } else {
-        assert.ok(Search.dataSize > 750 && Search.dataSize < 883);
+        assert.ok(Search.dataSize > 589 && Search.dataSize < 611);
     }
 
     assert.equal(Search.maxResults, 100);
@@ -267,8 +257,8 @@ for(let i = 0; i != type_size_suffixes.length; ++i) {
 {
     let buffer = fs.readFileSync(path.join(__dirname, "js-test-data/searchdata-" + type_size_suffixes[0] + ".bin"));
     assert.ok(Search.init(buffer.buffer.slice(buffer.byteOffset, buffer.byteOffset + buffer.byteLength)));
-    assert.equal(Search.dataSize, 750);
-    assert.equal(Search.symbolCount, "7 symbols (0.7 kB)");
+    assert.equal(Search.dataSize, 589);
+    assert.equal(Search.symbolCount, "7 symbols (0.6 kB)");
     assert.equal(Search.maxResults, 100);
 
     /* No spaces */
@@ -320,8 +310,8 @@ for(let i = 0; i != type_size_suffixes.length; ++i) {
 {
     let buffer = fs.readFileSync(path.join(__dirname, "js-test-data/searchdata-" + type_size_suffixes[0] + ".bin"));
     assert.ok(Search.init(buffer.buffer.slice(buffer.byteOffset, buffer.byteOffset + buffer.byteLength), 3));
-    assert.equal(Search.dataSize, 750);
-    assert.equal(Search.symbolCount, "7 symbols (0.7 kB)");
+    assert.equal(Search.dataSize, 589);
+    assert.equal(Search.symbolCount, "7 symbols (0.6 kB)");
     assert.equal(Search.maxResults, 3);
     assert.deepEqual(Search.search('m'), [[
         { name: 'Math',
@@ -349,8 +339,8 @@ for(let i = 0; i != type_size_suffixes.length; ++i) {
 {
     let b85 = fs.readFileSync(path.join(__dirname, "js-test-data/searchdata-" + type_size_suffixes[0] + ".b85"), {encoding: 'utf-8'});
     assert.ok(Search.load(b85));
-    assert.equal(Search.dataSize, 752); /* some padding on the end, that's okay */
-    assert.equal(Search.symbolCount, "7 symbols (0.7 kB)");
+    assert.equal(Search.dataSize, 592); /* some padding on the end, that's okay */
+    assert.equal(Search.symbolCount, "7 symbols (0.6 kB)");
     assert.equal(Search.maxResults, 100);
     assert.deepEqual(Search.search('min'), [[
         { name: 'Math::min(int, int)',
@@ -373,12 +363,125 @@ for(let i = 0; i != type_size_suffixes.length; ++i) {
           suffixLength: 8 }], '()']);
 }
 
+/* Sharded search data. Nothing type-size-dependent here, so test just on the
+   first variant. The results should be the same as with the whole data. */
+{
+    function init(key) {
+        let buffer = fs.readFileSync(path.join(__dirname, "js-test-data/sharded" + (key ? "-" + key : "") + ".bin"));
+        return Search.init(buffer.buffer.slice(buffer.byteOffset, buffer.byteOffset + buffer.byteLength));
+    }
+
+    /* A shard can't be opened without an index */
+    assert.ok(init(null));
+    Search.shards = null;
+    assert.ok(!init("6d"));
+
+    assert.ok(init(null));
+    assert.equal(Search.dataSize, 71);
+    assert.equal(Search.symbolCount, "7 symbols (0.1 kB)");
+    assert.equal(Search.maxResults, 100);
+    assert.deepEqual(Object.keys(Search.shards), ['']);
+
+    /* Shards that aren't loaded yet give back no results, the found prefix
+       stays the part before the shard. Characters that have no shard are
+       not found at all. */
+    assert.deepEqual(Search.search('min'), [[], '']);
+    assert.equal(Search.searchString, '');
+    assert.deepEqual(Search.search('xyz'), [[], '']);
+    assert.equal(Search.searchString, '');
+
+    for(let key of ['6d', '70', '72', '73', '76'])
+        assert.ok(init(key));
+    assert.deepEqual(Object.keys(Search.shards), ['', 'm', 'p', 'r', 's', 'v']);
+
+    /* The index is untouched by loading the shards */
+    assert.equal(Search.symbolCount, "7 symbols (0.1 kB)");
+
+    let min = [[
+        { name: 'Math::min(int, int)',
+          url: 'namespaceMath.html#min',
+          flags: 9, /* has prefix + suffix */
+          cssClass: 'm-info',
+          typeName: 'func',
+          suffixLength: 10 },
+        { name: 'Math::Vector::min() const',
+          url: 'classMath_1_1Vector.html#min',
+          flags: 9, /* has prefix + suffix */
+          cssClass: 'm-info',
+          typeName: 'func',
+          suffixLength: 8 },
+        { name: 'Math::Range::min() const',
+          url: 'classMath_1_1Range.html#min',
+          flags: 13, /* has prefix + suffix, deleted */
+          cssClass: 'm-info',
+          typeName: 'func',
+          suffixLength: 8 }], '()'];
+    assert.deepEqual(Search.search('min'), min);
+    assert.equal(Search.searchString, 'min');
+    assert.equal(Search.shardKey, 'm');
+
+    /* Switching to another shard */
+    assert.deepEqual(Search.search('vec'), [[
+        { name: 'Math::Vector',
+          url: 'classMath_1_1Vector.html',
+          flags: 2, /* deprecated, no prefix as Math isn't in this shard */
+          cssClass: 'm-primary',
+          typeName: 'class',
+          suffixLength: 3 }], 'tor']);
+    assert.equal(Search.searchString, 'vec');
+    assert.equal(Search.shardKey, 'v');
+
+    /* Aliases resolved inside the shard */
+    assert.deepEqual(Search.search('rect'), [[
+        { alias: 'Math::Range',
+          name: 'Rectangle::Rect()',
+          url: 'classMath_1_1Range.html',
+          flags: 0,
+          cssClass: 'm-primary',
+          typeName: 'class',
+          suffixLength: 2 },
+        { alias: 'Math::Range',
+          name: 'Rectangle',
+          url: 'classMath_1_1Range.html',
+          flags: 0,
+          cssClass: 'm-primary',
+          typeName: 'class',
+          suffixLength: 5 }], '']);
+
+    /* The math:: subtree is behind a lookahead barrier in a shard of its
+       own, so it's not needed for searching just math */
+    assert.deepEqual(Search.search('math'), [[
+        { name: 'Math',
+          url: 'namespaceMath.html',
+          flags: 0,
+          cssClass: 'm-primary',
+          typeName: 'namespace',
+          suffixLength: 0 }], '']);
+    assert.deepEqual(Search.search('math::vec'), [[], '']);
+    assert.equal(Search.searchString, 'math');
+    assert.ok(init('6d6174683a'));
+    assert.deepEqual(Search.search('math::vec'), [[
+        { name: 'Math::Vector',
+          url: 'classMath_1_1Vector.html',
+          flags: 2, /* deprecated */
+          cssClass: 'm-primary',
+          typeName: 'class',
+          suffixLength: 3 }], 'tor']);
+    assert.equal(Search.searchString, 'math::vec');
+    assert.equal(Search.shardKey, 'math:');
+
+    /* Going back to a shorter string goes through the index again */
+    assert.equal(Search.search('math')[0].length, 1);
+    assert.equal(Search.shardKey, 'm');
+    assert.deepEqual(Search.search('min'), min);
+}
+
 /* Search, Unicode. Nothing type-size-dependent here. */
 {
     let buffer = fs.readFileSync(path.join(__dirname, "js-test-data/unicode.bin"));
     assert.ok(Search.init(buffer.buffer.slice(buffer.byteOffset, buffer.byteOffset + buffer.byteLength)));
-    assert.equal(Search.dataSize, 165);
-    assert.equal(Search.symbolCount, "2 symbols (0.2 kB)");
+    assert.equal(Search.dataSize, 137);
+    assert.equal(Search.symbolCount, "2 symbols (0.1 kB)");
     /* Both "Hýždě" and "Hárá" have common autocompletion to "h\xA1", which is
        not valid UTF-8, so it has to get truncated */
     assert.deepEqual(Search.search('h'), [[
@@ -415,7 +518,7 @@ for(let i = 0; i != type_size_suffixes.length; ++i) {
 {
     let buffer = fs.readFileSync(path.join(__dirname, "js-test-data/nested.bin"));
     assert.ok(Search.init(buffer.buffer.slice(buffer.byteOffset, buffer.byteOffset + buffer.byteLength)));
-    assert.equal(Search.dataSize, 336);
+    assert.equal(Search.dataSize, 283);
     assert.equal(Search.symbolCount, "4 symbols (0.3 kB)");
     assert.deepEqual(Search.search('geo'), [[
         { name: 'Magnum::Math::Geometry',
@@ -443,13 +546,13 @@ for(let i = 0; i != type_size_suffixes.length; ++i) {
     /* Test just the smallest and largest size, everything else should be in
        between */
     if(i == 0) {
-        assert.equal(Search.dataSize, 6421);
-        assert.equal(Search.symbolCount, "131 symbols (6.3 kB)");
+        assert.equal(Search.dataSize, 6127);
+        assert.equal(Search.symbolCount, "131 symbols (6 kB)");
     } else if(i == type_size_suffixes.length - 1) {
-        assert.equal(Search.dataSize, 6964);
-        assert.equal(Search.symbolCount, "131 symbols (6.8 kB)");
+        assert.equal(Search.dataSize, 6391);
+        assert.equal(Search.symbolCount, "131 symbols (6.2 kB)");
     } else {
-        assert.ok(Search.dataSize > 6421 && Search.dataSize < 6964);
+        assert.ok(Search.dataSize > 6127 && Search.dataSize < 6391);
     }
 
     assert.equal(Search.maxResults, 10000);
@@ -0,0 +1,67 @@
+#
+#   This file is part of m.css.
+#
+#   Copyright © 2017, 2018, 2019, 2020, 2021, 2022, 2023
+#             Vladimír Vondruš <mosra@centrum.cz>
+#
+#   Permission is hereby granted, free of charge, to any person obtaining a
+#   copy of this software and associated documentation files (the "Software"),
+#   to deal in the Software without restriction, including without limitation
+#   the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#   and/or sell copies of the Software, and to permit persons to whom the
+#   Software is furnished to do so, subject to the following conditions:
+#
+#   The above copyright notice and this permission notice shall be included
+#   in all copies or substantial portions of the Software.
+#
+#   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#   IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#   FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#   THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#   LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#   DEALINGS IN THE SOFTWARE.
+#
+
+
+import pickle
+import unittest
+
+from _incremental import fingerprint
+from _search import ResultFlag, SearchResult
+
+class Slots:
+    __slots__ = ['a', 'b']
+
+class DerivedSlots(Slots):
+    __slots__ = 'c'
+
+class Fingerprint(unittest.TestCase):
+    def test_slots(self):
+        a = DerivedSlots()
+        a.a = 1
+        a.c = [2]
+        b = DerivedSlots()
+        b.a = 1
+        b.c = [2]
+
+        # Same contents fingerprint the same, unset slots are skipped
+        self.assertEqual(fingerprint(a), fingerprint(b))
+        b.b = None
+        self.assertNotEqual(fingerprint(a), fingerprint(b))
+        del b.b
+        b.c += [3]
+        self.assertNotEqual(fingerprint(a), fingerprint(b))
+
+    def test_search_result(self):
+        result = SearchResult()
+        result.flags = ResultFlag.DEPRECATED
+        result.url = 'a.html#foo'
+        result.prefix = ['a']
+        result.name = 'foo'
+
+        # Search results get saved into incremental build manifests
+        copy = pickle.loads(pickle.dumps(result))
+        self.assertEqual(fingerprint(copy), fingerprint(result))
+        copy.suffix = ' const'
+        self.assertNotEqual(fingerprint(copy), fingerprint(result))
@@ -0,0 +1,263 @@
+#
+#   This file is part of m.css.
+#
+#   Copyright © 2017, 2018, 2019, 2020, 2021, 2022, 2023
+#             Vladimír Vondruš <mosra@centrum.cz>
+#
+#   Permission is hereby granted, free of charge, to any person obtaining a
+#   copy of this software and associated documentation files (the "Software"),
+#   to deal in the Software without restriction, including without limitation
+#   the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#   and/or sell copies of the Software, and to permit persons to whom the
+#   Software is furnished to do so, subject to the following conditions:
+#
+#   The above copyright notice and this permission notice shall be included
+#   in all copies or substantial portions of the Software.
+#
+#   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#   IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#   FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#   THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#   LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#   DEALINGS IN THE SOFTWARE.
+#
+
+
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from jinja2 import DictLoader, Environment
+
+import _output
+from _output import OutputWriter
+
+class Output(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def read(self, filename):
+        with open(os.path.join(self.path, filename), 'rb') as f:
+            return f.read()
+
+    def test(self):
+        output = OutputWriter(self.path)
+        self.assertTrue(output.write('a.html', b'hello'))
+        self.assertTrue(output.write_rendered('sub/b.html', 'world'))
+        self.assertEqual(self.read('a.html'), b'hello')
+        self.assertEqual(self.read('sub/b.html'), b'world\n')
+        self.assertEqual((output.written, output.unchanged, output.removed), (2, 0, 0))
+
+        # Writing the same contents again doesn't touch the files, even
+        # without the hashes from the previous run
+        mtime = os.stat(os.path.join(self.path, 'a.html')).st_mtime_ns
+        output = OutputWriter(self.path)
+        self.assertFalse(output.write('a.html', b'hello'))
+        self.assertTrue(output.write('sub/b.html', b'changed'))
+        self.assertEqual(os.stat(os.path.join(self.path, 'a.html')).st_mtime_ns, mtime)
+        self.assertEqual(self.read('sub/b.html'), b'changed')
+        self.assertEqual((output.written, output.unchanged, output.removed), (1, 1, 0))
+
+        # Nothing is removed without the previous state
+        output.remove_orphans()
+        self.assertTrue(os.path.exists(os.path.join(self.path, 'a.html')))
+
+    def test_previous(self):
+        output = OutputWriter(self.path, {})
+        output.write('a.html', b'hello')
+        output.write('b.html', b'world')
+        output.write('c.html', b'!')
+        output.remove_orphans()
+
+        # A file modified outside gets written again even though the recorded
+        # hash matches
+        with open(os.path.join(self.path, 'b.html'), 'wb') as f:
+            f.write(b'wOrLd')
+
+        # A file that's neither written nor kept gets removed
+        output = OutputWriter(self.path, output.files)
+        self.assertFalse(output.write('a.html', b'hello'))
+        self.assertTrue(output.write('b.html', b'world'))
+        output.keep('c.html')
+        output.keep('nonexistent.html')
+        output.remove_orphans()
+        self.assertEqual(self.read('b.html'), b'world')
+        self.assertEqual((output.written, output.unchanged, output.removed), (1, 1, 0))
+        self.assertEqual(output.files.keys(), {'a.html', 'b.html', 'c.html'})
+
+        output = OutputWriter(self.path, output.files)
+        output.write('a.html', b'hello')
+        output.remove_orphans()
+        self.assertEqual((output.written, output.unchanged, output.removed), (0, 1, 2))
+        self.assertFalse(os.path.exists(os.path.join(self.path, 'b.html')))
+        self.assertFalse(os.path.exists(os.path.join(self.path, 'c.html')))
+
+    def test_recording(self):
+        output = OutputWriter(self.path)
+        output.start_recording()
+        output.write('a.html', b'hello')
+        recorded = output.stop_recording()
+        output.write('b.html', b'world')
+        self.assertEqual(recorded.keys(), {'a.html'})
+
+        merged = OutputWriter(self.path)
+        merged.merge(recorded)
+        self.assertEqual(merged.files, {'a.html': output.files['a.html']})
+        self.assertEqual((merged.written, merged.unchanged), (1, 0))
+
+    def test_template(self):
+        templates = {
+            'page.html': '{% for i in range(count) %}{{ i }} žluťoučký kůň\n{% endfor %}{% include "footer.html" %}',
+            'footer.html': '{{ footer }}\n'
+        }
+
+        for is_async in [False, True]:
+            with self.subTest(is_async=is_async):
+                env = Environment(loader=DictLoader(templates), enable_async=is_async)
+                template = env.get_template('page.html')
+                # Large enough to be streamed in more than one chunk
+                rendered = template.render(count=10000, footer='end')
+
+                output = OutputWriter(os.path.join(self.path, str(is_async)))
+                self.assertTrue(output.write_rendered('a.html', rendered))
+                self.assertTrue(output.write_template('b.html', template, {'count': 10000, 'footer': 'end'}))
+                self.assertEqual(self.read(f'{is_async}/b.html'), self.read(f'{is_async}/a.html'))
+                self.assertEqual(output.files['b.html'][2], output.files['a.html'][2])
+
+                # Rendering the same again doesn't touch the file, no
+                # temporary files are left behind
+                mtime = os.stat(os.path.join(output.directory, 'b.html')).st_mtime_ns
+                self.assertFalse(output.write_template('b.html', template, {'count': 10000, 'footer': 'end'}))
+                self.assertTrue(output.write_template('c.html', template, {'count': 0, 'footer': 'end'}))
+                self.assertEqual(os.stat(os.path.join(output.directory, 'b.html')).st_mtime_ns, mtime)
+                self.assertEqual(self.read(f'{is_async}/c.html'), b'end\n')
+                self.assertEqual(sorted(os.listdir(output.directory)), ['a.html', 'b.html', 'c.html'])
+                self.assertEqual((output.written, output.unchanged), (3, 1))
+
+    def test_template_error(self):
+        env = Environment(loader=DictLoader({'page.html': '{{ a.b.c }}'}))
+        output = OutputWriter(self.path)
+        with self.assertRaises(Exception):
+            output.write_template('a.html', env.get_template('page.html'), {'a': None})
+        self.assertEqual(os.listdir(self.path), [])
+
+    def test_background(self):
+        env = Environment(loader=DictLoader({
+            'page.html': '{% for i in range(count) %}{{ i }} {{ name }}\n{% endfor %}'
+        }))
+        template = env.get_template('page.html')
+
+        output = OutputWriter(self.path, {}, background=True)
+        self.assertIsNone(output.write('a.html', b'hello'))
+        output.copy(os.path.join(self.path, 'a.html'), 'sub/b.html')
+        for i in range(50):
+            self.assertIsNone(output.write_template('page{}.html'.format(i), template, {'count': 1000*i, 'name': 'page'}))
+        output.finish()
+        self.assertEqual(self.read('sub/b.html'), b'hello')
+        self.assertEqual(self.read('page17.html'), template.render(count=17000, name='page').encode('utf-8') + b'\n')
+        self.assertEqual((output.written, output.unchanged), (52, 0))
+        self.assertEqual(len(output.files), 52)
+
+        # Keeping, merging and removing goes in order with the writes. The
+        # thread is started again for new writes after finish().
+        output = OutputWriter(self.path, output.files, background=True)
+        output.write('a.html', b'hello')
+        output.keep('sub/b.html')
+        output.merge({'page0.html': (output.previous['page0.html'], False)})
+        output.remove_orphans()
+        self.assertEqual((output.written, output.unchanged, output.removed), (0, 2, 49))
+        self.assertEqual(output.files.keys(), {'a.html', 'sub/b.html', 'page0.html'})
+        output.write('c.html', b'!')
+        output.report()
+        self.assertEqual(self.read('c.html'), b'!')
+        self.assertEqual(sorted(os.listdir(self.path)), ['a.html', 'c.html', 'page0.html', 'sub'])
+
+    def test_background_error(self):
+        os.makedirs(os.path.join(self.path, 'dir.html'))
+        env = Environment(loader=DictLoader({'page.html': '{{ a.b.c }}'}))
+        template = env.get_template('page.html')
+
+        # An error in the writer thread is raised from finish()
+        output = OutputWriter(self.path, background=True)
+        output.write('dir.html', b'hello')
+        output.write('a.html', b'hello')
+        with self.assertRaises(IsADirectoryError):
+            output.finish()
+        self.assertEqual(self.read('a.html'), b'hello')
+
+        # An error in the rendering thread is raised right away, neither
+        # leaves temporary files behind
+        with self.assertRaises(Exception):
+            output.write_template('b.html', template, {'a': None})
+        output.write_template('dir.html', template, {'a': {'b': {'c': 'hey'}}})
+        with self.assertRaises(IsADirectoryError):
+            output.finish()
+        self.assertEqual(sorted(os.listdir(self.path)), ['a.html', 'dir.html'])
+
+    def test_compress(self):
+        output = OutputWriter(self.path, {})
+        output.write('a.html', b'hello'*100)
+        output.write('sub/b.css', b'world')
+        output.write('c.png', b'PNG')
+        output.write('searchdata.bin', b'MCS')
+        output.compress(['gz'], jobs=4)
+        output.remove_orphans()
+        self.assertEqual(gzip.decompress(self.read('a.html.gz')), b'hello'*100)
+        self.assertEqual(gzip.decompress(self.read('sub/b.css.gz')), b'world')
+        self.assertEqual(gzip.decompress(self.read('searchdata.bin.gz')), b'MCS')
+        # No timestamp in the gzip header
+        self.assertEqual(self.read('a.html.gz')[4:8], b'\x00\x00\x00\x00')
+        self.assertFalse(os.path.exists(os.path.join(self.path, 'c.png.gz')))
+        self.assertEqual((output.written, output.unchanged), (7, 0))
+
+        # Compressed files of unchanged files are not compressed again, the
+        # ones of changed or removed files are updated or removed as well
+        mtime = os.stat(os.path.join(self.path, 'a.html.gz')).st_mtime_ns
+        output = OutputWriter(self.path, output.files)
+        output.write('a.html', b'hello'*100)
+        output.write('sub/b.css', b'WORLD')
+        output.compress(['gz'])
+        output.remove_orphans()
+        self.assertEqual(gzip.decompress(self.read('sub/b.css.gz')), b'WORLD')
+        self.assertEqual(os.stat(os.path.join(self.path, 'a.html.gz')).st_mtime_ns, mtime)
+        self.assertEqual((output.written, output.unchanged, output.removed), (2, 1, 3))
+        self.assertEqual(output.files.keys(), {'a.html', 'a.html.gz', 'sub/b.css', 'sub/b.css.gz'})
+
+        # Without the previous state everything is compressed again, but the
+        # compression is deterministic so nothing is written
+        output = OutputWriter(self.path)
+        output.write('a.html', b'hello'*100)
+        output.compress(['gz'])
+        self.assertEqual(os.stat(os.path.join(self.path, 'a.html.gz')).st_mtime_ns, mtime)
+        self.assertEqual((output.written, output.unchanged), (0, 2))
+
+    def test_compress_unsupported(self):
+        output = OutputWriter(self.path)
+        output.write('a.html', b'hello')
+        with self.assertLogs() as cm:
+            output.compress(['zst'])
+        self.assertEqual(cm.output, ["WARNING:root:unknown output compression format zst, ignoring"])
+        self.assertEqual(os.listdir(self.path), ['a.html'])
+
+    @unittest.skipUnless(_output.brotli, "brotli not installed")
+    def test_compress_brotli(self):
+        output = OutputWriter(self.path)
+        output.write('a.html', b'hello')
+        output.compress(['gz', 'br'])
+        self.assertEqual(_output.brotli.decompress(self.read('a.html.br')), b'hello')
+        self.assertEqual(gzip.decompress(self.read('a.html.gz')), b'hello')
+
+    @unittest.skipIf(_output.brotli, "brotli installed")
+    def test_compress_brotli_unavailable(self):
+        output = OutputWriter(self.path)
+        output.write('a.html', b'hello')
+        with self.assertLogs() as cm:
+            output.compress(['gz', 'br'])
+        self.assertEqual(cm.output, ["WARNING:root:brotli module not found, not writing .br files"])
+        self.assertEqual(sorted(os.listdir(self.path)), ['a.html', 'a.html.gz'])
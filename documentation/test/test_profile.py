@@ -0,0 +1,91 @@
+#
+#   This file is part of m.css.
+#
+#   Copyright © 2017, 2018, 2019, 2020, 2021, 2022, 2023
+#             Vladimír Vondruš <mosra@centrum.cz>
+#
+#   Permission is hereby granted, free of charge, to any person obtaining a
+#   copy of this software and associated documentation files (the "Software"),
+#   to deal in the Software without restriction, including without limitation
+#   the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#   and/or sell copies of the Software, and to permit persons to whom the
+#   Software is furnished to do so, subject to the following conditions:
+#
+#   The above copyright notice and this permission notice shall be included
+#   in all copies or substantial portions of the Software.
+#
+#   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#   IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#   FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#   THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#   LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#   DEALINGS IN THE SOFTWARE.
+#
+
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from _profile import Profile
+
+class Profiling(unittest.TestCase):
+    def test(self):
+        profile = Profile()
+        with profile.phase('render'): pass
+        with profile.phase('render'): pass
+        profile.add_phase('search', 1.5)
+        profile.add_page('a.html', 0.25)
+        profile.add_page('b.html', 2.0)
+        profile.add_page('c.html', 0.25)
+        profile.add_cache('math', 3, 1)
+        profile.add_cache('code', 0, 0)
+        profile.finish()
+
+        self.assertEqual(profile.phases['render'][1], 2)
+        self.assertEqual(profile.phases['search'], [1.5, 1])
+        self.assertEqual(profile.slowest_pages(2), [('b.html', 2.0), ('a.html', 0.25)])
+
+        out = profile.to_json(top=1)
+        self.assertEqual(out['caches'], {
+            'math': {'hits': 3, 'misses': 1, 'hit_rate': 0.75},
+            'code': {'hits': 0, 'misses': 0, 'hit_rate': None}
+        })
+        self.assertEqual(out['slowest_pages'], [{'name': 'b.html', 'time': 2.0}])
+        self.assertEqual(len(out['pages']), 3)
+        self.assertGreater(out['total'], 0.0)
+
+    def test_merge(self):
+        profile = Profile()
+        profile.add_phase('parse_xml', 1.0)
+        profile.add_cache('math', 1, 1)
+
+        # Simulates what happens in a forked worker process
+        worker = Profile()
+        worker.add_phase('parse_xml', 5.0)
+        worker.start_recording()
+        worker.add_phase('parse_xml', 2.0)
+        worker.add_page('a.html', 2.5)
+        worker.add_cache('math', 4, 0)
+
+        profile.merge(worker.stop_recording())
+        self.assertEqual(profile.phases, {'parse_xml': [3.0, 2]})
+        self.assertEqual(profile.pages, {'a.html': 2.5})
+        self.assertEqual(profile.caches, {'math': [5, 1]})
+
+    def test_save(self):
+        path = tempfile.mkdtemp()
+        try:
+            profile = Profile()
+            profile.add_page('a.html', 0.5)
+            profile.finish()
+            with self.assertLogs(level='INFO') as cm:
+                profile.save(os.path.join(path, 'profile.json'), 5)
+            with open(os.path.join(path, 'profile.json')) as f:
+                self.assertEqual(json.load(f), profile.to_json(5))
+            self.assertIn('1 slowest out of 1 pages', cm.output[0])
+        finally:
+            shutil.rmtree(path)
@@ -28,8 +28,8 @@ import sys
 import unittest
 from types import SimpleNamespace as Empty
 
-from ._search_test_metadata import EntryType, search_type_map, trie_type_sizes, type_sizes
-from _search import Trie, ResultMap, ResultFlag, Serializer, Deserializer, serialize_search_data, pretty_print_trie, pretty_print_map, pretty_print
+from ._search_test_metadata import EntryType, search_type_map, type_sizes
+from _search import Trie, ResultMap, ResultFlag, Serializer, Deserializer, serialize_search_data, serialize_search_data_sharded, search_shard_filename, base85encode_search_data, base85decode_search_data, pretty_print_trie, pretty_print_map, pretty_print, CssClass, SearchData
 
 from test_doxygen import IntegrationTestCase
 
@@ -46,32 +46,20 @@ class TrieSerialization(unittest.TestCase):
     def test_empty(self):
         trie = Trie()
 
-        for i in trie_type_sizes:
-            with self.subTest(**i):
-                serialized = trie.serialize(Serializer(**i))
-                self.compare(Deserializer(**i), serialized, "")
-                self.assertEqual(len(serialized), 6)
+        serialized = trie.serialize(Serializer())
+        self.compare(Deserializer(), serialized, "")
+        self.assertEqual(len(serialized), 6)
 
     def test_single(self):
         trie = Trie()
         trie.insert("magnum", 1337)
         trie.insert("magnum", 21)
 
-        for i in trie_type_sizes:
-            with self.subTest(**i):
-                serialized = trie.serialize(Serializer(**i))
-                self.compare(Deserializer(**i), serialized, """
+        serialized = trie.serialize(Serializer())
+        self.compare(Deserializer(), serialized, """
 magnum [1337, 21]
 """)
-                # Verify just the smallest and largest size, everything else
-                # should fit in between
-                if i['file_offset_bytes'] == 3 and i['result_id_bytes'] == 2:
-                    self.assertEqual(len(serialized), 46)
-                elif i['file_offset_bytes'] == 4 and i['result_id_bytes'] == 4:
-                    self.assertEqual(len(serialized), 56)
-                else:
-                    self.assertGreater(len(serialized), 46)
-                    self.assertLess(len(serialized), 56)
+        self.assertEqual(len(serialized), 33)
 
     def test_multiple(self):
         trie = Trie()
@@ -107,10 +95,8 @@ magnum [1337, 21]
         trie.insert("range::max", 10)
         trie.insert("max", 10)
 
-        for i in trie_type_sizes:
-            with self.subTest(**i):
-                serialized = trie.serialize(Serializer(**i))
-                self.compare(Deserializer(**i), serialized, """
+        serialized = trie.serialize(Serializer())
+        self.compare(Deserializer(), serialized, """
 math [0]
 ||| :$
 |||  :vector [1]
@@ -138,15 +124,81 @@ range [2]
 |     :min [9]
 |       ax [10]
 """)
-                # Verify just the smallest and largest size, everything else
-                # should fit in between
-                if i['file_offset_bytes'] == 3 and i['result_id_bytes'] == 2:
-                    self.assertEqual(len(serialized), 340)
-                elif i['file_offset_bytes'] == 4 and i['result_id_bytes'] == 4:
-                    self.assertEqual(len(serialized), 428)
-                else:
-                    self.assertGreater(len(serialized), 340)
-                    self.assertLess(len(serialized), 428)
+        self.assertEqual(len(serialized), 224)
+
+    def test_merge_subtrees(self):
+        trie = Trie()
+
+        trie.insert("amin", 0)
+        trie.insert("bmin", 0)
+        trie.insert("cmin", 1)
+
+        # The a and b subtrees are equivalent including the results and get
+        # merged into one. The c subtree differs in the leaf, which makes all
+        # its nodes different as well.
+        stats = Empty()
+        serialized = trie.serialize(Serializer(), stats=stats)
+        self.compare(Deserializer(), serialized, """
+amin [0]
+bmin [0]
+cmin [1]
+""")
+        self.assertEqual(stats.node_count, 13)
+        self.assertEqual(stats.serialized_node_count, 9)
+        self.assertEqual(len(serialized), 4 + 9*2 + 9*2 + 2)
+
+        stats = Empty()
+        serialized_unmerged = trie.serialize(Serializer(), merge_subtrees=False, stats=stats)
+        self.assertEqual(stats.node_count, 13)
+        self.assertEqual(stats.serialized_node_count, 13)
+        self.assertEqual(len(serialized_unmerged), 4 + 13*2 + 12*2 + 3)
+
+    def test_merge_subtrees_minimal(self):
+        trie = Trie()
+
+        # Lots of shared suffixes at various depths, some with the same
+        # results and some not
+        for i, prefix in enumerate(['', 'a', 'ab', 'x', 'xy', 'q']):
+            for j, word in enumerate(['min', 'max', 'minmax', 'mix', 'in', 'ax']):
+                trie.insert(prefix + word, (i*j) % 3)
+        trie.insert("zax", 0, lookahead_barriers=[1])
+
+        # Independently count classes of equivalent nodes. Two nodes are
+        # equivalent if they have the same results and the same children in
+        # the same order, as search.js gathers results in that order.
+        classes = {}
+        def equivalence_class(node):
+            key = (tuple(trie._results.get(node, [])), tuple((trie._chars[child], trie._barriers[child], equivalence_class(child)) for child in trie._children(node)))
+            return classes.setdefault(key, len(classes))
+        equivalence_class(0)
+
+        # Each class got serialized exactly once
+        stats = Empty()
+        trie.serialize(Serializer(), stats=stats)
+        self.assertEqual(stats.serialized_node_count, len(classes))
+        self.assertLess(stats.serialized_node_count, stats.node_count)
+
+    def test_merge_subtrees_child_order(self):
+        trie = Trie()
+
+        trie.insert("ab", 0)
+        trie.insert("ac", 0)
+        trie.insert("bc", 0)
+        trie.insert("bb", 0)
+
+        # The a and b subtrees contain the same words but the children are in
+        # a different order, which means a different order of results, so
+        # they're not merged. Only the leaves are.
+        stats = Empty()
+        serialized = trie.serialize(Serializer(), stats=stats)
+        self.compare(Deserializer(), serialized, """
+ab [0]
+|c [0]
+bc [0]
+|b [0]
+""")
+        self.assertEqual(stats.node_count, 7)
+        self.assertEqual(stats.serialized_node_count, 4)
 
     def test_unicode(self):
         trie = Trie()
@@ -154,8 +206,8 @@ range [2]
         trie.insert("hýždě", 0)
         trie.insert("hárá", 1)
 
-        serialized = trie.serialize(Serializer(file_offset_bytes=3, result_id_bytes=2, name_size_bytes=1))
-        self.compare(Deserializer(file_offset_bytes=3, result_id_bytes=2, name_size_bytes=1), serialized, """
+        serialized = trie.serialize(Serializer())
+        self.compare(Deserializer(), serialized, """
 h0xc3
   0xbd
    0xc5
@@ -168,9 +220,9 @@ h0xc3
   |  0xa1
   |    [1]
 """)
-        self.assertEqual(len(serialized), 82)
+        self.assertEqual(len(serialized), 56)
 
-    def test_16bit_result_count(self):
+    def test_many_results(self):
         trie = Trie()
 
         for i in range(128):
@@ -181,58 +233,59 @@ h0xc3
         for i in [203, 215, 267]:
             trie.insert("__init__subclass__", i)
 
-        for i in trie_type_sizes:
-            with self.subTest(**i):
-                serialized = trie.serialize(Serializer(**i))
-                self.compare(Deserializer(**i), serialized, """
+        # The result count takes two bytes here
+        serialized = trie.serialize(Serializer())
+        self.compare(Deserializer(), serialized, """
 __init__ [{}]
         subclass__ [203, 215, 267]
 """.format(', '.join([str(i) for i in range(128)])))
-                # Verify just the smallest and largest size, everything else
-                # should fit in between
-                if i['file_offset_bytes'] == 3 and i['result_id_bytes'] == 2:
-                    self.assertEqual(len(serialized), 377)
-                elif i['file_offset_bytes'] == 4 and i['result_id_bytes'] == 4:
-                    self.assertEqual(len(serialized), 657)
-                else:
-                    self.assertGreater(len(serialized), 377)
-                    self.assertLess(len(serialized), 657)
+        self.assertEqual(len(serialized), 214)
 
-    def test_16bit_result_id_too_small(self):
+    def test_large_result_ids(self):
         trie = Trie()
-        trie.insert("a", 65536)
-        with self.assertRaisesRegex(OverflowError, "Trie result ID too large to store in 16 bits, set SEARCH_RESULT_ID_BYTES = 3 in your conf.py."):
-            trie.serialize(Serializer(file_offset_bytes=3, result_id_bytes=2, name_size_bytes=1))
+        trie.insert("a", [127, 128, 16383, 16384, 65536, 16*1024*1024, 4*1024*1024*1024 - 1])
 
-        # This should work
-        trie.serialize(Serializer(file_offset_bytes=3, result_id_bytes=3, name_size_bytes=1))
+        # Result IDs take 1, 2, 2, 3, 3, 4 and 5 bytes, the rest is the root
+        # offset, two nodes with two 1-byte counts and the single child
+        serialized = trie.serialize(Serializer())
+        self.compare(Deserializer(), serialized, """
+a [127, 128, 16383, 16384, 65536, 16777216, 4294967295]
+""")
+        self.assertEqual(len(serialized), 4 + 2 + 20 + 2 + 2)
 
-    def test_24bit_result_id_too_small(self):
+    def test_large_child_offsets(self):
         trie = Trie()
-        trie.insert("a", 16*1024*1024)
-        with self.assertRaisesRegex(OverflowError, "Trie result ID too large to store in 24 bits, set SEARCH_RESULT_ID_BYTES = 4 in your conf.py."):
-            trie.serialize(Serializer(file_offset_bytes=3, result_id_bytes=3, name_size_bytes=1))
-
-        # This should work
-        trie.serialize(Serializer(file_offset_bytes=3, result_id_bytes=4, name_size_bytes=1))
 
-    def test_23bit_file_offset_too_small(self):
+        # The subtree of the first child is serialized first and is large
+        # enough for the offset difference from the parent to take three
+        # bytes. The second child is right before the parent, so its offset
+        # difference takes just one byte.
+        trie.insert("a", [i for i in range(16384)])
+        trie.insert("b", 0)
+
+        serialized = trie.serialize(Serializer())
+        self.compare(Deserializer(), serialized, """
+a [{}]
+b [0]
+""".format(', '.join([str(i) for i in range(16384)])))
+        # Root offset, results (128 one-byte, the rest two-byte, plus the
+        # count), the other leaf and the root with two chars and offsets
+        self.assertEqual(len(serialized), 4 + (128 + (16384 - 128)*2 + 3 + 1) + 3 + (2 + 2 + 3 + 1))
+
+    def test_deep(self):
         trie = Trie()
 
-        # The high bit of the child offset stores a lookahead barrier, so the
-        # file has to be smaller than 8M, not 16. Python has a recursion limit
-        # of 1000, so we can't really insert a 8M character long string.
-        # Instead, insert one 130-character string where each char has 32k
-        # 16bit result IDs. 129 isn't enough to overflow the offsets.
-        results_32k = [j for j in range(32767)]
-        for i in range(130):
-            trie.insert('a'*i, results_32k)
+        # This used to hit the recursion limit both on insertion and on
+        # serialization
+        trie.insert('a'*5000, 1337)
 
-        with self.assertRaisesRegex(OverflowError, "Trie child offset too large to store in 23 bits, set SEARCH_FILE_OFFSET_BYTES = 4 in your conf.py."):
-            trie.serialize(Serializer(file_offset_bytes=3, result_id_bytes=2, name_size_bytes=1))
+        # Root offset, 5000 nodes with two 1-byte counts, a char and a 1-byte
+        # offset difference each and a leaf with a single 2-byte result
+        serialized = trie.serialize(Serializer())
+        self.assertEqual(len(serialized), 4 + 5000*4 + 4)
 
-        # This should work
-        trie.serialize(Serializer(file_offset_bytes=4, result_id_bytes=2, name_size_bytes=1))
+        # Same for printing it
+        self.compare(Deserializer(), serialized, 'a'*5000 + ' [1337]')
 
 class MapSerialization(unittest.TestCase):
     def __init__(self, *args, **kwargs):
@@ -250,8 +303,8 @@ class MapSerialization(unittest.TestCase):
         for i in type_sizes:
             with self.subTest(**i):
                 serialized = map.serialize(Serializer(**i))
-                self.compare(Deserializer(**i), serialized, "")
-                self.assertEqual(len(serialized), i['file_offset_bytes'])
+                self.compare(Deserializer(), serialized, "")
+                self.assertEqual(len(serialized), 1 + i['file_offset_bytes'])
 
     def test_single(self):
         map = ResultMap()
@@ -261,19 +314,12 @@ class MapSerialization(unittest.TestCase):
         for i in type_sizes:
             with self.subTest(**i):
                 serialized = map.serialize(Serializer(**i))
-                self.compare(Deserializer(**i), serialized, """
+                self.compare(Deserializer(), serialized, """
 0: Magnum [suffix_length=11, type=NAMESPACE] -> namespaceMagnum.html
 """)
-                # Verify just the smallest and largest size, everything else
-                # should fit in between. The `result_id_bytes` don't affect
-                # this case.
-                if i['file_offset_bytes'] == 3 and i['name_size_bytes'] == 1:
-                    self.assertEqual(len(serialized), 35)
-                elif i['file_offset_bytes'] == 4 and i['name_size_bytes'] == 2:
-                    self.assertEqual(len(serialized), 38)
-                else:
-                    self.assertGreater(len(serialized), 35)
-                    self.assertLess(len(serialized), 38)
+                # Offset size, two offsets, flags, suffix length and the
+                # strings
+                self.assertEqual(len(serialized), 1 + 2*i['file_offset_bytes'] + 1 + 1 + 27)
 
     def test_multiple(self):
         map = ResultMap()
@@ -289,7 +335,7 @@ class MapSerialization(unittest.TestCase):
         for i in type_sizes:
             with self.subTest(**i):
                 serialized = map.serialize(Serializer(**i))
-                self.compare(Deserializer(**i), serialized, """
+                self.compare(Deserializer(), serialized, """
 0: Math [type=NAMESPACE] -> namespaceMath.html
 1: ::Vector [prefix=0[:0], type=CLASS] -> classMath_1_1Vector.html
 2: ::Range [prefix=0[:0], type=CLASS] -> classMath_1_1Range.html
@@ -300,95 +346,84 @@ class MapSerialization(unittest.TestCase):
 """)
                 # Verify just the smallest and largest size, everything else
                 # should fit in between
-                if i['file_offset_bytes'] == 3 and i['result_id_bytes'] == 2 and i['name_size_bytes'] == 1:
-                    self.assertEqual(len(serialized), 202)
-                elif i['file_offset_bytes'] == 4 and i['result_id_bytes'] == 4 and i['name_size_bytes'] == 2:
-                    self.assertEqual(len(serialized), 231)
+                if i['file_offset_bytes'] == 2:
+                    self.assertEqual(len(serialized), 188)
+                elif i['file_offset_bytes'] == 4:
+                    self.assertEqual(len(serialized), 204)
                 else:
-                    self.assertGreater(len(serialized), 202)
-                    self.assertLess(len(serialized), 231)
+                    self.assertGreater(len(serialized), 188)
+                    self.assertLess(len(serialized), 204)
 
-    def test_24bit_file_offset_too_small(self):
+    def test_prefix_overloads(self):
         map = ResultMap()
-        # 3 bytes for the initial offset, 3 bytes for file size, 1 byte for the
-        # flags, 1 byte for the null terminator, 6 bytes for the URL
-        map.add('F'*(16*1024*1024 - 14), 'f.html', flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.CLASS))
-
-        with self.assertRaisesRegex(OverflowError, "Result map offset too large to store in 24 bits, set SEARCH_FILE_OFFSET_BYTES = 4 in your conf.py."):
-            # Disabling prefix merging otherwise memory usage goes to hell
-            map.serialize(Serializer(file_offset_bytes=3, result_id_bytes=2, name_size_bytes=1), merge_prefixes=False)
 
-        # This should work. Disabling prefix merging otherwise memory usage
-        # goes to hell.
-        map.serialize(Serializer(file_offset_bytes=4, result_id_bytes=2, name_size_bytes=1), merge_prefixes=False)
+        self.assertEqual(map.add("Math", "namespaceMath.html", flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.NAMESPACE)), 0)
+        self.assertEqual(map.add("Math::min()", "namespaceMath.html#a1", suffix_length=2, flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.FUNC)), 1)
+        self.assertEqual(map.add("Math::min()", "namespaceMath.html#a1", flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.FUNC)), 2)
+        self.assertEqual(map.add("Math::min()", "namespaceMath.html#b2", suffix_length=2, flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.FUNC)), 3)
+        self.assertEqual(map.add("Math::min()", "namespaceMath.html#b2", flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.FUNC)), 4)
+        self.assertEqual(map.add("Math::minmax()", "namespaceMath.html#b3", flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.FUNC)), 5)
+
+        # The overloads without a suffix should reference the overload with
+        # the same URL, not just the first one with the same name
+        serialized = map.serialize(Serializer())
+        self.compare(Deserializer(), serialized, """
+0: Math [type=NAMESPACE] -> namespaceMath.html
+1: ::min() [prefix=0[:18], suffix_length=2, type=FUNC] -> #a1
+2:  [prefix=1[:21], type=FUNC] ->
+3: ::min() [prefix=0[:18], suffix_length=2, type=FUNC] -> #b2
+4:  [prefix=3[:21], type=FUNC] ->
+5: ::minmax() [prefix=0[:18], type=FUNC] -> #b3
+""")
 
-    def test_8bit_suffix_length_too_small(self):
+    def test_file_offset_bytes_auto(self):
         map = ResultMap()
-        map.add("F()" + ';'*256, "f.html", flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.FUNC), suffix_length=256)
-
-        with self.assertRaisesRegex(OverflowError, "Result map suffix length too large to store in 8 bits, set SEARCH_NAME_SIZE_BYTES = 2 in your conf.py."):
-            map.serialize(Serializer(file_offset_bytes=3, result_id_bytes=2, name_size_bytes=1))
+        # 1 byte for the offset size, 2 bytes for the initial offset, 2 bytes
+        # for file size, 1 byte for the flags, 1 byte for the null terminator,
+        # 6 bytes for the URL. One byte more and it no longer fits into 16
+        # bits.
+        map.add('F'*(65536 - 14), 'f.html', flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.CLASS))
+        serialized = map.serialize(Serializer())
+        self.assertEqual(serialized[0], 2)
+        self.assertEqual(len(serialized), 65535)
 
-        # This should work
-        map.serialize(Serializer(file_offset_bytes=3, result_id_bytes=2, name_size_bytes=2))
-
-    def test_8bit_prefix_length_too_small(self):
         map = ResultMap()
-        map.add("A", 'a'*251 + ".html", flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.CLASS))
-        map.add("A::foo()", 'a'*251 + ".html#foo", flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.FUNC))
-
-        with self.assertRaisesRegex(OverflowError, "Result map prefix length too large to store in 8 bits, set SEARCH_NAME_SIZE_BYTES = 2 in your conf.py."):
-            map.serialize(Serializer(file_offset_bytes=3, result_id_bytes=2, name_size_bytes=1))
-
-        # This should work
-        map.serialize(Serializer(file_offset_bytes=3, result_id_bytes=2, name_size_bytes=2))
-
-    def test_16bit_prefix_id_too_small(self):
-        map = ResultMap()
-
-        # Adding A0 to A65535 would be too slow due to the recursive Trie
-        # population during prefix merging (SIGH) so trying this instead. It's
-        # still hella slow, but at least not TWO MINUTES.
-        for i in range(128):
-            for j in range(128):
-                for k in range(4):
-                    map.add(bytes([i, j, k]).decode('utf-8'), "a.html", flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.CLASS))
-
-        self.assertEqual(map.add("B", "b.html", flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.CLASS)), 65536)
-        map.add("B::foo()", "b.html#foo", flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.FUNC))
-
-        with self.assertRaisesRegex(OverflowError, "Result map prefix ID too large to store in 16 bits, set SEARCH_RESULT_ID_BYTES = 3 in your conf.py."):
-            map.serialize(Serializer(file_offset_bytes=3, result_id_bytes=2, name_size_bytes=1))
-
-        # This should work
-        map.serialize(Serializer(file_offset_bytes=3, result_id_bytes=3, name_size_bytes=1))
+        map.add('F'*(65536 - 13), 'f.html', flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.CLASS))
+        serialized = map.serialize(Serializer())
+        self.assertEqual(serialized[0], 3)
+        self.assertEqual(len(serialized), 65536 + 2)
 
-        # Testing this error for a 24bit prefix seems infeasibly slow, not
-        # doing that
-
-    def test_16bit_alias_id_too_small(self):
+    def test_24bit_file_offset_too_small(self):
         map = ResultMap()
+        # 1 byte for the offset size, 3 bytes for the initial offset, 3 bytes
+        # for file size, 1 byte for the flags, 1 byte for the null terminator,
+        # 6 bytes for the URL
+        map.add('F'*(16*1024*1024 - 15), 'f.html', flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.CLASS))
 
-        # The alias doesn't exist of course, hopefully that's fine in this case
-        map.add("B", "", alias=65536)
-
-        with self.assertRaisesRegex(OverflowError, "Result map alias ID too large to store in 16 bits, set SEARCH_RESULT_ID_BYTES = 3 in your conf.py."):
-            map.serialize(Serializer(file_offset_bytes=3, result_id_bytes=2, name_size_bytes=1))
+        with self.assertRaisesRegex(OverflowError, "Result map offset too large to store in 24 bits"):
+            # Disabling prefix merging otherwise memory usage goes to hell
+            map.serialize(Serializer(file_offset_bytes=3), merge_prefixes=False)
 
-        # This should work
-        map.serialize(Serializer(file_offset_bytes=3, result_id_bytes=3, name_size_bytes=1))
+        # This should work and pick 32 bits. Disabling prefix merging
+        # otherwise memory usage goes to hell.
+        serialized = map.serialize(Serializer(), merge_prefixes=False)
+        self.assertEqual(serialized[0], 4)
 
-    def test_24bit_alias_id_too_small(self):
+    def test_large_names_and_ids(self):
         map = ResultMap()
-
+        map.add("A", 'a'*251 + ".html", flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.CLASS))
+        map.add("A::foo()" + ';'*256, 'a'*251 + ".html#foo", flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.FUNC), suffix_length=256 + 2)
         # The alias doesn't exist of course, hopefully that's fine in this case
         map.add("B", "", alias=16*1024*1024)
 
-        with self.assertRaisesRegex(OverflowError, "Result map alias ID too large to store in 24 bits, set SEARCH_RESULT_ID_BYTES = 4 in your conf.py."):
-            map.serialize(Serializer(file_offset_bytes=3, result_id_bytes=3, name_size_bytes=1))
-
-        # This should work
-        map.serialize(Serializer(file_offset_bytes=3, result_id_bytes=4, name_size_bytes=1))
+        # Prefix length, suffix length and alias ID take more than one byte,
+        # which used to need a configuration option
+        serialized = map.serialize(Serializer())
+        self.compare(Deserializer(), serialized, """
+0: A [type=CLASS] -> {0}.html
+1: ::foo(){1} [prefix=0[:256], suffix_length=258, type=FUNC] -> #foo
+2: B [alias=16777216] ->
+""".format('a'*251, ';'*256))
 
 class Serialization(unittest.TestCase):
     def __init__(self, *args, **kwargs):
@@ -432,10 +467,216 @@ range [2]
 """)
                 # Verify just the smallest and largest size, everything else
                 # should fit in between
-                if i['file_offset_bytes'] == 3 and i['result_id_bytes'] == 2 and i['name_size_bytes'] == 1:
-                    self.assertEqual(len(serialized), 282)
-                elif i['file_offset_bytes'] == 4 and i['result_id_bytes'] == 4 and i['name_size_bytes'] == 2:
-                    self.assertEqual(len(serialized), 317)
+                if i['file_offset_bytes'] == 2:
+                    self.assertEqual(len(serialized), 236)
+                elif i['file_offset_bytes'] == 4:
+                    self.assertEqual(len(serialized), 244)
                 else:
-                    self.assertGreater(len(serialized), 282)
-                    self.assertLess(len(serialized), 317)
+                    self.assertGreater(len(serialized), 236)
+                    self.assertLess(len(serialized), 244)
+
+class ShardedSerialization(unittest.TestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.maxDiff = None
+
+    def compare(self, serialized: bytes, expected: str):
+        pretty = pretty_print(serialized, entryTypeClass=EntryType)[0]
+        #print(pretty)
+        self.assertEqual(pretty, expected.strip())
+
+    def test(self):
+        trie = Trie()
+        map = ResultMap()
+
+        trie.insert("math", map.add("Math", "namespaceMath.html", flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.NAMESPACE)))
+        index = map.add("Math::Vector", "classMath_1_1Vector.html", flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.CLASS))
+        trie.insert("math::vector", index, lookahead_barriers=[4])
+        trie.insert("vector", index)
+        index = map.add("Math::Range", "classMath_1_1Range.html", flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.CLASS))
+        trie.insert("math::range", index, lookahead_barriers=[4])
+        trie.insert("range", index)
+        trie.insert("rect", map.add("Rectangle", "", alias=index))
+
+        for jobs in [1, 3]:
+            with self.subTest(jobs=jobs):
+                shards = serialize_search_data_sharded(Serializer(), trie, map, search_type_map, 4, min_shard_weight=10, jobs=jobs)
+                self.assertEqual([key for key, shard in shards], [b'', b'm', b'math:', b'v', b'r'])
+
+                # The index has all children of the root in other shards and
+                # the total symbol count
+                self.compare(shards[0][1], """
+4 symbols, sharded
+m@
+v@
+r@
+
+(EntryType.PAGE, CssClass.SUCCESS, 'page'),
+(EntryType.NAMESPACE, CssClass.PRIMARY, 'namespace'),
+(EntryType.CLASS, CssClass.PRIMARY, 'class'),
+(EntryType.FUNC, CssClass.INFO, 'func')
+""")
+
+                # The subtree behind the lookahead barrier is large enough to
+                # be in a separate shard. Each shard has only the results it
+                # references, with the IDs remapped.
+                self.compare(shards[1][1], """
+1 symbols in shard m
+math [0]
+    :@
+0: Math [type=NAMESPACE] -> namespaceMath.html
+(EntryType.PAGE, CssClass.SUCCESS, 'page'),
+(EntryType.NAMESPACE, CssClass.PRIMARY, 'namespace'),
+(EntryType.CLASS, CssClass.PRIMARY, 'class'),
+(EntryType.FUNC, CssClass.INFO, 'func')
+""")
+                self.compare(shards[2][1], """
+2 symbols in shard math:
+math:$
+     :vector [0]
+      range [1]
+0: Math::Vector [type=CLASS] -> classMath_1_1Vector.html
+1: Math::Range [type=CLASS] -> classMath_1_1Range.html
+(EntryType.PAGE, CssClass.SUCCESS, 'page'),
+(EntryType.NAMESPACE, CssClass.PRIMARY, 'namespace'),
+(EntryType.CLASS, CssClass.PRIMARY, 'class'),
+(EntryType.FUNC, CssClass.INFO, 'func')
+""")
+
+                # The alias target gets pulled into the shard as well
+                self.compare(shards[4][1], """
+2 symbols in shard r
+range [0]
+ ect [1]
+0: Math::Range [type=CLASS] -> classMath_1_1Range.html
+1: Rectangle [alias=0] ->
+(EntryType.PAGE, CssClass.SUCCESS, 'page'),
+(EntryType.NAMESPACE, CssClass.PRIMARY, 'namespace'),
+(EntryType.CLASS, CssClass.PRIMARY, 'class'),
+(EntryType.FUNC, CssClass.INFO, 'func')
+""")
+
+        # With the default threshold only the children of the root are in
+        # separate shards
+        shards = serialize_search_data_sharded(Serializer(), trie, map, search_type_map, 4)
+        self.assertEqual([key for key, shard in shards], [b'', b'm', b'v', b'r'])
+
+    def test_empty(self):
+        shards = serialize_search_data_sharded(Serializer(), Trie(), ResultMap(), search_type_map, 0)
+        self.assertEqual([key for key, shard in shards], [b''])
+        self.compare(shards[0][1], """
+0 symbols, sharded
+
+
+(EntryType.PAGE, CssClass.SUCCESS, 'page'),
+(EntryType.NAMESPACE, CssClass.PRIMARY, 'namespace'),
+(EntryType.CLASS, CssClass.PRIMARY, 'class'),
+(EntryType.FUNC, CssClass.INFO, 'func')
+""")
+
+    def test_filename(self):
+        self.assertEqual(search_shard_filename('searchdata-v3.bin', b''), 'searchdata-v3.bin')
+        self.assertEqual(search_shard_filename('searchdata-v3.bin', b'm'), 'searchdata-v3-6d.bin')
+        self.assertEqual(search_shard_filename('output/searchdata-v3.js', b'\xc5::'), 'output/searchdata-v3-c53a3a.js')
+
+class Search(unittest.TestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.maxDiff = None
+
+    def setUp(self):
+        self.trie = Trie()
+        self.map = ResultMap()
+
+        self.trie.insert("math", self.map.add("Math", "namespaceMath.html", flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.NAMESPACE)))
+        index = self.map.add("Math::Vector", "classMath_1_1Vector.html", flags=ResultFlag.from_type(ResultFlag.DEPRECATED, EntryType.CLASS))
+        self.trie.insert("math::vector", index, lookahead_barriers=[4])
+        self.trie.insert("vector", index)
+        index = self.map.add("Math::Range", "classMath_1_1Range.html", flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.CLASS))
+        self.trie.insert("math::range", index, lookahead_barriers=[4])
+        self.trie.insert("range", index)
+        self.trie.insert("rect", self.map.add("Rectangle", "", alias=index))
+
+    def results(self, search: SearchData, string):
+        results, autocompletion = search.search(string)
+        return [(result.name, result.alias, result.url, result.flags, result.css_class, result.type_name, result.suffix_length) for result in results], autocompletion
+
+    def test(self):
+        for i in type_sizes:
+            with self.subTest(**i):
+                serialized = serialize_search_data(Serializer(**i), self.trie, self.map, search_type_map, 4)
+
+                # Both bytes and a memoryview are accepted
+                for data in [serialized, memoryview(serialized)]:
+                    search = SearchData(data)
+
+                    # The lookahead barrier hides the math:: subtree
+                    self.assertEqual(self.results(search, 'ma'), ([
+                        (b'Math', None, b'namespaceMath.html', ResultFlag.NONE, CssClass.PRIMARY, 'namespace', 2)
+                    ], 'th'))
+                    # Shorter suffixes first, breadth-first
+                    self.assertEqual(self.results(search, 'math::'), ([
+                        (b'Math::Range', None, b'classMath_1_1Range.html', ResultFlag.HAS_PREFIX, CssClass.PRIMARY, 'class', 5),
+                        (b'Math::Vector', None, b'classMath_1_1Vector.html', ResultFlag.HAS_PREFIX|ResultFlag.DEPRECATED, CssClass.PRIMARY, 'class', 6)
+                    ], ''))
+
+                    # Aliases get the URL and type of the target. Whitespace on
+                    # the left is ignored, on the right only if it isn't found.
+                    self.assertEqual(self.results(search, ' \tR '), ([
+                        (b'Rectangle', b'Math::Range', b'classMath_1_1Range.html', ResultFlag.HAS_PREFIX, CssClass.PRIMARY, 'class', 3),
+                        (b'Math::Range', None, b'classMath_1_1Range.html', ResultFlag.HAS_PREFIX, CssClass.PRIMARY, 'class', 4)
+                    ], ''))
+
+                    self.assertEqual(search.search('pizza'), ([], ''))
+
+                # Same result for the Base85-encoded variant, except for the
+                # padding at the end
+                decoded = base85decode_search_data(base85encode_search_data(serialized))
+                self.assertEqual(decoded[:len(serialized)], serialized)
+                self.assertEqual(self.results(SearchData(decoded), 'vec'), ([
+                    (b'Math::Vector', None, b'classMath_1_1Vector.html', ResultFlag.HAS_PREFIX|ResultFlag.DEPRECATED, CssClass.PRIMARY, 'class', 3)
+                ], 'tor'))
+
+    def test_max_results(self):
+        serialized = serialize_search_data(Serializer(), self.trie, self.map, search_type_map, 4)
+        results, autocompletion = SearchData(serialized, max_results=2).search('')
+        self.assertEqual([result.name for result in results], [b'Math', b'Rectangle'])
+
+    def test_stats(self):
+        serialized = serialize_search_data(Serializer(), self.trie, self.map, search_type_map, 4)
+        stats = Empty()
+        SearchData(serialized).search('vec', stats)
+        # Root with three children, then a node with one child for each char
+        self.assertEqual([(result_count, child_count) for offset, result_count, child_count in stats.path], [(0, 3), (0, 1), (0, 1), (0, 1)])
+        self.assertEqual(stats.node_count, 4)
+
+    def test_sharded(self):
+        shards = dict(serialize_search_data_sharded(Serializer(), self.trie, self.map, search_type_map, 4, min_shard_weight=10))
+        self.assertEqual(list(shards.keys()), [b'', b'm', b'math:', b'v', b'r'])
+
+        loaded = []
+        def load_shard(key):
+            loaded.append(key)
+            return shards.get(key)
+        search = SearchData(shards[b''], load_shard=load_shard)
+
+        # Shards are loaded only when needed and just once. The same results as
+        # with the whole data, except that prefixes are expanded in the
+        # shards.
+        self.assertEqual(self.results(search, 'math'), ([
+            (b'Math', None, b'namespaceMath.html', ResultFlag.NONE, CssClass.PRIMARY, 'namespace', 0)
+        ], ''))
+        self.assertEqual(loaded, [b'm'])
+        self.assertEqual(self.results(search, 'math::ve'), ([
+            (b'Math::Vector', None, b'classMath_1_1Vector.html', ResultFlag.DEPRECATED, CssClass.PRIMARY, 'class', 4)
+        ], 'ctor'))
+        self.assertEqual(self.results(search, 'ma'), ([
+            (b'Math', None, b'namespaceMath.html', ResultFlag.NONE, CssClass.PRIMARY, 'namespace', 2)
+        ], 'th'))
+        self.assertEqual(loaded, [b'm', b'math:'])
+
+        # Shards that aren't available give back nothing
+        del shards[b'r']
+        self.assertEqual(search.search('rect'), ([], ''))
+        self.assertEqual(search.search('rect'), ([], ''))
+        self.assertEqual(loaded, [b'm', b'math:', b'r'])
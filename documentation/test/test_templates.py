@@ -0,0 +1,117 @@
+#
+#   This file is part of m.css.
+#
+#   Copyright © 2017, 2018, 2019, 2020, 2021, 2022, 2023
+#             Vladimír Vondruš <mosra@centrum.cz>
+#
+#   Permission is hereby granted, free of charge, to any person obtaining a
+#   copy of this software and associated documentation files (the "Software"),
+#   to deal in the Software without restriction, including without limitation
+#   the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#   and/or sell copies of the Software, and to permit persons to whom the
+#   Software is furnished to do so, subject to the following conditions:
+#
+#   The above copyright notice and this permission notice shall be included
+#   in all copies or substantial portions of the Software.
+#
+#   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#   IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#   FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#   THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#   LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#   DEALINGS IN THE SOFTWARE.
+#
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from jinja2 import DictLoader, Environment
+
+from _output import OutputWriter
+from _templates import bytecode_cache, needs_async, shared_context
+
+class Templates(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def read(self, filename):
+        with open(os.path.join(self.path, filename), 'rb') as f:
+            return f.read()
+
+    def test_needs_async(self):
+        env = Environment()
+        env.filters['sync'] = lambda value: value
+        self.assertFalse(needs_async(env))
+
+        async def async_filter(value): return value
+        env.filters['async'] = async_filter
+        self.assertTrue(needs_async(env))
+
+    def test_bytecode_cache(self):
+        templates = {'page.html': '{{ a }}{% if b %} and {{ b }}{% endif %}'}
+        directory = os.path.join(self.path, 'cache')
+
+        env = Environment(loader=DictLoader(templates), bytecode_cache=bytecode_cache(directory, False, b'key'))
+        self.assertEqual(env.get_template('page.html').render(a='hello', b='world'), 'hello and world')
+        files = os.listdir(directory)
+        self.assertEqual(len(files), 1)
+        self.assertIn('-sync-', files[0])
+
+        # A new environment loads the template from the cache, an async one
+        # doesn't reuse the sync code
+        env = Environment(loader=DictLoader(templates), bytecode_cache=bytecode_cache(directory, False, b'key'))
+        self.assertEqual(env.get_template('page.html').render(a='hello'), 'hello')
+        env = Environment(loader=DictLoader(templates), enable_async=True, bytecode_cache=bytecode_cache(directory, True, b'key'))
+        self.assertEqual(env.get_template('page.html').render(a='hello'), 'hello')
+        self.assertEqual(len(os.listdir(directory)), 2)
+
+        # An edited template is compiled again
+        templates['page.html'] = '{{ a }}!'
+        env = Environment(loader=DictLoader(templates), bytecode_cache=bytecode_cache(directory, False, b'key'))
+        self.assertEqual(env.get_template('page.html').render(a='hello'), 'hello!')
+
+        # Filters with constant arguments get evaluated already when
+        # compiling, so a different key means compiling again. Files with the
+        # other key are removed.
+        templates['page.html'] = "{{ 'a'|upper }}"
+        env = Environment(loader=DictLoader(templates), bytecode_cache=bytecode_cache(directory, False, b'key'))
+        self.assertEqual(env.get_template('page.html').render(), 'A')
+        env = Environment(loader=DictLoader(templates), bytecode_cache=bytecode_cache(directory, False, b'other'))
+        env.filters['upper'] = lambda value: value + '!'
+        self.assertEqual(env.get_template('page.html').render(), 'a!')
+        files = os.listdir(directory)
+        self.assertEqual(len(files), 1)
+        self.assertIn('-{}-'.format(b'other'.hex()), files[0])
+
+    def test_shared_context(self):
+        templates = {
+            'page.html': '{{ PROJECT }}: {% for i in range(count) %}{% include "item.html" %}{% endfor %}',
+            'item.html': '[{{ i }} of {{ PROJECT }}]'
+        }
+
+        for is_async in [False, True]:
+            with self.subTest(is_async=is_async):
+                env = Environment(loader=DictLoader(templates), enable_async=is_async)
+                config = {'PROJECT': 'Foo', 'count': 1}
+                context = shared_context(env, config, count=2)
+                template = env.get_template('page.html')
+
+                # Page-specific values override the shared ones, globals such
+                # as range() are available
+                output = OutputWriter(self.path)
+                output.write_template('a.html', template, {}, context)
+                output.write_template('b.html', template, {'count': 3}, context)
+                output.write_template('c.html', template, {'PROJECT': 'Foo', 'count': 3})
+                self.assertEqual(self.read('a.html'), b'Foo: [0 of Foo][1 of Foo]\n')
+                self.assertEqual(self.read('b.html'), b'Foo: [0 of Foo][1 of Foo][2 of Foo]\n')
+                self.assertEqual(self.read('c.html'), self.read('b.html'))
+
+                # The shared context isn't modified by rendering
+                self.assertEqual(context['count'], 2)
@@ -0,0 +1,22 @@
+/** @file
+ * @brief A file
+ */
+
+/** @brief A namespace */
+namespace Namespace {
+
+/** @brief A class */
+class A {
+    public:
+        /** @brief A function */
+        void foo();
+};
+
+/** @brief Another class */
+class B {
+    public:
+        /** @brief Another function */
+        void bar();
+};
+
+}
@@ -74,13 +74,16 @@ class Doxyfile(unittest.TestCase):
         'M_CODE_FILTERS_PRE': {},
         'M_CODE_FILTERS_POST': {},
         'M_MATH_CACHE_FILE': 'm.math.cache',
+        'M_MATH_CACHE_SIZE': 64*1024*1024,
+        'M_DOT_CACHE_FILE': None,
+        'M_DOT_CACHE_SIZE': 64*1024*1024,
+        'M_CODE_CACHE_FILE': None,
+        'M_CODE_CACHE_SIZE': 64*1024*1024,
 
         'SEARCH_DISABLED': False,
         'SEARCH_DOWNLOAD_BINARY': False,
         'SEARCH_FILENAME_PREFIX': 'searchdata',
-        'SEARCH_RESULT_ID_BYTES': 2,
-        'SEARCH_FILE_OFFSET_BYTES': 3,
-        'SEARCH_NAME_SIZE_BYTES': 1,
+        'SEARCH_SHARDED': False,
         'SEARCH_BASE_URL': None,
         'SEARCH_EXTERNAL_URL': None,
         'SEARCH_HELP':
@@ -99,6 +102,10 @@ copy a link to the result using <span class="m-label m-dim">⌘</span>
 
         'SHOW_UNDOCUMENTED': False,
         'VERSION_LABELS': False,
+
+        'XML_CACHE_SIZE': 64*1024*1024,
+        'TEMPLATE_CACHE_DIR': None,
+        'COMPRESS_OUTPUT': []
     }
 
     def test(self):
@@ -139,6 +146,16 @@ copy a link to the result using <span class="m-label m-dim">⌘</span>
             "CRITICAL:root:test_doxygen/doxyfile/Doxyfile-subdirs: CREATE_SUBDIRS is not supported, sorry. Disable it and try again."
         ])
 
+    def test_deprecated_search_options(self):
+        state = State(copy.deepcopy(default_config))
+        with self.assertLogs() as cm:
+            parse_doxyfile(state, 'test_doxygen/doxyfile/Doxyfile-search-bytes')
+        self.assertEqual(cm.output, [
+            "WARNING:root:test_doxygen/doxyfile/Doxyfile-search-bytes: M_SEARCH_RESULT_ID_BYTES is deprecated and ignored, the search data field sizes are picked automatically",
+            "WARNING:root:test_doxygen/doxyfile/Doxyfile-search-bytes: M_SEARCH_NAME_SIZE_BYTES is deprecated and ignored, the search data field sizes are picked automatically"
+        ])
+        self.assertNotIn('SEARCH_RESULT_ID_BYTES', state.config)
+
 class UpgradeCustomVariables(BaseTestCase):
     def test(self):
         # Copy the Doxyfile to a new location because it gets overwritten
@@ -0,0 +1,98 @@
+#
+#   This file is part of m.css.
+#
+#   Copyright © 2017, 2018, 2019, 2020, 2021, 2022, 2023
+#             Vladimír Vondruš <mosra@centrum.cz>
+#
+#   Permission is hereby granted, free of charge, to any person obtaining a
+#   copy of this software and associated documentation files (the "Software"),
+#   to deal in the Software without restriction, including without limitation
+#   the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#   and/or sell copies of the Software, and to permit persons to whom the
+#   Software is furnished to do so, subject to the following conditions:
+#
+#   The above copyright notice and this permission notice shall be included
+#   in all copies or substantial portions of the Software.
+#
+#   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#   IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#   FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#   THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#   LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#   DEALINGS IN THE SOFTWARE.
+#
+
+import os
+import shutil
+
+from doxygen import manifest_filename
+
+from . import IntegrationTestCase
+
+class Incremental(IntegrationTestCase):
+    def setUp(self):
+        IntegrationTestCase.setUp(self)
+        if os.path.exists(os.path.join(self.path, manifest_filename)):
+            os.remove(os.path.join(self.path, manifest_filename))
+
+    def read_outputs(self):
+        out = {}
+        for file in os.listdir(os.path.join(self.path, 'html')):
+            with open(os.path.join(self.path, 'html', file), 'rb') as f:
+                out[file] = f.read()
+        return out
+
+    # Empties all compound pages so it's possible to check which of them were
+    # generated again
+    def clear_outputs(self, files):
+        for file in files:
+            with open(os.path.join(self.path, 'html', file), 'wb') as f:
+                pass
+
+    def test(self):
+        self.run_doxygen(wildcard='*.xml', incremental=True)
+        self.assertTrue(os.path.exists(os.path.join(self.path, manifest_filename)))
+        compounds = ['File_8h.html', 'classNamespace_1_1A.html', 'classNamespace_1_1B.html', 'namespaceNamespace.html']
+        for file in compounds:
+            self.assertTrue(os.path.exists(os.path.join(self.path, 'html', file)))
+
+        # Nothing changed, so nothing gets generated again
+        self.clear_outputs(compounds)
+        self.run_doxygen(wildcard='*.xml', incremental=True)
+        for file in compounds:
+            with self.subTest(file=file):
+                self.assertEqual(os.path.getsize(os.path.join(self.path, 'html', file)), 0)
+
+        # Changing a brief of a class regenerates the class and pages that
+        # list it, but not the other class
+        with open(os.path.join(self.path, 'xml', 'classNamespace_1_1A.xml')) as f:
+            contents = f.read()
+        with open(os.path.join(self.path, 'xml', 'classNamespace_1_1A.xml'), 'w') as f:
+            f.write(contents.replace('A class', 'A changed class'))
+        self.run_doxygen(wildcard='*.xml', incremental=True)
+        for file, regenerated in [
+            ('File_8h.html', True),
+            ('classNamespace_1_1A.html', True),
+            ('classNamespace_1_1B.html', False),
+            ('namespaceNamespace.html', True)
+        ]:
+            with self.subTest(file=file):
+                self.assertEqual(os.path.getsize(os.path.join(self.path, 'html', file)) != 0, regenerated)
+
+        # Pages of removed compounds get removed as well
+        os.remove(os.path.join(self.path, 'xml', 'classNamespace_1_1B.xml'))
+        self.run_doxygen(wildcard='*.xml', incremental=True)
+        self.assertFalse(os.path.exists(os.path.join(self.path, 'html', 'classNamespace_1_1B.html')))
+
+        # After all that, the output is the same as with a full build. Well,
+        # except for the empty pages.
+        incremental = self.read_outputs()
+        shutil.rmtree(os.path.join(self.path, 'html'))
+        self.run_doxygen(wildcard='*.xml')
+        expected = self.read_outputs()
+        self.assertEqual(incremental.keys(), expected.keys())
+        for file in expected:
+            if file == 'classNamespace_1_1B.html' or not incremental[file]: continue
+            with self.subTest(file=file):
+                self.assertEqual(incremental[file], expected[file])
@@ -38,6 +38,12 @@ class Layout(BaseTestCase):
         self.assertTrue(os.path.exists(os.path.join(self.path, 'html', searchdata_filename_b85.format(search_filename_prefix='searchdata'))))
         self.assertTrue(os.path.exists(os.path.join(self.path, 'html', 'favicon-light.png')))
 
+    def test_no_xml_cache(self):
+        self.run_doxygen(wildcard='index.xml', config={
+            'XML_CACHE_SIZE': 0
+        })
+        self.assertEqual(*self.actual_expected_contents('pages.html'))
+
 class GeneratedDoxyfile(BaseTestCase):
     def test(self):
         if os.path.exists(os.path.join(self.path, 'Doxyfile')):
@@ -27,6 +27,7 @@
 
 import argparse
 import os
+import shutil
 import sys
 
 from doxygen import EntryType
@@ -42,7 +43,7 @@ class Search(IntegrationTestCase):
             serialized = f.read()
             search_data_pretty = pretty_print(serialized, entryTypeClass=EntryType)[0]
         #print(search_data_pretty)
-        self.assertEqual(len(serialized), 4841)
+        self.assertEqual(len(serialized), 3910)
         self.assertEqual(search_data_pretty, """
 53 symbols
 deprecated_macro [0]
@@ -226,21 +227,26 @@ union [59]
 (EntryType.VAR, CssClass.DEFAULT, 'var')
 """.strip())
 
-    def test_byte_sizes(self):
-        for config, bytes, size in [
-            ('SEARCH_RESULT_ID_BYTES', 3, 4959),
-            ('SEARCH_RESULT_ID_BYTES', 4, 5077),
-            ('SEARCH_FILE_OFFSET_BYTES', 4, 5302),
-            ('SEARCH_NAME_SIZE_BYTES', 2, 4893)
-        ]:
-            with self.subTest(config=config, bytes=bytes, size=size):
-                self.run_doxygen(index_pages=[], wildcard='*.xml', config={
-                    config: bytes
-                })
+    def test_parallel(self):
+        # Everything, including the search data, should be the same as when
+        # rendered serially
+        self.run_doxygen(wildcard='*.xml')
+        expected = {}
+        for file in os.listdir(os.path.join(self.path, 'html')):
+            with open(os.path.join(self.path, 'html', file), 'rb') as f:
+                expected[file] = f.read()
 
-                with open(os.path.join(self.path, 'html', searchdata_filename.format(search_filename_prefix='secretblob')), 'rb') as f:
-                    serialized = f.read()
-                self.assertEqual(len(serialized), size)
+        shutil.rmtree(os.path.join(self.path, 'html'))
+        self.run_doxygen(wildcard='*.xml', jobs=2)
+        actual = {}
+        for file in os.listdir(os.path.join(self.path, 'html')):
+            with open(os.path.join(self.path, 'html', file), 'rb') as f:
+                actual[file] = f.read()
+
+        self.assertEqual(actual.keys(), expected.keys())
+        for file in expected:
+            with self.subTest(file=file):
+                self.assertEqual(actual[file], expected[file])
 
 class LongSuffixLength(IntegrationTestCase):
     def test(self):
@@ -250,7 +256,7 @@ class LongSuffixLength(IntegrationTestCase):
             serialized = f.read()
             search_data_pretty = pretty_print(serialized, entryTypeClass=EntryType)[0]
         #print(search_data_pretty)
-        self.assertEqual(len(serialized), 478)
+        self.assertEqual(len(serialized), 406)
         # The parameters get cut off with an ellipsis
         self.assertEqual(search_data_pretty, """
 2 symbols
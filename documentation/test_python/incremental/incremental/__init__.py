@@ -0,0 +1,13 @@
+"""A module"""
+
+class A:
+    """A class"""
+
+    def method(self, a: int) -> str:
+        """A method"""
+
+class B:
+    """Another class"""
+
+def function(a, b):
+    """A function"""
@@ -0,0 +1,13 @@
+"""A module with search data split into shards"""
+
+class Foo:
+    """A class"""
+
+    def a_method(self):
+        """A method"""
+
+class Bar:
+    """Another class"""
+
+def foo_function():
+    """A function"""
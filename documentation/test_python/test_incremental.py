@@ -0,0 +1,142 @@
+#
+#   This file is part of m.css.
+#
+#   Copyright © 2017, 2018, 2019, 2020, 2021, 2022, 2023
+#             Vladimír Vondruš <mosra@centrum.cz>
+#
+#   Permission is hereby granted, free of charge, to any person obtaining a
+#   copy of this software and associated documentation files (the "Software"),
+#   to deal in the Software without restriction, including without limitation
+#   the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#   and/or sell copies of the Software, and to permit persons to whom the
+#   Software is furnished to do so, subject to the following conditions:
+#
+#   The above copyright notice and this permission notice shall be included
+#   in all copies or substantial portions of the Software.
+#
+#   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#   IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#   FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#   THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#   LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#   DEALINGS IN THE SOFTWARE.
+#
+
+import gzip
+import os
+import shutil
+import sys
+
+from python import manifest_filename
+
+from . import BaseInspectTestCase
+
+class Incremental(BaseInspectTestCase):
+    def read_outputs(self):
+        out = {}
+        for file in os.listdir(os.path.join(self.path, 'output')):
+            if file == manifest_filename: continue
+            with open(os.path.join(self.path, 'output', file), 'rb') as f:
+                out[file] = f.read()
+        return out
+
+    # Empties all module, class and page outputs so it's possible to check
+    # which of them were generated again
+    def clear_outputs(self, files):
+        for file in files:
+            with open(os.path.join(self.path, 'output', file), 'wb') as f:
+                pass
+
+    def test(self):
+        self.run_python({
+            'INPUT_PAGES': ['page.rst']
+        }, incremental=True)
+        self.assertTrue(os.path.exists(os.path.join(self.path, 'output', manifest_filename)))
+        pages = ['incremental.html', 'incremental.A.html', 'incremental.B.html', 'page.html']
+        for file in pages:
+            self.assertTrue(os.path.exists(os.path.join(self.path, 'output', file)))
+
+        # Nothing changed, so nothing gets generated again. The summaries are
+        # still present in the index pages, which are always generated.
+        self.clear_outputs(pages)
+        self.run_python({
+            'INPUT_PAGES': ['page.rst']
+        }, incremental=True)
+        for file in pages:
+            with self.subTest(file=file):
+                self.assertEqual(os.path.getsize(os.path.join(self.path, 'output', file)), 0)
+        with open(os.path.join(self.path, 'output', 'classes.html')) as f:
+            self.assertIn('Another class', f.read())
+        with open(os.path.join(self.path, 'output', 'pages.html')) as f:
+            self.assertIn('A page summary.', f.read())
+
+        # Changing a docstring of a class regenerates the class and the module
+        # that lists it, but not the other class or the page
+        module = sys.modules['incremental']
+        A_doc = module.A.__doc__
+        B = module.B
+        try:
+            module.A.__doc__ = "A changed class"
+            self.run_python({
+                'INPUT_PAGES': ['page.rst']
+            }, incremental=True)
+            for file, regenerated in [
+                ('incremental.html', True),
+                ('incremental.A.html', True),
+                ('incremental.B.html', False),
+                ('page.html', False)
+            ]:
+                with self.subTest(file=file):
+                    self.assertEqual(os.path.getsize(os.path.join(self.path, 'output', file)) != 0, regenerated)
+
+            # Pages of removed classes get removed as well
+            del module.B
+            self.run_python({
+                'INPUT_PAGES': ['page.rst']
+            }, incremental=True)
+            self.assertFalse(os.path.exists(os.path.join(self.path, 'output', 'incremental.B.html')))
+
+            # After all that, the output is the same as with a full build.
+            # Well, except for the empty pages.
+            incremental = self.read_outputs()
+            shutil.rmtree(os.path.join(self.path, 'output'))
+            self.run_python({
+                'INPUT_PAGES': ['page.rst']
+            })
+            expected = self.read_outputs()
+        finally:
+            module.A.__doc__ = A_doc
+            module.B = B
+
+        self.assertEqual(incremental.keys(), expected.keys())
+        for file in expected:
+            if not incremental[file]: continue
+            with self.subTest(file=file):
+                self.assertEqual(incremental[file], expected[file])
+
+    def test_compress(self):
+        self.run_python({
+            'INPUT_PAGES': ['page.rst'],
+            'COMPRESS_OUTPUT': ['gz']
+        }, incremental=True)
+        outputs = self.read_outputs()
+        for file in ['incremental.html', 'incremental.B.html', 'classes.html', 'm-dark+documentation.compiled.css']:
+            with self.subTest(file=file):
+                self.assertEqual(gzip.decompress(outputs[file + '.gz']), outputs[file])
+
+        # Compressed files of pages that are no longer generated get removed
+        # together with them
+        module = sys.modules['incremental']
+        B = module.B
+        try:
+            del module.B
+            self.run_python({
+                'INPUT_PAGES': ['page.rst'],
+                'COMPRESS_OUTPUT': ['gz']
+            }, incremental=True)
+        finally:
+            module.B = B
+        outputs = self.read_outputs()
+        self.assertNotIn('incremental.B.html.gz', outputs)
+        self.assertEqual(gzip.decompress(outputs['incremental.html.gz']), outputs['incremental.html'])
@@ -27,7 +27,7 @@
 
 import os
 
-from _search import searchdata_filename, pretty_print
+from _search import searchdata_filename, search_shard_filename, pretty_print
 from python import EntryType
 
 from test_python import BaseInspectTestCase
@@ -45,7 +45,7 @@ class Search(BaseInspectTestCase):
             serialized = f.read()
             search_data_pretty = pretty_print(serialized, entryTypeClass=EntryType)[0]
         #print(search_data_pretty)
-        self.assertEqual(len(serialized), 2274)
+        self.assertEqual(len(serialized), 1771)
         self.assertEqual(search_data_pretty, """
 21 symbols
 search [14]
@@ -186,25 +186,6 @@ overloaded_method [17, 19, 15]
 (EntryType.DATA, CssClass.DEFAULT, 'data')
 """.strip())
 
-    def test_byte_sizes(self):
-        for config, bytes, size in [
-            ('SEARCH_RESULT_ID_BYTES', 3, 2333),
-            ('SEARCH_RESULT_ID_BYTES', 4, 2392),
-            ('SEARCH_FILE_OFFSET_BYTES', 4, 2525),
-            ('SEARCH_NAME_SIZE_BYTES', 2, 2313)
-        ]:
-            with self.subTest(config=config, bytes=bytes, size=size):
-                self.run_python({
-                    'SEARCH_DISABLED': False,
-                    'SEARCH_DOWNLOAD_BINARY': True,
-                    config: bytes,
-                    'PYBIND11_COMPATIBILITY': True
-                })
-
-                with open(os.path.join(self.path, 'output', searchdata_filename.format(search_filename_prefix='searchdata')), 'rb') as f:
-                    serialized = f.read()
-                self.assertEqual(len(serialized), size)
-
 class LongSuffixLength(BaseInspectTestCase):
     def test(self):
         self.run_python({
@@ -217,7 +198,7 @@ class LongSuffixLength(BaseInspectTestCase):
             serialized = f.read()
             search_data_pretty = pretty_print(serialized, entryTypeClass=EntryType)[0]
         #print(search_data_pretty)
-        self.assertEqual(len(serialized), 638)
+        self.assertEqual(len(serialized), 537)
         # The parameters get cut off with an ellipsis
         self.assertEqual(search_data_pretty, """
 3 symbols
@@ -243,3 +224,83 @@ many_parameters [0, 2]
 (EntryType.ENUM_VALUE, CssClass.DEFAULT, 'enum val'),
 (EntryType.DATA, CssClass.DEFAULT, 'data')
 """.strip())
+
+class Sharded(BaseInspectTestCase):
+    def test(self):
+        self.run_python({
+            'SEARCH_DISABLED': False,
+            'SEARCH_DOWNLOAD_BINARY': True,
+            'SEARCH_SHARDED': True
+        }, incremental=True)
+
+        search_output = os.path.join(self.path, 'output', searchdata_filename.format(search_filename_prefix='searchdata'))
+        with open(search_output, 'rb') as f:
+            search_data_pretty = pretty_print(f.read(), entryTypeClass=EntryType)[0]
+        #print(search_data_pretty)
+        self.assertEqual(search_data_pretty, """
+7 symbols, sharded
+s@
+b@
+_@
+f@
+a@
+
+(EntryType.PAGE, CssClass.SUCCESS, 'page'),
+(EntryType.MODULE, CssClass.PRIMARY, 'module'),
+(EntryType.CLASS, CssClass.PRIMARY, 'class'),
+(EntryType.FUNCTION, CssClass.INFO, 'func'),
+(EntryType.PROPERTY, CssClass.WARNING, 'property'),
+(EntryType.ENUM, CssClass.PRIMARY, 'enum'),
+(EntryType.ENUM_VALUE, CssClass.DEFAULT, 'enum val'),
+(EntryType.DATA, CssClass.DEFAULT, 'data')
+""".strip())
+
+        # The shard has just the symbols starting with given letter, without
+        # the modules and classes they're in
+        with open(search_shard_filename(search_output, b'f'), 'rb') as f:
+            search_data_pretty = pretty_print(f.read(), entryTypeClass=EntryType)[0]
+        #print(search_data_pretty)
+        self.assertEqual(search_data_pretty, """
+6 symbols in shard f
+foo [3]
+   .$
+    __weakref__ [0]
+   |a_method [1]
+   ||       ($
+   ||        ) [2]
+   _function [4]
+   |        ($
+   |         ) [5]
+0: .__weakref__ [prefix=3[:23], type=PROPERTY] -> #__weakref__
+1: .a_method() [prefix=3[:23], suffix_length=2, type=FUNCTION] -> #a_method
+2:  [prefix=1[:32], type=FUNCTION] ->
+3: search_sharded.Foo [type=CLASS] -> search_sharded.Foo.html
+4: search_sharded.foo_function() [suffix_length=2, type=FUNCTION] -> search_sharded.html#foo_function
+5:  [prefix=4[:32], type=FUNCTION] ->
+(EntryType.PAGE, CssClass.SUCCESS, 'page'),
+(EntryType.MODULE, CssClass.PRIMARY, 'module'),
+(EntryType.CLASS, CssClass.PRIMARY, 'class'),
+(EntryType.FUNCTION, CssClass.INFO, 'func'),
+(EntryType.PROPERTY, CssClass.WARNING, 'property'),
+(EntryType.ENUM, CssClass.PRIMARY, 'enum'),
+(EntryType.ENUM_VALUE, CssClass.DEFAULT, 'enum val'),
+(EntryType.DATA, CssClass.DEFAULT, 'data')
+""".strip())
+
+        # In an incremental build where nothing changed the shards are kept
+        self.run_python({
+            'SEARCH_DISABLED': False,
+            'SEARCH_DOWNLOAD_BINARY': True,
+            'SEARCH_SHARDED': True
+        }, incremental=True)
+        for char in 'abfs_':
+            with self.subTest(char=char):
+                self.assertTrue(os.path.exists(search_shard_filename(search_output, char.encode('utf-8'))))
+
+    def test_deprecated_options(self):
+        with self.assertLogs(level='WARNING') as cm:
+            self.run_python({
+                'SEARCH_DISABLED': False,
+                'SEARCH_RESULT_ID_BYTES': 3
+            })
+        self.assertIn("WARNING:root:SEARCH_RESULT_ID_BYTES is deprecated and ignored, the search data field sizes are picked automatically", cm.output)
@@ -25,6 +25,10 @@
 
 import re
 import subprocess
+from hashlib import sha1
+from multiprocessing.pool import ThreadPool
+
+import svgcache
 
 _patch_src = re.compile(r"""<\?xml version="1\.0" encoding="UTF-8" standalone="no"\?>
 <!DOCTYPE svg PUBLIC "-//W3C//DTD SVG 1\.1//EN"
@@ -40,6 +44,12 @@ _patch_custom_size_dst = r"""<svg{attribs} style="{size}" viewBox="\g<viewBox>">
 
 _comment_src = re.compile(r"""<!--[^-]+-->\n""")
 
+# Used for splitting output of multiple graphs rendered at once. Only named
+# graphs are rendered this way, for anonymous graphs dot generates a name
+# that depends on how many graphs it processed before.
+_svg_split_src = re.compile(r"""^(?=<\?xml )""", re.MULTILINE)
+_named_graph_src = re.compile(r"""^\s*(strict\s+)?(di)?graph\s+("[^"]*"|\w+)\s*{""")
+
 _class_src = re.compile(r"""<g id="(edge|node|clust)\d+" class="(?P<type>edge|node|cluster)(?P<classes>[^"]*)">
 <title>(?P<title>[^<]*)</title>
 <(?P<element>ellipse|polygon|path|text)( fill="(?P<fill>[^"]+)" stroke="[^"]+")? """)
@@ -61,39 +71,42 @@ _text_dst = ' style="font-size: {size}px;"'
 _font = ''
 _font_size = 0.0
 
+# Cache for rendered graphs, an svgcache.SvgCache keyed by a hash of the
+# source and the font setup. What's cached is the output with everything
+# processed except for the size and attributes of the <svg> element, which
+# get patched in on every use, so a graph with a different size or CSS
+# classes can still reuse the cached entry. If it's None, the cache is not
+# used at all.
+_cache_version = 1
+_cache = None
+
 # The pt are actually px (16pt font is the same size as 16px), so just
 # converting to rem here
 def _pt2em(pt): return pt/_font_size
 
-def dot2svg(source, size=None, attribs=''):
+def _dot_args():
+    return ['dot', '-Tsvg',
+        '-Gfontname={}'.format(_font),
+        '-Nfontname={}'.format(_font),
+        '-Efontname={}'.format(_font),
+        '-Gfontsize={}'.format(_font_size),
+        '-Nfontsize={}'.format(_font_size),
+        '-Efontsize={}'.format(_font_size),
+        '-Gbgcolor=transparent']
+
+def _run_dot(source):
     try:
-        ret = subprocess.run(['dot', '-Tsvg',
-            '-Gfontname={}'.format(_font),
-            '-Nfontname={}'.format(_font),
-            '-Efontname={}'.format(_font),
-            '-Gfontsize={}'.format(_font_size),
-            '-Nfontsize={}'.format(_font_size),
-            '-Efontsize={}'.format(_font_size),
-            '-Gbgcolor=transparent',
-            ], input=source.encode('utf-8'), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        ret = subprocess.run(_dot_args(), input=source.encode('utf-8'), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         if ret.returncode: print(ret.stderr.decode('utf-8'))
         ret.check_returncode()
     except FileNotFoundError: # pragma: no cover
         raise RuntimeError("dot not found")
+    return ret.stdout.decode('utf-8')
 
+# Everything except patching the <svg> element
+def _process(svg):
     # First remove comments
-    svg = _comment_src.sub('', ret.stdout.decode('utf-8'))
-
-    # Remove preamble and fixed size
-    if size:
-        svg = _patch_src.sub(_patch_custom_size_dst.format(attribs=attribs, size=size), svg)
-    else:
-        def patch_repl(match): return _patch_dst.format(
-            attribs=attribs,
-            width=_pt2em(float(match.group('width'))),
-            height=_pt2em(float(match.group('height'))),
-            viewBox=match.group('viewBox'))
-        svg = _patch_src.sub(patch_repl, svg)
+    svg = _comment_src.sub('', svg)
 
     # Remove unnecessary IDs and attributes, replace classes for elements
     def element_repl(match):
@@ -123,6 +136,124 @@ def dot2svg(source, size=None, attribs=''):
 
     return svg
 
+def cache_key(source):
+    return sha1('{}\0{}\0{}'.format(_font, _font_size, source).encode('utf-8')).digest()
+
+def dot2svg(source, size=None, attribs=''):
+    if _cache is None:
+        svg = _process(_run_dot(source))
+    else:
+        hash = cache_key(source)
+        entry = _cache.get(hash)
+        if entry is None:
+            entry = (None, _process(_run_dot(source)))
+            _cache.add(hash, entry)
+        svg = entry[1]
+
+    # Remove preamble and fixed size
+    if size:
+        return _patch_src.sub(_patch_custom_size_dst.format(attribs=attribs, size=size), svg)
+    def patch_repl(match): return _patch_dst.format(
+        attribs=attribs,
+        width=_pt2em(float(match.group('width'))),
+        height=_pt2em(float(match.group('height'))),
+        viewBox=match.group('viewBox'))
+    return _patch_src.sub(patch_repl, svg)
+
+# Renders multiple graphs with a single dot invocation, which outputs the SVGs
+# one after another. Returns an empty list if any of them failed or the output
+# can't be split to exactly one SVG per graph, such as when a source contains
+# more than one graph.
+def _render_batch(sources):
+    try:
+        ret = subprocess.run(_dot_args(), input='\n'.join(sources).encode('utf-8'), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except FileNotFoundError: # pragma: no cover
+        return []
+    if ret.returncode: return []
+
+    svgs = _svg_split_src.split(ret.stdout.decode('utf-8'))[1:]
+    if len(svgs) != len(sources): return []
+    return [_process(svg) for svg in svgs]
+
+# Renders all graphs that are not in the cache yet and puts them into the
+# cache, so the following dot2svg() calls for them are just cache lookups.
+# Like with latex2svgextra.prerender(), the graphs are deduplicated and
+# rendered in batches with a single dot invocation each, with more than one
+# job the batches are rendered in parallel. If a batch fails, the graphs get
+# rendered one by one by dot2svg(), reporting the error for the graph that
+# caused it.
+def prerender(sources, jobs=1, batch_size=100):
+    if _cache is None: return
+
+    to_render = {}
+    for source in sources:
+        if _named_graph_src.match(source):
+            to_render[cache_key(source)] = source
+    _cache.lookup(list(to_render.keys()))
+    for hash in _cache.entries.keys() & to_render.keys():
+        del to_render[hash]
+
+    # Nothing to gain for a single graph, leave it to dot2svg()
+    if len(to_render) < 2: return
+
+    hashes = list(to_render.keys())
+    count = max(min(jobs, len(hashes)), (len(hashes) + batch_size - 1)//batch_size)
+    batches = [hashes[i::count] for i in range(count)]
+    source_batches = [[to_render[hash] for hash in batch] for batch in batches]
+
+    if count == 1:
+        outs = [_render_batch(source_batches[0])]
+    else:
+        with ThreadPool(min(jobs, count)) as pool:
+            outs = pool.map(_render_batch, source_batches)
+
+    for batch, batch_outs in zip(batches, outs):
+        for hash, svg in zip(batch, batch_outs):
+            _cache.add(hash, (None, svg), used=False)
+
+# Starts using the cache. If file is None, the cache is only kept in memory
+# for the duration of the run. Otherwise it's read from given file as needed
+# and saved back by close_cache(), evicting least recently used graphs if the
+# total size of the data exceeds max_size bytes.
+def open_cache(file, max_size=64*1024*1024):
+    global _cache
+
+    if _cache is not None: _cache.close()
+    _cache = svgcache.SvgCache(file, _cache_version, max_size)
+
+# Saves graphs rendered in this run, see svgcache.SvgCache.close() for
+# details. The cache is not used anymore after this call.
+def close_cache():
+    global _cache
+
+    if _cache is None: return
+    _cache.close()
+    _cache = None
+
+# Used by doxygen.py and python.py for recording graphs used by a particular
+# page, see svgcache.SvgCache.start_recording() for details.
+def start_cache_recording():
+    if _cache is None: return
+    _cache.start_recording()
+
+def stop_cache_recording():
+    if _cache is None: return {}
+    return _cache.stop_recording()
+
+def merge_cache(entries):
+    if _cache is None: return
+    _cache.merge(entries)
+
+# Marks given graphs as used so they're less likely to get evicted
+def touch_cache(hashes):
+    if _cache is None: return
+    _cache.touch(hashes)
+
+# Number of cache hits and misses since open_cache(), used for profiling
+def cache_stats():
+    if _cache is None: return 0, 0
+    return _cache.hits, _cache.misses
+
 def configure(font, font_size):
     global _font, _font_size, _text_src
     _font = font
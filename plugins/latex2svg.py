@@ -27,6 +27,16 @@ default_template = r"""
 \end{document}
 """
 
+# Used by latex2svg_batch(), each code snippet is wrapped in its own standalone
+# environment, creating a separate page
+default_batch_template = r"""
+\documentclass[{{ fontsize }}pt,preview,multi]{standalone}
+{{ preamble }}
+\begin{document}
+{{ code }}
+\end{document}
+"""
+
 default_preamble = r"""
 \usepackage[utf8x]{inputenc}
 \usepackage{amsmath}
@@ -42,6 +52,7 @@ dvisvgm_cmd = 'dvisvgm --no-fonts'
 default_params = {
     'fontsize': 12,  # pt
     'template': default_template,
+    'batch_template': default_batch_template,
     'preamble': default_preamble,
     'latex_cmd': latex_cmd,
     'dvisvgm_cmd': dvisvgm_cmd,
@@ -93,6 +104,94 @@ elif '.so.10' in str(libgs):
         else:
             raise RuntimeError('libgs found by linker magic, but is not in {}'.format(' or '.join(prefixes)))
 
+def _run_latex(params, working_directory, quiet=False):
+    # Run LaTeX and create DVI file
+    try:
+        ret = subprocess.run(shlex.split(params['latex_cmd']+' code.tex'),
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             cwd=working_directory)
+        # LaTeX prints errors on stdout instead of stderr (stderr is empty),
+        # so print stdout instead
+        if ret.returncode and not quiet: print(ret.stdout.decode('utf-8'))
+        ret.check_returncode()
+    except FileNotFoundError:
+        raise RuntimeError('latex not found')
+
+def _run_dvisvgm(params, args, working_directory, quiet=False):
+    # Add LIBGS to environment if supplied
+    env = os.environ.copy()
+    if params['libgs']:
+        env['LIBGS'] = params['libgs']
+
+    # Convert DVI to SVG
+    try:
+        ret = subprocess.run(shlex.split(params['dvisvgm_cmd']+' '+args),
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             cwd=working_directory, env=env)
+        if ret.returncode and not quiet: print(ret.stderr.decode('utf-8'))
+        ret.check_returncode()
+    except FileNotFoundError:
+        raise RuntimeError('dvisvgm not found')
+
+    output = ret.stderr.decode('utf-8')
+
+    # Since we rely on Ghostscript to give us a "depth" (= vertical alignment)
+    # value, dvisvgm not using it means the output would be broken and it makes
+    # no sense to continue.
+    if 'Ghostscript not found' in output:
+        raise RuntimeError('libgs not detected by dvisvgm, point the LIBGS environment variable to its location')
+
+    return output
+
+# Parse dvisvgm output for size and alignment
+def _get_size(output, fontsize):
+    regex = r'\b([0-9.]+)pt x ([0-9.]+)pt'
+    match = re.search(regex, output)
+    if match:
+        return (float(match.group(1)) / fontsize,
+                float(match.group(2)) / fontsize)
+    else:
+        return None, None
+
+def _get_measure(output, name, fontsize):
+    regex = r'\b%s=([0-9.e-]+)pt' % name
+    match = re.search(regex, output)
+    if match:
+        return float(match.group(1)) / fontsize
+    else:
+        return None
+
+# dvisvgm names glyphs `g<font>-<char>`, with font IDs depending on all fonts
+# in the DVI file, and pages `page<N>`, so the same formula rendered as a part
+# of a multi-page batch would get different IDs than when rendered alone. The
+# order of glyph definitions isn't stable either. To make the output depend
+# only on the formula itself, the fonts are renumbered in the order the page
+# first uses them, the glyph definitions are ordered the same way and the page
+# is always `page1`.
+_glyph_use_src = re.compile(r"xlink:href='#g(\d+)-(\d+)'")
+_glyph_def_src = re.compile(r"<path [^>]*\bid='g(\d+)-(\d+)'[^>]*/>\n?")
+_glyph_id_src = re.compile(r"(id='|xlink:href='#)g(\d+)-")
+_defs_src = re.compile(r"<defs>\n?(.*?)</defs>", re.DOTALL)
+_page_src = re.compile(r"id='page\d+'")
+
+def _normalize_ids(svg):
+    glyphs = {}
+    fonts = {}
+    for match in _glyph_use_src.finditer(svg):
+        glyphs.setdefault(match.groups(), len(glyphs))
+        fonts.setdefault(match.group(1), str(len(fonts)))
+
+    def sort_defs(match):
+        defs = list(_glyph_def_src.finditer(match.group(1)))
+        for i in defs: fonts.setdefault(i.group(1), str(len(fonts)))
+        defs.sort(key=lambda i: glyphs.get(i.groups(), len(glyphs)))
+        rest = _glyph_def_src.sub('', match.group(1))
+        return match.group(0).replace(match.group(1), ''.join(i.group(0) for i in defs) + rest)
+
+    svg = _defs_src.sub(sort_defs, svg, count=1)
+    svg = _glyph_id_src.sub(lambda match: '{}g{}-'.format(match.group(1), fonts.get(match.group(2), match.group(2))), svg)
+    return _page_src.sub("id='page1'", svg)
+
 def latex2svg(code, params=default_params, working_directory=None):
     """Convert LaTeX to SVG using dvisvgm.
 
@@ -128,65 +227,82 @@ def latex2svg(code, params=default_params, working_directory=None):
     with open(os.path.join(working_directory, 'code.tex'), 'w') as f:
         f.write(document)
 
-    # Run LaTeX and create DVI file
-    try:
-        ret = subprocess.run(shlex.split(params['latex_cmd']+' code.tex'),
-                             stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                             cwd=working_directory)
-        # LaTeX prints errors on stdout instead of stderr (stderr is empty),
-        # so print stdout instead
-        if ret.returncode: print(ret.stdout.decode('utf-8'))
-        ret.check_returncode()
-    except FileNotFoundError:
-        raise RuntimeError('latex not found')
+    _run_latex(params, working_directory)
+    output = _run_dvisvgm(params, 'code.dvi', working_directory)
 
-    # Add LIBGS to environment if supplied
-    env = os.environ.copy()
-    if params['libgs']:
-        env['LIBGS'] = params['libgs']
+    with open(os.path.join(working_directory, 'code.svg'), 'r') as f:
+        svg = _normalize_ids(f.read())
 
-    # Convert DVI to SVG
-    try:
-        ret = subprocess.run(shlex.split(params['dvisvgm_cmd']+' code.dvi'),
-                             stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                             cwd=working_directory, env=env)
-        if ret.returncode: print(ret.stderr.decode('utf-8'))
-        ret.check_returncode()
-    except FileNotFoundError:
-        raise RuntimeError('dvisvgm not found')
+    width, height = _get_size(output, fontsize)
+    depth = _get_measure(output, 'depth', fontsize)
+    return {'svg': svg, 'depth': depth, 'width': width, 'height': height}
 
-    with open(os.path.join(working_directory, 'code.svg'), 'r') as f:
-        svg = f.read()
-
-    # Parse dvisvgm output for size and alignment
-    def get_size(output):
-        regex = r'\b([0-9.]+)pt x ([0-9.]+)pt'
-        match = re.search(regex, output)
-        if match:
-            return (float(match.group(1)) / fontsize,
-                    float(match.group(2)) / fontsize)
-        else:
-            return None, None
 
-    def get_measure(output, name):
-        regex = r'\b%s=([0-9.e-]+)pt' % name
-        match = re.search(regex, output)
-        if match:
-            return float(match.group(1)) / fontsize
-        else:
-            return None
+def latex2svg_batch(codes, params=default_params, working_directory=None):
+    """Convert multiple LaTeX snippets to SVG using a single LaTeX and dvisvgm
+    invocation.
 
-    output = ret.stderr.decode('utf-8')
+    Each snippet is put on a separate page of one DVI file using the
+    `batch_template` parameter, which is then converted by dvisvgm at once and
+    split back using the per-page size and depth information it reports. The
+    SVG of each snippet is the same as when rendered alone with `latex2svg()`.
+    Unlike `latex2svg()`, errors are not printed, only raised.
 
-    # Since we rely on Ghostscript to give us a "depth" (= vertical alignment)
-    # value, dvisvgm not using it means the output would be broken and it makes
-    # no sense to continue.
-    if 'Ghostscript not found' in output:
-        raise RuntimeError('libgs not detected by dvisvgm, point the LIBGS environment variable to its location')
+    Parameters
+    ----------
+    codes : list of str
+        LaTeX code snippets to render.
+    params : dict
+        Conversion parameters.
+    working_directory : str or None
+        Working directory for external commands and place for temporary files.
 
-    width, height = get_size(output)
-    depth = get_measure(output, 'depth')
-    return {'svg': svg, 'depth': depth, 'width': width, 'height': height}
+    Returns
+    -------
+    list
+        List of dictionaries in the same format as returned from `latex2svg()`,
+        in the same order as `codes`.
+    """
+    if not codes:
+        return []
+
+    if working_directory is None:
+        with TemporaryDirectory() as tmpdir:
+            return latex2svg_batch(codes, params, working_directory=tmpdir)
+
+    fontsize = params['fontsize']
+    code = ''.join('\\begin{{standalone}}\n{}\n\\end{{standalone}}\n'.format(code)
+                   for code in codes)
+    document = (params.get('batch_template', default_batch_template)
+                .replace('{{ preamble }}', params['preamble'])
+                .replace('{{ fontsize }}', str(fontsize))
+                .replace('{{ code }}', code))
+
+    with open(os.path.join(working_directory, 'code.tex'), 'w') as f:
+        f.write(document)
+
+    _run_latex(params, working_directory, quiet=True)
+    output = _run_dvisvgm(params, '--page=1- --output=%f-%p code.dvi',
+                          working_directory, quiet=True)
+
+    # The output for each page starts with "processing page N" and lists the
+    # size, depth and name of the file it was written to
+    pages = re.split(r'^processing page \d+', output, flags=re.MULTILINE)[1:]
+    if len(pages) != len(codes):
+        raise RuntimeError('expected {} pages from dvisvgm, got {}'.format(len(codes), len(pages)))
+
+    out = []
+    for page in pages:
+        match = re.search(r'output written to (\S+\.svg)', page)
+        if not match:
+            raise RuntimeError('dvisvgm output file not found')
+        with open(os.path.join(working_directory, match.group(1)), 'r') as f:
+            svg = _normalize_ids(f.read())
+
+        width, height = _get_size(page, fontsize)
+        depth = _get_measure(page, 'depth', fontsize)
+        out += [{'svg': svg, 'depth': depth, 'width': width, 'height': height}]
+    return out
 
 
 def main():
@@ -24,11 +24,14 @@
 #
 
 import html
-import pickle
 import re
+import subprocess
+from collections import ChainMap
+from multiprocessing.pool import ThreadPool
 from hashlib import sha1
 
 import latex2svg
+import svgcache
 
 # Extracted common code used by both doxygen.py and the m.math plugin to
 # avoid dependency of doxygen.py on Pelican
@@ -118,59 +121,133 @@ _unique_dst = r"""\g<name>='\g<ref>eq{counter}-\g<id>'"""
 # Reset back to zero on start of a new page for reproducible behavior.
 counter = 0
 
-# Cache for rendered formulas (source formula sha1 -> (depth, svg data)). The
-# counter is not included
-_cache_version = 0
+# Cache for rendered formulas, an svgcache.SvgCache keyed by a hash of the
+# formula source and of the params used to render it, so different preambles
+# or font sizes never share entries. The counter is not included. If it's
+# None, the cache is not used at all. Version 2 has the SVG IDs normalized,
+# see latex2svg._normalize_ids().
+_cache_version = 2
 _cache = None
+_cache_params_hash = b''
+
+def cache_key(formula):
+    return sha1(_cache_params_hash + formula.encode('utf-8')).digest()
+
+def _params_hash():
+    # The path to libgs doesn't affect the output
+    return sha1(repr(sorted((key, value) for key, value in params.items() if key != 'libgs')).encode('utf-8')).digest()
 
 # Fetch cached formula or render it and add to the cache. The formula has to
 # be already wrapped in $, $$ etc. environment.
 def fetch_cached_or_render(formula):
-    global _cache
-
     # Cache not used, pass through
-    if not _cache:
+    if _cache is None:
         out = latex2svg.latex2svg(formula, params=params)
         return out['depth'], out['svg']
 
-    hash = sha1(formula.encode('utf-8')).digest()
-    if not hash in _cache[2]:
+    hash = cache_key(formula)
+    entry = _cache.get(hash)
+    if entry is None:
         out = latex2svg.latex2svg(formula, params=params)
-        _cache[2][hash] = (_cache[1], out['depth'], out['svg'])
-    else:
-        _cache[2][hash] = (_cache[1], _cache[2][hash][1], _cache[2][hash][2])
-    return (_cache[2][hash][1], _cache[2][hash][2])
+        entry = (out['depth'], out['svg'])
+        _cache.add(hash, entry)
+    return entry
 
-def unpickle_cache(file):
-    global _cache
+# Used by prerender() for rendering a batch in a worker thread. Returns an
+# empty list if the batch failed.
+def _render_batch(formulas):
+    try:
+        return latex2svg.latex2svg_batch(formulas, params=params)
+    except (subprocess.CalledProcessError, RuntimeError):
+        return []
+
+# Renders all formulas that are not in the cache yet and puts them into the
+# cache, so the following fetch_cached_or_render() calls for them are just
+# cache lookups. The formulas are deduplicated and rendered in batches with a
+# single LaTeX and dvisvgm invocation each, as spawning the processes is what
+# takes most of the time. With more than one job, the batches are rendered in
+# parallel. Threads are enough for that, as all the work is done by the
+# external processes. If a batch fails (for example because one of the
+# formulas has an error), nothing from it is put into the cache and the
+# formulas get rendered one by one by fetch_cached_or_render(), reporting the
+# error for the formula that caused it. How the formulas get split into
+# batches depends on the job count and on what's cached already, but the SVGs
+# don't, as latex2svg normalizes the IDs in them.
+def prerender(formulas, jobs=1, batch_size=250):
+    if _cache is None: return
 
-    if file:
-        with open(file, 'rb') as f:
-            _cache = pickle.load(f)
+    to_render = {}
+    for formula in formulas:
+        to_render[cache_key(formula)] = formula
+    _cache.lookup(list(to_render.keys()))
+    for hash in _cache.entries.keys() & to_render.keys():
+        del to_render[hash]
+
+    # Nothing to gain for a single formula, leave it to
+    # fetch_cached_or_render()
+    if len(to_render) < 2: return
+
+    # Split the formulas evenly among the jobs, but don't put too many into a
+    # single batch so a broken formula doesn't cause too many others to be
+    # rendered one by one
+    hashes = list(to_render.keys())
+    count = max(min(jobs, len(hashes)), (len(hashes) + batch_size - 1)//batch_size)
+    batches = [hashes[i::count] for i in range(count)]
+    formula_batches = [[to_render[hash] for hash in batch] for batch in batches]
+
+    if count == 1:
+        outs = [_render_batch(formula_batches[0])]
     else:
-        _cache = None
+        with ThreadPool(min(jobs, count)) as pool:
+            outs = pool.map(_render_batch, formula_batches)
+
+    for batch, batch_outs in zip(batches, outs):
+        for hash, out in zip(batch, batch_outs):
+            _cache.add(hash, (out['depth'], out['svg']), used=False)
 
-    # Reset the cache if not valid or not expected version
-    if not _cache or _cache[0] != _cache_version:
-        _cache = (_cache_version, 0, {})
+# Starts using the cache. If file is None, the cache is only kept in memory
+# for the duration of the run. Otherwise it's read from given file as needed
+# and saved back by close_cache(), evicting least recently used formulas if
+# the total size of the data exceeds max_size bytes.
+def open_cache(file, max_size=64*1024*1024):
+    global _cache, _cache_params_hash
 
-    # Otherwise bump cache age
-    else: _cache = (_cache[0], _cache[1] + 1, _cache[2])
+    if _cache is not None: _cache.close()
+    _cache = svgcache.SvgCache(file, _cache_version, max_size)
+    _cache_params_hash = _params_hash()
 
-def pickle_cache(file):
+# Saves formulas rendered in this run, see svgcache.SvgCache.close() for
+# details. The cache is not used anymore after this call.
+def close_cache():
     global _cache
 
-    # Don't save any file if there is nothing
-    if not _cache or not _cache[2]: return
+    if _cache is None: return
+    _cache.close()
+    _cache = None
+
+# Used by doxygen.py and python.py for recording formulas used by a
+# particular page, see svgcache.SvgCache.start_recording() for details.
+def start_cache_recording():
+    if _cache is None: return
+    _cache.start_recording()
+
+def stop_cache_recording():
+    if _cache is None: return {}
+    return _cache.stop_recording()
+
+def merge_cache(entries):
+    if _cache is None: return
+    _cache.merge(entries)
 
-    # Prune entries that were not used
-    cache_to_save = (_cache_version, _cache[1], {})
-    for hash, entry in _cache[2].items():
-        if entry[0] != _cache[1]: continue
-        cache_to_save[2][hash] = entry
+# Marks given formulas as used so they're less likely to get evicted
+def touch_cache(hashes):
+    if _cache is None: return
+    _cache.touch(hashes)
 
-    with open(file, 'wb') as f:
-        pickle.dump(cache_to_save, f)
+# Number of cache hits and misses since open_cache(), used for profiling
+def cache_stats():
+    if _cache is None: return 0, 0
+    return _cache.hits, _cache.misses
 
 # Patches the output from dvisvgm
 def patch(formula, svg, depth, attribs):
@@ -33,9 +33,7 @@ from docutils.parsers.rst import Directive, directives
 import docutils.parsers.rst.directives.misc
 from docutils import io, nodes, utils, statemachine
 
-from pygments import highlight
-from pygments.formatters import HtmlFormatter
-from pygments.lexers import TextLexer, BashSessionLexer, get_lexer_by_name
+from pygments.lexers import TextLexer, BashSessionLexer
 
 import logging
 
@@ -43,6 +41,7 @@ logger = logging.getLogger(__name__)
 
 try:
     import ansilexer
+    import pygmentsextra
 except ImportError:
     # The above worked well on Pelican 4.2 and before, and also works with
     # other m.css tools like the Python doc generator. Pelican 4.5.0 changed to
@@ -64,20 +63,16 @@ except ImportError:
     import sys
     sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
     import ansilexer
+    import pygmentsextra
 
 filters_pre = None
 filters_post = None
 
 def _highlight(code, language, options, *, is_block, filters=[]):
-    # Use our own lexer for ANSI
-    if language == 'ansi':
-        lexer = ansilexer.AnsiLexer()
-    else:
-        try:
-            lexer = get_lexer_by_name(language)
-        except ValueError:
-            logger.warning("No lexer found for language '{}', code highlighting disabled".format(language))
-            lexer = TextLexer()
+    lexer = pygmentsextra.lexer_by_name(language)
+    if lexer is None:
+        logger.warning("No lexer found for language '{}', code highlighting disabled".format(language))
+        lexer = TextLexer()
 
     if (isinstance(lexer, BashSessionLexer) or
         isinstance(lexer, ansilexer.AnsiLexer)):
@@ -90,11 +85,6 @@ def _highlight(code, language, options, *, is_block, filters=[]):
         options['hl_lines'] = options['hl-lines']
         del options['hl-lines']
 
-    if isinstance(lexer, ansilexer.AnsiLexer):
-        formatter = ansilexer.HtmlAnsiFormatter(**options)
-    else:
-        formatter = HtmlFormatter(nowrap=True, **options)
-
     global filters_pre
     # First apply local pre filters, if any
     for filter in filters:
@@ -104,7 +94,7 @@ def _highlight(code, language, options, *, is_block, filters=[]):
     f = filters_pre.get(lexer.name)
     if f: code = f(code)
 
-    highlighted = highlight(code, lexer, formatter).rstrip()
+    highlighted = pygmentsextra.highlight(code, lexer, options).rstrip()
     # Strip whitespace around if inline code, strip only trailing whitespace if
     # a block
     if not is_block: highlighted = highlighted.lstrip()
@@ -319,7 +309,16 @@ code.options = {'class': directives.class_option,
                 'language': directives.unchanged,
                 'filters': directives.unchanged}
 
-def register_mcss(mcss_settings, **kwargs):
+def save_cache(*args, **kwargs):
+    pygmentsextra.close_cache()
+
+def register_mcss(mcss_settings, hooks_post_run=None, **kwargs):
+    cache_file = mcss_settings.get('M_CODE_CACHE_FILE')
+    if cache_file:
+        cache_file = os.path.join(mcss_settings.get('INPUT', ''), cache_file)
+    pygmentsextra.open_cache(cache_file or None, mcss_settings.get('M_CODE_CACHE_SIZE', 64*1024*1024))
+    if hooks_post_run is not None: hooks_post_run += [save_cache]
+
     rst.directives.register_directive('code', Code)
     rst.directives.register_directive('include', Include)
     rst.roles.register_canonical_role('code', code)
@@ -341,7 +340,7 @@ def register_mcss(mcss_settings, **kwargs):
 
 def _pelican_configure(pelicanobj):
     settings = {}
-    for key in ['M_CODE_FILTERS_PRE', 'M_CODE_FILTERS_POST']:
+    for key in ['M_CODE_FILTERS_PRE', 'M_CODE_FILTERS_POST', 'M_CODE_CACHE_FILE', 'M_CODE_CACHE_SIZE']:
         if key in pelicanobj.settings: settings[key] = pelicanobj.settings[key]
 
     register_mcss(mcss_settings=settings)
@@ -350,3 +349,4 @@ def register(): # for Pelican
     from pelican import signals
 
     signals.initialized.connect(_pelican_configure)
+    signals.finalized.connect(save_cache)
@@ -23,6 +23,7 @@
 #   DEALINGS IN THE SOFTWARE.
 #
 
+import os
 import re
 import subprocess
 
@@ -111,10 +112,20 @@ class StrictGraph(Dot):
             self.arguments[0] if self.arguments else '',
             '\n'.join(self.content)))
 
-def register_mcss(mcss_settings, **kwargs):
+def save_cache(*args, **kwargs):
+    dot2svg.close_cache()
+
+def register_mcss(mcss_settings, hooks_post_run=None, **kwargs):
     dot2svg.configure(
         mcss_settings.get('M_DOT_FONT', 'Source Sans Pro'),
         mcss_settings.get('M_DOT_FONT_SIZE', 16.0))
+
+    cache_file = mcss_settings.get('M_DOT_CACHE_FILE')
+    if cache_file:
+        cache_file = os.path.join(mcss_settings.get('INPUT', ''), cache_file)
+    dot2svg.open_cache(cache_file or None, mcss_settings.get('M_DOT_CACHE_SIZE', 64*1024*1024))
+    if hooks_post_run is not None: hooks_post_run += [save_cache]
+
     rst.directives.register_directive('digraph', Digraph)
     rst.directives.register_directive('strict-digraph', StrictDigraph)
     rst.directives.register_directive('graph', Graph)
@@ -130,3 +141,4 @@ def register(): # for Pelican
     from pelican import signals
 
     signals.initialized.connect(_pelican_configure)
+    signals.finalized.connect(save_cache)
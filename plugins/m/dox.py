@@ -29,8 +29,12 @@ from docutils.parsers import rst
 from docutils.parsers.rst.roles import set_classes
 
 import xml.etree.ElementTree as ET
+import array
+import mmap
 import os
 import re
+import sys
+from hashlib import sha1
 
 import logging
 
@@ -50,15 +54,194 @@ def parse_link(text):
 
     return title, link, hash
 
-def init(tagfiles, input):
-    global symbol_mapping, symbol_prefixes, tagfile_basenames
-
-    # Pre-round to populate subclasses. Clear everything in case we init'd
-    # before already.
+# Parses a tagfile into a dict of symbol names and (title, link) tuples, with
+# the link relative to the tagfile URL
+def parse_tagfile(file):
+    symbols = {}
+    tree = ET.parse(file)
+    root = tree.getroot()
+    for child in root:
+        if child.tag == 'compound' and 'kind' in child.attrib:
+            # Linking to pages
+            if child.attrib['kind'] == 'page':
+                link = child.find('filename').text + '.html'
+                symbols[child.find('name').text] = (child.find('title').text, link)
+
+            # Linking to files
+            if child.attrib['kind'] == 'file':
+                file_path = child.find('path')
+                link = child.find('filename').text
+                symbols[(file_path.text if file_path is not None else '') + child.find('name').text] = (None, link)
+
+                for member in child.findall('member'):
+                    if not 'kind' in member.attrib: continue
+
+                    # Preprocessor defines and macros
+                    if member.attrib['kind'] == 'define':
+                        symbols[member.find('name').text + ('()' if member.find('arglist').text else '')] = (None, link + '#' + member.find('anchor').text)
+
+            # Linking to namespaces, structs and classes
+            if child.attrib['kind'] in ['class', 'struct', 'namespace']:
+                name = child.find('name').text
+                # The cppreference tag file has <filename> empty
+                link = child.findtext('filename')
+                symbols[name] = (None, link)
+                for member in child.findall('member'):
+                    if not 'kind' in member.attrib: continue
+
+                    # In case of the cppreference tag file, <compound>
+                    # <filename> is empty, and <anchorfile> inside <member>
+                    # is used instead. Doxygen fills both, so use
+                    # <anchorfile> to cover both cases.
+                    link = member.find('anchorfile').text
+
+                    # Typedefs, constants, variables
+                    if member.attrib['kind'] in ['typedef', 'enumvalue', 'variable']:
+                        symbols[name + '::' + member.find('name').text] = (None, link + ('#' + member.findtext('anchor') if member.findtext('anchor') else ''))
+
+                    # Functions
+                    if member.attrib['kind'] == 'function':
+                        # <filename> can be empty (cppreference tag file)
+                        symbols[name + '::' + member.find('name').text + "()"] = (None, link + ('#' + member.findtext('anchor') if member.findtext('anchor') else ''))
+
+                    # Enums with values
+                    if member.attrib['kind'] == 'enumeration':
+                        enumeration = name + '::' + member.find('name').text
+                        symbols[enumeration] = (None, link + '#' + member.find('anchor').text)
+
+                        for value in member.findall('enumvalue'):
+                            symbols[enumeration + '::' + value.text] = (None, link + '#' + value.attrib['anchor'])
+
+            # Sections. While rather strange, these reuse the `link`
+            # variable defined by whatever came earlier --- because pages
+            # have it with implicit `.html` but e.g. files with explicit
+            # `.html`. TODO: fix more robustly
+            for section in child.findall('docanchor'):
+                symbols[section.text] = (section.attrib.get('title', ''), link + '#' + section.text)
+
+    return symbols
+
+# A precompiled tagfile index, built from the output of parse_tagfile() and
+# memory-mapped, so it's neither needed to parse the tagfile again nor to
+# create a dict with all symbols on every run. Names are sorted and looked up
+# with a binary search. After a header with the symbol count, there's an
+# array of N + 1 offsets to names and another of N + 1 offsets to values,
+# followed by the name and value data. A value is a zero byte followed by the
+# link for symbols without a title, or a one byte, the title, a zero byte and
+# the link otherwise. The offsets are in native byte order, which is included
+# in the header so a file created on a different machine isn't used.
+_index_magic = 'm.dox index v1 {}\n'.format(sys.byteorder).encode('utf-8')
+
+def write_tagfile_index(file, symbols):
+    names = sorted((name.encode('utf-8'), value) for name, value in symbols.items())
+    name_offsets = array.array('I', [0])
+    value_offsets = array.array('I', [0])
+    name_data = bytearray()
+    value_data = bytearray()
+    for name, (title, link) in names:
+        name_data += name
+        name_offsets.append(len(name_data))
+        if title is None:
+            value_data += b'\0'
+        else:
+            value_data += b'\1' + title.encode('utf-8') + b'\0'
+        value_data += link.encode('utf-8')
+        value_offsets.append(len(value_data))
+
+    # Write to a temporary file first so a parallel build never sees a
+    # partially written file
+    with open(file + '.tmp', 'wb') as f:
+        f.write(_index_magic)
+        f.write(array.array('I', [len(names)]).tobytes())
+        f.write(name_offsets.tobytes())
+        f.write(value_offsets.tobytes())
+        f.write(name_data)
+        f.write(value_data)
+    os.replace(file + '.tmp', file)
+
+class TagfileIndex:
+    def __init__(self, file):
+        with open(file, 'rb') as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._data[:len(_index_magic)] != _index_magic:
+            raise ValueError("invalid tagfile index header")
+
+        offset = len(_index_magic)
+        self._count = memoryview(self._data)[offset:offset + 4].cast('I')[0]
+        offset += 4
+        self._name_offsets = memoryview(self._data)[offset:offset + 4*(self._count + 1)].cast('I')
+        offset += 4*(self._count + 1)
+        self._value_offsets = memoryview(self._data)[offset:offset + 4*(self._count + 1)].cast('I')
+        offset += 4*(self._count + 1)
+        self._names = offset
+        self._values = offset + self._name_offsets[self._count]
+
+    def close(self):
+        # The memoryviews have to be released before the map can be closed
+        self._name_offsets.release()
+        self._value_offsets.release()
+        self._data.close()
+
+    def _name(self, i):
+        return self._data[self._names + self._name_offsets[i]:self._names + self._name_offsets[i + 1]]
+
+    # Returns a (title, link) tuple or None if the name is not there
+    def get(self, name):
+        name = name.encode('utf-8')
+        begin = 0
+        end = self._count
+        while begin < end:
+            middle = (begin + end)//2
+            if self._name(middle) < name: begin = middle + 1
+            else: end = middle
+        if begin == self._count or self._name(begin) != name: return None
+
+        value = self._data[self._values + self._value_offsets[begin]:self._values + self._value_offsets[begin + 1]].decode('utf-8')
+        if value[0] == '\0': return None, value[1:]
+        title, _, link = value[1:].partition('\0')
+        return title, link
+
+# Indices opened by the previous init(), closed on the next one
+_indices = []
+
+# Returns a function looking up symbols in given tagfile. If cache_dir is set,
+# the tagfile is parsed only if there's no index for it in the cache dir yet,
+# otherwise it's parsed every time. The index is looked up by a hash of the
+# tagfile contents, so it doesn't need to be invalidated in any way.
+def _load_tagfile(file, cache_dir, used):
+    if not cache_dir: return parse_tagfile(file).get
+
+    with open(file, 'rb') as f:
+        index_file = os.path.join(cache_dir, sha1(f.read()).hexdigest() + '.index')
+    used.add(index_file)
+
+    if os.path.exists(index_file):
+        try:
+            index = TagfileIndex(index_file)
+            _indices.append(index)
+            return index.get
+        except (OSError, ValueError) as e:
+            logger.warning("can't load tagfile index {}, creating it again: {}".format(index_file, e))
+
+    symbols = parse_tagfile(file)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        write_tagfile_index(index_file, symbols)
+    except OSError as e:
+        logger.warning("can't save tagfile index {}: {}".format(index_file, e))
+    return symbols.get
+
+def init(tagfiles, input, cache_dir=None):
+    global symbol_lookups, symbol_prefixes, tagfile_basenames
+
+    # Clear everything in case we init'd before already
+    for index in _indices: index.close()
+    del _indices[:]
     tagfile_basenames = []
-    symbol_mapping = {}
+    symbol_lookups = []
     symbol_prefixes = ['']
 
+    used = set()
     for f in tagfiles:
         tagfile, path = f[:2]
         prefixes = f[2] if len(f) > 2 else []
@@ -67,66 +250,26 @@ def init(tagfiles, input):
         tagfile_basenames += [(os.path.splitext(os.path.basename(tagfile))[0], path, css_classes)]
         symbol_prefixes += prefixes
 
-        tree = ET.parse(os.path.join(input, tagfile))
-        root = tree.getroot()
-        for child in root:
-            if child.tag == 'compound' and 'kind' in child.attrib:
-                # Linking to pages
-                if child.attrib['kind'] == 'page':
-                    link = path + child.find('filename').text + '.html'
-                    symbol_mapping[child.find('name').text] = (child.find('title').text, link, css_classes)
-
-                # Linking to files
-                if child.attrib['kind'] == 'file':
-                    file_path = child.find('path')
-                    link = path + child.find('filename').text
-                    symbol_mapping[(file_path.text if file_path is not None else '') + child.find('name').text] = (None, link, css_classes)
-
-                    for member in child.findall('member'):
-                        if not 'kind' in member.attrib: continue
-
-                        # Preprocessor defines and macros
-                        if member.attrib['kind'] == 'define':
-                            symbol_mapping[member.find('name').text + ('()' if member.find('arglist').text else '')] = (None, link + '#' + member.find('anchor').text, css_classes)
-
-                # Linking to namespaces, structs and classes
-                if child.attrib['kind'] in ['class', 'struct', 'namespace']:
-                    name = child.find('name').text
-                    # The cppreference tag file has <filename> empty
-                    link = path + child.findtext('filename')
-                    symbol_mapping[name] = (None, link, css_classes)
-                    for member in child.findall('member'):
-                        if not 'kind' in member.attrib: continue
-
-                        # In case of the cppreference tag file, <compound>
-                        # <filename> is empty, and <anchorfile> inside <member>
-                        # is used instead. Doxygen fills both, so use
-                        # <anchorfile> to cover both cases.
-                        link = path + member.find('anchorfile').text
-
-                        # Typedefs, constants, variables
-                        if member.attrib['kind'] in ['typedef', 'enumvalue', 'variable']:
-                            symbol_mapping[name + '::' + member.find('name').text] = (None, link + ('#' + member.findtext('anchor') if member.findtext('anchor') else ''), css_classes)
-
-                        # Functions
-                        if member.attrib['kind'] == 'function':
-                            # <filename> can be empty (cppreference tag file)
-                            symbol_mapping[name + '::' + member.find('name').text + "()"] = (None, link + ('#' + member.findtext('anchor') if member.findtext('anchor') else ''), css_classes)
-
-                        # Enums with values
-                        if member.attrib['kind'] == 'enumeration':
-                            enumeration = name + '::' + member.find('name').text
-                            symbol_mapping[enumeration] = (None, link + '#' + member.find('anchor').text, css_classes)
-
-                            for value in member.findall('enumvalue'):
-                                symbol_mapping[enumeration + '::' + value.text] = (None, link + '#' + value.attrib['anchor'], css_classes)
-
-                # Sections. While rather strange, these reuse the `link`
-                # variable defined by whatever came earlier --- because pages
-                # have it with implicit `.html` but e.g. files with explicit
-                # `.html`. TODO: fix more robustly
-                for section in child.findall('docanchor'):
-                    symbol_mapping[section.text] = (section.attrib.get('title', ''), link + '#' + section.text, css_classes)
+        # Later tagfiles override symbols from earlier ones, so they're
+        # looked up first
+        symbol_lookups.insert(0, (_load_tagfile(os.path.join(input, tagfile), cache_dir, used), path, css_classes))
+
+    # Remove indices of tagfiles that are not used anymore
+    if cache_dir and os.path.isdir(cache_dir):
+        for file in os.listdir(cache_dir):
+            file = os.path.join(cache_dir, file)
+            if file.endswith('.index') and file not in used:
+                os.remove(file)
+
+# Returns a (title, URL, CSS classes) tuple for given symbol or None if it's
+# not found
+def _find_symbol(name):
+    for lookup, path, css_classes in symbol_lookups:
+        found = lookup(name)
+        if found is not None:
+            title, link = found
+            return title, path + link, css_classes
+    return None
 
 def dox(name, rawtext, text, lineno, inliner: Inliner, options={}, content=[]):
     title, target, hash = parse_link(text)
@@ -150,8 +293,9 @@ def dox(name, rawtext, text, lineno, inliner: Inliner, options={}, content=[]):
             return [node], []
 
     for prefix in symbol_prefixes:
-        if prefix + target in symbol_mapping:
-            link_title, url, css_classes = symbol_mapping[prefix + target]
+        found = _find_symbol(prefix + target)
+        if found is not None:
+            link_title, url, css_classes = found
             if title:
                 use_title = title
             elif link_title:
@@ -181,8 +325,10 @@ def dox(name, rawtext, text, lineno, inliner: Inliner, options={}, content=[]):
 def register_mcss(mcss_settings, **kwargs):
     rst.roles.register_local_role('dox', dox)
 
+    cache_dir = mcss_settings.get('M_DOX_CACHE_DIR')
     init(input=mcss_settings['INPUT'],
-         tagfiles=mcss_settings.get('M_DOX_TAGFILES', []))
+         tagfiles=mcss_settings.get('M_DOX_TAGFILES', []),
+         cache_dir=os.path.join(mcss_settings['INPUT'], cache_dir) if cache_dir else None)
 
 # Below is only Pelican-specific functionality. If Pelican is not found, these
 # do nothing.
@@ -192,7 +338,7 @@ def _pelican_configure(pelicanobj):
         # For backwards compatibility, the input directory is pelican's CWD
         'INPUT': os.getcwd(),
     }
-    for key in ['M_DOX_TAGFILES']:
+    for key in ['M_DOX_TAGFILES', 'M_DOX_CACHE_DIR']:
         if key in pelicanobj.settings: settings[key] = pelicanobj.settings[key]
 
     register_mcss(mcss_settings=settings)
@@ -27,11 +27,13 @@ import copy
 import html
 import os
 import re
+import textwrap
 
 from docutils import nodes, utils
 from docutils.parsers import rst
 from docutils.parsers.rst import directives
 from docutils.parsers.rst.roles import set_classes
+from docutils.transforms import Transform
 
 try:
     import latex2svg
@@ -49,11 +51,17 @@ except ImportError:
 default_settings = {
     'INPUT': '',
     'M_MATH_RENDER_AS_CODE': False,
-    'M_MATH_CACHE_FILE': 'm.math.cache'
+    'M_MATH_CACHE_FILE': 'm.math.cache',
+    'M_MATH_CACHE_SIZE': 64*1024*1024,
+    'M_MATH_JOBS': 0
 }
 
 settings = None
 
+# Doc contents dicts passed from the Python doc generator, scanned for formulas
+# in prerender_python()
+doc_contents = []
+
 def _is_math_figure(parent):
     # The parent has to be a figure, marked as m-figure
     if not isinstance(parent, nodes.figure): return False
@@ -65,6 +73,34 @@ def _is_math_figure(parent):
 
     return True
 
+# Formulas are not rendered right away but only once the whole document is
+# parsed, so all formulas that are not cached yet can be rendered with a
+# single LaTeX and dvisvgm invocation. Until then, the raw node contains just
+# what's needed for rendering in an attribute.
+def _deferred_math(document, rawsource, formula, title, inline, attribs, **options):
+    if not getattr(document, 'm_math_deferred', False):
+        document.transformer.add_transform(RenderMath)
+        document.m_math_deferred = True
+
+    node = nodes.raw(rawsource, '', format='html', **options)
+    node['m-math'] = (formula, title, inline, attribs)
+    return node
+
+class RenderMath(Transform):
+    # Run after substitutions and such are resolved, so formulas copied
+    # around are rendered as well
+    default_priority = 900
+
+    def apply(self):
+        pending = [node for node in self.document.traverse(nodes.raw) if 'm-math' in node]
+        latex2svgextra.prerender([node['m-math'][0] for node in pending])
+
+        for node in pending:
+            formula, title, inline, attribs = node['m-math']
+            del node['m-math']
+            depth, svg = latex2svgextra.fetch_cached_or_render(formula)
+            node.append(nodes.Text(latex2svgextra.patch(title, svg, depth if inline else None, attribs)))
+
 class Math(rst.Directive):
     option_spec = {'class': directives.class_option,
                    'name': directives.unchanged}
@@ -90,18 +126,16 @@ class Math(rst.Directive):
 
         content = '\n'.join(self.content)
 
-        _, svg = latex2svgextra.fetch_cached_or_render("$$" + content + "$$")
-
         # If this is the first real node inside a math figure, put the SVG
         # directly inside
         if _is_math_figure(parent):
-            node = nodes.raw(self.block_text, latex2svgextra.patch(content, svg, None, ' class="{}"'.format(' '.join(['m-math'] + self.options.get('classes', [])))), format='html')
+            node = _deferred_math(self.state.document, self.block_text, "$$" + content + "$$", content, False, ' class="{}"'.format(' '.join(['m-math'] + self.options.get('classes', []))))
             node.line = self.content_offset + 1
             self.add_name(node)
             return [node]
 
         # Otherwise wrap it in a <div class="m-math">
-        node = nodes.raw(self.block_text, latex2svgextra.patch(content, svg, None, ''), format='html')
+        node = _deferred_math(self.state.document, self.block_text, "$$" + content + "$$", content, False, '')
         node.line = self.content_offset + 1
         self.add_name(node)
         container = nodes.container(**self.options)
@@ -136,18 +170,68 @@ def math(role, rawtext, text, lineno, inliner, options={}, content=[]):
         classes += ' ' + ' '.join(options['classes'])
         del options['classes']
 
-    depth, svg = latex2svgextra.fetch_cached_or_render("$" + text + "$")
-
     attribs = ' class="{}"'.format(classes)
-    node = nodes.raw(rawtext, latex2svgextra.patch(text, svg, depth, attribs), format='html', **options)
+    node = _deferred_math(inliner.document, rawtext, "$" + text + "$", text, True, attribs, **options)
     return [node], []
 
+_inline_src = re.compile(r':math[\w-]*:`(?P<formula>[^`]+)`')
+_block_src = re.compile(r'(?P<indent>\s*)\.\. math::\s*$')
+_option_src = re.compile(r'\s*:[^:]+:')
+
+# Collects formulas from reST source for the pre-render pass. Doesn't need to
+# be perfect -- anything that's missed gets rendered when the document is, and
+# anything extra is just rendered needlessly.
+def collect_formulas(source):
+    formulas = ['$' + match.group('formula') + '$' for match in _inline_src.finditer(source)]
+
+    lines = [line.rstrip() for line in source.splitlines()]
+    i = 0
+    while i < len(lines):
+        match = _block_src.match(lines[i])
+        i += 1
+        if not match: continue
+
+        # Directive content is everything that's indented more than the
+        # directive itself, except for the options at the start
+        indent = len(match.group('indent'))
+        while i < len(lines) and lines[i] and len(lines[i]) - len(lines[i].lstrip()) > indent and _option_src.match(lines[i]):
+            i += 1
+        block = []
+        while i < len(lines) and (not lines[i] or len(lines[i]) - len(lines[i].lstrip()) > indent):
+            block += [lines[i]]
+            i += 1
+        content = textwrap.dedent('\n'.join(block)).strip('\n')
+        if content: formulas += ['$$' + content + '$$']
+
+    return formulas
+
+def _prerender(sources):
+    if settings['M_MATH_RENDER_AS_CODE']: return
+
+    formulas = []
+    for source in sources: formulas += collect_formulas(source)
+    latex2svgextra.prerender(formulas, jobs=settings['M_MATH_JOBS'] or os.cpu_count() or 1)
+
+# Pre-render pass for the Python doc generator, collecting formulas from
+# docstrings, pages and external doc contents
+def prerender_python(name_map, **kwargs):
+    sources = []
+    for entry in name_map.values():
+        if isinstance(getattr(getattr(entry, 'object', None), '__doc__', None), str):
+            sources += [entry.object.__doc__]
+        if hasattr(entry, 'filename') and os.path.exists(entry.filename):
+            with open(entry.filename, 'r') as f:
+                sources += [f.read()]
+    for docs in doc_contents:
+        for doc in docs.values():
+            sources += [doc.get('summary') or '', doc.get('content') or '']
+    _prerender(sources)
+
 def save_cache(*args, **kwargs):
-    if settings['M_MATH_CACHE_FILE']:
-        latex2svgextra.pickle_cache(settings['M_MATH_CACHE_FILE'])
+    latex2svgextra.close_cache()
 
-def register_mcss(mcss_settings, hooks_pre_page, hooks_post_run, **kwargs):
-    global default_settings, settings
+def register_mcss(mcss_settings, hooks_pre_page, hooks_post_run, hooks_post_crawl=None, **kwargs):
+    global default_settings, settings, doc_contents
     settings = copy.deepcopy(default_settings)
     for key in settings.keys():
         if key in mcss_settings: settings[key] = mcss_settings[key]
@@ -155,15 +239,15 @@ def register_mcss(mcss_settings, hooks_pre_page, hooks_post_run, **kwargs):
     if settings['M_MATH_CACHE_FILE']:
         settings['M_MATH_CACHE_FILE'] = os.path.join(settings['INPUT'], settings['M_MATH_CACHE_FILE'])
 
-    # Ensure that cache is unpickled again if M_MATH_CACHE_FILE is *not* set --
+    # Ensure that cache is reset also if M_MATH_CACHE_FILE is *not* set --
     # otherwise tests will sporadically fail.
-    if settings['M_MATH_CACHE_FILE'] and os.path.exists(settings['M_MATH_CACHE_FILE']):
-        latex2svgextra.unpickle_cache(settings['M_MATH_CACHE_FILE'])
-    else:
-        latex2svgextra.unpickle_cache(None)
+    latex2svgextra.open_cache(settings['M_MATH_CACHE_FILE'] or None, settings['M_MATH_CACHE_SIZE'])
 
     hooks_pre_page += [new_page]
     hooks_post_run += [save_cache]
+    if hooks_post_crawl is not None:
+        doc_contents = [value for key, value in kwargs.items() if key.endswith('_doc_contents')]
+        hooks_post_crawl += [prerender_python]
 
     rst.directives.register_directive('math', Math)
     rst.roles.register_canonical_role('math', math)
@@ -174,6 +258,15 @@ def register_mcss(mcss_settings, hooks_pre_page, hooks_post_run, **kwargs):
 def _configure_pelican(pelicanobj):
     register_mcss(mcss_settings=pelicanobj.settings, hooks_pre_page=[], hooks_post_run=[])
 
+    # Pre-render formulas from all reST files in the content directory
+    sources = []
+    for dirpath, dirnames, filenames in os.walk(pelicanobj.settings['PATH']):
+        for filename in filenames:
+            if not filename.endswith('.rst'): continue
+            with open(os.path.join(dirpath, filename), 'r') as f:
+                sources += [f.read()]
+    _prerender(sources)
+
 def register():
     from pelican import signals
 
@@ -36,10 +36,14 @@ if __name__ == '__main__': # pragma: no cover
     sys.path.remove(os.path.realpath(os.path.dirname(__file__)))
 
 import argparse
+import io
 import logging
+import marshal
 import re
+import struct
+from hashlib import sha1
 from types import SimpleNamespace as Empty
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 from urllib.parse import urljoin
 import zlib
 
@@ -261,9 +265,13 @@ def parse_link(text):
 intersphinx_inventory = {}
 intersphinx_name_prefixes = []
 
+_inventory_line_re = re.compile(r'(?x)(.+?)\s+(\S*:\S*)\s+(-?\d+)\s+(\S+)\s+(.*)')
+
 # Basically a copy of sphinx.util.inventory.InventoryFile.load_v2. There's no
-# documentation for this, it seems.
-def parse_intersphinx_inventory(file, base_url, inventory, css_classes):
+# documentation for this, it seems. Returns a dict of types, each containing a
+# dict of names with a (location, title) tuple. The location is relative to
+# the base URL of the documentation.
+def parse_intersphinx_inventory_types(file) -> Dict[str, Dict[str, Tuple[str, str]]]:
     # Parse the header, uncompressed
     inventory_version = file.readline().rstrip()
     if inventory_version != b'# Sphinx inventory version 2':
@@ -276,9 +284,9 @@ def parse_intersphinx_inventory(file, base_url, inventory, css_classes):
         raise ValueError("invalid inventory header (not compressed): {}".format(line)) # pragma: no cover
 
     # Decompress the rest. Again mostly a copy of the sphinx code.
+    types = {}
     for line in zlib.decompress(file.read()).decode('utf-8').splitlines():
-        m = re.match(r'(?x)(.+?)\s+(\S*:\S*)\s+(-?\d+)\s+(\S+)\s+(.*)',
-                         line.rstrip())
+        m = _inventory_line_re.match(line.rstrip())
         if not m: # pragma: no cover
             print("wait what is this line?! {}".format(line))
             continue
@@ -290,16 +298,147 @@ def parse_intersphinx_inventory(file, base_url, inventory, css_classes):
 
         # The original code `continue`s in this case. I'm asserting. Fix your
         # docs.
-        assert not(type == 'py:module' and type in inventory and name in inventory[type]), "Well dang, we hit that bug in 1.1 that I didn't want to work around" # pragma: no cover
+        assert not(type == 'py:module' and type in types and name in types[type]), "Well dang, we hit that bug in 1.1 that I didn't want to work around" # pragma: no cover
 
-        # Prepend base URL and add to the inventory
-        inventory.setdefault(type, {})[name] = (urljoin(base_url, location), title, css_classes)
+        types.setdefault(type, {})[name] = (location, title)
 
-def parse_intersphinx_inventories(input, inventories):
+    return types
+
+def parse_intersphinx_inventory(file, base_url, inventory, css_classes):
+    for type, names in parse_intersphinx_inventory_types(file).items():
+        # Prepend base URL and add to the inventory
+        data = inventory.setdefault(type, {})
+        for name, (location, title) in names.items():
+            data[name] = (urljoin(base_url, location), title, css_classes)
+
+# The global inventory. Contents of each type are put together from all
+# inventories only when the type is first accessed, as parsing the names and
+# joining them with the base URL is what takes most of the time and usually
+# just a few types are ever needed.
+class _LazyInventory(dict):
+    def __init__(self):
+        dict.__init__(self)
+        self._pending: Dict[str, List[Tuple[Callable, str, List[str]]]] = {}
+
+    # Adds a type from given inventory. The load function returns its
+    # contents in the form returned by parse_intersphinx_inventory_types().
+    def add(self, type, load, base_url, css_classes):
+        dict.setdefault(self, type, {})
+        self._pending.setdefault(type, []).append((load, base_url, css_classes))
+
+    def _load(self, type):
+        pending = self._pending.pop(type, None)
+        if pending is None: return
+
+        data = dict.__getitem__(self, type)
+        for load, base_url, css_classes in pending:
+            for name, (location, title) in load().items():
+                data[name] = (urljoin(base_url, location), title, css_classes)
+
+    def __getitem__(self, type):
+        self._load(type)
+        return dict.__getitem__(self, type)
+
+    def get(self, type, default=None):
+        self._load(type)
+        return dict.get(self, type, default)
+
+    def setdefault(self, type, default=None):
+        self._load(type)
+        return dict.setdefault(self, type, default)
+
+    def values(self):
+        for type in list(self._pending): self._load(type)
+        return dict.values(self)
+
+    def items(self):
+        for type in list(self._pending): self._load(type)
+        return dict.items(self)
+
+# Cache of parsed inventories, keyed by a hash of the inventory file so it
+# doesn't need to be invalidated in any way. Each type of each inventory is
+# stored as a separate marshalled dict and unmarshalled only when the type is
+# first needed. The file starts with a magic, the marshal format version and
+# size of the index, followed by the marshalled index, which maps the
+# inventory hashes to a dict of types and (offset, size) of their data,
+# relative to the end of the index.
+_inventory_cache_magic = b'm.sphinx inventory cache v1\n'
+
+class _InventoryCache:
+    def __init__(self, file):
+        self.file = file
+        self.data = b''
+        self.index: Dict[bytes, Dict[str, Tuple[int, int]]] = {}
+        # Inventories that were parsed in this run, serialized, and hashes of
+        # all inventories used in this run
+        self.new: Dict[bytes, Dict[str, bytes]] = {}
+        self.used = []
+
+        if not os.path.exists(file): return
+        try:
+            with open(file, 'rb') as f:
+                data = f.read()
+            header_size = len(_inventory_cache_magic) + 8
+            if data[:len(_inventory_cache_magic)] != _inventory_cache_magic: raise ValueError("invalid magic")
+            marshal_version, index_size = struct.unpack_from('<II', data, len(_inventory_cache_magic))
+            if marshal_version != marshal.version: return
+            self.index = marshal.loads(data[header_size:header_size + index_size])
+            self.data = memoryview(data)[header_size + index_size:]
+        except Exception as e:
+            logging.warning("can't load intersphinx inventory cache {}, ignoring it: {}".format(file, e))
+            self.index = {}
+
+    # Returns a dict of types and functions returning their contents, or None
+    # if given inventory isn't in the cache
+    def get(self, hash):
+        self.used += [hash]
+        if hash in self.new:
+            types = self.new[hash]
+            return {type: (lambda data=data: marshal.loads(data)) for type, data in types.items()}
+        if hash not in self.index: return None
+        return {type: (lambda offset=offset, size=size: marshal.loads(self.data[offset:offset + size])) for type, (offset, size) in self.index[hash].items()}
+
+    def add(self, hash, types):
+        self.new[hash] = {type: marshal.dumps(names) for type, names in types.items()}
+
+    # Saves the cache if there's anything new, keeping only inventories that
+    # were used in this run
+    def save(self):
+        if not self.new and set(self.used) == set(self.index): return
+
+        index = {}
+        sections = []
+        offset = 0
+        for hash in dict.fromkeys(self.used):
+            index[hash] = {}
+            for type, (data_offset, size) in self.index.get(hash, {}).items():
+                sections += [self.data[data_offset:data_offset + size]]
+                index[hash][type] = (offset, size)
+                offset += size
+            for type, data in self.new.get(hash, {}).items():
+                sections += [data]
+                index[hash][type] = (offset, len(data))
+                offset += len(data)
+
+        index_data = marshal.dumps(index)
+        try:
+            # Write to a temporary file first so a parallel build never sees
+            # a partially written file
+            with open(self.file + '.tmp', 'wb') as f:
+                f.write(_inventory_cache_magic)
+                f.write(struct.pack('<II', marshal.version, len(index_data)))
+                f.write(index_data)
+                for data in sections: f.write(data)
+            os.replace(self.file + '.tmp', self.file)
+        except OSError as e:
+            logging.warning("can't save intersphinx inventory cache {}: {}".format(self.file, e))
+
+def parse_intersphinx_inventories(input, inventories, cache_file=None):
     global intersphinx_inventory, intersphinx_name_prefixes
-    intersphinx_inventory = {}
+    intersphinx_inventory = _LazyInventory()
     intersphinx_name_prefixes = ['']
 
+    cache = _InventoryCache(cache_file) if cache_file else None
     for f in inventories:
         inventory, base_url = f[:2]
         prefixes = f[2] if len(f) > 2 else []
@@ -307,7 +446,19 @@ def parse_intersphinx_inventories(input, inventories):
 
         intersphinx_name_prefixes += prefixes
         with open(os.path.join(input, inventory), 'rb') as file:
-            parse_intersphinx_inventory(file, base_url, intersphinx_inventory, css_classes)
+            data = file.read()
+
+        hash = sha1(data).digest()
+        types = cache.get(hash) if cache else None
+        if types is None:
+            parsed = parse_intersphinx_inventory_types(io.BytesIO(data))
+            if cache: cache.add(hash, parsed)
+            types = {type: (lambda names=names: names) for type, names in parsed.items()}
+
+        for type, load in types.items():
+            intersphinx_inventory.add(type, load, base_url, css_classes)
+
+    if cache: cache.save()
 
 # Matches e.g. py:function in py:function:open
 _type_prefix_re = re.compile(r'([a-z0-9]{,3}:[a-z0-9]{3,}):')
@@ -621,8 +772,10 @@ def register_mcss(mcss_settings, module_doc_contents, class_doc_contents, enum_d
     data_doc_output = data_doc_contents
     inventory_filename = os.path.join(mcss_settings['OUTPUT'], mcss_settings['M_SPHINX_INVENTORY_OUTPUT']) if 'M_SPHINX_INVENTORY_OUTPUT' in mcss_settings else None
 
+    cache_file = mcss_settings.get('M_SPHINX_INVENTORY_CACHE_FILE')
     parse_intersphinx_inventories(input=mcss_settings['INPUT'],
-         inventories=mcss_settings.get('M_SPHINX_INVENTORIES', []))
+         inventories=mcss_settings.get('M_SPHINX_INVENTORIES', []),
+         cache_file=os.path.join(mcss_settings['INPUT'], cache_file) if cache_file else None)
 
     rst.directives.register_directive('py:module', PyModule)
     rst.directives.register_directive('py:class', PyClass)
@@ -655,8 +808,10 @@ def _pelican_new_page(generator):
 def _pelican_configure(pelicanobj):
 
     # For backwards compatibility, the input directory is pelican's CWD
+    cache_file = pelicanobj.settings.get('M_SPHINX_INVENTORY_CACHE_FILE')
     parse_intersphinx_inventories(input=os.getcwd(),
-         inventories=pelicanobj.settings.get('M_SPHINX_INVENTORIES', []))
+         inventories=pelicanobj.settings.get('M_SPHINX_INVENTORIES', []),
+         cache_file=os.path.join(os.getcwd(), cache_file) if cache_file else None)
 
 def register(): # for Pelican
     from pelican import signals
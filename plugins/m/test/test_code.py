@@ -23,7 +23,13 @@
 #   DEALINGS IN THE SOFTWARE.
 #
 
+import os
 import re
+import sqlite3
+import tempfile
+import unittest
+
+import pygmentsextra
 
 from . import PelicanPluginTestCase
 
@@ -55,3 +61,36 @@ class Code(PelicanPluginTestCase):
         })
 
         self.assertEqual(*self.actual_expected_contents('page.html'))
+
+class Cache(unittest.TestCase):
+    def tearDown(self):
+        pygmentsextra.close_cache()
+
+    def test(self):
+        lexer = pygmentsextra.lexer_by_name('c++')
+        self.assertIs(pygmentsextra.lexer_by_name('c++'), lexer)
+        self.assertIs(pygmentsextra.lexer_for_filename('code.cpp'), pygmentsextra.lexer_for_filename('code.cpp'))
+        self.assertIsNone(pygmentsextra.lexer_by_name('nonexistent'))
+
+        # The ANSI lexer is stateful, so it's a new instance every time
+        self.assertIsNot(pygmentsextra.lexer_by_name('ansi'), pygmentsextra.lexer_by_name('ansi'))
+
+        with tempfile.TemporaryDirectory() as dir:
+            file = os.path.join(dir, 'm.code.cache')
+            pygmentsextra.open_cache(file)
+            highlighted = pygmentsextra.highlight('int a;', lexer)
+            self.assertIn('<span class="kt">int</span>', highlighted)
+            highlighted_lines = pygmentsextra.highlight('int a;', lexer, {'hl_lines': '1'})
+            self.assertNotEqual(highlighted_lines, highlighted)
+            pygmentsextra.close_cache()
+
+            with sqlite3.connect(file) as db:
+                self.assertEqual(db.execute("SELECT COUNT(*) FROM entries").fetchone()[0], 2)
+
+            # Next time it's taken from the cache, not highlighted again
+            with sqlite3.connect(file) as db:
+                db.execute("UPDATE entries SET svg = 'cached' WHERE hash = ?", (pygmentsextra.cache_key('int a;', lexer, {}), ))
+            pygmentsextra.open_cache(file)
+            self.assertEqual(pygmentsextra.highlight('int a;', lexer), 'cached')
+            self.assertEqual(pygmentsextra.highlight('int a;', lexer, {'hl_lines': '1'}), highlighted_lines)
+            pygmentsextra.close_cache()
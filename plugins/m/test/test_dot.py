@@ -23,12 +23,18 @@
 #   DEALINGS IN THE SOFTWARE.
 #
 
+import os
 import re
+import shutil
+import sqlite3
 import subprocess
+import tempfile
 import unittest
 
 from distutils.version import LooseVersion
 
+import dot2svg
+
 from . import PelicanPluginTestCase
 
 def dot_version():
@@ -51,3 +57,80 @@ class Dot(PelicanPluginTestCase):
             file = 'page-240.html'
 
         self.assertEqual(*self.actual_expected_contents('page.html', file))
+
+class Cache(unittest.TestCase):
+    def setUp(self):
+        dot2svg.configure('DejaVu Sans', 16.0)
+
+    def tearDown(self):
+        dot2svg.close_cache()
+
+    # This is using the cache, so doesn't matter if dot is found or not
+    def test(self):
+        dot2svg.open_cache(None)
+        dot2svg.merge_cache({dot2svg.cache_key('digraph "" { a }'): (None, """<?xml version="1.0" encoding="UTF-8" standalone="no"?>
+<!DOCTYPE svg PUBLIC "-//W3C//DTD SVG 1.1//EN"
+ "http://www.w3.org/Graphics/SVG/1.1/DTD/svg11.dtd">
+<svg width="32pt" height="16pt"
+ viewBox="0.00 0.00 32.00 16.00" xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink">
+<g id="graph0" class="graph" transform="translate(4 12)">
+</g>
+</svg>
+""")})
+
+        # The size and attributes are patched in on every use
+        self.assertEqual(dot2svg.dot2svg('digraph "" { a }', attribs=' class="m-graph"'), """<svg class="m-graph" style="width: 2.000rem; height: 1.000rem;" viewBox="0.00 0.00 32.00 16.00">
+<g transform="translate(4 12)">
+</g>
+</svg>
+""")
+        self.assertEqual(dot2svg.dot2svg('digraph "" { a }', size='width: 50%;'), """<svg style="width: 50%;" viewBox="0.00 0.00 32.00 16.00">
+<g transform="translate(4 12)">
+</g>
+</svg>
+""")
+
+        # A different font setup doesn't reuse the entry
+        key = dot2svg.cache_key('digraph "" { a }')
+        dot2svg.configure('DejaVu Sans', 12.0)
+        self.assertNotEqual(dot2svg.cache_key('digraph "" { a }'), key)
+
+    def test_touch_only(self):
+        with tempfile.TemporaryDirectory() as dir:
+            file = os.path.join(dir, 'm.dot.cache')
+
+            # Touching entries of a cache that doesn't exist doesn't create it
+            dot2svg.open_cache(file)
+            dot2svg.touch_cache([b'x'*20])
+            dot2svg.close_cache()
+            self.assertFalse(os.path.exists(file))
+
+            # An entry over the size limit gets evicted right away, leaving
+            # the database empty
+            dot2svg.open_cache(file, max_size=10)
+            dot2svg.merge_cache({b'y'*20: (None, '<svg></svg>')})
+            dot2svg.close_cache()
+            with sqlite3.connect(file) as db:
+                self.assertEqual(db.execute("SELECT COUNT(*) FROM entries").fetchone()[0], 0)
+
+            # Touching entries of an empty database doesn't fail
+            dot2svg.open_cache(file, max_size=10)
+            dot2svg.touch_cache([b'y'*20])
+            dot2svg.close_cache()
+            with sqlite3.connect(file) as db:
+                self.assertEqual(db.execute("SELECT COUNT(*) FROM entries").fetchone()[0], 0)
+
+    @unittest.skipUnless(shutil.which('dot'),
+                         "Graph rendering requires Graphviz installed")
+    def test_prerender(self):
+        sources = ['digraph "" { a -> b }', 'graph "title" { a -- b }', 'strict digraph "" { a -> a }']
+        dot2svg.open_cache(None)
+        expected = [dot2svg.dot2svg(source) for source in sources]
+
+        # Rendering in a batch gives the same output as rendering one by one,
+        # the following dot2svg() calls are just cache lookups
+        dot2svg.open_cache(None)
+        dot2svg.prerender(sources, jobs=2)
+        dot2svg.start_cache_recording()
+        self.assertEqual([dot2svg.dot2svg(source) for source in sources], expected)
+        self.assertEqual(len(dot2svg.stop_cache_recording()), len(sources))
@@ -23,6 +23,9 @@
 #   DEALINGS IN THE SOFTWARE.
 #
 
+import os
+import tempfile
+
 from . import PelicanPluginTestCase
 
 class Dox(PelicanPluginTestCase):
@@ -48,3 +51,18 @@ class Dox(PelicanPluginTestCase):
         })
 
         self.assertEqual(*self.actual_expected_contents('page.html', 'page_css_classes.html'))
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as dir:
+            # The first run creates the tagfile indices, the second uses them
+            for i in range(2):
+                self.run_pelican({
+                    'PLUGINS': ['m.htmlsanity', 'm.dox'],
+                    'M_DOX_TAGFILES': [
+                        ('../doc/documentation/corrade.tag', 'https://doc.magnum.graphics/corrade/', ['Corrade::']),
+                        ('m/test/dox/stl.tag', 'http://en.cppreference.com/w/', [])],
+                    'M_DOX_CACHE_DIR': dir
+                })
+
+                self.assertEqual(len(os.listdir(dir)), 2)
+                self.assertEqual(*self.actual_expected_contents('page.html'))
@@ -25,6 +25,12 @@
 
 # The directives are only for the Python theme and get tested inside it
 
+import os
+import tempfile
+import unittest
+
+import m.sphinx
+
 from . import PelicanPluginTestCase
 
 class Sphinx(PelicanPluginTestCase):
@@ -39,3 +45,39 @@ class Sphinx(PelicanPluginTestCase):
         })
 
         self.assertEqual(*self.actual_expected_contents('page.html'))
+
+class InventoryCache(unittest.TestCase):
+    def test(self):
+        input = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../../doc/documentation')
+        inventories = [('python.inv', 'https://docs.python.org/3/', ['xml.'], ['m-flat'])]
+
+        m.sphinx.parse_intersphinx_inventories(input, inventories)
+        expected = dict(m.sphinx.intersphinx_inventory.items())
+        self.assertEqual(expected['py:function']['open'], ('https://docs.python.org/3/library/functions.html#open', '-', ['m-flat']))
+
+        with tempfile.TemporaryDirectory() as dir:
+            cache_file = os.path.join(dir, 'm.sphinx.cache')
+
+            # First time the cache gets created, second time it's used. The
+            # types are loaded only when accessed.
+            for i in range(2):
+                m.sphinx.parse_intersphinx_inventories(input, inventories, cache_file)
+                self.assertTrue(os.path.exists(cache_file))
+                self.assertEqual(dict.get(m.sphinx.intersphinx_inventory, 'py:function'), {})
+                self.assertEqual(m.sphinx.intersphinx_inventory['py:function']['open'], expected['py:function']['open'])
+                self.assertEqual(dict(m.sphinx.intersphinx_inventory.items()), expected)
+
+            # A different base URL doesn't need the cache to be updated
+            mtime = os.path.getmtime(cache_file)
+            m.sphinx.parse_intersphinx_inventories(input, [('python.inv', 'https://docs.python.org/2/')], cache_file)
+            self.assertEqual(m.sphinx.intersphinx_inventory['py:function']['open'], ('https://docs.python.org/2/library/functions.html#open', '-', []))
+            self.assertEqual(os.path.getmtime(cache_file), mtime)
+
+            # A broken file is ignored and overwritten
+            with open(cache_file, 'wb') as f: f.write(b'oops')
+            with self.assertLogs() as cm:
+                m.sphinx.parse_intersphinx_inventories(input, inventories, cache_file)
+            self.assertEqual(len(cm.output), 1)
+            self.assertEqual(dict(m.sphinx.intersphinx_inventory.items()), expected)
+            m.sphinx.parse_intersphinx_inventories(input, inventories, cache_file)
+            self.assertEqual(dict(m.sphinx.intersphinx_inventory.items()), expected)
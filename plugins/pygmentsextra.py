@@ -0,0 +1,140 @@
+#
+#   This file is part of m.css.
+#
+#   Copyright © 2017, 2018, 2019, 2020, 2021, 2022, 2023
+#             Vladimír Vondruš <mosra@centrum.cz>
+#
+#   Permission is hereby granted, free of charge, to any person obtaining a
+#   copy of this software and associated documentation files (the "Software"),
+#   to deal in the Software without restriction, including without limitation
+#   the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#   and/or sell copies of the Software, and to permit persons to whom the
+#   Software is furnished to do so, subject to the following conditions:
+#
+#   The above copyright notice and this permission notice shall be included
+#   in all copies or substantial portions of the Software.
+#
+#   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#   IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#   FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#   THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#   LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#   DEALINGS IN THE SOFTWARE.
+#
+
+# Extracted common code used by both doxygen.py and the m.code plugin for
+# highlighting code with Pygments. Looking up a lexer by name or by a filename
+# scans all lexer plugins and creating a formatter processes the whole style,
+# so both are done just once and the instances reused. The highlighted output
+# is additionally kept in a persistent svgcache.SvgCache, so code that didn't
+# change since the last build doesn't need to be highlighted again.
+
+from hashlib import sha1
+
+import pygments
+from pygments.formatters import HtmlFormatter
+from pygments.lexers import get_lexer_by_name, find_lexer_class_for_filename
+
+import ansilexer
+import svgcache
+
+# Lexers and formatters created so far. The ANSI lexer keeps state between
+# tokens, so it's never reused.
+_lexers = {}
+_lexers_for_filename = {}
+_formatters = {}
+
+# Cache for highlighted code, keyed by a hash of the code, the lexer and
+# formatter options and the Pygments version, so a Pygments upgrade doesn't
+# reuse stale output. Code filters are applied outside of it, so they don't
+# need to be a part of the key. If it's None, the cache is not used at all.
+_cache_version = 1
+_cache = None
+
+# Returns a lexer for given language name, or None if there's no such lexer
+def lexer_by_name(name):
+    if name == 'ansi': return ansilexer.AnsiLexer()
+
+    if name not in _lexers:
+        try:
+            _lexers[name] = get_lexer_by_name(name)
+        except ValueError:
+            _lexers[name] = None
+    return _lexers[name]
+
+# Returns a lexer for given filename, or None if there's no such lexer
+def lexer_for_filename(filename):
+    if filename not in _lexers_for_filename:
+        lexer = find_lexer_class_for_filename(filename)
+        _lexers_for_filename[filename] = lexer() if lexer else None
+    return _lexers_for_filename[filename]
+
+def _formatter(lexer, options):
+    if isinstance(lexer, ansilexer.AnsiLexer):
+        return ansilexer.HtmlAnsiFormatter(**options)
+
+    key = repr(sorted(options.items()))
+    if key not in _formatters:
+        _formatters[key] = HtmlFormatter(nowrap=True, **options)
+    return _formatters[key]
+
+def cache_key(code, lexer, options):
+    return sha1(repr((pygments.__version__, type(lexer).__module__, type(lexer).__qualname__, sorted(lexer.options.items()), sorted(options.items()))).encode('utf-8') + b'\0' + code.encode('utf-8')).digest()
+
+# Highlights given code with given lexer and HTML formatter options, or
+# fetches it from the cache
+def highlight(code, lexer, options={}):
+    # Cache not used, pass through
+    if _cache is None:
+        return pygments.highlight(code, lexer, _formatter(lexer, options))
+
+    hash = cache_key(code, lexer, options)
+    entry = _cache.get(hash)
+    if entry is None:
+        entry = (None, pygments.highlight(code, lexer, _formatter(lexer, options)))
+        _cache.add(hash, entry)
+    return entry[1]
+
+# Starts using the cache. If file is None, the cache is only kept in memory
+# for the duration of the run. Otherwise it's read from given file as needed
+# and saved back by close_cache(), evicting least recently used code if the
+# total size of the data exceeds max_size bytes.
+def open_cache(file, max_size=64*1024*1024):
+    global _cache
+
+    if _cache is not None: _cache.close()
+    _cache = svgcache.SvgCache(file, _cache_version, max_size)
+
+# Saves code highlighted in this run, see svgcache.SvgCache.close() for
+# details. The cache is not used anymore after this call.
+def close_cache():
+    global _cache
+
+    if _cache is None: return
+    _cache.close()
+    _cache = None
+
+# Used by doxygen.py and python.py for recording code used by a particular
+# page, see svgcache.SvgCache.start_recording() for details.
+def start_cache_recording():
+    if _cache is None: return
+    _cache.start_recording()
+
+def stop_cache_recording():
+    if _cache is None: return {}
+    return _cache.stop_recording()
+
+def merge_cache(entries):
+    if _cache is None: return
+    _cache.merge(entries)
+
+# Marks given code as used so it's less likely to get evicted
+def touch_cache(hashes):
+    if _cache is None: return
+    _cache.touch(hashes)
+
+# Number of cache hits and misses since open_cache(), used for profiling
+def cache_stats():
+    if _cache is None: return 0, 0
+    return _cache.hits, _cache.misses
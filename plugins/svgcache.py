@@ -0,0 +1,213 @@
+#
+#   This file is part of m.css.
+#
+#   Copyright © 2017, 2018, 2019, 2020, 2021, 2022, 2023
+#             Vladimír Vondruš <mosra@centrum.cz>
+#
+#   Permission is hereby granted, free of charge, to any person obtaining a
+#   copy of this software and associated documentation files (the "Software"),
+#   to deal in the Software without restriction, including without limitation
+#   the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#   and/or sell copies of the Software, and to permit persons to whom the
+#   Software is furnished to do so, subject to the following conditions:
+#
+#   The above copyright notice and this permission notice shall be included
+#   in all copies or substantial portions of the Software.
+#
+#   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#   IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#   FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#   THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#   LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#   DEALINGS IN THE SOFTWARE.
+#
+
+
+# Persistent cache for rendered SVGs, used by latex2svgextra for math formulas
+# and by dot2svg for graphs. Besides that, pygmentsextra uses it for
+# highlighted code, with the depth being always None. Entries are kept in an
+# SQLite database keyed by a hash of everything that affects the output, so
+# there's no need to invalidate anything when the input or the parameters
+# change. The database is read lazily, only the entries that are actually
+# needed get loaded, and on close() only the newly rendered entries get added.
+# Each entry remembers when it was last used and the least recently used ones
+# get evicted once the total size of the SVG data exceeds the limit. As SQLite
+# handles locking on its own, the same file can be shared by parallel worker
+# processes or by multiple concurrent builds, for example on a CI.
+
+import logging
+import os
+import sqlite3
+import time
+
+# SQLite limits the number of variables in a single query, look the entries up
+# in chunks
+_lookup_chunk = 500
+
+class SvgCache:
+    # If file is None, the entries are kept only in memory for the lifetime of
+    # the object. A database with a different version is discarded when saving
+    # to it. Zero is the version of a newly created SQLite database, so the
+    # versions start at 1.
+    def __init__(self, file=None, version=1, max_size=64*1024*1024):
+        self.file = file
+        self.version = version
+        self.max_size = max_size
+        # Hash -> (depth, svg data). The depth is None for SVGs that don't
+        # have any.
+        self.entries = {}
+        # Hashes that are known to be in the database, hashes used during the
+        # lifetime of this object and, if recording, entries used since
+        # start_recording()
+        self.stored = set()
+        self.used = set()
+        self.recording = None
+        # Number of cache hits and misses, for profiling. Entries rendered
+        # upfront are counted as misses when added, their first use is then
+        # not a hit.
+        self.prerendered = set()
+        self.hits = 0
+        self.misses = 0
+        # The database connection is opened lazily and only in the process
+        # that opened it, a connection inherited over fork() can't be used
+        self._db = None
+        self._db_pid = None
+
+    # Returns the database connection or None if there's no (valid) database
+    # yet. With create set, a new database is created, replacing any file
+    # that's not a database of the expected version, such as a pickled math
+    # cache from previous versions of m.css.
+    def _connect(self, create=False):
+        if self._db is not None and self._db_pid != os.getpid():
+            self._db = None
+        if self._db is not None or not self.file: return self._db
+
+        if not os.path.exists(self.file):
+            if not create: return None
+        elif os.path.getsize(self.file):
+            with open(self.file, 'rb') as f:
+                if f.read(16) != b'SQLite format 3\0':
+                    if not create: return None
+                    os.remove(self.file)
+
+        db = sqlite3.connect(self.file, timeout=60, isolation_level=None)
+        if db.execute("PRAGMA user_version").fetchone()[0] != self.version:
+            if not create:
+                db.close()
+                return None
+            db.execute("BEGIN IMMEDIATE")
+            # Someone else might have created it meanwhile
+            if db.execute("PRAGMA user_version").fetchone()[0] != self.version:
+                db.execute("DROP TABLE IF EXISTS entries")
+                db.execute("CREATE TABLE entries (hash BLOB PRIMARY KEY, depth REAL, svg TEXT, size INTEGER, used REAL)")
+                db.execute("PRAGMA user_version = {}".format(self.version))
+            db.execute("COMMIT")
+            db.execute("PRAGMA journal_mode = WAL")
+
+        self._db = db
+        self._db_pid = os.getpid()
+        return db
+
+    # Loads given entries from the database, if they're there and not loaded
+    # yet
+    def lookup(self, hashes):
+        hashes = [hash for hash in hashes if hash not in self.entries]
+        if not hashes: return
+
+        try:
+            db = self._connect()
+            if not db: return
+            for i in range(0, len(hashes), _lookup_chunk):
+                chunk = hashes[i:i + _lookup_chunk]
+                for hash, depth, svg in db.execute("SELECT hash, depth, svg FROM entries WHERE hash IN ({})".format(', '.join('?'*len(chunk))), chunk):
+                    self.entries[hash] = (depth, svg)
+                    self.stored.add(hash)
+        except sqlite3.Error as e:
+            logging.warning("can't read cache {}, ignoring it: {}".format(self.file, e))
+
+    # Returns a (depth, svg) entry and marks it as used, or None if it's not
+    # in the cache
+    def get(self, hash):
+        self.lookup([hash])
+        entry = self.entries.get(hash)
+        if entry is not None:
+            if hash in self.prerendered: self.prerendered.remove(hash)
+            else: self.hits += 1
+            self._use(hash, entry)
+        return entry
+
+    # Adds a newly rendered entry. If used is False, it's not recorded as used
+    # by the current page, which is the case for pre-rendered entries.
+    def add(self, hash, entry, used=True):
+        self.entries[hash] = entry
+        self.misses += 1
+        if used: self._use(hash, entry)
+        else: self.prerendered.add(hash)
+
+    def _use(self, hash, entry):
+        self.used.add(hash)
+        if self.recording is not None: self.recording[hash] = entry
+
+    # All entries used between the two calls get recorded in a dict that's
+    # returned from stop_recording(). Their hashes can be then passed to
+    # touch() if the page using them is not generated in a following
+    # incremental build. When rendering in parallel worker processes, the
+    # recorded entries get passed to the parent process, which then merges
+    # them back to its own cache with merge() and saves them later.
+    def start_recording(self):
+        self.recording = {}
+
+    def stop_recording(self):
+        recorded = self.recording or {}
+        self.recording = None
+        return recorded
+
+    def merge(self, entries):
+        self.entries.update(entries)
+        self.used.update(entries.keys())
+
+    # Marks given entries as used so they're less likely to get evicted
+    def touch(self, hashes):
+        self.used.update(hashes)
+
+    # Saves entries rendered since this object was created and updates the
+    # last use time of all entries that were used, then evicts the least
+    # recently used ones over the size limit. Doesn't create any file if there
+    # is nothing to save.
+    def close(self):
+        try:
+            if self.file: self._save()
+        except sqlite3.Error as e:
+            logging.warning("can't save cache {}: {}".format(self.file, e))
+        finally:
+            if self._db is not None and self._db_pid == os.getpid():
+                self._db.close()
+            self._db = None
+
+    def _save(self):
+        now = time.time()
+        new = [(hash, depth, svg, len(svg), now) for hash, (depth, svg) in self.entries.items() if hash not in self.stored]
+        used = [(now, hash) for hash in self.used if hash in self.stored or hash not in self.entries]
+        if not new and not used: return
+
+        # If there's just used entries to update, such as when an incremental
+        # build only restored pages from the previous run, there's nothing to
+        # update in a database that doesn't exist
+        db = self._connect(create=bool(new))
+        if not db: return
+        db.execute("BEGIN IMMEDIATE")
+        db.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)", new)
+        db.executemany("UPDATE entries SET used = ? WHERE hash = ?", used)
+
+        # Evict least recently used entries that don't fit into the size
+        # limit. The sum is NULL for an empty table.
+        if db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0] > self.max_size:
+            size = 0
+            evict = []
+            for hash, entry_size in db.execute("SELECT hash, size FROM entries ORDER BY used DESC, hash"):
+                size += entry_size
+                if size > self.max_size: evict += [(hash, )]
+            db.executemany("DELETE FROM entries WHERE hash = ?", evict)
+        db.execute("COMMIT")
+        self.stored.update(hash for hash, *_ in new)